@@ -0,0 +1,403 @@
+"""
+Throughput and latency benchmark of the Python worker.
+
+Enqueues synthetic `asset-tag` jobs, runs one or more workers in this process
+until every job is completed and writes the results as JSON. Script execution
+is replaced by a no-op or sleep handler, so the numbers cover claiming,
+locking, progress and completion: the parts of the worker that talk to Redis.
+
+    python benchmarks/bench_queue.py --jobs 10000 --workers 2 --concurrency 4
+    python benchmarks/bench_queue.py --redis redis://localhost:6379/15 --jobs 100000 --output bench.json
+
+Without `--redis` the benchmark runs against fakeredis. Its numbers are only
+comparable with other fakeredis runs; use a local redis-server for absolute
+throughput.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from unittest import mock
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+import redis
+import redis.asyncio
+import redis.asyncio.client
+import redis.client
+
+from keys import QueueKeys
+from lanes import parse_lanes
+
+logger = logging.getLogger("bench_queue")
+
+JOB_NAME = "asset-tag"
+PERCENTILES = (50, 95, 99)
+
+
+class CommandCounter:
+    """
+    Counts the commands and round trips of every Redis client of this process.
+
+    Each command of a pipeline counts once and the pipeline as one round trip;
+    commands run inside Lua scripts are not seen here (see
+    `server_command_stats` for those).
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.round_trips = 0
+        self.lock = threading.Lock()
+        self.patches = []
+
+    def record(self, commands):
+        with self.lock:
+            self.round_trips += 1
+            for args in commands:
+                name = args[0].decode() if isinstance(args[0], bytes) else str(args[0])
+                self.counts[name.upper()] += 1
+
+    def __enter__(self):
+        counter = self
+
+        def execute_command(original):
+            def wrapper(client, *args, **options):
+                counter.record([args])
+                return original(client, *args, **options)
+            return wrapper
+
+        def execute_async_command(original):
+            async def wrapper(client, *args, **options):
+                counter.record([args])
+                return await original(client, *args, **options)
+            return wrapper
+
+        def execute_pipeline(original):
+            def wrapper(pipeline, connection, commands, raise_on_error):
+                counter.record([args for args, _ in commands])
+                return original(pipeline, connection, commands, raise_on_error)
+            return wrapper
+
+        def execute_async_pipeline(original):
+            async def wrapper(pipeline, connection, commands, raise_on_error):
+                counter.record([args for args, _ in commands])
+                return await original(pipeline, connection, commands, raise_on_error)
+            return wrapper
+
+        targets = [
+            (redis.client.Redis, "execute_command", execute_command),
+            (redis.client.Pipeline, "_execute_pipeline", execute_pipeline),
+            (redis.client.Pipeline, "_execute_transaction", execute_pipeline),
+            (redis.asyncio.client.Redis, "execute_command", execute_async_command),
+            (redis.asyncio.client.Pipeline, "_execute_pipeline", execute_async_pipeline),
+            (redis.asyncio.client.Pipeline, "_execute_transaction", execute_async_pipeline),
+        ]
+        for owner, name, wrap in targets:
+            patch = mock.patch.object(owner, name, wrap(getattr(owner, name)))
+            patch.start()
+            self.patches.append(patch)
+        return self
+
+    def __exit__(self, *exc_info):
+        for patch in self.patches:
+            patch.stop()
+        self.patches = []
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+            self.round_trips = 0
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts), self.round_trips
+
+
+def server_command_stats(client):
+    """
+    Calls per command from `INFO commandstats`, including commands run by Lua scripts
+    """
+    stats = client.info("commandstats")
+    return {name.split("_", 1)[1].upper(): value["calls"] for name, value in stats.items()}
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a sorted list
+    """
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[int(rank) - 1]
+
+
+def latency_summary(values_ms):
+    values = sorted(values_ms)
+    summary = {f"p{pct}": percentile(values, pct) for pct in PERCENTILES}
+    summary["mean"] = sum(values) / len(values) if values else None
+    summary["max"] = values[-1] if values else None
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Recorder:
+    """
+    Claim and completion times of the benchmark jobs, shared by all workers
+    """
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.claim_to_complete = []
+        self.enqueue_to_complete = []
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def completed(self, job_data):
+        now_ms = time.time() * 1000
+        with self.lock:
+            if job_data.get("claimedAt") is not None:
+                self.claim_to_complete.append(now_ms - job_data["claimedAt"])
+            if isinstance(job_data.get("timestamp"), (int, float)):
+                self.enqueue_to_complete.append(now_ms - job_data["timestamp"])
+            if len(self.claim_to_complete) >= self.expected:
+                self.done.set()
+
+
+def make_worker_class(engine, recorder, handler_sleep, progress_updates):
+    """
+    Worker subclass whose scripts are no-ops (or sleeps) and which reports each completed job
+    """
+    if engine == "asyncio":
+        from async_worker import AsyncWorker
+
+        class BenchAsyncWorker(AsyncWorker):
+            async def process_job(self, job_data):
+                result = await super().process_job(job_data)
+                recorder.completed(job_data)
+                return result
+
+            async def execute_script(self, job_id, script_type, params, on_progress=None):
+                for i in range(progress_updates):
+                    await self.update_progress(job_id, {"percentage": 10 + 80 * (i + 1) // progress_updates})
+                if handler_sleep:
+                    await asyncio.sleep(handler_sleep)
+                return {"success": True, "output": []}
+
+        return BenchAsyncWorker
+
+    from worker import Worker
+
+    class BenchWorker(Worker):
+        def process_job(self, job_data):
+            result = super().process_job(job_data)
+            recorder.completed(job_data)
+            return result
+
+        def execute_script(self, job_id, script_type, params, on_progress=None):
+            for i in range(progress_updates):
+                self.update_progress(job_id, {"percentage": 10 + 80 * (i + 1) // progress_updates})
+            if handler_sleep:
+                time.sleep(handler_sleep)
+            return {"success": True, "output": []}
+
+    return BenchWorker
+
+
+def enqueue(client, keys, jobs, payload_bytes, rate, batch_size=1000):
+    """
+    Push the benchmark jobs onto the wait list, all at once or paced at `rate` jobs per second
+    """
+    blob = "x" * payload_bytes
+    if rate:
+        # Small batches keep the pacing smooth, about one every 10 ms
+        batch_size = max(1, min(batch_size, int(rate / 100)))
+    started = time.perf_counter()
+    for first in range(0, jobs, batch_size):
+        if rate:
+            delay = started + first / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        now_ms = int(time.time() * 1000)
+        pipe = client.pipeline(transaction=False)
+        for job_id in range(first, min(jobs, first + batch_size)):
+            pipe.lpush(keys.wait, json.dumps({
+                "id": f"bench-{job_id}",
+                "name": JOB_NAME,
+                "timestamp": now_ms,
+                "data": {"scriptParams": {}, "blob": blob},
+            }))
+        pipe.execute()
+
+
+def cleanup(client, queue_key):
+    for pattern in (f"{queue_key}:*", f"bull:{queue_key}:*"):
+        batch = []
+        for key in client.scan_iter(match=pattern, count=1000):
+            batch.append(key)
+            if len(batch) >= 1000:
+                client.delete(*batch)
+                batch = []
+        if batch:
+            client.delete(*batch)
+
+
+def run_benchmark(args):
+    queue_key = args.queue or f"bench-{uuid.uuid4().hex[:8]}"
+    keys = QueueKeys(queue_key)
+    recorder = Recorder(args.jobs)
+    worker_class = make_worker_class(args.engine, recorder, args.sleep_ms / 1000, args.progress_updates)
+    # Importing the worker configures logging; its per-job info logs would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+
+    patches = []
+    if args.redis:
+        redis_url = args.redis
+        client = redis.from_url(redis_url)
+    else:
+        try:
+            import fakeredis
+            import fakeredis.aioredis
+        except ImportError:
+            sys.exit("fakeredis is not installed: pip install fakeredis lupa, or pass --redis")
+        server = fakeredis.FakeServer()
+        redis_url = "redis://fakeredis"
+        client = fakeredis.FakeRedis(server=server)
+        patches = [
+            mock.patch("redis.from_url", lambda *a, **kw: fakeredis.FakeRedis(server=server)),
+            mock.patch("redis.asyncio.from_url", lambda *a, **kw: fakeredis.aioredis.FakeRedis(server=server)),
+        ]
+    for patch in patches:
+        patch.start()
+
+    worker_options = dict(redis_url=redis_url, queue_key=queue_key, concurrency=args.concurrency,
+                          prefetch=args.prefetch, lanes=parse_lanes(None))
+    workers = [worker_class(**worker_options) for _ in range(args.workers)]
+
+    counter = CommandCounter()
+    try:
+        with counter:
+            if not args.rate:
+                enqueue(client, keys, args.jobs, args.payload_bytes, 0)
+            counter.reset()
+            server_before = server_command_stats(client) if args.redis else None
+
+            started = time.perf_counter()
+            threads = []
+            if args.rate:
+                threads.append(threading.Thread(target=enqueue, name="producer", daemon=True,
+                                                args=(client, keys, args.jobs, args.payload_bytes, args.rate)))
+            for worker in workers:
+                target = (lambda w=worker: asyncio.run(w.poll_queue())) if args.engine == "asyncio" \
+                    else worker.poll_queue
+                threads.append(threading.Thread(target=target, name=f"worker-{worker.worker_id}", daemon=True))
+            for thread in threads:
+                thread.start()
+
+            finished = recorder.done.wait(args.timeout)
+            elapsed = time.perf_counter() - started
+            for worker in workers:
+                worker.shutdown_requested = True
+            for thread in threads:
+                thread.join()
+
+            commands, round_trips = counter.snapshot()
+            server_after = server_command_stats(client) if args.redis else None
+        completed = len(recorder.claim_to_complete)
+        if not finished:
+            logger.warning(f"Timed out after {args.timeout}s with {completed} of {args.jobs} jobs completed")
+    finally:
+        if args.redis:
+            cleanup(client, queue_key)
+        for patch in patches:
+            patch.stop()
+
+    per_job = max(1, completed)
+    results = {
+        "config": {
+            "redis": "redis-server" if args.redis else "fakeredis",
+            "engine": args.engine,
+            "jobs": args.jobs,
+            "workers": args.workers,
+            "concurrency": args.concurrency,
+            "prefetch": args.prefetch,
+            "payloadBytes": args.payload_bytes,
+            "sleepMs": args.sleep_ms,
+            "progressUpdates": args.progress_updates,
+            "rate": args.rate,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "commit": git_commit(),
+        },
+        "completed": completed,
+        "timedOut": not finished,
+        "durationSeconds": elapsed,
+        "throughputJobsPerSecond": completed / elapsed if elapsed else None,
+        "latencyMs": {
+            "claimToComplete": latency_summary(recorder.claim_to_complete),
+            "enqueueToComplete": latency_summary(recorder.enqueue_to_complete),
+        },
+        "roundTripsPerJob": round_trips / per_job,
+        "clientCommandsPerJob": {
+            "total": sum(commands.values()) / per_job,
+            "byCommand": {name: count / per_job for name, count in sorted(commands.items())},
+        },
+    }
+    if server_before is not None:
+        server_calls = {name: server_after.get(name, 0) - server_before.get(name, 0)
+                        for name in server_after}
+        # Leave out the INFO call that took the second snapshot
+        server_calls["INFO"] = server_calls.get("INFO", 0) - 1
+        server_calls = {name: calls for name, calls in server_calls.items() if calls > 0}
+        results["serverCommandsPerJob"] = {
+            "total": sum(server_calls.values()) / per_job,
+            "byCommand": {name: calls / per_job for name, calls in sorted(server_calls.items())},
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Python worker throughput and latency benchmark')
+    parser.add_argument('--redis', help='Redis URL of a local redis-server (default: in-process fakeredis). '
+                                        'Use a spare database; the benchmark queue\'s keys are deleted afterwards')
+    parser.add_argument('--queue', help='Queue key prefix (default: a random bench-* name)')
+    parser.add_argument('--jobs', type=int, default=10000, help='Number of jobs to enqueue')
+    parser.add_argument('--payload-bytes', type=int, default=256, help='Size of the filler data in each job')
+    parser.add_argument('--sleep-ms', type=float, default=0, help='Time each job\'s handler sleeps (0 is a no-op)')
+    parser.add_argument('--progress-updates', type=int, default=0, help='Progress updates sent by each job')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Enqueue jobs at this rate per second while the workers run (0 enqueues all up front)')
+    parser.add_argument('--workers', type=int, default=1, help='Worker instances run in this process')
+    parser.add_argument('--concurrency', type=int, default=1, help='Job slots per worker')
+    parser.add_argument('--prefetch', type=int, default=1, help='Jobs claimed per round trip')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads', help='Worker engine')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds after which the run is stopped')
+    parser.add_argument('--output', help='File the JSON results are written to (default: stdout)')
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"{results['completed']} jobs in {results['durationSeconds']:.2f}s, "
+              f"{results['throughputJobsPerSecond']:.1f} jobs/s, results written to {args.output}")
+    else:
+        print(output)
@@ -0,0 +1,932 @@
+import asyncio
+import functools
+import json
+import logging
+import signal
+import subprocess
+import time
+
+import redis.asyncio as aioredis
+
+from batching import BATCH_POLL_INTERVAL, batch_key
+from checkpoint import resumable_steps
+from lanes import LANE_BLOCK_TIMEOUT
+from log_capture import LineSplitter, LogCapture
+from pipeline import PipelineInterrupted, build_pipeline_steps, run_pipeline_async
+from progress import AsyncProgressPublisher
+from result_store import IDENTITY
+from scripts import SCRIPT_JOBS, build_script_command
+from serializers import negotiate
+from shards import split_urls
+from usage import USAGE_SUPPORTED, queue_usage_sample, spawn_async, wait_with_usage
+from worker_core import (GENERIC_JOB_STEPS, WorkerCore, batch_results, generic_output, line_progress,
+                         pipeline_output, pipeline_result, script_error, script_line, script_output, script_result)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncWorker(WorkerCore):
+    """
+    asyncio variant of `Worker` with the same job semantics.
+
+    All Redis calls go through `redis.asyncio` and script output is read through
+    asyncio pipes, so a single process can keep hundreds of I/O-bound jobs in
+    flight without a thread per job. Like `Worker` it runs one job at a time
+    unless given a higher `concurrency`; a few hundred suit I/O-bound jobs.
+    """
+
+    publisher_class = AsyncProgressPublisher
+
+    def connect(self, redis_url, cluster):
+        """
+        asyncio clients of the nodes the shards are spread over, one for a cluster
+        """
+        if cluster:
+            return [aioredis.RedisCluster.from_url(split_urls(redis_url)[0])]
+        return [aioredis.from_url(url) for url in split_urls(redis_url)]
+
+    async def execute_script(self, job_id, script_type, params, on_progress=None):
+        """
+        Execute one of the asset pipeline scripts based on the job type.
+
+        The script function runs on a warm executor when the pool is enabled and
+        one is idle; otherwise the script is started as a subprocess.
+
+        Args:
+            job_id: The ID of the job
+            script_type: Type of script to execute (export, import, decimate, tag)
+            params: Parameters to pass to the script
+            on_progress: Optional coroutine function(percentage or None, line) receiving
+                the script's progress instead of the job's progress key
+
+        Returns:
+            Dictionary with execution results
+        """
+        cmd = build_script_command(script_type, params)
+        capture = LogCapture(job_id, script_type, log_dir=self.log_dir, max_lines=self.log_tail_lines)
+
+        async def handle_line(line, is_stderr=False):
+            parsed = script_line(capture, line, is_stderr)
+            if parsed is None:
+                return
+
+            percentage, stripped_line = parsed
+            if on_progress:
+                await on_progress(percentage, stripped_line)
+                return
+            await self.update_progress(job_id, line_progress(percentage, stripped_line))
+
+        with self.tracer.span("execute_script", job_id=job_id, scriptType=script_type):
+            return await self.run_script(job_id, script_type, params, cmd, capture, handle_line, on_progress)
+
+    async def run_script(self, job_id, script_type, params, cmd, capture, handle_line, on_progress):
+        """
+        Serve a script step from the step cache, a warm executor or a subprocess
+        """
+        if self.step_cache:
+            with self.tracer.span("step_cache.lookup"):
+                cached = await asyncio.to_thread(self.step_cache.lookup, script_type, params)
+            if cached:
+                message = self.cache_hit(job_id, script_type, cached)
+                if on_progress:
+                    await on_progress(100, message)
+                else:
+                    await self.update_progress(job_id, {"log": message})
+                return cached
+
+        usage = {}
+        try:
+            ran = None
+            if self.executor_pool and self.executor_pool.supports(script_type):
+                logger.info(f"[{job_id}] Running {script_type} on a warm executor")
+                with self.tracer.span("script.executor") as span:
+                    ran = await self.run_in_executor_pool(script_type, params, handle_line)
+                    if span and ran is None:
+                        span.discard()
+
+            if ran is None:
+                ran = await self.run_subprocess(job_id, cmd, handle_line)
+            return_code, usage = ran
+            await self.record_usage(script_type, usage)
+
+            if return_code != 0:
+                raise Exception(f"Script execution failed with return code {return_code}")
+
+            capture.close()
+            result = script_result(capture, return_code, usage)
+            if self.step_cache:
+                await asyncio.to_thread(self.step_cache.store, script_type, params, result)
+            return result
+
+        except Exception as e:
+            logger.exception(f"[{job_id}] Error executing script {script_type}")
+            capture.close()
+            return script_error(capture, str(e), usage)
+
+    async def run_subprocess(self, job_id, cmd, handle_line):
+        """
+        Run a script in a fresh interpreter, passing each output line to handle_line.
+        Where wait4 is available the child is reaped with it from a helper
+        thread (see `usage.open_pipe_reader`).
+
+        Returns:
+            Tuple of (process return code, usage fields or None, see `usage.usage_fields`)
+        """
+        logger.info(f"[{job_id}] Executing command: {' '.join(cmd)}")
+
+        started = time.monotonic()
+        with self.tracer.span("script.spawn"):
+            if USAGE_SUPPORTED:
+                process, stdout, stderr = await spawn_async(cmd)
+            else:
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                stdout, stderr = process.stdout, process.stderr
+
+        # Read both pipes as they are written so a chatty script cannot block on a full pipe
+        async def pump(stream, is_stderr):
+            splitter = LineSplitter()
+            while chunk := await stream.read(65536):
+                for line in splitter.feed(chunk):
+                    await handle_line(line, is_stderr=is_stderr)
+            for line in splitter.close():
+                await handle_line(line, is_stderr=is_stderr)
+
+        with self.tracer.span("script.run", pid=process.pid):
+            await asyncio.gather(pump(stdout, False), pump(stderr, True))
+        with self.tracer.span("script.wait"):
+            if isinstance(process, subprocess.Popen):
+                return await asyncio.to_thread(wait_with_usage, process, started)
+            return await process.wait(), None
+
+    async def run_in_executor_pool(self, script_type, params, handle_line, warm_executor=None):
+        """
+        Run a script on the warm executor pool from a helper thread, relaying its
+        output lines back onto the event loop. With a reserved `warm_executor`,
+        `params` is a list and the task is run there with `WarmExecutorPool.run_batch`.
+
+        Returns:
+            Tuple of (return code, usage fields), of lists of them for a batch,
+            or None when no executor was idle
+        """
+        loop = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+
+        def on_line(*item):
+            loop.call_soon_threadsafe(lines.put_nowait, item)
+
+        run = self.executor_pool.run
+        if warm_executor:
+            run = functools.partial(self.executor_pool.run_batch, warm_executor)
+        future = loop.run_in_executor(None, run, script_type, params, on_line)
+        future.add_done_callback(lambda _: lines.put_nowait(None))
+
+        while (item := await lines.get()) is not None:
+            await handle_line(*item)
+
+        return await future
+
+    async def execute_pipeline(self, job_id, params):
+        """
+        Execute an asset pipeline as a graph of steps.
+
+        Steps whose dependencies have completed run concurrently (up to
+        `maxParallelSteps` from the params, or the worker's pipeline parallelism),
+        and the job's progress is the steps' progress weighted by their cost.
+        """
+        logger.info(f"[{job_id}] Starting asset pipeline execution")
+        results = {}
+
+        try:
+            steps = build_pipeline_steps(params)
+            max_parallel = int(params.get("maxParallelSteps", self.pipeline_parallelism))
+
+            completed = await self.load_checkpoint(job_id, steps)
+            if completed:
+                await self.update_progress(job_id, self.resumed_steps(job_id, steps, completed))
+
+            async def run_step(step, pipeline_run):
+                # Steps run as tasks created inside the job's span, so they nest under it
+                with self.tracer.span("pipeline.step", stepId=step["id"], stepType=step["type"]):
+                    return await run_traced_step(step, pipeline_run)
+
+            async def run_traced_step(step, pipeline_run):
+                step_id = step["id"]
+                logger.info(f"[{job_id}] Starting step {step_id} ({step['type']})")
+                await self.update_progress(job_id, {
+                    "percentage": pipeline_run.step_progress(step_id, None),
+                    "log": f"Starting step {step_id}..."
+                })
+
+                async def on_progress(percentage, line):
+                    await self.update_progress(job_id, {
+                        "percentage": pipeline_run.step_progress(step_id, percentage),
+                        "log": f"[{step_id}] {line}"
+                    })
+
+                with self.metrics.step_duration.time(step["type"]):
+                    step_result = await self.execute_script(job_id, step["type"], step["params"],
+                                                            on_progress=on_progress)
+                if step_result.get("success", False):
+                    await self.update_progress(job_id, {
+                        "percentage": pipeline_run.step_progress(step_id, 100),
+                        "log": f"Step {step_id} completed"
+                    })
+                    await self.save_checkpoint(job_id, step, step_result)
+                return step_result
+
+            # On shutdown no new steps start; the job is requeued and resumes from its checkpoint
+            results, error = await run_pipeline_async(steps, run_step, max_parallel, completed=completed,
+                                                      should_stop=lambda: self.shutdown_requested)
+            if error:
+                raise Exception(error)
+            await self.clear_checkpoint(job_id)
+
+            # Complete pipeline
+            logger.info(f"[{job_id}] Pipeline execution completed successfully")
+            await self.update_progress(job_id, {"percentage": 100, "log": "Pipeline execution completed"})
+
+            return pipeline_result(results)
+
+        except PipelineInterrupted:
+            raise
+
+        except Exception as e:
+            logger.exception(f"[{job_id}] Pipeline execution failed")
+            return pipeline_result(results, str(e))
+
+    async def process_job(self, job_data):
+        """
+        Process a job from the queue with locking.
+        """
+        job_id = job_data.get("id")
+        name = job_data.get("name")
+        data = job_data.get("data", {})
+
+        if not await self.join_flights([job_data]):
+            # Attached to an identical job that is already running
+            return True
+
+        if not await self.lock_job(job_id):
+            logger.warning(f"Job {job_id} is locked by another worker, handed it back to its lane")
+            self.flights.pop(job_id, None)
+            return False
+
+        logger.info(f"Processing job {job_id} ({name}) with exclusive lock")
+        await self.record_queue_wait(job_data)
+        self.active_jobs[job_id] = name
+        self.progress_publishers[job_id] = self.progress_publisher(job_data)
+        # On the event loop the profile also covers other jobs running at the same time
+        self.start_profiler(job_id, data)
+
+        try:
+            await self.update_progress(
+                job_id,
+                {"percentage": 0, "log": f"Starting job {name} processing from Python worker"},
+            )
+
+            if name == "asset-pipeline":
+                script_params = data.get("scriptParams", {})
+
+                if script_params.get("pipeline"):
+                    await self.update_progress(job_id, {"percentage": 2, "log": "Starting asset pipeline job..."})
+
+                    result = await self.execute_pipeline(job_id, script_params)
+
+                    if not result.get("success", False):
+                        raise Exception(f"Pipeline execution failed: {result.get('error', 'Unknown error')}")
+
+                    await self.complete_job(job_id, pipeline_output(result))
+                    return True
+
+            if name in SCRIPT_JOBS:
+                script_params = data.get("scriptParams", {})
+
+                await self.update_progress(job_id, {"percentage": 10, "log": f"Executing {name} script..."})
+
+                result = await self.execute_script(job_id, name, script_params)
+
+                if not result.get("success", False):
+                    raise Exception(f"Script execution failed: {result.get('error', 'Unknown error')}")
+
+                await self.update_progress(job_id, {"percentage": 100, "log": "Script execution completed"})
+                await self.complete_job(job_id, script_output(name, result))
+
+            else:
+                # Process generic job with simulated progress updates
+                for i in range(1, GENERIC_JOB_STEPS + 1):
+                    progress = i * 100 // GENERIC_JOB_STEPS
+                    await asyncio.sleep(1.0)
+
+                    log_message = f"Processing step {i}..."
+                    logger.info(f"[{job_id}] {log_message}")
+
+                    await self.update_progress(
+                        job_id, {"percentage": progress, "log": log_message}
+                    )
+
+                await self.complete_job(job_id, generic_output(job_id, data, self.worker_id))
+
+            return True
+
+        except PipelineInterrupted as e:
+            await self.requeue_job(job_id, sorted(e.results))
+            return False
+
+        except Exception as e:
+            logger.exception(f"Error processing job {job_id}")
+            await self.fail_job(job_id, str(e))
+            return False
+        finally:
+            self.active_jobs.pop(job_id, None)
+            self.flights.pop(job_id, None)
+            publisher = self.progress_publishers.pop(job_id, None)
+            if publisher:
+                await publisher.flush()
+            self.discard_profiler(job_id)
+            await self.unlock_job(job_id)
+            logger.info(f"Released lock for job {job_id}")
+
+    async def lock_job(self, job_id, pipe=None):
+        """
+        Take the exclusive lock of a claimed job or hand the claim back (see `Worker.lock_job`)
+        """
+        call = functools.partial(self.shard_for(job_id).scripts.lock_job, **self.lock_call(job_id, self.worker_id))
+        if pipe is not None:
+            return await call(client=pipe)
+        with self.redis_op("lock", job_id):
+            return await call() == 1
+
+    async def unlock_job(self, job_id):
+        """
+        Release the lock of a job this worker ran
+        """
+        shard = self.shard_for(job_id)
+        with self.redis_op("unlock", job_id):
+            await shard.redis.delete(shard.keys.job(job_id, "lock"))
+
+    async def execute_batch(self, script_type, jobs, warm_executor):
+        """
+        Execute a script for every job of a batch (see `Worker.execute_batch`)
+        """
+        params_list = [job.get("data", {}).get("scriptParams", {}) for job in jobs]
+        captures = [LogCapture(job.get("id"), script_type, log_dir=self.log_dir, max_lines=self.log_tail_lines)
+                    for job in jobs]
+
+        async def handle_line(index, line, is_stderr=False):
+            script_line(captures[index], line, is_stderr)
+
+        logger.info(f"Running a batch of {len(jobs)} {script_type} job(s) on a warm executor")
+        with self.tracer.span("script.executor_batch", scriptType=script_type, jobs=len(jobs)):
+            return_codes, usages = await self.run_in_executor_pool(script_type, params_list, handle_line,
+                                                                   warm_executor)
+        await self.record_usage(script_type, *usages)
+
+        return batch_results(captures, return_codes, usages)
+
+    async def process_batch(self, jobs, warm_executor):
+        """
+        Process compatible jobs as one batch (see `Worker.process_batch`)
+        """
+        name = jobs[0].get("name")
+        shard = self.shard_for(jobs[0].get("id"))
+        jobs = await self.join_flights(jobs)
+        if not jobs:
+            return True
+
+        pipe = shard.redis.pipeline(transaction=False)
+        for job in jobs:
+            await self.lock_job(job.get("id"), pipe)
+        with self.redis_op("lock"):
+            jobs = self.locked_jobs(jobs, await pipe.execute())
+        if not jobs:
+            return False
+        job_ids = [job.get("id") for job in jobs]
+
+        logger.info(f"Processing batch of {len(jobs)} {name} job(s) {job_ids} with exclusive locks")
+        pipe = shard.redis.pipeline(transaction=False)
+        for job in jobs:
+            await self.record_queue_wait(job, pipe)
+            self.active_jobs[job.get("id")] = name
+
+        try:
+            with self.redis_op("queue_wait"):
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to record queue wait for batch {job_ids}: {str(e)}")
+
+        try:
+            results = await self.execute_batch(name, jobs, warm_executor)
+
+            # Complete and fail every job of the batch in one round trip
+            pipe = shard.redis.pipeline(transaction=False)
+            for job, result in zip(jobs, results):
+                job_id = job.get("id")
+                if result.get("success", False):
+                    serializer = negotiate(job, self.serializer)
+                    self.queue_final_progress(pipe, job_id, serializer)
+                    output_result = script_output(name, result, batch_size=len(jobs))
+                    call = await self.complete_job_call(job_id, output_result, serializer)
+                    await shard.scripts.complete_job(client=pipe, **call)
+                else:
+                    await shard.scripts.fail_job(
+                        client=pipe,
+                        **self.fail_job_call(job_id, f"Script execution failed: {result.get('error', 'Unknown error')}")
+                    )
+                self.metrics.job_finished(job_id, completed=result.get("success", False))
+            with self.redis_op("complete"):
+                await pipe.execute()
+
+            completed = sum(1 for result in results if result.get("success", False))
+            logger.info(f"Batch of {len(jobs)} {name} job(s) finished: {completed} completed, "
+                        f"{len(jobs) - completed} failed")
+            return True
+
+        except Exception as e:
+            logger.exception(f"Error processing batch {job_ids}")
+            for job_id in job_ids:
+                await self.fail_job(job_id, str(e))
+            return False
+        finally:
+            for job_id in job_ids:
+                self.active_jobs.pop(job_id, None)
+                self.flights.pop(job_id, None)
+            with self.redis_op("unlock"):
+                await shard.redis.delete(*[shard.keys.job(job_id, "lock") for job_id in job_ids])
+            logger.info(f"Released locks for batch {job_ids}")
+
+    async def get_next_job(self):
+        """
+        Claim the next job from the Redis queue (see `Worker.get_next_job`)
+        """
+        job = self.take_prefetched()
+        if job:
+            return job
+
+        # Cleared before the claim so a job finishing after it wakes up the wait below
+        self.resources.released.clear()
+        claimed, lanes, shard = await self.claim(self.prefetch)
+
+        if self.all_deferred(claimed):
+            # Jobs are waiting but none fits the free capacity: wait for a running job to release its tokens
+            await asyncio.to_thread(self.resources.released.wait, LANE_BLOCK_TIMEOUT)
+            return None
+
+        if not claimed:
+            lanes, shard, lane_key, claiming_key, timeout = self.block_target()
+            with self.redis_op("block") as span:
+                moved = await shard.redis.blmove(lane_key, claiming_key, timeout, src="RIGHT", dest="LEFT")
+                # Idle blocks would flood the trace
+                if span and not moved:
+                    span.discard()
+            if not moved:
+                return None
+            with self.redis_op("claim"):
+                claimed = await shard.scripts.claim_jobs(**self.handoff_call(shard, lanes, lane_key, claiming_key))
+            if claimed and claimed[0] == b"deferred":
+                # The job does not fit the free capacity: put it back at the head of its
+                # lane and give running jobs a moment to release their tokens
+                with self.redis_op("defer"):
+                    await shard.redis.lmove(claiming_key, lane_key, "RIGHT", "RIGHT")
+                await asyncio.to_thread(self.resources.released.wait, timeout)
+                return None
+
+        jobs = self.accept_claimed(claimed, lanes, shard)
+        if not jobs:
+            return None
+
+        self.keep_prefetched(jobs[1:])
+        return jobs[0]
+
+    async def claim(self, count):
+        """
+        Move up to `count` jobs into the processing hash of one shard without blocking (see `Worker.claim`)
+        """
+        lanes = self.lanes.order()
+        deferred = None
+        for shard in self.shard_scheduler.order():
+            with self.redis_op("claim") as span:
+                claimed = await shard.scripts.claim_jobs(**self.claim_call(shard, lanes, count))
+                # Empty polls would flood the trace
+                if span and not claimed:
+                    span.discard()
+            if any(status != b"deferred" for status in claimed[::3]):
+                return claimed, lanes, shard
+            if claimed and deferred is None:
+                deferred = (claimed, lanes, shard)
+        return deferred or ([], lanes, self.shards[0])
+
+    async def collect_batch(self, job_data):
+        """
+        Gather up to `max_batch` jobs that can run in one batch with `job_data` (see `Worker.collect_batch`)
+        """
+        key = batch_key(job_data)
+        if self.max_batch <= 1 or key is None:
+            return [job_data]
+
+        batch = [job_data]
+        deadline = time.monotonic() + self.batch_window
+        while (remaining := self.fill_batch(batch, key, deadline)) is not None:
+            try:
+                claimed, lanes, shard = await self.claim(self.max_batch - len(batch))
+                jobs = self.accept_claimed(claimed, lanes, shard)
+            except Exception as e:
+                logger.error(f"Failed to claim more jobs for a batch: {str(e)}")
+                break
+            if jobs:
+                self.keep_prefetched(jobs)
+            else:
+                await asyncio.sleep(min(remaining, BATCH_POLL_INTERVAL))
+        return batch
+
+    async def release_prefetched(self):
+        """
+        Give prefetched jobs that were never started back to the queue
+        """
+        for shard, shard_job_ids in self.drain_prefetched().items():
+            try:
+                released = await shard.scripts.release_jobs(**self.release_call(shard, shard_job_ids[::-1]))
+                logger.info(f"Returned {released} prefetched job(s) to {shard.keys.wait}")
+            except Exception as e:
+                logger.error(f"Failed to return prefetched jobs {shard_job_ids}: {str(e)}")
+
+    async def record_queue_wait(self, job_data, pipe=None):
+        """
+        Record how long a job waited in its lane (see `Worker.record_queue_wait`)
+        """
+        job_id = job_data.get("id")
+        lane, wait_ms = job_data.get("lane", self.lanes.names[0]), None
+        try:
+            queued = pipe is not None
+            pipe = pipe if queued else self.shard_for(job_id).redis.pipeline(transaction=False)
+            lane, wait_ms = self.queue_wait_writes(pipe, job_data)
+            if not queued:
+                with self.redis_op("queue_wait", job_id):
+                    await pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to record queue wait for job {job_id}: {str(e)}")
+
+        self.job_started(job_data, lane, wait_ms)
+
+    async def update_progress(self, job_id, progress_data):
+        """
+        Update job progress in Redis, coalesced through the job's publisher while it runs
+        """
+        publisher = self.progress_publishers.get(job_id)
+        if publisher:
+            await publisher.publish(progress_data)
+            return
+
+        try:
+            shard = self.shard_for(job_id)
+            progress_key = shard.keys.job(job_id, "progress")
+            await shard.redis.set(progress_key, self.serializer.dumps(progress_data),
+                                  ex=self.result_store.progress_ttl or None)
+            logger.debug(f"Updated progress for job {job_id}: {progress_data}")
+        except Exception as e:
+            logger.error(f"Failed to update progress for job {job_id}: {str(e)}")
+
+    async def flush_progress(self, job_id):
+        """
+        Write any coalesced progress for a job that is still pending
+        """
+        publisher = self.progress_publishers.get(job_id)
+        if publisher:
+            await publisher.flush()
+
+    async def flush_progress_loop(self):
+        """
+        Periodically write progress that has been held back by coalescing
+        """
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            for publisher in list(self.progress_publishers.values()):
+                if publisher.is_due():
+                    await publisher.flush()
+
+    async def heartbeat(self):
+        """
+        Extend the leases and lock keys of active and prefetched jobs (see `Worker.heartbeat`)
+        """
+        lost = []
+        capacity = json.dumps(self.resources.snapshot())
+        for shard, shard_job_ids in self.held_jobs().items():
+            with self.redis_op("heartbeat"):
+                lost += await shard.scripts.extend_leases(**self.extend_call(shard, shard_job_ids))
+                pipe = shard.redis.pipeline(transaction=False)
+                self.queue_registration(pipe, shard, capacity)
+                await pipe.execute()
+        if lost:
+            self.forget_lost(lost)
+
+    async def reap_expired(self):
+        """
+        Requeue jobs whose lease expired, failing those out of retries, on every shard
+        """
+        for shard in self.shards:
+            with self.redis_op("reap"):
+                requeued, failed, recovered = await shard.scripts.reap_expired(**self.reap_call(shard))
+            self.log_reaped(shard, requeued, failed, recovered)
+
+    async def sample_queue_depths(self):
+        """
+        Sample queue depths into the metrics and each shard's load (see `Worker.sample_queue_depths`)
+        """
+        depths = {}
+        for shard in self.shards:
+            pipe = shard.redis.pipeline(transaction=False)
+            self.queue_depth_reads(pipe, shard)
+            with self.redis_op("sample"):
+                depths[shard] = await pipe.execute()
+        self.record_depths(depths)
+
+    async def record_usage(self, script_type, *usages):
+        """
+        Add the resource usage of script runs to the rolling samples of their type
+        """
+        usages = [usage for usage in usages if self.observe_usage(script_type, usage)]
+        if not usages:
+            return
+        shard = self.shards[0]
+        try:
+            pipe = shard.redis.pipeline(transaction=False)
+            for usage in usages:
+                queue_usage_sample(pipe, shard.keys, script_type, usage, self.usage_window)
+            with self.redis_op("usage"):
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to record resource usage of {script_type}: {str(e)}")
+
+    async def refresh_usage_estimates(self):
+        """
+        Replace the static memory needs of script job types with measured ones
+        (see `Worker.refresh_usage_estimates`)
+        """
+        if not self.usage_window:
+            return
+        pipe = self.shards[0].redis.pipeline(transaction=False)
+        self.queue_usage_reads(pipe)
+        with self.redis_op("usage"):
+            self.record_usage_estimates(await pipe.execute())
+
+    async def heartbeat_loop(self):
+        """
+        Heartbeat and reap a few times per lease
+        """
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await self.heartbeat()
+                await self.reap_expired()
+                await self.sample_queue_depths()
+                await self.refresh_usage_estimates()
+            except Exception as e:
+                logger.error(f"Lease heartbeat failed: {str(e)}")
+
+    async def complete_job(self, job_id, result_data):
+        """
+        Mark a job as completed
+        """
+        shard = self.shard_for(job_id)
+        await self.flush_progress(job_id)
+        self.metrics.job_finished(job_id, completed=True)
+        serializer = self.finished_serializer(job_id)
+        result_data = self.profiled_result(job_id, result_data)
+        try:
+            call = await self.complete_job_call(job_id, result_data, serializer)
+            with self.redis_op("complete", job_id):
+                await shard.scripts.complete_job(**call)
+
+            logger.info(f"Job {job_id} completed successfully")
+
+        except Exception as e:
+            logger.error(f"Failed to mark job {job_id} as completed: {str(e)}")
+
+    async def complete_job_call(self, job_id, result_data, serializer):
+        """
+        Keys and arguments of the complete script storing a job's encoded result
+        """
+        data = serializer.dumps(result_data)
+        if self.result_store.encoding_for(len(data)) == IDENTITY:
+            stored, encoding = data, IDENTITY
+        else:
+            # Compressing or writing a large result would stall the event loop
+            stored, encoding = await asyncio.to_thread(self.result_store.encode, self.shard_for(job_id).keys.queue_key,
+                                                       job_id, data, serializer.content_type)
+        return self.complete_call(job_id, stored, encoding, serializer)
+
+    async def fail_job(self, job_id, error_message):
+        """
+        Mark a job as failed
+        """
+        shard = self.shard_for(job_id)
+        await self.flush_progress(job_id)
+        self.metrics.job_finished(job_id, completed=False)
+        try:
+            with self.redis_op("fail", job_id):
+                await shard.scripts.fail_job(**self.fail_job_call(job_id, error_message))
+
+            logger.error(f"Job {job_id} failed: {error_message}")
+
+        except Exception as e:
+            logger.error(f"Failed to mark job {job_id} as failed: {str(e)}")
+
+    async def join_flights(self, jobs):
+        """
+        Attach jobs to identical jobs already running (see `Worker.join_flights`)
+        """
+        keyed = self.flight_keys(jobs)
+        if not keyed:
+            return jobs
+        shard = self.shard_for(jobs[0].get("id"))
+        pipe = shard.redis.pipeline(transaction=False)
+        for job, key in keyed:
+            await shard.scripts.join_flight(client=pipe, **self.join_flight_call(shard, job, key))
+        try:
+            with self.redis_op("join_flight"):
+                leaders = await pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to register idempotency keys, running the jobs on their own: {str(e)}")
+            return jobs
+        return self.settle_flights(jobs, keyed, leaders, shard)
+
+    async def requeue_job(self, job_id, done_steps):
+        """
+        Put a pipeline job interrupted by shutdown back in its lane (see `Worker.requeue_job`)
+        """
+        await self.flush_progress(job_id)
+        self.metrics.job_requeued(job_id)
+        shard = self.shard_for(job_id)
+        try:
+            pipe = shard.redis.pipeline(transaction=False)
+            await shard.scripts.release_jobs(client=pipe, **self.release_call(shard, [job_id]))
+            self.queue_requeued_event(pipe, job_id, done_steps)
+            with self.redis_op("requeue", job_id):
+                await pipe.execute()
+
+            logger.info(f"Job {job_id} requeued after steps {done_steps}")
+
+        except Exception as e:
+            logger.error(f"Failed to requeue job {job_id}: {str(e)}")
+
+    async def load_checkpoint(self, job_id, steps):
+        """
+        Results of the pipeline steps that can be skipped (see `Worker.load_checkpoint`)
+        """
+        shard = self.shard_for(job_id)
+        try:
+            with self.redis_op("checkpoint", job_id):
+                entries = await shard.redis.hgetall(shard.keys.job(job_id, "checkpoint"))
+        except Exception as e:
+            logger.error(f"Failed to load checkpoint of job {job_id}, running all steps: {str(e)}")
+            return {}
+        return resumable_steps(job_id, steps, entries)
+
+    async def save_checkpoint(self, job_id, step, result):
+        """
+        Record a completed pipeline step in the job's checkpoint hash
+        """
+        try:
+            pipe = self.shard_for(job_id).redis.pipeline(transaction=False)
+            self.queue_checkpoint(pipe, job_id, step, result)
+            with self.redis_op("checkpoint", job_id):
+                await pipe.execute()
+        except Exception as e:
+            # Only costs rerunning the step if the job is retried
+            logger.error(f"Failed to checkpoint step {step['id']} of job {job_id}: {str(e)}")
+
+    async def clear_checkpoint(self, job_id):
+        """
+        Drop the checkpoint of a pipeline that ran to completion
+        """
+        shard = self.shard_for(job_id)
+        try:
+            with self.redis_op("checkpoint", job_id):
+                await shard.redis.delete(shard.keys.job(job_id, "checkpoint"))
+        except Exception as e:
+            logger.error(f"Failed to clear checkpoint of job {job_id}: {str(e)}")
+
+    async def poll_queue(self):
+        """
+        Continuously poll the Redis queue for new jobs.
+
+        Each claimed job runs as its own task; a semaphore keeps at most
+        `concurrency` jobs in flight. On shutdown no new jobs are claimed and
+        running tasks are awaited before returning.
+        """
+        logger.info(f"Async worker {self.worker_id} started polling queue {self.queue_key} with up to {self.concurrency} job(s)")
+
+        if self.cluster:
+            # Scripts run inside pipelines there, which need them loaded on every primary
+            await asyncio.gather(*self.shards[0].scripts.load())
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        flusher = asyncio.create_task(self.flush_progress_loop())
+        await self.heartbeat()
+        heartbeat = asyncio.create_task(self.heartbeat_loop())
+
+        async def run_slot(job_data):
+            try:
+                with self.tracer.span("process_job", job_id=job_data.get("id"), jobName=job_data.get("name"),
+                                      lane=job_data.get("lane")):
+                    await self.process_job(job_data)
+            finally:
+                self.free_jobs([job_data])
+                slots.release()
+
+        async def run_batch_slot(jobs, warm_executor):
+            try:
+                with self.tracer.span("process_batch", job_id=jobs[0].get("id"), jobName=jobs[0].get("name"),
+                                      jobs=len(jobs)):
+                    await self.process_batch(jobs, warm_executor)
+            finally:
+                # Only still reserved when the batch ended before its task was sent
+                self.executor_pool.release(warm_executor)
+                self.free_jobs(jobs)
+                slots.release()
+
+        try:
+            while not self.shutdown_requested:
+                await slots.acquire()
+                if self.shutdown_requested:
+                    slots.release()
+                    break
+
+                try:
+                    with self.tracer.span("get_next_job") as span:
+                        job_data = await self.get_next_job()
+                        if span:
+                            if job_data:
+                                span.job_id = job_data.get("id")
+                            else:
+                                span.discard()
+
+                    # A batch is only collected once a warm executor is reserved for it
+                    warm_executor = self.batch_executor(job_data) if job_data else None
+                    batch = await self.collect_batch(job_data) if warm_executor else [job_data]
+                    if len(batch) > 1:
+                        task = asyncio.create_task(run_batch_slot(batch, warm_executor))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                    elif job_data:
+                        if warm_executor:
+                            self.executor_pool.release(warm_executor)
+                        task = asyncio.create_task(run_slot(job_data))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                    else:
+                        # The claim already blocked, so poll again right away
+                        slots.release()
+
+                except Exception as e:
+                    slots.release()
+                    logger.exception(f"Error during queue polling: {str(e)}")
+                    await asyncio.sleep(5)
+        finally:
+            await self.release_prefetched()
+            if tasks:
+                logger.info(f"Async worker {self.worker_id} draining {len(tasks)} in-flight job(s)")
+                await asyncio.gather(*tasks, return_exceptions=True)
+            flusher.cancel()
+            self.tracer.close()
+            heartbeat.cancel()
+            try:
+                for shard in self.shards:
+                    await shard.redis.zrem(shard.keys.workers, self.worker_id)
+                    await shard.redis.hdel(shard.keys.capacity, self.worker_id)
+                    await shard.redis.hdel(shard.keys.claiming_lanes, self.worker_id)
+            except Exception as e:
+                logger.error(f"Failed to deregister worker {self.worker_id}: {str(e)}")
+            if self.executor_pool:
+                self.executor_pool.close()
+            for client in {id(shard.redis): shard.redis for shard in self.shards}.values():
+                await client.close()
+
+        logger.info(f"Async worker {self.worker_id} stopped polling")
+
+    def handle_shutdown(self, signum, frame=None):
+        """
+        Handle shutdown signals gracefully
+        """
+        logger.info(f"Received shutdown signal {signum}, stopping worker after in-flight jobs finish: {list(self.active_jobs)}")
+        self.shutdown_requested = True
+
+    async def run(self):
+        """
+        Register signal handlers on the running loop and poll the queue
+        """
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.handle_shutdown, signum)
+
+        logger.info(f"Starting async worker {self.worker_id}")
+        await self.poll_queue()
+
+    def start(self):
+        """
+        Start the worker on a new event loop
+        """
+        asyncio.run(self.run())
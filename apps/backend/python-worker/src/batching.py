@@ -0,0 +1,51 @@
+import json
+
+# Job types whose jobs may run together as one executor task, with the script
+# params that must be equal for two jobs to share a batch (and their defaults)
+BATCHABLE_JOBS = {
+    "asset-tag": {"category": "general"},
+}
+
+# Milliseconds a batch waits for more compatible jobs to be claimed
+DEFAULT_BATCH_WINDOW_MS = 20
+
+# Seconds between two claims while a batch waits for more jobs
+BATCH_POLL_INTERVAL = 0.005
+
+
+def batch_key(job_data):
+    """
+    Key shared by jobs that can run in the same batch, or None when the job
+    always runs on its own (other job types and jobs asking for a profile).
+    A batch only holds jobs claimed from the same shard.
+    """
+    name = job_data.get("name")
+    if name not in BATCHABLE_JOBS:
+        return None
+    data = job_data.get("data") or {}
+    if data.get("profile"):
+        return None
+    params = data.get("scriptParams") or {}
+    return (name, job_data.get("shard", 0)) + tuple(
+        json.dumps(params.get(field, default), sort_keys=True) for field, default in BATCHABLE_JOBS[name].items()
+    )
+
+
+def take_compatible(jobs, key, limit):
+    """
+    Remove up to `limit` jobs with batch key `key` from a deque of jobs,
+    keeping the order of the others
+
+    Returns:
+        List of the removed jobs
+    """
+    taken = []
+    kept = []
+    while jobs:
+        job = jobs.popleft()
+        if len(taken) < limit and batch_key(job) == key:
+            taken.append(job)
+        else:
+            kept.append(job)
+    jobs.extend(kept)
+    return taken
@@ -0,0 +1,614 @@
+import asyncio
+import logging
+import time
+import uuid
+
+from async_worker import AsyncWorker
+from keys import BullKeys
+from lanes import DEFAULT_LANE, LANE_BLOCK_TIMEOUT, queue_wait_ms
+from lua_scripts import BullScripts, decode_bull_job
+from progress import BULL_EVENTS_MAXLEN, AsyncBullProgressPublisher, BullProgressPublisher
+from serializers import FAST_JSON
+from worker import Worker
+
+logger = logging.getLogger(__name__)
+
+# Default prefix of BullMQ keys, the `prefix` option of Queue and Worker
+DEFAULT_BULL_PREFIX = "bull"
+
+# Longest wait on the queue's marker before moveToActive runs again
+MARKER_BLOCK_TIMEOUT = 1.0
+
+# Reply codes of BULL_MOVE_TO_FINISHED other than 0
+FINISH_ERRORS = {
+    -1: "job no longer exists",
+    -2: "job lock is missing",
+    -3: "job is not in the active list",
+    -6: "job lock is held by another worker",
+}
+
+# Why BULL_MOVE_TO_ACTIVE left the next job for Node workers
+REFUSALS = {
+    "rate-limited": "queue is rate limited",
+    "parent": "job is the child of a flow",
+}
+
+
+def check_bull_options(worker):
+    """
+    Refuse options the BullMQ layout has no place for: jobs are claimed one
+    at a time from a single wait list, and results go to the job hash.
+
+    Raises:
+        ValueError: An unsupported option is set
+    """
+    unsupported = [option for option, used in (
+        ("shards", len(worker.shards) > 1),
+        ("prefetch", worker.prefetch > 1),
+        ("max_batch", worker.max_batch > 1),
+        ("dedupe_ttl", worker.dedupe_ttl_ms > 0),
+        ("lanes", worker.lanes.names != [DEFAULT_LANE]),
+    ) if used]
+    if unsupported:
+        raise ValueError(f"Not supported with the BullMQ protocol: {', '.join(unsupported)}")
+
+
+def retry_delay(opts, attempts_made):
+    """
+    Milliseconds before a failed job is tried again, following its `attempts`
+    and `backoff` options like BullMQ does, or -1 when it has no attempts left.
+    Custom backoff strategies only exist in Node; they retry at once here.
+
+    Args:
+        opts: BullMQ options of the job
+        attempts_made: Attempts made so far, including the one that just failed
+    """
+    if attempts_made >= int(opts.get("attempts") or 1):
+        return -1
+    backoff = opts.get("backoff")
+    if isinstance(backoff, (int, float)):
+        return int(backoff)
+    if not isinstance(backoff, dict):
+        return 0
+    delay = backoff.get("delay") or 0
+    if backoff.get("type") == "exponential":
+        return int(round(2 ** (attempts_made - 1) * delay))
+    if backoff.get("type") == "fixed":
+        return int(delay)
+    return 0
+
+
+def move_to_active_call(keys, token, lock_ms, worker_name):
+    """
+    Keys and arguments of BULL_MOVE_TO_ACTIVE
+    """
+    return dict(
+        keys=[keys.wait, keys.active, keys.prioritized, keys.events, keys.delayed, keys.meta, keys.pc, keys.marker,
+              keys.limiter],
+        args=[keys.prefix, int(time.time() * 1000), token, lock_ms, worker_name],
+    )
+
+
+def move_to_finished_call(keys, job_id, token, failed, value, delay=-1):
+    """
+    Keys and arguments of BULL_MOVE_TO_FINISHED completing a job with its JSON
+    return value, or failing it with an error message and retrying it after
+    `delay` ms unless that is -1
+    """
+    target = "failed" if failed else "completed"
+    return dict(
+        keys=[keys.job(job_id), keys.active, keys.failed if failed else keys.completed, keys.events, keys.meta,
+              keys.wait, keys.paused, keys.delayed, keys.marker, keys.stalled, keys.prioritized],
+        args=[job_id, int(time.time() * 1000), token, target, "failedReason" if failed else "returnvalue", value,
+              keys.prefix, delay],
+    )
+
+
+def move_to_wait_call(keys, job_id, token):
+    """
+    Keys and arguments of BULL_MOVE_TO_WAIT
+    """
+    return dict(
+        keys=[keys.active, keys.wait, keys.paused, keys.stalled, keys.meta, keys.marker, keys.events],
+        args=[job_id, token, keys.prefix],
+    )
+
+
+def move_stalled_call(keys, max_stalled, check_ms):
+    """
+    Keys and arguments of BULL_MOVE_STALLED
+    """
+    return dict(
+        keys=[keys.stalled, keys.wait, keys.active, keys.stalled_check, keys.meta, keys.paused, keys.marker,
+              keys.events, keys.failed],
+        args=[max_stalled, keys.prefix, int(time.time() * 1000), check_ms],
+    )
+
+
+def refusal(reply):
+    """
+    Message for a BULL_MOVE_TO_ACTIVE reply that refused the next job, or None
+    """
+    if len(reply) < 3:
+        return None
+    reason, job_id = reply[2].decode(), reply[3].decode()
+    message = f"Not claiming from the queue, {REFUSALS.get(reason, reason)}"
+    if job_id:
+        message += f" (job {job_id})"
+    return message + "; rate limiting and flows are left to Node workers"
+
+
+def marker_timeout(next_delayed_ms):
+    """
+    Seconds to block on the marker: until the next delayed job is due, at most MARKER_BLOCK_TIMEOUT
+    """
+    if not next_delayed_ms:
+        return MARKER_BLOCK_TIMEOUT
+    return min(MARKER_BLOCK_TIMEOUT, max(0.01, next_delayed_ms / 1000 - time.time()))
+
+
+class BullMQWorker(Worker):
+    """
+    `Worker` consuming a BullMQ queue next to the Node workers.
+
+    Jobs are claimed, locked, completed, failed, retried and recovered from
+    stalls with the same Redis transitions as BullMQ (see `keys.BullKeys`), so
+    `Queue.add()` callers, `QueueEvents` listeners and Node workers on the same
+    queue see Python-run jobs like any other. The lock duration and the
+    stalled check interval are the lease TTL, and `max_retries` is the
+    queue's `maxStalledCount`. Pipelines, scripts, warm executors, the step
+    cache and checkpoints work as with the native layout.
+    """
+
+    def __init__(self, *args, prefix=DEFAULT_BULL_PREFIX, **kwargs):
+        """
+        Args:
+            prefix: Prefix of the queue's keys, BullMQ's `prefix` option
+            Other arguments as for `Worker`; `queue_key` is the BullMQ queue name
+        """
+        super().__init__(*args, **kwargs)
+        check_bull_options(self)
+        self.bull_keys = BullKeys(self.queue_key, prefix=prefix)
+        self.bull_scripts = BullScripts(self.shards[0].redis)
+        # Recorded as `pb` (processed by) on the jobs this worker takes
+        self.worker_name = f"python-worker-{self.worker_id}"
+        # Active job id -> token its lock holds
+        self.tokens = {}
+        # Why the last claim left the next job for Node workers, if it did
+        self.refused = None
+
+    def get_next_job(self):
+        """
+        Move the next job to the active list with BullMQ's moveToActive. When
+        none is waiting, block on the queue's marker like a Node worker until
+        a job is added or the next delayed job is due.
+        """
+        client = self.shards[0].redis
+        token = str(uuid.uuid4())
+        # Cleared before the claim so a job finishing after it wakes up the wait below
+        self.resources.released.clear()
+        with self.redis_op("claim") as span:
+            reply = self.bull_scripts.move_to_active(**move_to_active_call(self.bull_keys, token, self.lease_ttl_ms,
+                                                                           self.worker_name))
+            if span and not reply[0]:
+                span.discard()
+
+        refused = refusal(reply)
+        if refused != self.refused:
+            # Logged once per change rather than on every claim
+            if refused:
+                logger.warning(refused)
+            self.refused = refused
+        if refused:
+            time.sleep(MARKER_BLOCK_TIMEOUT)
+            return None
+
+        if not reply[0]:
+            timeout = marker_timeout(int(reply[1]))
+            with self.redis_op("block") as span:
+                popped = client.bzpopmin(self.bull_keys.marker, timeout)
+                if span and not popped:
+                    span.discard()
+            if popped and popped[2] > time.time() * 1000:
+                # Marker of a delayed job that is not due yet
+                time.sleep(timeout)
+            return None
+
+        job_id = reply[0].decode()
+        self.tokens[job_id] = token
+        try:
+            job = decode_bull_job(reply, DEFAULT_LANE)
+        except ValueError as e:
+            logger.error(f"Failed to parse data of job {job_id}: {str(e)}")
+            self.finish_job(job_id, True, f"Invalid job data: {str(e)}")
+            return None
+
+        needs = self.resources.needs(job, job["lane"])
+        if not self.resources.fits(needs):
+            # Next in line again for whichever worker has room; wait for a running job to release its tokens
+            self.release_job(job_id)
+            self.resources.released.wait(LANE_BLOCK_TIMEOUT)
+            return None
+        self.resources.acquire(job_id, needs)
+        self.metrics.job_claimed(job.get("name"), job["lane"])
+        return job
+
+    def release_job(self, job_id):
+        """
+        Put an active job back at the head of the wait list and drop its lock
+        """
+        try:
+            with self.redis_op("release", job_id):
+                self.bull_scripts.move_to_wait(**move_to_wait_call(self.bull_keys, job_id, self.tokens.pop(job_id)))
+        except Exception as e:
+            logger.error(f"Failed to return job {job_id} to {self.bull_keys.wait}: {str(e)}")
+
+    def finish_job(self, job_id, failed, value, delay=-1):
+        """
+        Run BULL_MOVE_TO_FINISHED for a job this worker holds
+
+        Returns:
+            Whether the job was moved; otherwise its lock was lost and another worker owns it
+        """
+        with self.redis_op("fail" if failed else "complete", job_id):
+            code = self.bull_scripts.move_to_finished(
+                **move_to_finished_call(self.bull_keys, job_id, self.tokens.pop(job_id, ""), failed, value, delay)
+            )
+        if code:
+            logger.error(f"Could not finish job {job_id}: {FINISH_ERRORS.get(code, code)}")
+        return not code
+
+    def lock_job(self, job_id, slot_name, pipe=None):
+        """
+        moveToActive already locked the job with this worker's token
+        """
+        return True
+
+    def unlock_job(self, job_id):
+        """
+        Finishing or releasing the job deleted its lock; one still held was lost to the stalled check
+        """
+        self.tokens.pop(job_id, None)
+
+    def progress_publisher(self, job_data):
+        """
+        Publisher writing a job's progress and log lines where BullMQ keeps them
+        """
+        return BullProgressPublisher(
+            self.shards[0].redis, self.bull_keys, job_data.get("id"), interval=self.progress_interval,
+            stream_maxlen=BULL_EVENTS_MAXLEN, instrument=self.redis_op, serializer=FAST_JSON,
+            keep_logs=job_data.get("opts", {}).get("keepLogs"),
+        )
+
+    def record_queue_wait(self, job_data, pipe=None):
+        """
+        Record how long a job waited in the metrics; moveToActive already emitted its `active` event
+        """
+        wait_ms = queue_wait_ms(job_data)
+        logger.info(f"Job {job_data.get('id')} waited {wait_ms if wait_ms is not None else '?'} ms")
+        self.metrics.job_started(job_data.get("id"), job_data.get("name"), job_data.get("lane"), wait_ms)
+
+    def update_progress(self, job_id, progress_data):
+        """
+        Update job progress through its publisher, or directly in the job hash once it stopped running
+        """
+        publisher = self.progress_publishers.get(job_id)
+        if publisher:
+            publisher.publish(progress_data)
+            return
+
+        try:
+            client = self.shards[0].redis
+            if client.exists(self.bull_keys.job(job_id)):
+                client.hset(self.bull_keys.job(job_id), "progress", FAST_JSON.dumps(progress_data))
+        except Exception as e:
+            logger.error(f"Failed to update progress for job {job_id}: {str(e)}")
+
+    def complete_job(self, job_id, result_data):
+        """
+        Mark a job as completed, storing its result as the job's `returnvalue`
+        """
+        self.flush_progress(job_id)
+        self.metrics.job_finished(job_id, completed=True)
+        profiler = self.profilers.pop(job_id, None)
+        if profiler:
+            result_data = {**result_data, **profiler.stop()}
+        try:
+            if self.finish_job(job_id, False, FAST_JSON.dumps(result_data)):
+                logger.info(f"Job {job_id} completed successfully")
+        except Exception as e:
+            logger.error(f"Failed to mark job {job_id} as completed: {str(e)}")
+
+    def fail_job(self, job_id, error_message):
+        """
+        Mark a job as failed, or schedule its next attempt when its `attempts` option allows one
+        """
+        self.flush_progress(job_id)
+        self.metrics.job_finished(job_id, completed=False)
+        try:
+            opts, attempts_made = self.bull_options(job_id)
+            delay = retry_delay(opts, attempts_made + 1)
+            if self.finish_job(job_id, True, error_message, delay):
+                if delay < 0:
+                    logger.error(f"Job {job_id} failed: {error_message}")
+                else:
+                    logger.warning(f"Job {job_id} failed, retrying in {delay} ms: {error_message}")
+        except Exception as e:
+            logger.error(f"Failed to mark job {job_id} as failed: {str(e)}")
+
+    def bull_options(self, job_id):
+        """
+        BullMQ options of a job and the number of attempts it made before the current one
+        """
+        opts, attempts_made = self.shards[0].redis.hmget(self.bull_keys.job(job_id), "opts", "atm")
+        return FAST_JSON.loads(opts or b"{}"), int(attempts_made or 0)
+
+    def requeue_job(self, job_id, done_steps):
+        """
+        Put a pipeline job interrupted by shutdown back in the wait list; the
+        next worker resumes after `done_steps` from its checkpoint
+        """
+        self.flush_progress(job_id)
+        self.metrics.job_requeued(job_id)
+        self.release_job(job_id)
+        logger.info(f"Job {job_id} requeued after steps {done_steps}")
+
+    def heartbeat(self):
+        """
+        Extend the locks of the jobs this worker is running
+        """
+        tokens = dict(self.tokens)
+        if not tokens:
+            return
+        args = [self.lease_ttl_ms, self.bull_keys.prefix]
+        for job_id, token in tokens.items():
+            args += [job_id, token]
+        with self.redis_op("heartbeat"):
+            lost = self.bull_scripts.extend_locks(keys=[self.bull_keys.stalled], args=args)
+        for job_id in lost:
+            logger.warning(f"Lock of job {job_id.decode()} was lost before it could be extended; it may run twice")
+
+    def reap_expired(self):
+        """
+        Run BullMQ's stalled job check, at most once per lease TTL across all workers of the queue
+        """
+        with self.redis_op("reap"):
+            requeued, failed = self.bull_scripts.move_stalled(
+                **move_stalled_call(self.bull_keys, self.max_retries, self.lease_ttl_ms)
+            )
+        if requeued or failed:
+            logger.warning(f"Stalled jobs on {self.bull_keys.queue_name}: {len(requeued)} requeued, {len(failed)} failed")
+
+    def sample_queue_depths(self):
+        """
+        Sample the waiting (wait list and prioritized set) and active job counts into the metrics
+        """
+        pipe = self.shards[0].redis.pipeline(transaction=False)
+        pipe.llen(self.bull_keys.wait)
+        pipe.zcard(self.bull_keys.prioritized)
+        pipe.llen(self.bull_keys.active)
+        with self.redis_op("sample"):
+            wait, prioritized, active = pipe.execute()
+        self.metrics.queue_depth.set(wait + prioritized, DEFAULT_LANE)
+        self.metrics.queue_depth.set(active, "processing")
+
+
+class AsyncBullMQWorker(AsyncWorker):
+    """
+    asyncio variant of `BullMQWorker`
+    """
+
+    def __init__(self, *args, prefix=DEFAULT_BULL_PREFIX, **kwargs):
+        super().__init__(*args, **kwargs)
+        check_bull_options(self)
+        self.bull_keys = BullKeys(self.queue_key, prefix=prefix)
+        self.bull_scripts = BullScripts(self.shards[0].redis)
+        self.worker_name = f"python-worker-{self.worker_id}"
+        self.tokens = {}
+        self.refused = None
+
+    async def get_next_job(self):
+        """
+        Move the next job to the active list, blocking on the marker while none waits (see `BullMQWorker.get_next_job`)
+        """
+        client = self.shards[0].redis
+        token = str(uuid.uuid4())
+        self.resources.released.clear()
+        with self.redis_op("claim") as span:
+            reply = await self.bull_scripts.move_to_active(**move_to_active_call(self.bull_keys, token,
+                                                                                 self.lease_ttl_ms, self.worker_name))
+            if span and not reply[0]:
+                span.discard()
+
+        refused = refusal(reply)
+        if refused != self.refused:
+            if refused:
+                logger.warning(refused)
+            self.refused = refused
+        if refused:
+            await asyncio.sleep(MARKER_BLOCK_TIMEOUT)
+            return None
+
+        if not reply[0]:
+            timeout = marker_timeout(int(reply[1]))
+            with self.redis_op("block") as span:
+                popped = await client.bzpopmin(self.bull_keys.marker, timeout)
+                if span and not popped:
+                    span.discard()
+            if popped and popped[2] > time.time() * 1000:
+                await asyncio.sleep(timeout)
+            return None
+
+        job_id = reply[0].decode()
+        self.tokens[job_id] = token
+        try:
+            job = decode_bull_job(reply, DEFAULT_LANE)
+        except ValueError as e:
+            logger.error(f"Failed to parse data of job {job_id}: {str(e)}")
+            await self.finish_job(job_id, True, f"Invalid job data: {str(e)}")
+            return None
+
+        needs = self.resources.needs(job, job["lane"])
+        if not self.resources.fits(needs):
+            await self.release_job(job_id)
+            await asyncio.to_thread(self.resources.released.wait, LANE_BLOCK_TIMEOUT)
+            return None
+        self.resources.acquire(job_id, needs)
+        self.metrics.job_claimed(job.get("name"), job["lane"])
+        return job
+
+    async def release_job(self, job_id):
+        """
+        Put an active job back at the head of the wait list and drop its lock
+        """
+        try:
+            with self.redis_op("release", job_id):
+                await self.bull_scripts.move_to_wait(**move_to_wait_call(self.bull_keys, job_id,
+                                                                         self.tokens.pop(job_id)))
+        except Exception as e:
+            logger.error(f"Failed to return job {job_id} to {self.bull_keys.wait}: {str(e)}")
+
+    async def finish_job(self, job_id, failed, value, delay=-1):
+        """
+        Run BULL_MOVE_TO_FINISHED for a job this worker holds (see `BullMQWorker.finish_job`)
+        """
+        with self.redis_op("fail" if failed else "complete", job_id):
+            code = await self.bull_scripts.move_to_finished(
+                **move_to_finished_call(self.bull_keys, job_id, self.tokens.pop(job_id, ""), failed, value, delay)
+            )
+        if code:
+            logger.error(f"Could not finish job {job_id}: {FINISH_ERRORS.get(code, code)}")
+        return not code
+
+    async def lock_job(self, job_id, pipe=None):
+        """
+        moveToActive already locked the job with this worker's token
+        """
+        return True
+
+    async def unlock_job(self, job_id):
+        """
+        Finishing or releasing the job deleted its lock (see `BullMQWorker.unlock_job`)
+        """
+        self.tokens.pop(job_id, None)
+
+    def progress_publisher(self, job_data):
+        """
+        Publisher writing a job's progress and log lines where BullMQ keeps them
+        """
+        return AsyncBullProgressPublisher(
+            self.shards[0].redis, self.bull_keys, job_data.get("id"), interval=self.progress_interval,
+            stream_maxlen=BULL_EVENTS_MAXLEN, instrument=self.redis_op, serializer=FAST_JSON,
+            keep_logs=job_data.get("opts", {}).get("keepLogs"),
+        )
+
+    async def record_queue_wait(self, job_data, pipe=None):
+        """
+        Record how long a job waited in the metrics (see `BullMQWorker.record_queue_wait`)
+        """
+        wait_ms = queue_wait_ms(job_data)
+        logger.info(f"Job {job_data.get('id')} waited {wait_ms if wait_ms is not None else '?'} ms")
+        self.metrics.job_started(job_data.get("id"), job_data.get("name"), job_data.get("lane"), wait_ms)
+
+    async def update_progress(self, job_id, progress_data):
+        """
+        Update job progress through its publisher, or directly in the job hash
+        """
+        publisher = self.progress_publishers.get(job_id)
+        if publisher:
+            await publisher.publish(progress_data)
+            return
+
+        try:
+            client = self.shards[0].redis
+            if await client.exists(self.bull_keys.job(job_id)):
+                await client.hset(self.bull_keys.job(job_id), "progress", FAST_JSON.dumps(progress_data))
+        except Exception as e:
+            logger.error(f"Failed to update progress for job {job_id}: {str(e)}")
+
+    async def complete_job(self, job_id, result_data):
+        """
+        Mark a job as completed, storing its result as the job's `returnvalue`
+        """
+        await self.flush_progress(job_id)
+        self.metrics.job_finished(job_id, completed=True)
+        profiler = self.profilers.pop(job_id, None)
+        if profiler:
+            result_data = {**result_data, **profiler.stop()}
+        try:
+            if await self.finish_job(job_id, False, FAST_JSON.dumps(result_data)):
+                logger.info(f"Job {job_id} completed successfully")
+        except Exception as e:
+            logger.error(f"Failed to mark job {job_id} as completed: {str(e)}")
+
+    async def fail_job(self, job_id, error_message):
+        """
+        Mark a job as failed, or schedule its next attempt (see `BullMQWorker.fail_job`)
+        """
+        await self.flush_progress(job_id)
+        self.metrics.job_finished(job_id, completed=False)
+        try:
+            opts, attempts_made = await self.bull_options(job_id)
+            delay = retry_delay(opts, attempts_made + 1)
+            if await self.finish_job(job_id, True, error_message, delay):
+                if delay < 0:
+                    logger.error(f"Job {job_id} failed: {error_message}")
+                else:
+                    logger.warning(f"Job {job_id} failed, retrying in {delay} ms: {error_message}")
+        except Exception as e:
+            logger.error(f"Failed to mark job {job_id} as failed: {str(e)}")
+
+    async def bull_options(self, job_id):
+        """
+        BullMQ options of a job and the number of attempts it made before the current one
+        """
+        opts, attempts_made = await self.shards[0].redis.hmget(self.bull_keys.job(job_id), "opts", "atm")
+        return FAST_JSON.loads(opts or b"{}"), int(attempts_made or 0)
+
+    async def requeue_job(self, job_id, done_steps):
+        """
+        Put a pipeline job interrupted by shutdown back in the wait list
+        """
+        await self.flush_progress(job_id)
+        self.metrics.job_requeued(job_id)
+        await self.release_job(job_id)
+        logger.info(f"Job {job_id} requeued after steps {done_steps}")
+
+    async def heartbeat(self):
+        """
+        Extend the locks of the jobs this worker is running
+        """
+        tokens = dict(self.tokens)
+        if not tokens:
+            return
+        args = [self.lease_ttl_ms, self.bull_keys.prefix]
+        for job_id, token in tokens.items():
+            args += [job_id, token]
+        with self.redis_op("heartbeat"):
+            lost = await self.bull_scripts.extend_locks(keys=[self.bull_keys.stalled], args=args)
+        for job_id in lost:
+            logger.warning(f"Lock of job {job_id.decode()} was lost before it could be extended; it may run twice")
+
+    async def reap_expired(self):
+        """
+        Run BullMQ's stalled job check (see `BullMQWorker.reap_expired`)
+        """
+        with self.redis_op("reap"):
+            requeued, failed = await self.bull_scripts.move_stalled(
+                **move_stalled_call(self.bull_keys, self.max_retries, self.lease_ttl_ms)
+            )
+        if requeued or failed:
+            logger.warning(f"Stalled jobs on {self.bull_keys.queue_name}: {len(requeued)} requeued, {len(failed)} failed")
+
+    async def sample_queue_depths(self):
+        """
+        Sample the waiting and active job counts into the metrics
+        """
+        pipe = self.shards[0].redis.pipeline(transaction=False)
+        pipe.llen(self.bull_keys.wait)
+        pipe.zcard(self.bull_keys.prioritized)
+        pipe.llen(self.bull_keys.active)
+        with self.redis_op("sample"):
+            wait, prioritized, active = await pipe.execute()
+        self.metrics.queue_depth.set(wait + prioritized, DEFAULT_LANE)
+        self.metrics.queue_depth.set(active, "processing")
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+from step_cache import output_paths
+
+logger = logging.getLogger(__name__)
+
+
+def step_fingerprint(step):
+    """
+    Hash of a step's type and params. A checkpoint entry only applies to a
+    step with the same definition, so editing a step's params reruns it.
+    """
+    definition = json.dumps([step["type"], step["params"]], sort_keys=True, default=str)
+    return hashlib.sha256(definition.encode()).hexdigest()[:16]
+
+
+def checkpoint_entry(step, result):
+    """
+    Value of a completed step's field in the job's `{queue}:{id}:checkpoint` hash
+    """
+    return json.dumps({
+        "type": step["type"],
+        "fingerprint": step_fingerprint(step),
+        "artifacts": [path for path in output_paths(step["type"], step["params"]) if path],
+        "result": result,
+        "completedAt": int(time.time() * 1000),
+    })
+
+
+def resumable_steps(job_id, steps, entries):
+    """
+    Results of the checkpointed steps a resumed pipeline can skip.
+
+    An entry is used when its step still has the same definition and every
+    artifact it recorded still exists. A step is only skipped when all of its
+    dependencies are skipped too, since it consumed their outputs.
+
+    Args:
+        job_id: The ID of the job, for logging
+        steps: Step graph from build_pipeline_steps
+        entries: Contents of the job's checkpoint hash (step id -> entry)
+
+    Returns:
+        Dict of step id -> checkpointed result, marked with `fromCheckpoint`
+    """
+    candidates = {}
+    for step_id, raw in entries.items():
+        step_id = step_id.decode() if isinstance(step_id, bytes) else step_id
+        step = steps.get(step_id)
+        if step is None:
+            continue
+        try:
+            entry = json.loads(raw)
+        except ValueError:
+            logger.warning(f"[{job_id}] Ignoring unreadable checkpoint of step {step_id}")
+            continue
+        if entry.get("fingerprint") != step_fingerprint(step):
+            logger.info(f"[{job_id}] Step {step_id} changed since it was checkpointed, running it again")
+            continue
+        missing = [path for path in entry.get("artifacts", []) if not os.path.exists(path)]
+        if missing:
+            logger.info(f"[{job_id}] Outputs of checkpointed step {step_id} are gone ({missing}), running it again")
+            continue
+        candidates[step_id] = {**entry["result"], "fromCheckpoint": True}
+
+    # Drop steps whose dependencies run again, until nothing changes
+    while True:
+        stale = [step_id for step_id in candidates
+                 if not all(dep in candidates for dep in steps[step_id]["dependsOn"])]
+        if not stale:
+            return candidates
+        for step_id in stale:
+            del candidates[step_id]
@@ -0,0 +1,230 @@
+import argparse
+import logging
+import os
+import sys
+
+import redis
+
+from batching import DEFAULT_BATCH_WINDOW_MS
+from executor_pool import DEFAULT_MAX_JOBS_PER_EXECUTOR, DEFAULT_MAX_RSS_MB, WarmExecutorPool
+from keys import QueueKeys
+from lanes import DEFAULT_STARVATION_MS, parse_lanes
+from log_capture import DEFAULT_LOG_DIR, DEFAULT_LOG_TAIL_LINES
+from lua_scripts import DEFAULT_LEASE_TTL, DEFAULT_MAX_RETRIES
+from metrics import start_metrics_server
+from pipeline import DEFAULT_PIPELINE_PARALLELISM
+from progress import DEFAULT_EVENT_STREAM_MAXLEN, DEFAULT_PROGRESS_INTERVAL
+from resources import ResourcePool, available_cpus
+from result_store import (CODECS, DEFAULT_COMPRESS_THRESHOLD, DEFAULT_OFFLOAD_THRESHOLD, DEFAULT_PROGRESS_TTL,
+                          DEFAULT_RESULT_TTL, DEFAULT_STATUS_TTL, ResultStore)
+from serializers import FAST_JSON, SERIALIZERS
+from shards import ROUND_ROBIN, SHARD_POLICIES, split_urls
+from step_cache import DEFAULT_CACHE_MAX_MB, DEFAULT_CACHE_TTL_SECONDS, StepCache
+from tracing import Tracer
+from usage import DEFAULT_USAGE_WINDOW
+from worker_core import DEFAULT_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+
+def build_parser():
+    """
+    Command line of `python src/worker.py`, shared by both engines and both queue protocols
+    """
+    parser = argparse.ArgumentParser(description='Asset Pipeline Worker')
+    parser.add_argument('--redis', 
+                        default=f"redis://{os.environ.get('REDIS_HOST', 'localhost')}:{os.environ.get('REDIS_PORT', '6379')}", 
+                        help='Redis connection URL, or a comma-separated list of nodes the queue shards are spread over')
+    parser.add_argument('--queue', default=os.environ.get('JOB_QUEUE_NAME', 'local-job-queue'),
+                        help='Redis queue key prefix')
+    parser.add_argument('--concurrency', type=int, default=int(os.environ.get('WORKER_CONCURRENCY', DEFAULT_CONCURRENCY)),
+                        help='Number of jobs processed in parallel by this worker')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default=os.environ.get('WORKER_ENGINE', 'threads'),
+                        help='Run jobs on slot threads or on an asyncio event loop')
+    parser.add_argument('--progress-interval', type=float,
+                        default=float(os.environ.get('PROGRESS_INTERVAL', DEFAULT_PROGRESS_INTERVAL)),
+                        help='Minimum seconds between two progress writes for the same job')
+    parser.add_argument('--event-stream-maxlen', type=int,
+                        default=int(os.environ.get('EVENT_STREAM_MAXLEN', DEFAULT_EVENT_STREAM_MAXLEN)),
+                        help='Approximate number of events kept in each job\'s event stream')
+    parser.add_argument('--warm-executors', type=int, default=int(os.environ.get('WARM_EXECUTORS', '0')),
+                        help='Number of pre-warmed executor processes for asset scripts (0 runs every script as a subprocess)')
+    parser.add_argument('--executor-max-jobs', type=int,
+                        default=int(os.environ.get('EXECUTOR_MAX_JOBS', DEFAULT_MAX_JOBS_PER_EXECUTOR)),
+                        help='Jobs a warm executor runs before it is recycled')
+    parser.add_argument('--executor-max-rss-mb', type=int,
+                        default=int(os.environ.get('EXECUTOR_MAX_RSS_MB', DEFAULT_MAX_RSS_MB)),
+                        help='Memory ceiling in MB after which a warm executor is recycled')
+    parser.add_argument('--pipeline-parallelism', type=int,
+                        default=int(os.environ.get('PIPELINE_PARALLELISM', DEFAULT_PIPELINE_PARALLELISM)),
+                        help='Maximum number of steps of one pipeline job running at the same time')
+    parser.add_argument('--step-cache-dir', default=os.environ.get('STEP_CACHE_DIR'),
+                        help='Directory of the content-addressed step result cache (disabled when unset)')
+    parser.add_argument('--step-cache-max-mb', type=int,
+                        default=int(os.environ.get('STEP_CACHE_MAX_MB', DEFAULT_CACHE_MAX_MB)),
+                        help='Size in MB above which least recently used cache entries are evicted')
+    parser.add_argument('--step-cache-ttl', type=int,
+                        default=int(os.environ.get('STEP_CACHE_TTL', DEFAULT_CACHE_TTL_SECONDS)),
+                        help='Expiry in seconds of step cache index entries in Redis')
+    parser.add_argument('--prefetch', type=int, default=int(os.environ.get('PREFETCH', '1')),
+                        help='Maximum number of jobs claimed per Redis round trip when the queue is deep')
+    parser.add_argument('--lease-ttl', type=float, default=float(os.environ.get('LEASE_TTL', DEFAULT_LEASE_TTL)),
+                        help='Seconds a claimed job stays leased without a heartbeat before it is requeued')
+    parser.add_argument('--max-retries', type=int, default=int(os.environ.get('MAX_RETRIES', DEFAULT_MAX_RETRIES)),
+                        help='Number of times a job whose lease expired is requeued before it is failed')
+    parser.add_argument('--lanes', default=os.environ.get('WORKER_LANES', ''),
+                        help='Priority lanes of the queue with weights, e.g. interactive:5,default:3,bulk:1 '
+                             '(default: the queue\'s own wait list only)')
+    parser.add_argument('--lane-policy', choices=['weighted', 'strict'],
+                        default=os.environ.get('LANE_POLICY', 'weighted'),
+                        help='Share claims between lanes by weight, or always prefer earlier lanes')
+    parser.add_argument('--starvation-ms', type=int,
+                        default=int(os.environ.get('STARVATION_MS', DEFAULT_STARVATION_MS)),
+                        help='Age in ms of a lane\'s oldest job after which that lane is served first (0 disables)')
+    parser.add_argument('--log-dir', default=os.environ.get('SCRIPT_LOG_DIR', DEFAULT_LOG_DIR),
+                        help='Directory full script logs are spilled to once they outgrow the in-memory tail')
+    parser.add_argument('--log-tail-lines', type=int,
+                        default=int(os.environ.get('LOG_TAIL_LINES', DEFAULT_LOG_TAIL_LINES)),
+                        help='Number of most recent script output lines kept in memory and in job results')
+    parser.add_argument('--metrics-port', type=int, default=int(os.environ.get('METRICS_PORT', '0')),
+                        help='Port of the Prometheus /metrics endpoint (0 disables it)')
+    parser.add_argument('--trace-file', default=os.environ.get('TRACE_FILE'),
+                        help='JSON lines file trace spans are appended to (tracing is disabled when unset)')
+    parser.add_argument('--cpu-slots', type=int, default=int(os.environ.get('WORKER_CPU_SLOTS', '0')),
+                        help='CPU capacity tokens shared by running jobs (default: the CPUs this process may use, '
+                             'at least --concurrency)')
+    parser.add_argument('--memory-mb', type=int, default=int(os.environ.get('WORKER_MEMORY_MB', '0')),
+                        help='Memory budget in MB shared by running jobs (0 does not limit memory)')
+    parser.add_argument('--accelerators', type=int, default=int(os.environ.get('WORKER_ACCELERATORS', '0')),
+                        help='Accelerator slots of this host; jobs needing an accelerator are not claimed when 0')
+    parser.add_argument('--serializer', choices=sorted(SERIALIZERS),
+                        default=os.environ.get('SERIALIZER', FAST_JSON.name),
+                        help='Format of progress and results of jobs without a contentType marker '
+                             '(default: orjson when installed, else json)')
+    parser.add_argument('--result-compress-threshold', type=int,
+                        default=int(os.environ.get('RESULT_COMPRESS_THRESHOLD', DEFAULT_COMPRESS_THRESHOLD)),
+                        help='Size in bytes from which results are compressed before they are stored (0 disables)')
+    parser.add_argument('--result-codec', choices=CODECS, default=os.environ.get('RESULT_CODEC', CODECS[0]),
+                        help='Compression of large results (default: zstd when installed, else zlib)')
+    parser.add_argument('--artifact-dir', default=os.environ.get('RESULT_ARTIFACT_DIR'),
+                        help='Directory very large results are written to, keeping only a reference in Redis')
+    parser.add_argument('--result-offload-threshold', type=int,
+                        default=int(os.environ.get('RESULT_OFFLOAD_THRESHOLD', DEFAULT_OFFLOAD_THRESHOLD)),
+                        help='Size in bytes from which results are written to --artifact-dir')
+    parser.add_argument('--result-ttl', type=int, default=int(os.environ.get('RESULT_TTL', DEFAULT_RESULT_TTL)),
+                        help='Seconds result and error keys are kept (0 keeps them forever)')
+    parser.add_argument('--status-ttl', type=int, default=int(os.environ.get('STATUS_TTL', DEFAULT_STATUS_TTL)),
+                        help='Seconds status keys are kept (0 keeps them forever)')
+    parser.add_argument('--progress-ttl', type=int,
+                        default=int(os.environ.get('PROGRESS_TTL', DEFAULT_PROGRESS_TTL)),
+                        help='Seconds progress keys and job event streams are kept (0 keeps them forever)')
+    parser.add_argument('--max-batch', type=int, default=int(os.environ.get('MAX_BATCH', '1')),
+                        help='Maximum number of compatible asset-tag jobs run as one batch (1 disables batching)')
+    parser.add_argument('--batch-window-ms', type=int,
+                        default=int(os.environ.get('BATCH_WINDOW_MS', DEFAULT_BATCH_WINDOW_MS)),
+                        help='Milliseconds a batch waits for more compatible jobs to be claimed')
+    parser.add_argument('--dedupe-ttl', type=int, default=int(os.environ.get('DEDUPE_TTL', '0')),
+                        help='Seconds an idempotency key stays registered to its running job (0 disables deduplication)')
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('QUEUE_SHARDS', '1')),
+                        help='Number of hash-tagged shards the queue is split into')
+    parser.add_argument('--redis-cluster', action='store_true',
+                        default=os.environ.get('REDIS_CLUSTER', '').lower() in ('1', 'true', 'yes'),
+                        help='Treat --redis as a Redis Cluster node instead of a comma-separated list of nodes')
+    parser.add_argument('--shard-policy', choices=SHARD_POLICIES,
+                        default=os.environ.get('SHARD_POLICY', ROUND_ROBIN),
+                        help='Rotate the shard claimed from first, or prefer shards with the fewest jobs in flight')
+    parser.add_argument('--usage-window', type=int,
+                        default=int(os.environ.get('USAGE_WINDOW', DEFAULT_USAGE_WINDOW)),
+                        help='Recent script runs per job type whose resource usage is kept in Redis and used to '
+                             'estimate memory needs (0 disables the estimates)')
+    parser.add_argument('--protocol', choices=['native', 'bullmq'], default=os.environ.get('QUEUE_PROTOCOL', 'native'),
+                        help='Consume the native queue layout, or a BullMQ queue named --queue next to Node workers')
+    parser.add_argument('--bullmq-prefix', default=os.environ.get('BULLMQ_PREFIX', 'bull'),
+                        help='Key prefix of the BullMQ queue (the prefix option of its Queue and Workers)')
+
+    return parser
+
+
+def build_worker(args):
+    """
+    Worker of the engine and protocol the parsed arguments ask for
+    """
+    executor_pool = None
+    if args.warm_executors > 0:
+        executor_pool = WarmExecutorPool(args.warm_executors, max_jobs=args.executor_max_jobs,
+                                         max_rss_mb=args.executor_max_rss_mb)
+        executor_pool.start()
+    
+    step_cache = None
+    if args.step_cache_dir:
+        # The cache index lives next to the first shard's keys
+        cache_url = split_urls(args.redis)[0]
+        cache_client = (redis.RedisCluster.from_url(cache_url) if args.redis_cluster
+                        else redis.from_url(cache_url))
+        step_cache = StepCache(args.step_cache_dir, max_bytes=args.step_cache_max_mb * 1024 * 1024,
+                               client=cache_client, keys=QueueKeys(args.queue),
+                               ttl=args.step_cache_ttl)
+    
+    worker_options = dict(
+        redis_url=args.redis,
+        queue_key=args.queue,
+        concurrency=args.concurrency,
+        progress_interval=args.progress_interval,
+        event_stream_maxlen=args.event_stream_maxlen,
+        executor_pool=executor_pool,
+        pipeline_parallelism=args.pipeline_parallelism,
+        step_cache=step_cache,
+        prefetch=args.prefetch,
+        lease_ttl=args.lease_ttl,
+        max_retries=args.max_retries,
+        lanes=parse_lanes(args.lanes),
+        lane_policy=args.lane_policy,
+        starvation_ms=args.starvation_ms,
+        log_dir=args.log_dir,
+        log_tail_lines=args.log_tail_lines,
+        tracer=Tracer(args.trace_file),
+        serializer=SERIALIZERS[args.serializer],
+        result_store=ResultStore(compress_threshold=args.result_compress_threshold, codec=args.result_codec,
+                                 artifact_dir=args.artifact_dir,
+                                 offload_threshold=args.result_offload_threshold, result_ttl=args.result_ttl,
+                                 status_ttl=args.status_ttl, progress_ttl=args.progress_ttl),
+        max_batch=args.max_batch,
+        batch_window_ms=args.batch_window_ms,
+        dedupe_ttl=args.dedupe_ttl,
+        shards=args.shards,
+        cluster=args.redis_cluster,
+        shard_policy=args.shard_policy,
+        usage_window=args.usage_window,
+        resources=ResourcePool(cpu=args.cpu_slots or max(available_cpus(), args.concurrency),
+                               memory_mb=args.memory_mb, accelerators=args.accelerators),
+    )
+    
+    if args.protocol == 'bullmq':
+        from bullmq_worker import AsyncBullMQWorker, BullMQWorker
+        worker_class = AsyncBullMQWorker if args.engine == 'asyncio' else BullMQWorker
+        worker_options['prefix'] = args.bullmq_prefix
+    elif args.engine == 'asyncio':
+        from async_worker import AsyncWorker
+        worker_class = AsyncWorker
+    else:
+        from worker import Worker
+        worker_class = Worker
+    worker = worker_class(**worker_options)
+
+    return worker
+
+
+def main():
+    """
+    Parse the command line, then create and start a worker
+    """
+    args = build_parser().parse_args()
+    
+    try:
+        worker = build_worker(args)
+        if args.metrics_port:
+            start_metrics_server(worker.metrics, args.metrics_port)
+        worker.start()
+    except Exception as e:
+        logger.critical(f"Worker failed to start: {str(e)}")
+        sys.exit(1)
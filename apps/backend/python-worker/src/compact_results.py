@@ -0,0 +1,246 @@
+import json
+import logging
+import os
+import sys
+import time
+
+import redis
+
+from keys import QueueKeys
+from result_store import (CODECS, DEFAULT_COMPRESS_THRESHOLD, DEFAULT_OFFLOAD_THRESHOLD, DEFAULT_PROGRESS_TTL,
+                          DEFAULT_RESULT_TTL, DEFAULT_STATUS_TTL, IDENTITY, REFERENCE, REFERENCE_PREFIX, ResultStore,
+                          compress, is_compressed)
+from serializers import JSON_CONTENT_TYPE, MSGPACK_CONTENT_TYPE
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Keys fetched per SCAN call and per pipelined round trip
+DEFAULT_BATCH_SIZE = 500
+
+# Artifact files younger than this (seconds) may belong to a result that is still being stored
+MIN_ORPHAN_AGE = 3600
+
+# Job statuses after which a job's keys may expire
+FINISHED_STATUSES = (b"completed", b"failed")
+
+
+def _job_id(key, queue_key, suffix):
+    return key[len(queue_key) + 1:-(len(suffix) + 1)]
+
+
+def _guess_content_type(value):
+    # Results are maps: a JSON object starts with `{`, a msgpack map never does
+    return JSON_CONTENT_TYPE if value[:1] in (b"{", b"[") else MSGPACK_CONTENT_TYPE
+
+
+class ResultCompactor:
+    """
+    One-off compaction of the per-job keys of a queue written before results
+    were compressed and keys expired.
+
+    Plain results at or above the store's thresholds are rewritten compressed
+    or offloaded, keeping their remaining TTL. Result, status, error, progress
+    and event keys of finished jobs that never expire get the store's TTLs.
+    Artifact files whose result key is gone are removed.
+    """
+
+    def __init__(self, client, queue_key, store, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+        """
+        Args:
+            client: Redis client
+            queue_key: Base key of the job queue
+            store: ResultStore deciding how results are kept and for how long
+            batch_size: Keys handled per SCAN call and pipelined round trip
+            dry_run: Only count what would change
+        """
+        self.client = client
+        self.keys = QueueKeys(queue_key)
+        self.queue_key = queue_key
+        self.store = store
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.stats = {
+            "results": 0,
+            "compressed": 0,
+            "offloaded": 0,
+            "bytesBefore": 0,
+            "bytesAfter": 0,
+            "expiring": 0,
+            "orphanedArtifacts": 0,
+        }
+
+    def scan(self, suffix):
+        """
+        Yield batches of `{queue}:{id}:{suffix}` keys
+        """
+        batch = []
+        for key in self.client.scan_iter(match=f"{self.queue_key}:*:{suffix}", count=self.batch_size):
+            batch.append(key.decode() if isinstance(key, bytes) else key)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def compact_results(self):
+        """
+        Compress or offload plain results that are over the thresholds
+        """
+        for batch in self.scan("result"):
+            pipe = self.client.pipeline(transaction=False)
+            for key in batch:
+                pipe.get(key)
+            values = pipe.execute()
+
+            pipe = self.client.pipeline(transaction=False)
+            for key, value in zip(batch, values):
+                if value is None or value.startswith(REFERENCE_PREFIX) or is_compressed(value):
+                    continue
+                self.stats["results"] += 1
+                encoding = self.store.encoding_for(len(value))
+                if encoding == IDENTITY:
+                    continue
+                if self.dry_run:
+                    # An offloaded result leaves only its small reference behind
+                    stored = b"" if encoding == REFERENCE else compress(value, encoding)
+                else:
+                    job_id = _job_id(key, self.queue_key, "result")
+                    stored, encoding = self.store.encode(self.queue_key, job_id, value, _guess_content_type(value))
+                    # KEEPTTL so the result still expires when it was going to
+                    pipe.set(key, stored, keepttl=True)
+                self.stats["offloaded" if encoding == REFERENCE else "compressed"] += 1
+                self.stats["bytesBefore"] += len(value)
+                self.stats["bytesAfter"] += len(stored)
+            if not self.dry_run:
+                pipe.execute()
+
+    def expire_keys(self):
+        """
+        Give the keys of finished jobs that never expire their TTL
+        """
+        ttls = {
+            "result": self.store.result_ttl,
+            "error": self.store.result_ttl,
+            "status": self.store.status_ttl,
+            "progress": self.store.progress_ttl,
+            "events": self.store.progress_ttl,
+        }
+        for suffix, ttl in ttls.items():
+            if not ttl:
+                continue
+            for batch in self.scan(suffix):
+                pipe = self.client.pipeline(transaction=False)
+                for key in batch:
+                    pipe.ttl(key)
+                    pipe.get(self.keys.job(_job_id(key, self.queue_key, suffix), "status"))
+                replies = pipe.execute()
+
+                pipe = self.client.pipeline(transaction=False)
+                for key, remaining, status in zip(batch, replies[::2], replies[1::2]):
+                    # -1: the key exists without a TTL; jobs still waiting or running keep theirs
+                    if remaining != -1 or (status is not None and status not in FINISHED_STATUSES):
+                        continue
+                    self.stats["expiring"] += 1
+                    pipe.expire(key, ttl)
+                if not self.dry_run:
+                    pipe.execute()
+
+    def prune_artifacts(self):
+        """
+        Remove artifact files whose result key expired or no longer refers to them
+        """
+        if not self.store.artifact_dir:
+            return
+        directory = os.path.join(self.store.artifact_dir, self.queue_key)
+        if not os.path.isdir(directory):
+            return
+
+        now = time.time()
+        orphans = []
+        artifacts = []
+        for entry in os.scandir(directory):
+            if not entry.is_file() or now - entry.stat().st_mtime < MIN_ORPHAN_AGE:
+                continue
+            if entry.name.startswith("."):
+                # Temporary file left behind by an interrupted write
+                orphans.append(entry.path)
+            elif ".result." in entry.name:
+                artifacts.append((os.path.abspath(entry.path), entry.name.split(".result.")[0]))
+
+        for start in range(0, len(artifacts), self.batch_size):
+            batch = artifacts[start:start + self.batch_size]
+            pipe = self.client.pipeline(transaction=False)
+            for _, job_id in batch:
+                pipe.get(self.keys.job(job_id, "result"))
+            for (path, _), value in zip(batch, pipe.execute()):
+                if not (value and value.startswith(REFERENCE_PREFIX) and json.loads(value)["resultRef"] == path):
+                    orphans.append(path)
+
+        self.stats["orphanedArtifacts"] = len(orphans)
+        if self.dry_run:
+            return
+        for path in orphans:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def run(self):
+        self.compact_results()
+        self.expire_keys()
+        self.prune_artifacts()
+        return self.stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Compress or offload existing large job results, expire old job keys and prune orphaned artifacts'
+    )
+    parser.add_argument('--redis',
+                        default=f"redis://{os.environ.get('REDIS_HOST', 'localhost')}:{os.environ.get('REDIS_PORT', '6379')}",
+                        help='Redis connection URL')
+    parser.add_argument('--queue', default=os.environ.get('JOB_QUEUE_NAME', 'local-job-queue'),
+                        help='Redis queue key prefix')
+    parser.add_argument('--result-compress-threshold', type=int,
+                        default=int(os.environ.get('RESULT_COMPRESS_THRESHOLD', DEFAULT_COMPRESS_THRESHOLD)),
+                        help='Size in bytes from which results are compressed (0 disables)')
+    parser.add_argument('--result-codec', choices=CODECS, default=os.environ.get('RESULT_CODEC', CODECS[0]),
+                        help='Compression of large results (default: zstd when installed, else zlib)')
+    parser.add_argument('--artifact-dir', default=os.environ.get('RESULT_ARTIFACT_DIR'),
+                        help='Directory very large results are written to')
+    parser.add_argument('--result-offload-threshold', type=int,
+                        default=int(os.environ.get('RESULT_OFFLOAD_THRESHOLD', DEFAULT_OFFLOAD_THRESHOLD)),
+                        help='Size in bytes from which results are written to --artifact-dir')
+    parser.add_argument('--result-ttl', type=int, default=int(os.environ.get('RESULT_TTL', DEFAULT_RESULT_TTL)),
+                        help='Seconds result and error keys are kept (0 leaves them)')
+    parser.add_argument('--status-ttl', type=int, default=int(os.environ.get('STATUS_TTL', DEFAULT_STATUS_TTL)),
+                        help='Seconds status keys are kept (0 leaves them)')
+    parser.add_argument('--progress-ttl', type=int,
+                        default=int(os.environ.get('PROGRESS_TTL', DEFAULT_PROGRESS_TTL)),
+                        help='Seconds progress keys and job event streams are kept (0 leaves them)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Keys handled per SCAN call and round trip')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Report what would change without writing anything')
+
+    args = parser.parse_args()
+
+    try:
+        store = ResultStore(compress_threshold=args.result_compress_threshold, codec=args.result_codec,
+                            artifact_dir=args.artifact_dir, offload_threshold=args.result_offload_threshold,
+                            result_ttl=args.result_ttl, status_ttl=args.status_ttl, progress_ttl=args.progress_ttl)
+        compactor = ResultCompactor(redis.from_url(args.redis), args.queue, store,
+                                    batch_size=args.batch_size, dry_run=args.dry_run)
+        stats = compactor.run()
+    except Exception as e:
+        logger.critical(f"Compaction failed: {str(e)}")
+        sys.exit(1)
+
+    saved = stats["bytesBefore"] - stats["bytesAfter"]
+    logger.info(f"{'Would compact' if args.dry_run else 'Compacted'} {stats['compressed']} result(s) and offloaded "
+                f"{stats['offloaded']} of {stats['results']} plain result(s), saving {saved} bytes in Redis; "
+                f"{stats['expiring']} key(s) given a TTL, {stats['orphanedArtifacts']} orphaned artifact(s) removed")
+    print(json.dumps(stats, indent=2))
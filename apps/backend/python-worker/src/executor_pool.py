@@ -0,0 +1,433 @@
+import contextlib
+import importlib
+import io
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where only the /proc-less fallback needs it
+    resource = None
+
+from scripts import get_script_dir
+from usage import call_usage
+
+logger = logging.getLogger(__name__)
+
+# Automation module and function behind each script job type
+SCRIPT_FUNCTIONS = {
+    "asset-export": ("export", "export_asset"),
+    "asset-import": ("import", "import_asset"),
+    "asset-decimate": ("decimate", "decimate_model"),
+    "asset-tag": ("tag", "tag_assets"),
+}
+
+# Defaults for recycling executor processes
+DEFAULT_MAX_JOBS_PER_EXECUTOR = 100
+DEFAULT_MAX_RSS_MB = 1024
+
+
+class UsageError(ValueError):
+    """
+    Job params the script's command line interface would reject (argparse exits with 2)
+    """
+
+
+def _required(params, name, flag=None):
+    """
+    A param the command line interface requires, as a positional argument or `flag`
+    """
+    value = params.get(name)
+    if value is None or value == "" or value == []:
+        raise UsageError(f"the following arguments are required: {flag or name}")
+    return value
+
+
+def build_call_args(script_type, params):
+    """
+    Map job params to keyword arguments of the automation function, with the
+    same defaults, conversions and required arguments as the script's command
+    line interface.
+    """
+    if script_type == "asset-export":
+        return {
+            "input_file": _required(params, "input"),
+            "output_file": _required(params, "output"),
+            "format": params.get("format", "fbx"),
+            "quality": int(params.get("quality", 75)),
+        }
+    if script_type == "asset-import":
+        return {
+            "source_file": _required(params, "source"),
+            "destination": _required(params, "destination"),
+            "scale": float(params.get("scale", 1.0)),
+            "fix_orientation": bool(params.get("fix_orientation")),
+        }
+    if script_type == "asset-decimate":
+        reduction = int(params.get("reduction", 50))
+        if reduction < 1 or reduction > 99:
+            raise ValueError("Reduction percentage must be between 1 and 99")
+        # The CLI flag defaults to True, so UVs are always preserved
+        return {
+            "input_file": _required(params, "input"),
+            "output_file": _required(params, "output"),
+            "target_reduction": reduction,
+            "preserve_uvs": True,
+        }
+    if script_type == "asset-tag":
+        return {
+            "target_path": _required(params, "target"),
+            "tags": list(_required(params, "tags", "--tags/-t")),
+            "category": params.get("category", "general"),
+            "replace": bool(params.get("replace")),
+        }
+    raise ValueError(f"Unknown script type: {script_type}")
+
+
+class _LineWriter(io.TextIOBase):
+    """
+    File-like object that forwards complete lines to the parent process
+    """
+
+    def __init__(self, conn, kind):
+        self.conn = conn
+        self.kind = kind
+        self.buffer = ""
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.buffer += text
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            self.conn.send((self.kind, line))
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            self.conn.send((self.kind, self.buffer))
+            self.buffer = ""
+
+
+def _current_rss_mb():
+    """
+    Resident set size of this process in MB (peak RSS where /proc is unavailable,
+    0 where neither is)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        if resource is None:
+            return 0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _call(conn, function, script_type, params):
+    """
+    Call an automation function with its output forwarded to the parent
+
+    Returns:
+        The return code the script's command line interface would exit with
+    """
+    stdout = _LineWriter(conn, "stdout")
+    stderr = _LineWriter(conn, "stderr")
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            return_code = 0 if function(**build_call_args(script_type, params)) else 1
+        except SystemExit as e:
+            return_code = e.code if isinstance(e.code, int) else 1
+        except UsageError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return_code = 2
+        except Exception:
+            traceback.print_exc()
+            return_code = 1
+    stdout.flush()
+    stderr.flush()
+    return return_code
+
+
+def _measured_call(conn, function, script_type, params):
+    """
+    `_call` with the resource usage of the call
+
+    Returns:
+        Tuple of (return code, usage fields or None where resource is unavailable, see `usage.call_usage`)
+    """
+    if resource is None:
+        return _call(conn, function, script_type, params), None
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.monotonic()
+    return_code = _call(conn, function, script_type, params)
+    return return_code, call_usage(before, resource.getrusage(resource.RUSAGE_SELF), time.monotonic() - started)
+
+
+def _executor_main(conn, script_dir, max_jobs, max_rss_mb):
+    """
+    Entry point of an executor process: import the automation modules once,
+    then run tasks sent by the parent until told to stop or due for recycling.
+
+    A task is one params dict, or a list of them for a batch: the function is
+    then called once per item and an `item` message reports each return code
+    and usage. The `done` message carries the usage of a single call.
+    """
+    sys.path.insert(0, script_dir)
+    functions = {}
+    for script_type, (module_name, function_name) in SCRIPT_FUNCTIONS.items():
+        try:
+            functions[script_type] = getattr(importlib.import_module(module_name), function_name)
+        except Exception as e:
+            print(f"Executor {os.getpid()} could not load {module_name}.{function_name}: {e}", file=sys.stderr)
+    conn.send(("ready", sorted(functions)))
+
+    jobs_run = 0
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        script_type, params = task
+
+        if isinstance(params, list):
+            for index, item in enumerate(params):
+                conn.send(("item", index, *_measured_call(conn, functions[script_type], script_type, item)))
+            return_code, usage = 0, None
+        else:
+            return_code, usage = _measured_call(conn, functions[script_type], script_type, params)
+
+        jobs_run += len(params) if isinstance(params, list) else 1
+        recycle = jobs_run >= max_jobs or (max_rss_mb and _current_rss_mb() > max_rss_mb)
+        conn.send(("done", return_code, bool(recycle), usage))
+        if recycle:
+            break
+    conn.close()
+
+
+class _Executor:
+    """
+    Handle on one executor process
+    """
+
+    def __init__(self, context, script_dir, max_jobs, max_rss_mb):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_executor_main,
+            args=(child_conn, script_dir, max_jobs, max_rss_mb),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        _, self.functions = self.conn.recv()
+        # Taken off the idle queue by `WarmExecutorPool.reserve` and not yet given a task
+        self.reserved = False
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, EOFError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+
+
+class WarmExecutorPool:
+    """
+    Pool of pre-warmed executor processes for the asset pipeline scripts.
+
+    Each executor imports the automation modules once and then calls their
+    functions directly, streaming captured stdout/stderr back line by line.
+    Executors are replaced after `max_jobs` tasks or once their RSS exceeds
+    `max_rss_mb`, and an executor that dies is replaced as well.
+    """
+
+    def __init__(self, size, max_jobs=DEFAULT_MAX_JOBS_PER_EXECUTOR, max_rss_mb=DEFAULT_MAX_RSS_MB,
+                 script_dir=None):
+        """
+        Args:
+            size: Number of executor processes
+            max_jobs: Tasks an executor runs before it is recycled
+            max_rss_mb: RSS ceiling in MB after which an executor is recycled (None disables)
+            script_dir: Directory of the automation modules
+        """
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.script_dir = os.path.abspath(script_dir or get_script_dir())
+        # Spawned, not forked, so executors never inherit the worker's threads or Redis sockets
+        self.context = multiprocessing.get_context("spawn")
+        self.idle = queue.Queue()
+        self.functions = set()
+        self.closed = False
+
+    def start(self):
+        """
+        Start all executor processes and wait until they have imported the modules
+        """
+        for _ in range(self.size):
+            executor = self._spawn()
+            if executor:
+                self.functions.update(executor.functions)
+                self.idle.put(executor)
+        logger.info(f"Started {self.idle.qsize()} warm executor(s) supporting {sorted(self.functions)}")
+
+    def _spawn(self):
+        try:
+            return _Executor(self.context, self.script_dir, self.max_jobs, self.max_rss_mb)
+        except Exception as e:
+            logger.error(f"Failed to start warm executor: {str(e)}")
+            return None
+
+    def _replace(self, executor):
+        """
+        Stop an executor and put a fresh one in its place, off the caller's thread
+        """
+        def replace():
+            executor.stop()
+            if self.closed:
+                return
+            new_executor = self._spawn()
+            if new_executor:
+                self.idle.put(new_executor)
+
+        threading.Thread(target=replace, name="executor-recycle", daemon=True).start()
+
+    def supports(self, script_type):
+        return script_type in self.functions
+
+    def reserve(self):
+        """
+        Take an idle executor for a task that is not ready to be sent yet
+
+        Returns:
+            The executor, or None when none is idle
+        """
+        try:
+            executor = self.idle.get_nowait()
+        except queue.Empty:
+            return None
+        executor.reserved = True
+        return executor
+
+    def release(self, executor):
+        """
+        Give back a reserved executor that was not given a task. Does nothing
+        once a task ran on it, since the task already returned it to the pool.
+        """
+        if executor is None or not executor.reserved:
+            return
+        executor.reserved = False
+        if self.closed:
+            executor.stop()
+        else:
+            self.idle.put(executor)
+
+    def run(self, script_type, params, on_line):
+        """
+        Run a script function on an idle executor.
+
+        Args:
+            script_type: Type of script to execute
+            params: Job parameters of the script
+            on_line: Callback called with (line, is_stderr) for each output line
+
+        Returns:
+            Tuple of (the script's return code, usage fields or None, see
+            `usage.call_usage`), or None when no executor is idle and the
+            caller should fall back to a subprocess
+        """
+        executor = self.reserve()
+        if executor is None:
+            return None
+
+        def on_message(message):
+            kind, line = message
+            on_line(line, kind == "stderr")
+
+        try:
+            return self._run_task(executor, script_type, params, on_message)
+        except (EOFError, OSError) as e:
+            logger.error(f"Warm executor {executor.process.pid} died while running {script_type}: {str(e)}")
+            self._replace(executor)
+            raise RuntimeError(f"Executor process died while running {script_type}")
+
+    def run_batch(self, executor, script_type, params_list, on_line):
+        """
+        Run a script function for several jobs as one task on an executor
+        reserved with `reserve`. The automation functions take one target, so
+        the executor calls the function once per job, in one process that
+        already imported it.
+
+        Args:
+            executor: The reserved executor
+            script_type: Type of script to execute
+            params_list: Job parameters of each call
+            on_line: Callback called with (index, line, is_stderr) for each output line,
+                where index is the position of the call in `params_list`
+
+        Returns:
+            Tuple of (return codes, usage fields) in the order of `params_list`,
+            with None for calls not finished when the executor died
+        """
+        return_codes = [None] * len(params_list)
+        usages = [None] * len(params_list)
+        current = [0]
+
+        def on_message(message):
+            if message[0] == "item":
+                _, index, return_codes[index], usages[index] = message
+                current[0] = index + 1
+            else:
+                on_line(current[0], message[1], message[0] == "stderr")
+
+        try:
+            self._run_task(executor, script_type, list(params_list), on_message)
+        except (EOFError, OSError) as e:
+            logger.error(f"Warm executor {executor.process.pid} died while running a batch of "
+                         f"{len(params_list)} {script_type} job(s): {str(e)}")
+            self._replace(executor)
+        return return_codes, usages
+
+    def _run_task(self, executor, script_type, params, on_message):
+        """
+        Send a task to an executor and pass its messages to on_message until it is done
+
+        Returns:
+            Tuple of (the task's return code, its usage fields or None)
+        """
+        executor.reserved = False
+        executor.conn.send((script_type, params))
+        while True:
+            message = executor.conn.recv()
+            if message[0] == "done":
+                _, return_code, recycle, usage = message
+                break
+            on_message(message)
+
+        if recycle:
+            logger.info(f"Recycling warm executor {executor.process.pid}")
+            self._replace(executor)
+        else:
+            self.idle.put(executor)
+        return return_code, usage
+
+    def close(self):
+        """
+        Stop all idle executors
+        """
+        self.closed = True
+        while True:
+            try:
+                self.idle.get_nowait().stop()
+            except queue.Empty:
+                break
@@ -0,0 +1,130 @@
+from lanes import DEFAULT_LANE
+
+
+class QueueKeys:
+    """
+    Redis key layout for one job queue.
+
+    `bull:{queue}:wait` is the list producers push to. Claimed jobs live in the
+    `{queue}:processing` hash (job id -> exact claimed payload) so that
+    completing or failing a job is a constant-time lookup by id.
+    """
+
+    def __init__(self, queue_key):
+        self.queue_key = queue_key
+        self.wait = f"bull:{queue_key}:wait"
+        self.processing = f"{queue_key}:processing"
+        self.completed = f"{queue_key}:completed"
+        self.failed = f"{queue_key}:failed"
+        self.pending = f"{queue_key}:pending"
+        # Pub/sub channel announcing new events in any job's event stream
+        self.events_channel = f"{queue_key}:events"
+        # Claimed job id -> lease expiry (ms); the reaper requeues entries past their deadline
+        self.leases = f"{queue_key}:leases"
+        # Job id -> number of times its lease expired
+        self.retries = f"{queue_key}:retries"
+        # Claimed job id -> wait list of the lane it was claimed from
+        self.job_lanes = f"{queue_key}:job-lanes"
+        # Per-lane claim counters and time-in-queue histogram
+        self.lane_stats = f"{queue_key}:lane-stats"
+        # Worker id -> heartbeat deadline (ms), used to recover hand-off lists of dead workers
+        self.workers = f"{queue_key}:workers"
+        # Worker id -> advertised capacity tokens and how many are free
+        self.capacity = f"{queue_key}:capacity"
+        # Worker id -> lane wait list its hand-off list is filled from
+        self.claiming_lanes = f"{queue_key}:claiming-lanes"
+        # Hit/miss counters of the step result cache
+        self.cache_stats = f"{queue_key}:cache:stats"
+
+    def lane(self, lane):
+        """
+        Wait list of a priority lane. The default lane is the queue's own
+        `bull:{queue}:wait` list, other lanes live next to it.
+        """
+        if lane == DEFAULT_LANE:
+            return self.wait
+        return f"bull:{self.queue_key}:{lane}:wait"
+
+    def claiming(self, worker_id):
+        """
+        Per-worker hand-off list used by the blocking claim. It holds at most
+        one payload between the blocking pop and its move into `processing`.
+        """
+        return f"{self.queue_key}:claiming:{worker_id}"
+
+    def cache_entry(self, cache_key):
+        """
+        Index entry of a step cache key, naming the host that holds its artifacts
+        """
+        return f"{self.queue_key}:cache:{cache_key}"
+
+    def flight(self, idempotency_key):
+        """
+        Id of the job running under an idempotency key; jobs attached to it are
+        kept in the `{queue}:flight:{key}:followers` set
+        """
+        return f"{self.queue_key}:flight:{idempotency_key}"
+
+    def job(self, job_id, suffix):
+        """
+        Per-job key such as `{queue}:{job_id}:status`
+        """
+        return f"{self.queue_key}:{job_id}:{suffix}"
+
+    def usage(self, job_type):
+        """
+        List of the resource usage of a job type's most recent script runs, newest first
+        """
+        return f"{self.queue_key}:usage:{job_type}"
+
+
+class BullKeys:
+    """
+    BullMQ's Redis key layout for one queue, as used by the Node workers.
+
+    Unlike the native layout, `bull:{queue}:wait` holds job ids; each job's
+    name, data and options live in the `bull:{queue}:{id}` hash and claimed
+    ids move through the `active` list, guarded by `bull:{queue}:{id}:lock`
+    holding the claiming worker's token.
+    """
+
+    def __init__(self, queue_name, prefix="bull"):
+        self.queue_name = queue_name
+        # Prefix of per-job keys, BullMQ's `queue.toKey('')`
+        self.prefix = f"{prefix}:{queue_name}:"
+        self.wait = self.prefix + "wait"
+        self.paused = self.prefix + "paused"
+        self.active = self.prefix + "active"
+        self.prioritized = self.prefix + "prioritized"
+        self.delayed = self.prefix + "delayed"
+        self.completed = self.prefix + "completed"
+        self.failed = self.prefix + "failed"
+        self.stalled = self.prefix + "stalled"
+        self.stalled_check = self.prefix + "stalled-check"
+        self.events = self.prefix + "events"
+        self.meta = self.prefix + "meta"
+        # Priority counter keeping jobs of the same priority in FIFO order
+        self.pc = self.prefix + "pc"
+        # Sorted set workers block on: `0` when jobs are waiting, `1` scored by the next delayed job
+        self.marker = self.prefix + "marker"
+        # Job counter of the current rate limit window, set by rate-limited Node workers or `rateLimit()`
+        self.limiter = self.prefix + "limiter"
+
+    def job(self, job_id):
+        """
+        Hash of a job: `name`, `data`, `opts`, `timestamp`, and `progress`,
+        `returnvalue` or `failedReason` once it ran
+        """
+        return f"{self.prefix}{job_id}"
+
+    def lock(self, job_id):
+        """
+        Lock of an active job, holding the token of the worker running it
+        """
+        return f"{self.prefix}{job_id}:lock"
+
+    def logs(self, job_id):
+        """
+        List of log lines of a job, what `job.log()` appends to
+        """
+        return f"{self.prefix}{job_id}:logs"
@@ -0,0 +1,105 @@
+import random
+
+# Lane that maps to the queue's original `bull:{queue}:wait` list
+DEFAULT_LANE = "default"
+
+# Default age in milliseconds after which the oldest job of any lane is claimed first
+DEFAULT_STARVATION_MS = 30000
+
+# Seconds the blocking claim waits on the first lane before every lane is polled
+# again, when a worker consumes several lanes
+LANE_BLOCK_TIMEOUT = 0.25
+
+# Upper bounds (ms) of the per-lane time-in-queue histogram buckets
+QUEUE_WAIT_BUCKETS_MS = (100, 500, 1000, 5000, 30000, 120000)
+
+LANE_POLICIES = ("weighted", "strict")
+
+
+def parse_lanes(spec):
+    """
+    Parse a lane specification such as `interactive:5,default:3,bulk:1`.
+
+    Returns:
+        List of (lane, weight) tuples in the given order; a lane without a
+        weight gets weight 1. An empty spec means the single default lane.
+    """
+    lanes = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, weight = item.partition(":")
+        weight = float(weight) if weight else 1.0
+        if weight <= 0:
+            raise ValueError(f"Lane {name} must have a positive weight")
+        if name in (lane for lane, _ in lanes):
+            raise ValueError(f"Duplicate lane: {name}")
+        lanes.append((name, weight))
+    return lanes or [(DEFAULT_LANE, 1.0)]
+
+
+class LaneScheduler:
+    """
+    Decides in which order a worker tries its lanes on each claim.
+
+    With the `strict` policy lanes are always tried in the configured order.
+    With `weighted` the order is a weighted random permutation: the first
+    non-empty lane in it is lane L with probability weight(L) / sum of the
+    weights of the non-empty lanes, so busy lanes share claims in proportion
+    to their weights no matter which other lanes are empty. Starvation
+    protection happens in the claim script, which serves a lane first once
+    its oldest job has waited longer than `starvation_ms`.
+    """
+
+    def __init__(self, lanes, policy="weighted", starvation_ms=DEFAULT_STARVATION_MS):
+        """
+        Args:
+            lanes: List of (lane, weight) tuples from parse_lanes
+            policy: `weighted` or `strict`
+            starvation_ms: Age of a lane's oldest job after which it is served first (0 disables)
+        """
+        if policy not in LANE_POLICIES:
+            raise ValueError(f"Unknown lane policy: {policy}")
+        self.lanes = lanes
+        self.policy = policy
+        self.starvation_ms = starvation_ms
+        self.names = [lane for lane, _ in lanes]
+
+    def order(self):
+        """
+        Lanes in the order they should be tried for the next claim
+        """
+        if self.policy == "strict" or len(self.lanes) == 1:
+            return list(self.names)
+        # Efraimidis-Spirakis: sorting by u ** (1 / weight) draws a weighted permutation
+        return [lane for _, lane in sorted(
+            ((random.random() ** (1.0 / weight), lane) for lane, weight in self.lanes), reverse=True
+        )]
+
+    def block_lane(self):
+        """
+        Lane the claim blocks on when every lane is empty: the first (highest priority) one
+        """
+        return self.names[0]
+
+
+def queue_wait_ms(job_data):
+    """
+    Milliseconds between a job's enqueue `timestamp` and its claim, or None when unknown
+    """
+    enqueued = job_data.get("timestamp")
+    claimed = job_data.get("claimedAt")
+    if not isinstance(enqueued, (int, float)) or claimed is None:
+        return None
+    return max(0, int(claimed - enqueued))
+
+
+def lane_stat_fields(lane, wait_ms):
+    """
+    Fields of the `{queue}:lane-stats` hash to increment for one claimed job
+    """
+    fields = {f"{lane}:count": 1, f"{lane}:waitMs": wait_ms}
+    bucket = next((bound for bound in QUEUE_WAIT_BUCKETS_MS if wait_ms <= bound), "inf")
+    fields[f"{lane}:le:{bucket}"] = 1
+    return fields
@@ -0,0 +1,142 @@
+import collections
+import gzip
+import logging
+import os
+import tempfile
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Default number of most recent output lines kept in memory and in the job result
+DEFAULT_LOG_TAIL_LINES = 200
+
+# Default directory of spilled script logs
+DEFAULT_LOG_DIR = os.path.join(tempfile.gettempdir(), "python-worker-logs")
+
+# Longest line kept whole; longer output without a newline is split into lines of this size
+MAX_LINE_BYTES = 64 * 1024
+
+
+class LineSplitter:
+    """
+    Turns chunks of raw process output into decoded lines
+    """
+
+    def __init__(self):
+        self.buffer = b""
+
+    def feed(self, chunk):
+        """
+        Add a chunk and return the complete lines it finishes
+        """
+        self.buffer += chunk
+        lines = []
+        while True:
+            end = self.buffer.find(b"\n")
+            if end < 0:
+                if len(self.buffer) < MAX_LINE_BYTES:
+                    break
+                end = MAX_LINE_BYTES - 1
+            lines.append(self.buffer[:end + 1].decode(errors="replace"))
+            self.buffer = self.buffer[end + 1:]
+        return lines
+
+    def close(self):
+        """
+        Return the last unterminated line, if any
+        """
+        rest, self.buffer = self.buffer, b""
+        return [rest.decode(errors="replace")] if rest else []
+
+
+class LogCapture:
+    """
+    Bounded capture of one script run's output.
+
+    The last `max_lines` lines are kept in a ring buffer. Once the buffer
+    overflows, the full log (including the lines already buffered) is written
+    to a gzip file in `log_dir`, so memory per job stays constant however much
+    the script prints.
+    """
+
+    def __init__(self, job_id, script_type, log_dir=DEFAULT_LOG_DIR, max_lines=DEFAULT_LOG_TAIL_LINES):
+        """
+        Args:
+            job_id: The ID of the job
+            script_type: Type of script whose output is captured
+            log_dir: Directory the full log is spilled to
+            max_lines: Number of most recent lines kept in memory
+        """
+        self.job_id = job_id
+        self.script_type = script_type
+        self.log_dir = log_dir
+        self.lines = collections.deque(maxlen=max(1, max_lines))
+        self.total_lines = 0
+        self.path = None
+        self.file = None
+        self.lock = threading.Lock()
+
+    def add(self, line, is_stderr=False):
+        """
+        Record one output line; stderr lines are prefixed with `ERROR: `
+        """
+        if is_stderr:
+            line = f"ERROR: {line}"
+        with self.lock:
+            if self.file is None and len(self.lines) == self.lines.maxlen:
+                self._spill()
+            if self.file:
+                try:
+                    self.file.write(line + "\n")
+                except (OSError, ValueError) as e:
+                    logger.warning(f"[{self.job_id}] Stopped writing log file {self.path}: {str(e)}")
+                    self._close_file()
+            self.lines.append(line)
+            self.total_lines += 1
+
+    def _spill(self):
+        """
+        Open the log file and write the lines buffered so far
+        """
+        try:
+            os.makedirs(self.log_dir, exist_ok=True)
+            self.path = os.path.join(self.log_dir, f"{self.job_id}-{self.script_type}-{uuid.uuid4().hex[:8]}.log.gz")
+            self.file = gzip.open(self.path, "wt", encoding="utf-8", compresslevel=6)
+            for line in self.lines:
+                self.file.write(line + "\n")
+        except OSError as e:
+            logger.warning(f"[{self.job_id}] Cannot spill script output to {self.log_dir}: {str(e)}")
+            # Keep only the ring buffer from here on
+            self._close_file()
+
+    def _close_file(self):
+        """
+        Close the log file; nothing more is written to disk afterwards
+        """
+        if self.file:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+        self.file = False
+
+    def close(self):
+        """
+        Finish the log file, if one was written
+        """
+        with self.lock:
+            self._close_file()
+
+    def result_fields(self):
+        """
+        Output fields for the job result: the tail, how many lines were dropped
+        from it and the path of the full log when one was written
+        """
+        with self.lock:
+            fields = {"output": list(self.lines)}
+            if self.total_lines > len(self.lines):
+                fields["outputTruncated"] = self.total_lines - len(self.lines)
+            if self.path and os.path.exists(self.path):
+                fields["logFile"] = self.path
+            return fields
@@ -0,0 +1,819 @@
+import time
+
+from serializers import FAST_JSON
+
+# Default seconds a claimed job stays leased without a heartbeat
+DEFAULT_LEASE_TTL = 30
+
+# Default number of times a job whose lease expired is requeued before it is failed
+DEFAULT_MAX_RETRIES = 3
+
+# Maximum expired leases handled by one reaper call
+REAP_BATCH_SIZE = 100
+
+# Server-side job state transitions. Each script runs as a single round trip and
+# only touches keys by id, so its cost does not depend on how many jobs are in flight.
+
+# Lease deadlines are taken from the Redis server clock, so workers on hosts with
+# skewed clocks still agree on when a lease has expired
+NOW_MS = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+"""
+
+# Moves up to ARGV[1] payloads from the source lists, tried in order, into the
+# processing hash, takes a lease on each and remembers which lane it came from.
+# A lane whose oldest job (by its `timestamp`) has waited at least ARGV[3] ms is
+# tried first, so low priority lanes cannot starve. A lane's next job is only
+# taken when its resource needs fit the worker's free capacity tokens; otherwise
+# the lane is skipped, so a heavy job waits without holding up lighter lanes.
+# KEYS[1] processing hash, KEYS[2] pending list, KEYS[3] leases sorted set,
+# KEYS[4] job lanes hash, KEYS[5..] source lists
+# ARGV[1] maximum number of jobs to claim, ARGV[2] lease duration in milliseconds,
+# ARGV[3] starvation threshold in milliseconds (0 disables), ARGV[4] JSON of the
+# worker's free and total capacity and the default needs (see ResourcePool.claim_argument),
+# ARGV[5..] lane wait list of each source
+# Returns a flat list of status/source index/payload triples: 'ok' for claimed jobs,
+# 'invalid' for payloads that could not be parsed (those are parked on the pending list)
+# and 'deferred' for a lane's next job that did not fit (it stays in its lane).
+CLAIM_JOBS = NOW_MS + """
+local sources = {}
+for i = 5, #KEYS do
+    table.insert(sources, i - 4)
+end
+
+local starvation = tonumber(ARGV[3])
+if starvation > 0 and #sources > 1 then
+    local starved = nil
+    local oldest = now - starvation
+    for _, index in ipairs(sources) do
+        local tail = redis.call('LINDEX', KEYS[index + 4], -1)
+        if tail then
+            local ok, job = pcall(cjson.decode, tail)
+            if ok and type(job) == 'table' and type(job['timestamp']) == 'number' and job['timestamp'] <= oldest then
+                starved = index
+                oldest = job['timestamp']
+            end
+        end
+    end
+    if starved then
+        table.remove(sources, starved)
+        table.insert(sources, 1, starved)
+    end
+end
+
+local resources = cjson.decode(ARGV[4])
+
+-- Mirrors job_needs() and ResourcePool.charge(); returns nil when the job does not fit
+local function charge(job, index)
+    local needs = {}
+    for kind, value in pairs(resources['base']) do
+        needs[kind] = value
+    end
+    local defaults = {resources['jobTypes'][job['name']] or {}, resources['lanes'][index] or {}}
+    local data = job['data']
+    if type(data) == 'table' and type(data['resources']) == 'table' then
+        table.insert(defaults, data['resources'])
+    end
+    for _, overrides in ipairs(defaults) do
+        for kind, value in pairs(overrides) do
+            if needs[kind] ~= nil and type(value) == 'number' then
+                needs[kind] = value
+            end
+        end
+    end
+
+    local charged = {}
+    for kind, capacity in pairs(resources['capacity']) do
+        local need = needs[kind] or 0
+        if kind ~= 'accelerator' and need > capacity then
+            need = capacity
+        end
+        if need > resources['free'][kind] then
+            return nil
+        end
+        charged[kind] = need
+    end
+    return charged
+end
+
+local claimed = {}
+local remaining = tonumber(ARGV[1])
+for _, index in ipairs(sources) do
+    while remaining > 0 do
+        local raw = redis.call('LINDEX', KEYS[index + 4], -1)
+        if not raw then
+            break
+        end
+        local ok, job = pcall(cjson.decode, raw)
+        if ok and type(job) == 'table' and job['id'] ~= nil then
+            local charged = charge(job, index)
+            if not charged then
+                table.insert(claimed, 'deferred')
+                table.insert(claimed, index)
+                table.insert(claimed, raw)
+                break
+            end
+            for kind, value in pairs(charged) do
+                resources['free'][kind] = resources['free'][kind] - value
+            end
+            redis.call('RPOP', KEYS[index + 4])
+            redis.call('HSET', KEYS[1], tostring(job['id']), raw)
+            redis.call('ZADD', KEYS[3], now + tonumber(ARGV[2]), tostring(job['id']))
+            redis.call('HSET', KEYS[4], tostring(job['id']), ARGV[index + 4])
+            table.insert(claimed, 'ok')
+            remaining = remaining - 1
+        else
+            redis.call('RPOP', KEYS[index + 4])
+            redis.call('RPUSH', KEYS[2], raw)
+            table.insert(claimed, 'invalid')
+        end
+        table.insert(claimed, index)
+        table.insert(claimed, raw)
+    end
+end
+return claimed
+"""
+
+# Gives claimed but unprocessed jobs back to the queue, at the end consumers pop from.
+# Each job goes back to the lane it was claimed from.
+# KEYS[1] processing hash, KEYS[2] default wait list, KEYS[3] leases sorted set, KEYS[4] job lanes hash
+# ARGV job ids, the one to be consumed first last
+RELEASE_JOBS = """
+local released = 0
+for i = 1, #ARGV do
+    local raw = redis.call('HGET', KEYS[1], ARGV[i])
+    local lane = redis.call('HGET', KEYS[4], ARGV[i]) or KEYS[2]
+    redis.call('ZREM', KEYS[3], ARGV[i])
+    redis.call('HDEL', KEYS[4], ARGV[i])
+    if raw then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+        redis.call('RPUSH', lane, raw)
+        released = released + 1
+    end
+end
+return released
+"""
+
+# Takes the exclusive lock of a claimed job, which expires with its lease. When
+# another worker holds it (it is running another copy of the same job id), the
+# claim is handed back instead: the payload goes to the back of the lane it was
+# claimed from and its lease is dropped, without counting a retry, so the copy
+# runs once the lock is released.
+# KEYS[1] lock key, KEYS[2] processing hash, KEYS[3] default wait list, KEYS[4] leases sorted set,
+# KEYS[5] job lanes hash
+# ARGV[1] job id, ARGV[2] lock owner, ARGV[3] lease duration in milliseconds
+# Returns 1 when the lock was taken, 0 when the claim was handed back
+LOCK_JOB = """
+if redis.call('SET', KEYS[1], ARGV[2], 'NX', 'PX', ARGV[3]) then
+    return 1
+end
+local raw = redis.call('HGET', KEYS[2], ARGV[1])
+local lane = redis.call('HGET', KEYS[5], ARGV[1]) or KEYS[3]
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[4], ARGV[1])
+redis.call('HDEL', KEYS[5], ARGV[1])
+if raw then
+    redis.call('LPUSH', lane, raw)
+end
+return 0
+"""
+
+# Sets a TTL in seconds on a key, unless the TTL is 0
+EXPIRE_UNLESS_ZERO = """
+local function expire(key, ttl)
+    if tonumber(ttl) > 0 then
+        redis.call('EXPIRE', key, ttl)
+    end
+end
+"""
+
+# Hands a finished leader's outcome to the jobs attached to its flight (see
+# JOIN_FLIGHT) and ends the flight. Followers no longer in the processing hash
+# were handed out again after the flight expired and run on their own.
+# `event` holds the fields of the followers' final event.
+FINISH_FLIGHT = """
+local function finish_flight(flight, followers, leader, prefix, status, suffix, value, value_ttl, status_ttl,
+                             events_ttl, maxlen, channel, event, processing, finished, leases, retries, job_lanes)
+    if redis.call('GET', flight) == leader then
+        redis.call('DEL', flight)
+    end
+    local ids = redis.call('SMEMBERS', followers)
+    redis.call('DEL', followers)
+    for _, id in ipairs(ids) do
+        local raw = redis.call('HGET', processing, id)
+        if raw then
+            local job_prefix = prefix .. ':' .. id .. ':'
+            redis.call('HDEL', processing, id)
+            redis.call('ZREM', leases, id)
+            redis.call('HDEL', retries, id)
+            redis.call('HDEL', job_lanes, id)
+            redis.call('SET', job_prefix .. suffix, value)
+            redis.call('SET', job_prefix .. 'status', status)
+            redis.call('XADD', job_prefix .. 'events', 'MAXLEN', '~', maxlen, '*', unpack(event))
+            expire(job_prefix .. suffix, value_ttl)
+            expire(job_prefix .. 'status', status_ttl)
+            expire(job_prefix .. 'events', events_ttl)
+            redis.call('PUBLISH', channel, cjson.encode({jobId = id, type = status}))
+            redis.call('LPUSH', finished, raw)
+        end
+    end
+end
+"""
+
+# Marks a claimed job completed.
+# KEYS[1] processing hash, KEYS[2] completed list, KEYS[3] result key, KEYS[4] status key,
+# KEYS[5] job event stream, KEYS[6] leases sorted set, KEYS[7] retries hash, KEYS[8] job lanes hash,
+# KEYS[9] progress key
+# ARGV[1] job id, ARGV[2] stored result, ARGV[3] event stream max length, ARGV[4] events channel,
+# ARGV[5] content type of the result, ARGV[6] content encoding of the stored result,
+# ARGV[7] result TTL, ARGV[8] status TTL, ARGV[9] progress and event stream TTL (seconds, 0 keeps the key)
+# When the job leads a flight: KEYS[10] flight key, KEYS[11] flight followers set, ARGV[10] queue key prefix
+COMPLETE_JOB = EXPIRE_UNLESS_ZERO + FINISH_FLIGHT + """
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[6], ARGV[1])
+redis.call('HDEL', KEYS[7], ARGV[1])
+redis.call('HDEL', KEYS[8], ARGV[1])
+redis.call('SET', KEYS[3], ARGV[2])
+redis.call('SET', KEYS[4], 'completed')
+redis.call('XADD', KEYS[5], 'MAXLEN', '~', ARGV[3], '*', 'type', 'completed', 'percentage', '100',
+    'contentType', ARGV[5], 'contentEncoding', ARGV[6])
+expire(KEYS[3], ARGV[7])
+expire(KEYS[4], ARGV[8])
+expire(KEYS[5], ARGV[9])
+expire(KEYS[9], ARGV[9])
+redis.call('PUBLISH', ARGV[4], cjson.encode({jobId = ARGV[1], type = 'completed'}))
+if #KEYS > 9 then
+    finish_flight(KEYS[10], KEYS[11], ARGV[1], ARGV[10], 'completed', 'result', ARGV[2], ARGV[7], ARGV[8], ARGV[9],
+        ARGV[3], ARGV[4], {'type', 'completed', 'percentage', '100', 'contentType', ARGV[5],
+        'contentEncoding', ARGV[6], 'leader', ARGV[1]}, KEYS[1], KEYS[2], KEYS[6], KEYS[7], KEYS[8])
+end
+if raw then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    redis.call('LPUSH', KEYS[2], raw)
+    return 1
+end
+return 0
+"""
+
+# Marks a claimed job failed.
+# KEYS[1] processing hash, KEYS[2] failed list, KEYS[3] status key, KEYS[4] error key,
+# KEYS[5] job event stream, KEYS[6] leases sorted set, KEYS[7] retries hash, KEYS[8] job lanes hash,
+# KEYS[9] progress key
+# ARGV[1] job id, ARGV[2] error message, ARGV[3] event stream max length, ARGV[4] events channel,
+# ARGV[5] error TTL, ARGV[6] status TTL, ARGV[7] progress and event stream TTL (seconds, 0 keeps the key)
+# When the job leads a flight: KEYS[10] flight key, KEYS[11] flight followers set, ARGV[8] queue key prefix
+FAIL_JOB = EXPIRE_UNLESS_ZERO + FINISH_FLIGHT + """
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[6], ARGV[1])
+redis.call('HDEL', KEYS[7], ARGV[1])
+redis.call('HDEL', KEYS[8], ARGV[1])
+redis.call('SET', KEYS[3], 'failed')
+redis.call('SET', KEYS[4], ARGV[2])
+redis.call('XADD', KEYS[5], 'MAXLEN', '~', ARGV[3], '*', 'type', 'failed', 'error', ARGV[2])
+expire(KEYS[3], ARGV[6])
+expire(KEYS[4], ARGV[5])
+expire(KEYS[5], ARGV[7])
+expire(KEYS[9], ARGV[7])
+redis.call('PUBLISH', ARGV[4], cjson.encode({jobId = ARGV[1], type = 'failed'}))
+if #KEYS > 9 then
+    finish_flight(KEYS[10], KEYS[11], ARGV[1], ARGV[8], 'failed', 'error', ARGV[2], ARGV[5], ARGV[6], ARGV[7],
+        ARGV[3], ARGV[4], {'type', 'failed', 'error', ARGV[2], 'leader', ARGV[1]},
+        KEYS[1], KEYS[2], KEYS[6], KEYS[7], KEYS[8])
+end
+if raw then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    redis.call('LPUSH', KEYS[2], raw)
+    return 1
+end
+return 0
+"""
+
+# Registers a job as the one running under its idempotency key, or attaches it
+# to the job already running under that key. An attached job is not run: it
+# stays in the processing hash with its lease pushed to the end of the flight,
+# and the leader's complete or fail script hands it the leader's outcome. If the
+# leader never finishes, the flight key expires and the reaper hands the
+# attached jobs out again, so a stale flight cannot hold up new work.
+# KEYS[1] flight key, KEYS[2] flight followers set, KEYS[3] leases sorted set, KEYS[4] job event stream
+# ARGV[1] job id, ARGV[2] flight TTL in milliseconds, ARGV[3] event stream max length
+# Returns the id of the job leading the flight (ARGV[1] when the job runs itself)
+JOIN_FLIGHT = NOW_MS + """
+local leader = redis.call('GET', KEYS[1])
+if not leader then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return ARGV[1]
+end
+if leader == ARGV[1] then
+    -- The leader itself, claimed again after it was requeued
+    return leader
+end
+local remaining = redis.call('PTTL', KEYS[1])
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('PEXPIRE', KEYS[2], remaining)
+redis.call('ZADD', KEYS[3], 'XX', now + remaining, ARGV[1])
+redis.call('XADD', KEYS[4], 'MAXLEN', '~', ARGV[3], '*', 'type', 'attached', 'leader', leader)
+return leader
+"""
+
+# Extends the leases of jobs this worker still holds, along with their lock keys,
+# and records the worker as alive.
+# KEYS[1] leases sorted set, KEYS[2] workers sorted set, KEYS[3..] lock key of each job
+# ARGV[1] lease duration in milliseconds, ARGV[2] worker id, ARGV[3..] job ids
+# Returns the ids whose lease was already gone (reaped and handed to another worker).
+EXTEND_LEASES = NOW_MS + """
+local deadline = now + tonumber(ARGV[1])
+local lost = {}
+redis.call('ZADD', KEYS[2], deadline, ARGV[2])
+for i = 3, #ARGV do
+    if redis.call('ZADD', KEYS[1], 'XX', 'CH', deadline, ARGV[i]) == 1 then
+        redis.call('PEXPIRE', KEYS[i], ARGV[1])
+    else
+        table.insert(lost, ARGV[i])
+    end
+end
+return lost
+"""
+
+# Requeues jobs whose lease has expired, failing those that ran out of retries,
+# and recovers the hand-off lists of workers that stopped heartbeating.
+# Per-job and per-worker key names are derived from the queue prefix, which keeps
+# the number of keys independent of how many jobs expire at once.
+# Requeued jobs go back to the lane they were claimed from, and recovered hand-offs
+# to the lane their worker blocked on.
+# KEYS[1] leases sorted set, KEYS[2] processing hash, KEYS[3] default wait list, KEYS[4] failed list,
+# KEYS[5] retries hash, KEYS[6] workers sorted set, KEYS[7] job lanes hash, KEYS[8] worker capacity hash,
+# KEYS[9] hand-off lanes hash
+# ARGV[1] queue key prefix, ARGV[2] number of times a job may be requeued, ARGV[3] maximum entries handled per call,
+# ARGV[4] event stream max length, ARGV[5] events channel, ARGV[6] error TTL, ARGV[7] status TTL,
+# ARGV[8] progress and event stream TTL (seconds, 0 keeps the key)
+# Returns {requeued, failed, recovered hand-offs}
+REAP_EXPIRED = NOW_MS + EXPIRE_UNLESS_ZERO + """
+local requeued = 0
+local failed = 0
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, tonumber(ARGV[3]))
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('DEL', ARGV[1] .. ':' .. id .. ':lock')
+    local raw = redis.call('HGET', KEYS[2], id)
+    local lane = redis.call('HGET', KEYS[7], id) or KEYS[3]
+    redis.call('HDEL', KEYS[7], id)
+    if raw then
+        redis.call('HDEL', KEYS[2], id)
+        local attempts = redis.call('HINCRBY', KEYS[5], id, 1)
+        if attempts > tonumber(ARGV[2]) then
+            local message = 'Lease expired ' .. attempts .. ' time(s), giving up'
+            redis.call('HDEL', KEYS[5], id)
+            redis.call('LPUSH', KEYS[4], raw)
+            local job_prefix = ARGV[1] .. ':' .. id .. ':'
+            redis.call('SET', job_prefix .. 'status', 'failed')
+            redis.call('SET', job_prefix .. 'error', message)
+            redis.call('XADD', job_prefix .. 'events', 'MAXLEN', '~', ARGV[4], '*',
+                'type', 'failed', 'error', message)
+            expire(job_prefix .. 'error', ARGV[6])
+            expire(job_prefix .. 'status', ARGV[7])
+            expire(job_prefix .. 'events', ARGV[8])
+            expire(job_prefix .. 'progress', ARGV[8])
+            redis.call('PUBLISH', ARGV[5], cjson.encode({jobId = id, type = 'failed'}))
+            failed = failed + 1
+        else
+            -- Back at the end consumers pop from, so the job does not wait behind the whole queue
+            redis.call('RPUSH', lane, raw)
+            requeued = requeued + 1
+        end
+    end
+end
+
+local recovered = 0
+local dead = redis.call('ZRANGEBYSCORE', KEYS[6], '-inf', now, 'LIMIT', 0, tonumber(ARGV[3]))
+for _, worker_id in ipairs(dead) do
+    redis.call('ZREM', KEYS[6], worker_id)
+    redis.call('HDEL', KEYS[8], worker_id)
+    local lane = redis.call('HGET', KEYS[9], worker_id) or KEYS[3]
+    redis.call('HDEL', KEYS[9], worker_id)
+    local claiming = ARGV[1] .. ':claiming:' .. worker_id
+    local raw = redis.call('RPOP', claiming)
+    while raw do
+        redis.call('RPUSH', lane, raw)
+        recovered = recovered + 1
+        raw = redis.call('RPOP', claiming)
+    end
+end
+return {requeued, failed, recovered}
+"""
+
+
+# BullMQ-compatible transitions. They follow the semantics of BullMQ's own
+# moveToActive, moveToFinished, extendLock and moveStalledJobsToWait commands on
+# its key layout (see keys.BullKeys), so Python and Node workers can consume the
+# same queue. Rate-limited queues and the children of flows are refused at claim
+# time and left to Node workers; deduplication ids and job schedulers are not
+# handled, so queues using them should stay on Node workers.
+
+# Shared helpers: event stream appends capped at the queue's `opts.maxLenEvents`,
+# the paused/global concurrency check and the marker blocked workers wait on
+BULL_HELPERS = """
+local rcall = redis.call
+local function emit(eventsKey, metaKey, ...)
+    local maxEvents = rcall('HGET', metaKey, 'opts.maxLenEvents')
+    if not maxEvents then
+        maxEvents = 10000
+        rcall('HSET', metaKey, 'opts.maxLenEvents', maxEvents)
+    end
+    rcall('XADD', eventsKey, 'MAXLEN', '~', maxEvents, '*', ...)
+end
+local function isPausedOrMaxed(metaKey, activeKey)
+    local meta = rcall('HMGET', metaKey, 'paused', 'concurrency')
+    if meta[1] then
+        return true
+    end
+    if meta[2] then
+        return rcall('LLEN', activeKey) >= tonumber(meta[2])
+    end
+    return false
+end
+local function addMarker(markerKey, pausedOrMaxed)
+    if not pausedOrMaxed then
+        rcall('ZADD', markerKey, 0, '0')
+    end
+end
+-- Scores beyond 2^47 would be printed in exponent notation by tostring
+local function score(value)
+    return string.format('%.0f', value)
+end
+"""
+
+# Promotes due delayed jobs, then moves the next job id from the wait list (or the
+# prioritized set) to the active list, locks it with the worker's token and
+# returns its hash. Jobs this worker cannot run correctly are left where they are
+# for Node workers: nothing is claimed while the queue is rate limited (a global
+# `max` in the meta hash, or a live limiter window of a Node worker), or while the
+# next job is the child of a flow, whose parent only moves on in BullMQ's own
+# moveToFinished.
+# KEYS[1] wait list, KEYS[2] active list, KEYS[3] prioritized set, KEYS[4] events stream,
+# KEYS[5] delayed set, KEYS[6] meta hash, KEYS[7] priority counter, KEYS[8] marker,
+# KEYS[9] rate limiter
+# ARGV[1] job key prefix, ARGV[2] timestamp (ms), ARGV[3] lock token,
+# ARGV[4] lock duration (ms), ARGV[5] worker name
+# Returns {job id, flat list of the job hash}, {0, timestamp of the next delayed job or 0},
+# or {0, 0, `rate-limited` or `parent`, job id or ''} when the next job is refused
+BULL_MOVE_TO_ACTIVE = BULL_HELPERS + """
+local waitKey, activeKey, prioritizedKey, eventsKey = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local delayedKey, metaKey, pcKey, markerKey = KEYS[5], KEYS[6], KEYS[7], KEYS[8]
+local prefix = ARGV[1]
+local now = tonumber(ARGV[2])
+local pausedOrMaxed = isPausedOrMaxed(metaKey, activeKey)
+
+local due = rcall('ZRANGEBYSCORE', delayedKey, 0, score((now + 1) * 0x1000 - 1), 'LIMIT', 0, 1000)
+if #due > 0 then
+    rcall('ZREM', delayedKey, unpack(due))
+    for _, jobId in ipairs(due) do
+        local priority = tonumber(rcall('HGET', prefix .. jobId, 'priority')) or 0
+        if priority == 0 then
+            rcall('LPUSH', waitKey, jobId)
+        else
+            local counter = rcall('INCR', pcKey)
+            rcall('ZADD', prioritizedKey, score(priority * 0x100000000 + counter % 0x100000000), jobId)
+        end
+        emit(eventsKey, metaKey, 'event', 'waiting', 'jobId', jobId, 'prev', 'delayed')
+        rcall('HSET', prefix .. jobId, 'delay', 0)
+    end
+    addMarker(markerKey, pausedOrMaxed)
+end
+if pausedOrMaxed then
+    return {0, 0}
+end
+if rcall('HEXISTS', metaKey, 'max') == 1 or rcall('PTTL', KEYS[9]) > 0 then
+    return {0, 0, 'rate-limited', ''}
+end
+
+local nextId = rcall('LINDEX', waitKey, -1)
+if nextId and string.sub(nextId, 1, 2) == '0:' then
+    nextId = rcall('LINDEX', waitKey, -2)
+end
+if not nextId then
+    nextId = rcall('ZRANGE', prioritizedKey, 0, 0)[1]
+end
+if nextId and rcall('HEXISTS', prefix .. nextId, 'parentKey') == 1 then
+    return {0, 0, 'parent', nextId}
+end
+
+local jobId = rcall('RPOPLPUSH', waitKey, activeKey)
+-- Markers pushed into the wait list by BullMQ before v5
+if jobId and string.sub(jobId, 1, 2) == '0:' then
+    rcall('LREM', activeKey, 1, jobId)
+    jobId = rcall('RPOPLPUSH', waitKey, activeKey)
+end
+if not jobId then
+    local prioritized = rcall('ZPOPMIN', prioritizedKey)
+    if #prioritized > 0 then
+        jobId = prioritized[1]
+        rcall('LPUSH', activeKey, jobId)
+    else
+        rcall('DEL', pcKey)
+    end
+end
+if not jobId then
+    local nextDelayed = rcall('ZRANGE', delayedKey, 0, 0, 'WITHSCORES')
+    if nextDelayed[2] then
+        return {0, math.floor(tonumber(nextDelayed[2]) / 0x1000)}
+    end
+    return {0, 0}
+end
+
+local jobKey = prefix .. jobId
+rcall('SET', jobKey .. ':lock', ARGV[3], 'PX', ARGV[4])
+emit(eventsKey, metaKey, 'event', 'active', 'jobId', jobId, 'prev', 'waiting')
+rcall('HSET', jobKey, 'processedOn', ARGV[2], 'pb', ARGV[5])
+rcall('HINCRBY', jobKey, 'ats', 1)
+addMarker(markerKey, false)
+return {jobId, rcall('HGETALL', jobKey)}
+"""
+
+# Releases an active job's lock and either finishes it, keeping it in the completed
+# or failed set as its removeOnComplete/removeOnFail options allow, or, for a failed
+# job with attempts left, puts it back in the wait list or the delayed set.
+# KEYS[1] job hash, KEYS[2] active list, KEYS[3] completed or failed set, KEYS[4] events stream,
+# KEYS[5] meta hash, KEYS[6] wait list, KEYS[7] paused list, KEYS[8] delayed set,
+# KEYS[9] marker, KEYS[10] stalled set, KEYS[11] prioritized set
+# ARGV[1] job id, ARGV[2] timestamp (ms), ARGV[3] lock token, ARGV[4] `completed` or `failed`,
+# ARGV[5] `returnvalue` or `failedReason`, ARGV[6] JSON return value or error message,
+# ARGV[7] job key prefix, ARGV[8] retry delay in ms (-1 finishes the job)
+# Returns 0, or -1 missing job, -2 missing lock, -3 job not active, -6 lock held by another token
+BULL_MOVE_TO_FINISHED = BULL_HELPERS + """
+local jobKey, activeKey, targetKey, eventsKey, metaKey = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5]
+local waitKey, pausedKey, delayedKey, markerKey = KEYS[6], KEYS[7], KEYS[8], KEYS[9]
+local jobId, target, field, value, prefix = ARGV[1], ARGV[4], ARGV[5], ARGV[6], ARGV[7]
+local now = tonumber(ARGV[2])
+local retryDelay = tonumber(ARGV[8])
+
+if rcall('EXISTS', jobKey) == 0 then
+    return -1
+end
+local lockToken = rcall('GET', jobKey .. ':lock')
+if lockToken ~= ARGV[3] then
+    if lockToken then
+        return -6
+    end
+    return -2
+end
+rcall('DEL', jobKey .. ':lock')
+rcall('SREM', KEYS[10], jobId)
+if rcall('LREM', activeKey, -1, jobId) < 1 then
+    return -3
+end
+local attemptsMade = rcall('HINCRBY', jobKey, 'atm', 1)
+
+if retryDelay >= 0 then
+    rcall('HSET', jobKey, 'failedReason', value)
+    local pausedOrMaxed = isPausedOrMaxed(metaKey, activeKey)
+    if retryDelay > 0 then
+        -- Same ordering as BullMQ: ms timestamp in the high bits, a tie breaker in the low 12
+        local delayedAt = now + retryDelay
+        local delayedScore = delayedAt * 0x1000
+        local last = rcall('ZREVRANGEBYSCORE', delayedKey, score((delayedAt + 1) * 0x1000 - 1),
+                           score(delayedScore), 'WITHSCORES', 'LIMIT', 0, 1)
+        if #last > 0 then
+            delayedScore = math.min(tonumber(last[2]) + 1, (delayedAt + 1) * 0x1000 - 1)
+        end
+        rcall('ZADD', delayedKey, score(delayedScore), jobId)
+        rcall('HSET', jobKey, 'delay', retryDelay)
+        emit(eventsKey, metaKey, 'event', 'delayed', 'jobId', jobId, 'delay', delayedAt)
+        if not pausedOrMaxed then
+            local nextDelayed = rcall('ZRANGE', delayedKey, 0, 0, 'WITHSCORES')
+            rcall('ZADD', markerKey, score(math.floor(tonumber(nextDelayed[2]) / 0x1000)), '1')
+        end
+    else
+        local paused = rcall('HEXISTS', metaKey, 'paused') == 1
+        rcall('LPUSH', paused and pausedKey or waitKey, jobId)
+        addMarker(markerKey, pausedOrMaxed)
+        emit(eventsKey, metaKey, 'event', 'waiting', 'jobId', jobId, 'prev', 'failed')
+    end
+    return 0
+end
+
+-- removeOnComplete/removeOnFail: true removes the job, a number keeps that many, {age, count} bounds both
+local opts = cjson.decode(rcall('HGET', jobKey, 'opts') or '{}')
+local keep = opts[target == 'completed' and 'removeOnComplete' or 'removeOnFail']
+local maxCount, maxAge
+if keep == true then
+    maxCount = 0
+elseif type(keep) == 'number' then
+    maxCount = keep
+elseif type(keep) == 'table' then
+    maxCount = type(keep['count']) == 'number' and keep['count'] or nil
+    maxAge = type(keep['age']) == 'number' and keep['age'] or nil
+end
+
+local function removeJobs(jobIds)
+    for _, removedId in ipairs(jobIds) do
+        rcall('DEL', prefix .. removedId, prefix .. removedId .. ':logs')
+    end
+end
+
+if maxCount == 0 then
+    rcall('DEL', jobKey, jobKey .. ':logs')
+else
+    rcall('ZADD', targetKey, now, jobId)
+    rcall('HSET', jobKey, field, value, 'finishedOn', now)
+    if maxAge then
+        local expired = rcall('ZRANGEBYSCORE', targetKey, '-inf', now - maxAge * 1000, 'LIMIT', 0, 1000)
+        if #expired > 0 then
+            removeJobs(expired)
+            rcall('ZREM', targetKey, unpack(expired))
+        end
+    end
+    if maxCount and maxCount > 0 then
+        removeJobs(rcall('ZREVRANGE', targetKey, maxCount, -1))
+        rcall('ZREMRANGEBYRANK', targetKey, 0, -(maxCount + 1))
+    end
+end
+
+emit(eventsKey, metaKey, 'event', target, 'jobId', jobId, field, value, 'prev', 'active')
+if target == 'failed' then
+    emit(eventsKey, metaKey, 'event', 'retries-exhausted', 'jobId', jobId, 'attemptsMade', attemptsMade)
+end
+if rcall('LLEN', waitKey) == 0 and rcall('LLEN', activeKey) == 0 and rcall('ZCARD', KEYS[11]) == 0 then
+    emit(eventsKey, metaKey, 'event', 'drained')
+end
+return 0
+"""
+
+# Puts an active job back at the head of the wait list, e.g. when its worker shuts
+# down before finishing it, releasing its lock if the token still matches.
+# KEYS[1] active list, KEYS[2] wait list, KEYS[3] paused list, KEYS[4] stalled set,
+# KEYS[5] meta hash, KEYS[6] marker, KEYS[7] events stream
+# ARGV[1] job id, ARGV[2] lock token, ARGV[3] job key prefix
+# Returns 1 when the job was active and moved back, 0 otherwise
+BULL_MOVE_TO_WAIT = BULL_HELPERS + """
+local jobId = ARGV[1]
+local lockKey = ARGV[3] .. jobId .. ':lock'
+if rcall('GET', lockKey) == ARGV[2] then
+    rcall('DEL', lockKey)
+end
+if rcall('LREM', KEYS[1], 1, jobId) == 0 then
+    return 0
+end
+rcall('SREM', KEYS[4], jobId)
+local paused = rcall('HEXISTS', KEYS[5], 'paused') == 1
+rcall('RPUSH', paused and KEYS[3] or KEYS[2], jobId)
+addMarker(KEYS[6], isPausedOrMaxed(KEYS[5], KEYS[1]))
+emit(KEYS[7], KEYS[5], 'event', 'waiting', 'jobId', jobId, 'prev', 'active')
+return 1
+"""
+
+# Extends the locks this worker still holds and takes the jobs off the stalled set.
+# KEYS[1] stalled set
+# ARGV[1] lock duration (ms), ARGV[2] job key prefix, ARGV[3..] job id/token pairs
+# Returns the ids whose lock was lost or taken over
+BULL_EXTEND_LOCKS = """
+local lost = {}
+for i = 3, #ARGV, 2 do
+    local jobId, token = ARGV[i], ARGV[i + 1]
+    local lockKey = ARGV[2] .. jobId .. ':lock'
+    if redis.call('GET', lockKey) == token then
+        redis.call('SET', lockKey, token, 'PX', ARGV[1])
+        redis.call('SREM', KEYS[1], jobId)
+    else
+        table.insert(lost, jobId)
+    end
+end
+return lost
+"""
+
+# BullMQ's stalled job check, run at most once per ARGV[4] ms by any worker: jobs
+# marked on the previous run whose lock is gone go back to the wait list, or are
+# failed once they stalled more than ARGV[1] times. Every active job is then marked
+# again; a worker holding the job unmarks it when it extends the lock.
+# KEYS[1] stalled set, KEYS[2] wait list, KEYS[3] active list, KEYS[4] stalled-check key,
+# KEYS[5] meta hash, KEYS[6] paused list, KEYS[7] marker, KEYS[8] events stream, KEYS[9] failed set
+# ARGV[1] maximum stalled count, ARGV[2] job key prefix, ARGV[3] timestamp (ms), ARGV[4] check interval (ms)
+# Returns {requeued ids, failed ids}
+BULL_MOVE_STALLED = BULL_HELPERS + """
+local stalledKey, waitKey, activeKey, metaKey, eventsKey = KEYS[1], KEYS[2], KEYS[3], KEYS[5], KEYS[8]
+if rcall('SET', KEYS[4], ARGV[3], 'PX', ARGV[4], 'NX') == false then
+    return {{}, {}}
+end
+
+local requeued, failed = {}, {}
+local stalling = rcall('SMEMBERS', stalledKey)
+if #stalling > 0 then
+    rcall('DEL', stalledKey)
+    local paused = rcall('HEXISTS', metaKey, 'paused') == 1
+    for _, jobId in ipairs(stalling) do
+        local jobKey = ARGV[2] .. jobId
+        if string.sub(jobId, 1, 2) == '0:' then
+            rcall('LREM', activeKey, 1, jobId)
+        elseif rcall('EXISTS', jobKey .. ':lock') == 0 and rcall('LREM', activeKey, 1, jobId) > 0 then
+            if rcall('HINCRBY', jobKey, 'stc', 1) > tonumber(ARGV[1]) then
+                local reason = 'job stalled more than allowable limit'
+                rcall('ZADD', KEYS[9], ARGV[3], jobId)
+                rcall('HSET', jobKey, 'failedReason', reason, 'finishedOn', ARGV[3])
+                rcall('HINCRBY', jobKey, 'atm', 1)
+                emit(eventsKey, metaKey, 'event', 'failed', 'jobId', jobId, 'failedReason', reason, 'prev', 'active')
+                table.insert(failed, jobId)
+            else
+                rcall('RPUSH', paused and KEYS[6] or waitKey, jobId)
+                addMarker(KEYS[7], isPausedOrMaxed(metaKey, activeKey))
+                emit(eventsKey, metaKey, 'event', 'waiting', 'jobId', jobId, 'prev', 'active')
+                emit(eventsKey, metaKey, 'event', 'stalled', 'jobId', jobId)
+                table.insert(requeued, jobId)
+            end
+        end
+    end
+end
+
+local active = rcall('LRANGE', activeKey, 0, -1)
+for i = 1, #active, 5000 do
+    rcall('SADD', stalledKey, unpack(active, i, math.min(i + 4999, #active)))
+end
+return {requeued, failed}
+"""
+
+
+def decode_claimed(claimed, lanes):
+    """
+    Split the reply of CLAIM_JOBS into parsed jobs and invalid payloads.
+
+    Each job is tagged with the lane it was claimed from (`lanes` names the
+    lane of each source list passed to the script) and its claim time in ms.
+    Deferred jobs, which stayed in their lane, are left out.
+    """
+    jobs = []
+    invalid = []
+    claimed_at = int(time.time() * 1000)
+    for status, index, raw in zip(claimed[::3], claimed[1::3], claimed[2::3]):
+        if status == b"ok":
+            job = FAST_JSON.loads(raw)
+            job["lane"] = lanes[int(index) - 1]
+            job["claimedAt"] = claimed_at
+            jobs.append(job)
+        elif status == b"invalid":
+            invalid.append(raw)
+    return jobs, invalid
+
+
+def decode_bull_job(reply, lane):
+    """
+    Turn the reply of BULL_MOVE_TO_ACTIVE into a job shaped like a native
+    payload: `id`, `name`, parsed `data` and `opts`, the enqueue `timestamp`,
+    `attemptsMade`, the lane it is counted in and its claim time in ms.
+
+    Raises:
+        ValueError: The job's data or options are not valid JSON
+    """
+    job_id, fields = reply
+    job_hash = {field.decode(): value.decode("utf-8", "replace") for field, value in zip(fields[::2], fields[1::2])}
+    return {
+        "id": job_id.decode(),
+        "name": job_hash.get("name"),
+        "data": FAST_JSON.loads(job_hash.get("data") or "{}"),
+        "opts": FAST_JSON.loads(job_hash.get("opts") or "{}"),
+        "timestamp": int(job_hash.get("timestamp") or 0) or None,
+        "attemptsMade": int(job_hash.get("atm") or 0),
+        "lane": lane,
+        "claimedAt": int(time.time() * 1000),
+    }
+
+
+class QueueScripts:
+    """
+    Lua transition scripts registered on a Redis client.
+
+    Works with both `redis.Redis` and `redis.asyncio.Redis`; the latter returns
+    awaitables when the scripts are called.
+    """
+
+    def __init__(self, client):
+        self.claim_jobs = client.register_script(CLAIM_JOBS)
+        self.release_jobs = client.register_script(RELEASE_JOBS)
+        self.lock_job = client.register_script(LOCK_JOB)
+        self.complete_job = client.register_script(COMPLETE_JOB)
+        self.fail_job = client.register_script(FAIL_JOB)
+        self.extend_leases = client.register_script(EXTEND_LEASES)
+        self.reap_expired = client.register_script(REAP_EXPIRED)
+        self.join_flight = client.register_script(JOIN_FLIGHT)
+
+    def load(self):
+        """
+        Load every script into the script cache of each primary. Cluster
+        pipelines cannot load a missing script themselves, so cluster clients
+        call this once after connecting. Returns the replies (awaitables on an
+        asyncio client).
+        """
+        scripts = (self.claim_jobs, self.release_jobs, self.lock_job, self.complete_job, self.fail_job, self.extend_leases,
+                   self.reap_expired, self.join_flight)
+        return [script.registered_client.script_load(script.script) for script in scripts]
+
+
+class BullScripts:
+    """
+    BullMQ-compatible transition scripts registered on a Redis client (see `QueueScripts`)
+    """
+
+    def __init__(self, client):
+        self.move_to_active = client.register_script(BULL_MOVE_TO_ACTIVE)
+        self.move_to_finished = client.register_script(BULL_MOVE_TO_FINISHED)
+        self.move_to_wait = client.register_script(BULL_MOVE_TO_WAIT)
+        self.extend_locks = client.register_script(BULL_EXTEND_LOCKS)
+        self.move_stalled = client.register_script(BULL_MOVE_STALLED)
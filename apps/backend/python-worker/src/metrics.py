@@ -0,0 +1,252 @@
+import abc
+import bisect
+import contextlib
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Metric(abc.ABC):
+    """
+    Base of the metric types: a name, help text and label names.
+
+    Each metric holds one lock that is only taken for the few instructions of
+    an update, so recording stays cheap on the job path.
+    """
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    @abc.abstractmethod
+    def _samples(self):
+        """
+        Sample lines of the metric in the Prometheus text format
+        """
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def _samples(self):
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in sorted(values.items())]
+
+
+class Gauge(_Metric):
+    """
+    Gauge set by the worker, or computed at scrape time when `callback` is given
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), callback=None):
+        super().__init__(name, help_text, labels)
+        self.values = {}
+        self.callback = callback
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def _samples(self):
+        if self.callback:
+            try:
+                return [f"{self.name} {self.callback()}"]
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} callback failed: {str(e)}")
+                return []
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, *label_values):
+        """
+        Observe the duration of the `with` block
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def _samples(self):
+        with self.lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self.series.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class WorkerMetrics:
+    """
+    Metrics of one worker process, rendered in the Prometheus text format.
+
+    Recording is always on; the numbers are only exposed when a metrics server
+    is started for them.
+    """
+
+    def __init__(self, concurrency, active_jobs=None):
+        """
+        Args:
+            concurrency: Configured number of job slots
+            active_jobs: Optional callable returning the number of jobs running right now
+        """
+        self.jobs_claimed = Counter("worker_jobs_claimed_total", "Jobs claimed from the queue", ("job_type", "lane"))
+        self.jobs_completed = Counter("worker_jobs_completed_total", "Jobs completed", ("job_type",))
+        self.jobs_failed = Counter("worker_jobs_failed_total", "Jobs failed", ("job_type",))
+        self.jobs_requeued = Counter("worker_jobs_requeued_total", "Jobs handed back to the queue unfinished on shutdown",
+                                     ("job_type",))
+        self.jobs_deduplicated = Counter("worker_jobs_deduplicated_total",
+                                         "Jobs attached to an identical running job instead of running",
+                                         ("job_type",))
+        self.queue_wait = Histogram("worker_job_queue_wait_seconds", "Time between enqueue and claim",
+                                    ("lane",))
+        self.job_duration = Histogram("worker_job_duration_seconds", "Job execution time", ("job_type",))
+        self.step_duration = Histogram("worker_pipeline_step_duration_seconds", "Pipeline step execution time",
+                                       ("step_type",))
+        self.steps_resumed = Counter("worker_pipeline_steps_resumed_total",
+                                     "Pipeline steps skipped because a checkpoint of them was still valid",
+                                     ("step_type",))
+        self.script_cpu = Histogram("worker_script_cpu_seconds", "User and system CPU time of script runs",
+                                    ("script_type",))
+        self.memory_estimate = Gauge("worker_job_memory_estimate_mb",
+                                     "Memory need of a job type measured from its recent script runs", ("job_type",))
+        self.redis_latency = Histogram("worker_redis_roundtrip_seconds", "Redis round trip latency",
+                                       ("operation",), buckets=LATENCY_BUCKETS)
+        self.queue_depth = Gauge("worker_queue_depth", "Sampled number of jobs per queue list", ("list",))
+        self.concurrency = Gauge("worker_concurrency", "Configured number of job slots")
+        self.concurrency.set(concurrency)
+        self.in_flight = Gauge("worker_jobs_in_flight", "Jobs currently running", callback=active_jobs)
+        self.metrics = [
+            self.jobs_claimed, self.jobs_completed, self.jobs_failed, self.jobs_requeued, self.jobs_deduplicated,
+            self.queue_wait, self.job_duration, self.step_duration, self.steps_resumed, self.script_cpu,
+            self.memory_estimate, self.redis_latency, self.queue_depth, self.concurrency, self.in_flight,
+        ]
+        # job id -> (job type, start time) of running jobs
+        self.running = {}
+        self.lock = threading.Lock()
+
+    def job_claimed(self, job_type, lane):
+        self.jobs_claimed.inc(job_type, lane)
+
+    def job_started(self, job_id, job_type, lane, queue_wait_ms):
+        if queue_wait_ms is not None:
+            self.queue_wait.observe(queue_wait_ms / 1000, lane)
+        with self.lock:
+            self.running[job_id] = (job_type, time.perf_counter())
+
+    def job_finished(self, job_id, completed):
+        with self.lock:
+            job_type, started = self.running.pop(job_id, (None, None))
+        if job_type is None:
+            return
+        self.job_duration.observe(time.perf_counter() - started, job_type)
+        (self.jobs_completed if completed else self.jobs_failed).inc(job_type)
+
+    def job_requeued(self, job_id):
+        with self.lock:
+            job_type, _ = self.running.pop(job_id, (None, None))
+        if job_type is not None:
+            self.jobs_requeued.inc(job_type)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(metrics, port, host="0.0.0.0"):
+    """
+    Serve `metrics.render()` at `/metrics` from a daemon thread
+
+    Returns:
+        The running ThreadingHTTPServer
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(f"Metrics request: {format % args}")
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
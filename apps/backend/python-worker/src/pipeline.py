@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from scripts import SCRIPT_MAP
+
+logger = logging.getLogger(__name__)
+
+# Relative expected cost of each step type, used to weight aggregated progress
+DEFAULT_STEP_COSTS = {
+    "asset-import": 2,
+    "asset-tag": 1,
+    "asset-decimate": 5,
+    "asset-export": 2,
+}
+
+# Steps of the legacy `pipeline: true` job, as a graph: tagging does not need the
+# decimated mesh, so it runs alongside decimation
+DEFAULT_PIPELINE = [
+    {"id": "import", "type": "asset-import", "dependsOn": []},
+    {"id": "tag", "type": "asset-tag", "dependsOn": ["import"]},
+    {"id": "decimate", "type": "asset-decimate", "dependsOn": ["import"]},
+    {"id": "export", "type": "asset-export", "dependsOn": ["tag", "decimate"]},
+]
+
+# Default number of steps of one pipeline job that may run at the same time
+DEFAULT_PIPELINE_PARALLELISM = 4
+
+# Aggregated progress of the steps is reported within this range of the job's progress
+PROGRESS_START = 5
+PROGRESS_END = 95
+
+
+class PipelineError(ValueError):
+    """
+    Raised when a pipeline definition is invalid
+    """
+
+
+class PipelineInterrupted(Exception):
+    """
+    Raised when a pipeline stops before all steps ran because the worker is shutting down
+    """
+
+    def __init__(self, results):
+        super().__init__(f"Pipeline interrupted after steps: {sorted(results)}")
+        self.results = results
+
+
+def _normalize_type(step_type):
+    if step_type in SCRIPT_MAP:
+        return step_type
+    if f"asset-{step_type}" in SCRIPT_MAP:
+        return f"asset-{step_type}"
+    raise PipelineError(f"Unknown pipeline step type: {step_type}")
+
+
+def build_pipeline_steps(script_params):
+    """
+    Build the step graph of a pipeline job.
+
+    `scriptParams.pipeline` is either `true`, which runs the default
+    import/tag/decimate/export graph with params taken from
+    `scriptParams.<step>`, or a list of steps:
+
+        {"id": "export-gltf", "type": "asset-export", "params": {...},
+         "dependsOn": ["decimate"], "cost": 2}
+
+    Returns:
+        Dict of step id -> normalized step, in definition order
+    """
+    definition = script_params.get("pipeline")
+    if definition is True:
+        definition = [{**step, "params": script_params.get(step["id"], {})} for step in DEFAULT_PIPELINE]
+    if not isinstance(definition, list) or not definition:
+        raise PipelineError("scriptParams.pipeline must be true or a non-empty list of steps")
+
+    steps = {}
+    for index, raw_step in enumerate(definition):
+        if not isinstance(raw_step, dict):
+            raise PipelineError(f"Pipeline step {index} must be an object")
+        step_type = _normalize_type(raw_step.get("type") or raw_step.get("id"))
+        step_id = str(raw_step.get("id") or f"{step_type}-{index}")
+        if step_id in steps:
+            raise PipelineError(f"Duplicate pipeline step id: {step_id}")
+        steps[step_id] = {
+            "id": step_id,
+            "type": step_type,
+            "params": raw_step.get("params", {}),
+            "dependsOn": [str(dep) for dep in raw_step.get("dependsOn", [])],
+            "cost": float(raw_step.get("cost", DEFAULT_STEP_COSTS[step_type])),
+        }
+
+    for step in steps.values():
+        for dep in step["dependsOn"]:
+            if dep not in steps:
+                raise PipelineError(f"Step {step['id']} depends on unknown step {dep}")
+
+    # Kahn's algorithm: every step must become ready at some point
+    remaining = {step_id: set(step["dependsOn"]) for step_id, step in steps.items()}
+    while remaining:
+        ready = [step_id for step_id, deps in remaining.items() if not deps]
+        if not ready:
+            raise PipelineError(f"Pipeline has a dependency cycle between: {sorted(remaining)}")
+        for step_id in ready:
+            del remaining[step_id]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+    return steps
+
+
+class PipelineRun:
+    """
+    Scheduling and progress state of one pipeline execution.
+
+    Tracks which steps are pending, running and done, hands out steps whose
+    dependencies have completed, and aggregates per-step progress weighted
+    by each step's expected cost. Steps completed by an earlier run start
+    out done.
+    """
+
+    def __init__(self, steps, completed=()):
+        self.steps = steps
+        self.pending = {step_id: step for step_id, step in steps.items() if step_id not in completed}
+        self.running = set()
+        self.done = set(completed)
+        self.fraction = {step_id: 1.0 if step_id in completed else 0.0 for step_id in steps}
+        self.total_cost = sum(step["cost"] for step in steps.values()) or 1.0
+        self.reported = PROGRESS_START
+        self.lock = threading.Lock()
+
+    def take_ready(self):
+        """
+        Mark every step whose dependencies are done as running and return them
+        """
+        ready = [step for step in self.pending.values() if all(dep in self.done for dep in step["dependsOn"])]
+        for step in ready:
+            del self.pending[step["id"]]
+            self.running.add(step["id"])
+        return ready
+
+    def finish(self, step_id):
+        with self.lock:
+            self.running.discard(step_id)
+            self.done.add(step_id)
+            self.fraction[step_id] = 1.0
+
+    def step_progress(self, step_id, percentage):
+        """
+        Record a step's own progress and return the job's aggregated percentage
+        """
+        with self.lock:
+            if percentage is not None:
+                self.fraction[step_id] = max(self.fraction[step_id], min(percentage, 100) / 100.0)
+            weighted = sum(self.steps[s]["cost"] * f for s, f in self.fraction.items()) / self.total_cost
+            # Never report going backwards while several steps interleave their updates
+            self.reported = max(self.reported, int(PROGRESS_START + (PROGRESS_END - PROGRESS_START) * weighted))
+            return self.reported
+
+
+def run_pipeline(steps, run_step, max_parallel=DEFAULT_PIPELINE_PARALLELISM, completed=None, should_stop=None):
+    """
+    Run a pipeline graph on threads, starting each step as soon as its
+    dependencies have completed.
+
+    Args:
+        steps: Step graph from build_pipeline_steps
+        run_step: Callable(step, pipeline_run) returning the step's result dict
+        max_parallel: Maximum number of steps running at the same time
+        completed: Optional dict of step id -> result of steps that are not run again
+        should_stop: Optional callable; once it returns True no new steps are started
+
+    Returns:
+        Tuple (results by step id, error message or None). After a failure no new
+        steps are started, but running ones are allowed to finish.
+
+    Raises:
+        PipelineInterrupted: When `should_stop` ended the run with steps left to run
+    """
+    max_parallel = max(1, max_parallel)
+    completed = completed or {}
+    should_stop = should_stop or (lambda: False)
+    pipeline_run = PipelineRun(steps, completed)
+    results = dict(completed)
+    error = None
+    futures = {}
+    queued = []
+
+    with ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="pipeline-step") as executor:
+        while True:
+            if error is None and not should_stop():
+                queued.extend(pipeline_run.take_ready())
+                while queued and len(futures) < max_parallel:
+                    step = queued.pop(0)
+                    futures[executor.submit(run_step, step, pipeline_run)] = step
+            if not futures:
+                break
+
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = futures.pop(future)
+                try:
+                    step_result = future.result()
+                except Exception as e:
+                    step_result = {"success": False, "error": str(e)}
+                results[step["id"]] = step_result
+                if step_result.get("success", False):
+                    pipeline_run.finish(step["id"])
+                elif error is None:
+                    error = f"Step {step['id']} failed: {step_result.get('error', 'Unknown error')}"
+
+    if error is None and len(pipeline_run.done) < len(steps):
+        raise PipelineInterrupted(results)
+    return results, error
+
+
+async def run_pipeline_async(steps, run_step, max_parallel=DEFAULT_PIPELINE_PARALLELISM, completed=None,
+                             should_stop=None):
+    """
+    asyncio counterpart of `run_pipeline`; run_step is a coroutine function
+    """
+    max_parallel = max(1, max_parallel)
+    completed = completed or {}
+    should_stop = should_stop or (lambda: False)
+    pipeline_run = PipelineRun(steps, completed)
+    results = dict(completed)
+    error = None
+    tasks = {}
+    queued = []
+
+    while True:
+        if error is None and not should_stop():
+            queued.extend(pipeline_run.take_ready())
+            while queued and len(tasks) < max_parallel:
+                step = queued.pop(0)
+                tasks[asyncio.create_task(run_step(step, pipeline_run))] = step
+        if not tasks:
+            break
+
+        finished, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in finished:
+            step = tasks.pop(task)
+            try:
+                step_result = task.result()
+            except Exception as e:
+                step_result = {"success": False, "error": str(e)}
+            results[step["id"]] = step_result
+            if step_result.get("success", False):
+                pipeline_run.finish(step["id"])
+            elif error is None:
+                error = f"Step {step['id']} failed: {step_result.get('error', 'Unknown error')}"
+
+    if error is None and len(pipeline_run.done) < len(steps):
+        raise PipelineInterrupted(results)
+    return results, error
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+
+import redis
+
+from lanes import DEFAULT_LANE
+from shards import build_shards, shard_index, split_urls
+
+logger = logging.getLogger(__name__)
+
+
+class QueueProducer:
+    """
+    Adds jobs to a queue in the native layout the workers consume.
+
+    A job goes to shard `shard_index(id, shards)` and onto the wait list of its
+    lane there, with an enqueue `timestamp` for the starvation check and
+    queue-wait metrics. Producers must be configured with the same `--queue`,
+    `--shards` and `--redis-cluster` as the workers, or the workers never see
+    the jobs.
+    """
+
+    def __init__(self, redis_url="redis://localhost:6379", queue_key="jobs", shards=1, cluster=False):
+        """
+        Args:
+            redis_url: Redis connection URL, or comma-separated nodes the shards are spread over
+            queue_key: Base key of the job queue
+            shards: Number of shards the queue is split into
+            cluster: Whether redis_url points at a Redis Cluster
+        """
+        if cluster:
+            clients = [redis.RedisCluster.from_url(split_urls(redis_url)[0])]
+        else:
+            clients = [redis.from_url(url) for url in split_urls(redis_url)]
+        self.shards = build_shards(clients, queue_key, shards, cluster)
+
+    def shard_for(self, job_id):
+        """
+        Shard holding a job's wait list entry and per-job keys
+        """
+        return self.shards[shard_index(job_id, len(self.shards))]
+
+    def payload(self, name, data, job_id=None, content_type=None):
+        """
+        Job payload as the workers decode it
+        """
+        job = {
+            "id": str(job_id or uuid.uuid4()),
+            "name": name,
+            "data": data or {},
+            "timestamp": int(time.time() * 1000),
+        }
+        if content_type:
+            job["contentType"] = content_type
+        return job
+
+    def add(self, name, data, job_id=None, lane=DEFAULT_LANE, content_type=None):
+        """
+        Add one job
+
+        Returns:
+            The job id
+        """
+        job = self.payload(name, data, job_id, content_type)
+        shard = self.shard_for(job["id"])
+        shard.redis.lpush(shard.keys.lane(lane), json.dumps(job))
+        return job["id"]
+
+    def add_many(self, jobs, lane=DEFAULT_LANE):
+        """
+        Add jobs given as `(name, data)` or `(name, data, job_id)` tuples, with
+        one pipelined round trip per shard
+
+        Returns:
+            The job ids, in the order given
+        """
+        payloads = [self.payload(*job) for job in jobs]
+        by_shard = {}
+        for job in payloads:
+            by_shard.setdefault(self.shard_for(job["id"]), []).append(job)
+        for shard, shard_jobs in by_shard.items():
+            pipe = shard.redis.pipeline(transaction=False)
+            for job in shard_jobs:
+                pipe.lpush(shard.keys.lane(lane), json.dumps(job))
+            pipe.execute()
+        return [job["id"] for job in payloads]
+
+    def status(self, job_id):
+        """
+        Status of a job (`completed`, `failed`, ...) or None while it has none
+        """
+        shard = self.shard_for(job_id)
+        status = shard.redis.get(shard.keys.job(job_id, "status"))
+        return status.decode() if status is not None else None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Add a job to a native worker queue')
+    parser.add_argument('name', help='Job name, e.g. asset-tag')
+    parser.add_argument('--data', default='{}', help='JSON job data')
+    parser.add_argument('--id', help='Job id (default: a random UUID)')
+    parser.add_argument('--lane', default=DEFAULT_LANE, help='Priority lane of the job')
+    parser.add_argument('--redis',
+                        default=f"redis://{os.environ.get('REDIS_HOST', 'localhost')}:{os.environ.get('REDIS_PORT', '6379')}",
+                        help='Redis connection URL, or comma-separated nodes the shards are spread over')
+    parser.add_argument('--queue', default=os.environ.get('JOB_QUEUE_NAME', 'local-job-queue'),
+                        help='Redis queue key prefix')
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('QUEUE_SHARDS', '1')),
+                        help='Number of shards the queue is split into')
+    parser.add_argument('--redis-cluster', action='store_true',
+                        default=os.environ.get('REDIS_CLUSTER', '').lower() in ('1', 'true', 'yes'),
+                        help='Treat --redis as a node of a Redis Cluster')
+
+    args = parser.parse_args()
+
+    try:
+        producer = QueueProducer(args.redis, args.queue, shards=args.shards, cluster=args.redis_cluster)
+        job_id = producer.add(args.name, json.loads(args.data), job_id=args.id, lane=args.lane)
+    except Exception as e:
+        logger.critical(f"Failed to add job: {str(e)}")
+        sys.exit(1)
+    logger.info(f"Added job {job_id} to {producer.shard_for(job_id).keys.lane(args.lane)}")
+    print(job_id)
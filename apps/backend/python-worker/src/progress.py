@@ -0,0 +1,237 @@
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+
+from serializers import FAST_JSON
+
+logger = logging.getLogger(__name__)
+
+# Default minimum time between two progress writes for the same job
+DEFAULT_PROGRESS_INTERVAL = 0.5
+
+# Default approximate cap on the number of entries kept in a job's event stream
+DEFAULT_EVENT_STREAM_MAXLEN = 1000
+
+# BullMQ's default cap on its queue-wide event stream (`opts.maxLenEvents` in the meta hash)
+BULL_EVENTS_MAXLEN = 10000
+
+
+class ProgressPublisher:
+    """
+    Coalesces progress updates for one job.
+
+    Every update replaces the pending progress state and its log line is
+    buffered. Writes happen at most once per `interval`: the latest progress
+    and all buffered log lines go out together in one pipelined round trip.
+    A final (100%) update is always written immediately, and `flush()` writes
+    whatever is still pending.
+
+    Each write sets the `{queue}:{id}:progress` snapshot, appends the log
+    lines and a progress event to the job's capped `{queue}:{id}:events`
+    stream and publishes a notification on `{queue}:events`. The snapshot is
+    written with the job's serializer; notifications are always JSON. With a
+    `ttl`, the snapshot and the stream expire that many seconds after the
+    last write.
+    """
+
+    def __init__(self, client, keys, job_id, interval=DEFAULT_PROGRESS_INTERVAL,
+                 stream_maxlen=DEFAULT_EVENT_STREAM_MAXLEN, instrument=None, serializer=None,
+                 ttl=0):
+        """
+        Args:
+            client: Redis client used for the pipelined writes
+            keys: QueueKeys of the job's queue
+            job_id: The ID of the job
+            interval: Minimum number of seconds between two writes
+            stream_maxlen: Approximate number of events kept in the job's stream
+            instrument: Optional callable(operation, job_id) returning a context
+                manager wrapped around each write, for latency metrics and tracing
+            serializer: Serializer of the progress snapshot (defaults to JSON)
+            ttl: Seconds the snapshot and event stream are kept after the last write (0 keeps them)
+        """
+        self.client = client
+        self.keys = keys
+        self.job_id = job_id
+        self.interval = interval
+        self.stream_maxlen = stream_maxlen
+        self.instrument = instrument or (lambda operation, job_id=None: contextlib.nullcontext())
+        self.serializer = serializer or FAST_JSON
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # Serializes flushes so an older batch can never overwrite a newer one
+        self.flush_lock = threading.Lock()
+        self.latest = None
+        self.percentage = 0
+        self.pending_logs = []
+        self.last_flush = 0.0
+
+    def _buffer(self, progress_data):
+        """
+        Record an update and tell whether it should be written right away.
+        Updates without a percentage (plain log lines) keep the last known one.
+        """
+        with self.lock:
+            final = "percentage" in progress_data and progress_data["percentage"] >= 100
+            self.percentage = progress_data.get("percentage", self.percentage)
+            self.latest = {**progress_data, "percentage": self.percentage}
+            if progress_data.get("log"):
+                self.pending_logs.append((self.percentage, progress_data["log"]))
+            return final or time.monotonic() - self.last_flush >= self.interval
+
+    def _take_batch(self):
+        """
+        Take the pending state and reset the buffer, or return None when there is nothing to write
+        """
+        with self.lock:
+            if self.latest is None:
+                return None
+            batch = (self.latest, self.pending_logs)
+            self.latest = None
+            self.pending_logs = []
+            self.last_flush = time.monotonic()
+            return batch
+
+    def _queue_writes(self, pipe, latest, logs):
+        """
+        Add the writes for one batch to a pipeline
+        """
+        events_key = self.keys.job(self.job_id, "events")
+        pipe.set(self.keys.job(self.job_id, "progress"), self.serializer.dumps(latest), ex=self.ttl or None)
+        for percentage, log in logs:
+            pipe.xadd(events_key, {"type": "log", "percentage": percentage, "log": log},
+                      maxlen=self.stream_maxlen, approximate=True)
+        pipe.xadd(events_key, {"type": "progress", "percentage": latest["percentage"]},
+                  maxlen=self.stream_maxlen, approximate=True)
+        if self.ttl:
+            pipe.expire(events_key, self.ttl)
+        pipe.publish(self.keys.events_channel, FAST_JSON.dumps(
+            {"jobId": self.job_id, "type": "progress", "percentage": latest["percentage"]}
+        ))
+
+    def is_due(self):
+        """
+        Whether pending updates are older than the coalescing interval
+        """
+        with self.lock:
+            return self.latest is not None and time.monotonic() - self.last_flush >= self.interval
+
+    def publish(self, progress_data):
+        """
+        Record a progress update, writing it if the interval has elapsed
+        """
+        if self._buffer(progress_data):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the latest progress and buffered log lines in one round trip
+        """
+        with self.flush_lock:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            try:
+                pipe = self.client.pipeline(transaction=False)
+                self._queue_writes(pipe, *batch)
+                with self.instrument("progress", self.job_id):
+                    pipe.execute()
+                logger.debug(f"Flushed progress for job {self.job_id}: {batch[0]} (+{len(batch[1])} log lines)")
+            except Exception as e:
+                logger.error(f"Failed to update progress for job {self.job_id}: {str(e)}")
+
+
+class BullProgressPublisher(ProgressPublisher):
+    """
+    `ProgressPublisher` for jobs of a BullMQ queue (see `keys.BullKeys`).
+
+    Writes what `job.updateProgress()` and `job.log()` would: the latest
+    progress as JSON in the job hash's `progress` field, a `progress` event on
+    the queue's event stream for `QueueEvents` listeners, and the log lines
+    appended to the job's logs list, trimmed to the job's `keepLogs` option.
+    """
+
+    def __init__(self, *args, keep_logs=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.keep_logs = keep_logs
+
+    def _queue_writes(self, pipe, latest, logs):
+        progress = self.serializer.dumps(latest)
+        pipe.hset(self.keys.job(self.job_id), "progress", progress)
+        if logs:
+            logs_key = self.keys.logs(self.job_id)
+            pipe.rpush(logs_key, *[log for _percentage, log in logs])
+            if self.keep_logs:
+                pipe.ltrim(logs_key, -self.keep_logs, -1)
+        pipe.xadd(self.keys.events, {"event": "progress", "jobId": self.job_id, "data": progress},
+                  maxlen=self.stream_maxlen, approximate=True)
+
+
+def read_job_events(client, keys, job_id, last_id="0-0", block=None, count=None):
+    """
+    Read events appended to a job's stream after `last_id`.
+
+    Args:
+        client: Redis client
+        keys: QueueKeys of the job's queue
+        job_id: The ID of the job
+        last_id: Stream id of the last event already seen ("0-0" reads from the start)
+        block: Milliseconds to block waiting for new events, or None to return immediately
+        count: Maximum number of events to return
+
+    Returns:
+        List of (event id, fields) tuples with str keys and values
+    """
+    response = client.xread({keys.job(job_id, "events"): last_id}, count=count, block=block)
+    events = []
+    for _stream, entries in response or []:
+        for event_id, fields in entries:
+            events.append((
+                event_id.decode() if isinstance(event_id, bytes) else event_id,
+                {
+                    (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+                    for k, v in fields.items()
+                },
+            ))
+    return events
+
+
+class AsyncProgressPublisher(ProgressPublisher):
+    """
+    `ProgressPublisher` for `redis.asyncio` clients
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.flush_lock = asyncio.Lock()
+
+    async def publish(self, progress_data):
+        """
+        Record a progress update, writing it if the interval has elapsed
+        """
+        if self._buffer(progress_data):
+            await self.flush()
+
+    async def flush(self):
+        """
+        Write the latest progress and buffered log lines in one round trip
+        """
+        async with self.flush_lock:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            try:
+                pipe = self.client.pipeline(transaction=False)
+                self._queue_writes(pipe, *batch)
+                with self.instrument("progress", self.job_id):
+                    await pipe.execute()
+                logger.debug(f"Flushed progress for job {self.job_id}: {batch[0]} (+{len(batch[1])} log lines)")
+            except Exception as e:
+                logger.error(f"Failed to update progress for job {self.job_id}: {str(e)}")
+
+
+class AsyncBullProgressPublisher(BullProgressPublisher, AsyncProgressPublisher):
+    """
+    `BullProgressPublisher` for `redis.asyncio` clients
+    """
@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+
+# Resource kinds a worker advertises capacity tokens for
+RESOURCE_KINDS = ("cpu", "memoryMb", "accelerator")
+
+# Needs of a job that declares nothing and has no job type default
+BASE_NEEDS = {"cpu": 1, "memoryMb": 0, "accelerator": 0}
+
+# Default needs by job type, overridden by measured estimates and by `data.resources` of a job
+JOB_TYPE_NEEDS = {
+    "asset-import": {"cpu": 1, "memoryMb": 512},
+    "asset-tag": {"cpu": 1, "memoryMb": 128},
+    "asset-decimate": {"cpu": 2, "memoryMb": 2048},
+    "asset-export": {"cpu": 1, "memoryMb": 1024},
+    "asset-pipeline": {"cpu": 2, "memoryMb": 2048},
+}
+
+# Default needs of jobs in a resource class lane, e.g. the `gpu` step queue
+LANE_NEEDS = {
+    "gpu": {"accelerator": 1},
+}
+
+
+def available_cpus():
+    """
+    Number of CPUs this process may run on
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def job_needs(job_data, lane=None, estimates=None):
+    """
+    Resources a job needs: the base needs, then the job type's defaults and
+    measured `estimates` (see `usage.usage_estimates`), then its lane's
+    defaults and finally what the job declares in `data.resources`.
+
+    Must stay in line with `job_needs` in the claim script.
+    """
+    needs = dict(BASE_NEEDS)
+    needs.update(JOB_TYPE_NEEDS.get(job_data.get("name"), {}))
+    needs.update((estimates or {}).get(job_data.get("name"), {}))
+    needs.update(LANE_NEEDS.get(lane, {}))
+    data = job_data.get("data")
+    declared = data.get("resources") if isinstance(data, dict) else None
+    if isinstance(declared, dict):
+        needs.update({kind: value for kind, value in declared.items()
+                      if kind in RESOURCE_KINDS and isinstance(value, (int, float))})
+    return needs
+
+
+class ResourcePool:
+    """
+    Capacity tokens of one worker: CPU slots, a memory budget and accelerator
+    slots (zero on CPU-only hosts).
+
+    Claimed jobs hold their needs until they finish. A job only fits while its
+    needs are within what is free. CPU and memory needs larger than the whole
+    capacity are capped at it, so an oversized job still runs once the worker
+    is idle. Accelerator needs are never capped: a host without accelerators
+    does not take jobs that need one. A memory budget of 0 is not enforced.
+    """
+
+    def __init__(self, cpu=None, memory_mb=0, accelerators=0):
+        """
+        Args:
+            cpu: CPU slots (defaults to the number of CPUs this process may run on)
+            memory_mb: Memory budget in MB (0 disables the memory check)
+            accelerators: Accelerator slots
+        """
+        self.capacity = {"cpu": cpu or available_cpus(), "accelerator": accelerators}
+        if memory_mb:
+            self.capacity["memoryMb"] = memory_mb
+        # job id -> tokens held by claimed jobs that have not finished yet
+        self.held = {}
+        # Job type -> needs measured from recent runs, replacing the static defaults
+        self.estimates = {}
+        self.lock = threading.Lock()
+        self.released = threading.Event()
+
+    def charge(self, needs):
+        """
+        Tokens a job with these needs holds, capped as described above
+        """
+        return {kind: needs.get(kind, 0) if kind == "accelerator" else min(needs.get(kind, 0), capacity)
+                for kind, capacity in self.capacity.items()}
+
+    def free(self):
+        with self.lock:
+            free = dict(self.capacity)
+            for charged in self.held.values():
+                for kind, value in charged.items():
+                    free[kind] -= value
+            return free
+
+    def acquire(self, job_id, needs):
+        charged = self.charge(needs)
+        with self.lock:
+            self.held[job_id] = charged
+
+    def release(self, job_id):
+        with self.lock:
+            if self.held.pop(job_id, None) is not None:
+                self.released.set()
+
+    def fits(self, needs):
+        """
+        Whether a job with these needs fits the free tokens, decided like the claim script does
+        """
+        free = self.free()
+        return all(value <= free[kind] for kind, value in self.charge(needs).items())
+
+    def needs(self, job_data, lane=None):
+        """
+        Needs of a job with the measured estimates applied
+        """
+        return job_needs(job_data, lane, self.estimates)
+
+    def claim_argument(self, lanes):
+        """
+        JSON argument of the claim script: free and total capacity, and the
+        default needs by job type (with the measured estimates applied) and by
+        lane (in the order of `lanes`)
+        """
+        return json.dumps({
+            "free": self.free(),
+            "capacity": self.capacity,
+            "base": BASE_NEEDS,
+            "jobTypes": {job_type: {**JOB_TYPE_NEEDS.get(job_type, {}), **self.estimates.get(job_type, {})}
+                         for job_type in {**JOB_TYPE_NEEDS, **self.estimates}},
+            "lanes": [LANE_NEEDS.get(lane, {}) for lane in lanes],
+        })
+
+    def snapshot(self):
+        """
+        Capacity and free tokens, as advertised in `{queue}:capacity`
+        """
+        return {"capacity": self.capacity, "free": self.free(), "jobs": len(self.held)}
@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import tempfile
+import zlib
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Results at least this large (bytes) are compressed before they are stored
+DEFAULT_COMPRESS_THRESHOLD = 64 * 1024
+
+# Results at least this large (bytes) are written to the artifact directory, when one is set
+DEFAULT_OFFLOAD_THRESHOLD = 1024 * 1024
+
+# Default expiry in seconds of result/error, status and progress/event keys (0 keeps them forever)
+DEFAULT_RESULT_TTL = 7 * 24 * 3600
+DEFAULT_STATUS_TTL = 7 * 24 * 3600
+DEFAULT_PROGRESS_TTL = 24 * 3600
+
+IDENTITY = "identity"
+ZLIB = "zlib"
+ZSTD = "zstd"
+# The Redis value is a reference to an artifact file
+REFERENCE = "ref"
+
+CODECS = (ZSTD, ZLIB) if zstandard is not None else (ZLIB,)
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+REFERENCE_PREFIX = b'{"resultRef":'
+
+
+def compress(data, codec):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+
+def decompress(data):
+    """
+    Decompress zstd or zlib data, telling them apart by their header
+    """
+    if data.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("Result is zstd compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def is_compressed(data):
+    # zlib streams start with 0x78, which no JSON document or msgpack map does
+    return data.startswith(ZSTD_MAGIC) or (len(data) > 1 and data[0] == 0x78 and
+                                           (data[0] * 256 + data[1]) % 31 == 0)
+
+
+class ResultStore:
+    """
+    Decides how a job result is kept in Redis and for how long.
+
+    Small results are stored as they are, so the TypeScript services read
+    them unchanged. Results of at least `compress_threshold` bytes are
+    compressed. With an `artifact_dir`, results of at least
+    `offload_threshold` bytes are written there compressed, and Redis only
+    keeps a small JSON reference to the file. `read_result` undoes either.
+
+    Result, status and progress keys expire after their TTLs; 0 keeps them.
+    """
+
+    def __init__(self, compress_threshold=DEFAULT_COMPRESS_THRESHOLD, codec=None, artifact_dir=None,
+                 offload_threshold=DEFAULT_OFFLOAD_THRESHOLD, result_ttl=DEFAULT_RESULT_TTL,
+                 status_ttl=DEFAULT_STATUS_TTL, progress_ttl=DEFAULT_PROGRESS_TTL):
+        """
+        Args:
+            compress_threshold: Size in bytes from which results are compressed (0 disables compression)
+            codec: `zstd` or `zlib` (defaults to zstd when installed)
+            artifact_dir: Directory large results are offloaded to (disabled when None)
+            offload_threshold: Size in bytes from which results are offloaded
+            result_ttl: Seconds result and error keys are kept
+            status_ttl: Seconds status keys are kept
+            progress_ttl: Seconds progress keys and job event streams are kept
+        """
+        codec = codec or CODECS[0]
+        if codec not in CODECS:
+            raise ValueError(f"Result codec {codec} is not available (installed: {', '.join(CODECS)})")
+        self.compress_threshold = compress_threshold
+        self.codec = codec
+        self.artifact_dir = artifact_dir
+        self.offload_threshold = offload_threshold
+        self.result_ttl = result_ttl
+        self.status_ttl = status_ttl
+        self.progress_ttl = progress_ttl
+
+    def encode(self, queue_key, job_id, data, content_type):
+        """
+        Turn a serialized result into the value stored in Redis
+
+        Returns:
+            Tuple of (value, content encoding)
+        """
+        encoding = self.encoding_for(len(data))
+        if encoding == REFERENCE:
+            try:
+                return self.offload(queue_key, job_id, data, content_type), REFERENCE
+            except OSError as e:
+                logger.warning(f"[{job_id}] Cannot offload result to {self.artifact_dir}, "
+                               f"keeping it compressed in Redis: {str(e)}")
+                encoding = self.codec
+        if encoding == IDENTITY:
+            return data, IDENTITY
+        return compress(data, self.codec), self.codec
+
+    def encoding_for(self, size):
+        """
+        How a result of `size` bytes is stored: `identity`, the codec, or `ref` when it is offloaded
+        """
+        if self.artifact_dir and size >= self.offload_threshold:
+            return REFERENCE
+        if self.compress_threshold and size >= self.compress_threshold:
+            return self.codec
+        return IDENTITY
+
+    def offload(self, queue_key, job_id, data, content_type):
+        """
+        Write a compressed result to the artifact directory and return the reference stored in Redis
+        """
+        directory = os.path.join(self.artifact_dir, queue_key)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{job_id}.result.{self.codec}")
+        # Written under a temporary name so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{job_id}.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(compress(data, self.codec))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return json.dumps({
+            "resultRef": os.path.abspath(path),
+            "contentType": content_type,
+            "contentEncoding": self.codec,
+            "size": len(data),
+        }, separators=(",", ":")).encode()
+
+    def ttl_args(self):
+        return [self.result_ttl, self.status_ttl, self.progress_ttl]
+
+
+def decode_stored(value):
+    """
+    Serialized result from the value stored in Redis: read the referenced file
+    and decompress as needed. The result is in the job's content type.
+    """
+    if value is None:
+        return None
+    if value.startswith(REFERENCE_PREFIX):
+        reference = json.loads(value)
+        with open(reference["resultRef"], "rb") as f:
+            return decompress(f.read())
+    if is_compressed(value):
+        return decompress(value)
+    return value
+
+
+def read_result(client, keys, job_id, serializer=None):
+    """
+    Read and decode a job's result, whatever way it was stored.
+
+    Args:
+        client: Redis client
+        keys: QueueKeys of the job's queue
+        job_id: The ID of the job
+        serializer: Serializer of the job's content type (JSON when None)
+
+    Returns:
+        The result, or None when the job has no (unexpired) result
+    """
+    data = decode_stored(client.get(keys.job(job_id, "result")))
+    if data is None:
+        return None
+    return serializer.loads(data) if serializer else json.loads(data)
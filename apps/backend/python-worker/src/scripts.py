@@ -0,0 +1,90 @@
+import os
+import sys
+
+# Map job types to asset pipeline scripts
+SCRIPT_MAP = {
+    "asset-export": "export.py",
+    "asset-import": "import.py",
+    "asset-decimate": "decimate.py",
+    "asset-tag": "tag.py"
+}
+
+SCRIPT_JOBS = list(SCRIPT_MAP)
+
+
+def get_script_dir():
+    """
+    Get the directory holding the asset pipeline automation scripts
+    """
+    base_dir = os.environ.get("ASSET_PIPELINE_PATH", "../../asset-pipeline")
+    return os.path.join(base_dir, "src/automation")
+
+
+def build_script_command(script_type, params):
+    """
+    Build the command line used to run an asset pipeline script.
+
+    Args:
+        script_type: Type of script to execute (export, import, decimate, tag)
+        params: Parameters to pass to the script
+
+    Returns:
+        List of command line arguments
+    """
+    if script_type not in SCRIPT_MAP:
+        raise ValueError(f"Unknown script type: {script_type}")
+
+    script_path = os.path.join(get_script_dir(), SCRIPT_MAP[script_type])
+
+    # Convert params dictionary to command line arguments
+    cmd = [sys.executable, script_path]
+
+    # Handle different parameter formats for each script type
+    if script_type == "asset-export":
+        cmd.extend([params.get("input"), params.get("output")])
+        if "format" in params:
+            cmd.extend(["--format", params.get("format")])
+        if "quality" in params:
+            cmd.extend(["--quality", str(params.get("quality"))])
+
+    elif script_type == "asset-import":
+        cmd.extend([params.get("source"), params.get("destination")])
+        if "scale" in params:
+            cmd.extend(["--scale", str(params.get("scale"))])
+        if params.get("fix_orientation"):
+            cmd.append("--fix-orientation")
+
+    elif script_type == "asset-decimate":
+        cmd.extend([params.get("input"), params.get("output")])
+        if "reduction" in params:
+            cmd.extend(["--reduction", str(params.get("reduction"))])
+        if params.get("preserve_uvs"):
+            cmd.append("--preserve-uvs")
+
+    elif script_type == "asset-tag":
+        cmd.append(params.get("target"))
+        if "tags" in params and params["tags"]:
+            cmd.extend(["--tags"] + params["tags"])
+        if "category" in params:
+            cmd.extend(["--category", params.get("category")])
+        if params.get("replace"):
+            cmd.append("--replace")
+
+    return cmd
+
+
+def parse_progress(line):
+    """
+    Extract a progress percentage from a script output line.
+
+    Returns:
+        The percentage as an int, or None if the line carries no progress
+    """
+    if "Progress:" not in line or "%" not in line:
+        return None
+    try:
+        progress_text = line.split("Progress:")[1].strip()
+        return int(float(progress_text.split("%")[0].strip()))
+    except Exception:
+        return None
+
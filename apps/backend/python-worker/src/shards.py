@@ -0,0 +1,95 @@
+import itertools
+import zlib
+
+from keys import QueueKeys
+from lua_scripts import QueueScripts
+
+ROUND_ROBIN = "round-robin"
+LEAST_LOADED = "least-loaded"
+SHARD_POLICIES = (ROUND_ROBIN, LEAST_LOADED)
+
+
+def split_urls(redis_url):
+    """
+    Redis URLs of a comma-separated `--redis` value
+    """
+    return [url.strip() for url in redis_url.split(",") if url.strip()]
+
+
+def shard_queue_key(queue_key, index, count, cluster=False):
+    """
+    Key prefix of one shard of a queue.
+
+    A single shard on plain Redis keeps the plain key layout. With more
+    shards, or on a Redis Cluster even with one, every key of shard `index`
+    carries the hash tag `{queue:index}`, e.g. `bull:{jobs:3}:wait` and
+    `{jobs:3}:processing`, so a shard's keys share one cluster slot and its
+    Lua scripts never cross slots.
+    """
+    if count <= 1 and not cluster:
+        return queue_key
+    return f"{{{queue_key}:{index}}}"
+
+
+def shard_index(job_id, count):
+    """
+    Shard a producer pushes a job to: crc32 of the job id modulo the shard count.
+    Clients use the same rule to find a job's keys.
+    """
+    return zlib.crc32(str(job_id).encode()) % count
+
+
+class Shard:
+    """
+    One shard of a queue: its key layout, the Redis client of the node that
+    holds it and the Lua scripts registered on that client
+    """
+
+    def __init__(self, index, client, queue_key):
+        self.index = index
+        self.redis = client
+        self.keys = QueueKeys(queue_key)
+        self.scripts = QueueScripts(client)
+        # Sampled length of the shard's wait lists and processing hash
+        self.waiting = 0
+        self.processing = 0
+
+
+def build_shards(clients, queue_key, count, cluster=False):
+    """
+    Shards of a queue spread over Redis clients round-robin. A cluster client
+    is passed alone (with `cluster`) and routes each shard to the node owning its slot.
+    """
+    count = max(1, int(count))
+    return [Shard(index, clients[index % len(clients)], shard_queue_key(queue_key, index, count, cluster))
+            for index in range(count)]
+
+
+class ShardScheduler:
+    """
+    Decides which shard a claim tries first.
+
+    `round-robin` rotates the starting shard on every claim. `least-loaded`
+    prefers shards with waiting jobs and, among them, the one with the fewest
+    jobs in flight, from the depths sampled on every heartbeat and adjusted by
+    this worker's own claims in between.
+    """
+
+    def __init__(self, shards, policy=ROUND_ROBIN):
+        if policy not in SHARD_POLICIES:
+            raise ValueError(f"Unknown shard policy: {policy}")
+        self.shards = shards
+        self.policy = policy
+        self.rotation = itertools.cycle(range(len(shards)))
+
+    def order(self):
+        start = next(self.rotation)
+        rotated = self.shards[start:] + self.shards[:start]
+        if self.policy == LEAST_LOADED:
+            # Stable sort, so ties keep the rotation
+            rotated.sort(key=lambda shard: (shard.waiting <= 0, shard.processing))
+        return rotated
+
+    def claimed(self, shard, count):
+        shard.waiting -= count
+        shard.processing += count
@@ -0,0 +1,38 @@
+import hashlib
+import json
+
+from scripts import SCRIPT_JOBS
+
+# Job types whose identical submissions share one execution: a job's result only
+# depends on its name and script params
+DERIVED_KEY_JOBS = set(SCRIPT_JOBS) | {"asset-pipeline"}
+
+
+def _normalize(value):
+    # Unset params and params set to null mean the same to the scripts
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def idempotency_key(job_data):
+    """
+    Key under which identical jobs share one execution, or None when the job
+    always runs on its own.
+
+    An `idempotencyKey` in the payload (or in its `data`) is used as given.
+    Otherwise script and pipeline jobs get a key derived from their name and
+    normalized `scriptParams`; jobs asking for a profile never share a run.
+    """
+    data = job_data.get("data") or {}
+    explicit = job_data.get("idempotencyKey") or data.get("idempotencyKey")
+    if explicit:
+        return str(explicit)
+    name = job_data.get("name")
+    if name not in DERIVED_KEY_JOBS or data.get("profile"):
+        return None
+    params = json.dumps(_normalize(data.get("scriptParams") or {}), sort_keys=True, separators=(",", ":"),
+                        default=str)
+    return f"{name}:{hashlib.sha256(params.encode()).hexdigest()[:32]}"
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+from scripts import SCRIPT_MAP, get_script_dir
+
+logger = logging.getLogger(__name__)
+
+# Param holding the input file of each cacheable script type. `asset-tag` only
+# writes metadata next to its target, so it is never cached.
+CACHE_INPUT_PARAMS = {
+    "asset-import": "source",
+    "asset-decimate": "input",
+    "asset-export": "input",
+}
+
+# Params naming where a step writes its artifacts; they are left out of the key
+# so the same work submitted with a different output path still hits
+OUTPUT_PARAMS = {"output", "destination"}
+
+DEFAULT_CACHE_MAX_MB = 10240
+DEFAULT_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+MANIFEST_FILE = "manifest.json"
+
+# Result fields that describe the run that produced an entry rather than its outcome
+RUN_FIELDS = {"logFile", "usage"}
+
+# Script path -> ((mtime, size), content digest), so a script is only re-read after it changed
+_script_digests = {}
+
+
+def output_paths(script_type, params):
+    """
+    Artifact files a script writes for the given params
+    """
+    if script_type == "asset-import":
+        dest_file = os.path.join(params.get("destination") or "", os.path.basename(params.get("source") or ""))
+        return [dest_file, f"{dest_file}.meta"]
+    if script_type in ("asset-decimate", "asset-export"):
+        return [params.get("output")]
+    return []
+
+
+def script_digest(script_type):
+    """
+    Content hash of the script a step runs, so entries made by an older version of it no longer match
+    """
+    path = os.path.join(get_script_dir(), SCRIPT_MAP[script_type])
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _script_digests.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    _script_digests[path] = (version, digest)
+    return digest
+
+
+def path_params(script_type, params):
+    """
+    Paths a step's result may mention that are not part of its cache key: its
+    input file and where it writes its artifacts
+    """
+    input_param = CACHE_INPUT_PARAMS.get(script_type)
+    paths = [params.get(name) for name in sorted(OUTPUT_PARAMS | {input_param}) if name]
+    return ["" if path is None else str(path) for path in paths + output_paths(script_type, params)]
+
+
+def rewrite_paths(value, replacements):
+    """
+    Replace the paths of the run that produced a cache entry with those of the
+    step being served, in every string of a result
+    """
+    replacements = {old: new for old, new in replacements.items() if old and old != new}
+    if not replacements:
+        return value
+    pattern = re.compile("|".join(re.escape(old) for old in sorted(replacements, key=len, reverse=True)))
+
+    def rewrite(item):
+        if isinstance(item, str):
+            return pattern.sub(lambda match: replacements[match.group(0)], item)
+        if isinstance(item, list):
+            return [rewrite(element) for element in item]
+        if isinstance(item, dict):
+            return {key: rewrite(element) for key, element in item.items()}
+        return item
+
+    return rewrite(value)
+
+
+class StepCache:
+    """
+    Content-addressed cache of script step results on local disk.
+
+    Entries are keyed by a hash of the step's input file content, the
+    script's own content and the normalized params (without input and output
+    paths). An entry holds copies of the step's output artifacts and its
+    result dict; on a hit the artifacts are copied to the requested output
+    paths and paths in the result are rewritten to them. The least recently
+    used entries are evicted once the cache exceeds `max_bytes`.
+
+    When a Redis client is given, entries are indexed under
+    `{queue}:cache:{key}` (with the host that holds the artifacts) and
+    hit/miss counters are kept in the `{queue}:cache:stats` hash.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024, client=None, keys=None,
+                 ttl=DEFAULT_CACHE_TTL_SECONDS):
+        """
+        Args:
+            cache_dir: Directory holding the cache entries
+            max_bytes: Size above which least recently used entries are evicted
+            client: Optional Redis client for the index and shared counters
+            keys: QueueKeys used to name the Redis index keys
+            ttl: Expiry of the Redis index entries in seconds
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.client = client
+        self.keys = keys
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def cache_key(self, script_type, params):
+        """
+        Content hash of a step, or None when the step cannot be cached
+        """
+        input_param = CACHE_INPUT_PARAMS.get(script_type)
+        input_path = params.get(input_param) if input_param else None
+        if not input_path or not os.path.isfile(input_path):
+            return None
+
+        digest = hashlib.sha256()
+        digest.update(script_type.encode())
+        digest.update(script_digest(script_type).encode())
+        normalized = {k: v for k, v in params.items() if k not in OUTPUT_PARAMS and k != input_param}
+        digest.update(json.dumps(normalized, sort_keys=True, default=str).encode())
+        with open(input_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _record(self, field):
+        with self.lock:
+            if field == "hits":
+                self.hits += 1
+            else:
+                self.misses += 1
+        if self.client is not None and self.keys is not None:
+            try:
+                self.client.hincrby(self.keys.cache_stats, field, 1)
+            except Exception as e:
+                logger.warning(f"Failed to update step cache stats: {str(e)}")
+
+    def lookup(self, script_type, params):
+        """
+        Return the cached result of a step with its artifacts restored, or None on a miss
+        """
+        try:
+            key = self.cache_key(script_type, params)
+        except OSError as e:
+            logger.warning(f"Cannot hash input of {script_type} step: {str(e)}")
+            return None
+        if key is None:
+            return None
+
+        entry_dir = os.path.join(self.cache_dir, key)
+        manifest_path = os.path.join(entry_dir, MANIFEST_FILE)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            for name, target in zip(manifest["artifacts"], output_paths(script_type, params)):
+                if os.path.dirname(target):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(os.path.join(entry_dir, name), target)
+            # Touch the manifest so eviction sees the entry as recently used
+            os.utime(manifest_path)
+        except (OSError, ValueError, KeyError):
+            self._record("misses")
+            return None
+
+        self._record("hits")
+        replacements = dict(zip(manifest.get("paths", []), path_params(script_type, params)))
+        return {**rewrite_paths(manifest["result"], replacements), "cached": True, "cacheKey": key}
+
+    def store(self, script_type, params, result):
+        """
+        Copy a successful step's artifacts and result into the cache
+        """
+        try:
+            key = self.cache_key(script_type, params)
+        except OSError:
+            return
+        if key is None:
+            return
+
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry_dir):
+            return
+
+        # Build the entry in a temporary directory and rename it into place, so
+        # concurrent lookups never see a partial entry
+        tmp_dir = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        try:
+            os.makedirs(tmp_dir)
+            artifacts = []
+            for index, path in enumerate(output_paths(script_type, params)):
+                name = f"artifact-{index}"
+                shutil.copyfile(path, os.path.join(tmp_dir, name))
+                artifacts.append(name)
+            with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+                # The spilled log and resource usage belong to the run that produced the entry, not to later hits
+                cached_result = {k: v for k, v in result.items() if k not in RUN_FIELDS}
+                json.dump({"scriptType": script_type, "artifacts": artifacts, "result": cached_result,
+                           "paths": path_params(script_type, params), "createdAt": time.time()}, f)
+            os.rename(tmp_dir, entry_dir)
+        except OSError as e:
+            logger.warning(f"Failed to cache {script_type} step: {str(e)}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        if self.client is not None and self.keys is not None:
+            try:
+                self.client.set(self.keys.cache_entry(key),
+                                json.dumps({"host": socket.gethostname(), "scriptType": script_type}),
+                                ex=self.ttl)
+            except Exception as e:
+                logger.warning(f"Failed to index step cache entry {key}: {str(e)}")
+
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_bytes
+        """
+        with self.lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                entry_dir = os.path.join(self.cache_dir, name)
+                manifest_path = os.path.join(entry_dir, MANIFEST_FILE)
+                if name.startswith(".") or not os.path.isfile(manifest_path):
+                    continue
+                size = sum(
+                    os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir)
+                )
+                entries.append((os.path.getmtime(manifest_path), size, name))
+                total += size
+
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+                total -= size
+                if self.client is not None and self.keys is not None:
+                    try:
+                        self.client.delete(self.keys.cache_entry(name))
+                    except Exception:
+                        pass
+                logger.info(f"Evicted step cache entry {name}")
+
+    def stats(self):
+        """
+        Hit/miss counters of this worker
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,411 @@
+import json
+import logging
+import math
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import redis
+
+from keys import QueueKeys
+from lanes import parse_lanes
+from shards import build_shards, split_urls
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+
+# Seconds between two queue samples and scaling decisions
+DEFAULT_SCALE_INTERVAL = 5.0
+
+# Waiting plus running jobs one worker process is expected to keep up with
+DEFAULT_JOBS_PER_WORKER = 2
+
+# Age in ms of the oldest waiting job above which one more worker is started
+DEFAULT_MAX_QUEUE_AGE_MS = 30000
+
+# Seconds the queue must need fewer workers before one is stopped
+DEFAULT_SCALE_DOWN_DELAY = 60.0
+
+# Restart delay of a crashed worker doubles from the base up to the maximum;
+# a worker that stayed up for STABLE_SECONDS resets it
+RESTART_BACKOFF_BASE = 1.0
+RESTART_BACKOFF_MAX = 60.0
+STABLE_SECONDS = 60.0
+
+# Seconds between two checks of the worker processes
+TICK_SECONDS = 0.5
+
+
+def parse_cpu_sets(spec, slots):
+    """
+    Parse CPU sets such as `0-3;4-7` or `0,1;2,3`, or `auto` to split the CPUs
+    this process may use evenly across `slots` workers.
+
+    Returns:
+        List of CPU sets, used round-robin by worker slot; empty when unset
+    """
+    if not spec:
+        return []
+    if spec == "auto":
+        if not hasattr(os, "sched_getaffinity"):
+            raise ValueError("CPU pinning is not supported on this platform")
+        cpus = sorted(os.sched_getaffinity(0))
+        per_slot = max(1, len(cpus) // slots)
+        return [set(cpus[i:i + per_slot]) for i in range(0, per_slot * min(slots, len(cpus)), per_slot)]
+
+    cpu_sets = []
+    for group in spec.split(";"):
+        cpus = set()
+        for item in group.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            first, _, last = item.partition("-")
+            cpus.update(range(int(first), int(last or first) + 1))
+        if cpus:
+            cpu_sets.append(cpus)
+    return cpu_sets
+
+
+class Autoscaler:
+    """
+    Decides how many worker processes the queue needs.
+
+    The target follows the load (waiting plus running jobs) divided by
+    `jobs_per_worker`, and is raised by one above the current count while the
+    oldest waiting job is older than `max_queue_age_ms`. Scale-up is
+    immediate; scale-down happens one worker at a time, and only after the
+    target stayed below the current count for `scale_down_delay` seconds.
+    """
+
+    def __init__(self, min_workers, max_workers, jobs_per_worker=DEFAULT_JOBS_PER_WORKER,
+                 max_queue_age_ms=DEFAULT_MAX_QUEUE_AGE_MS, scale_down_delay=DEFAULT_SCALE_DOWN_DELAY):
+        """
+        Args:
+            min_workers: Worker processes kept running even when the queue is empty
+            max_workers: Upper bound of worker processes
+            jobs_per_worker: Waiting plus running jobs per worker process
+            max_queue_age_ms: Age of the oldest waiting job above which one more worker is started (0 disables)
+            scale_down_delay: Seconds of lower demand before a worker is stopped
+        """
+        if min_workers < 0 or max_workers < max(1, min_workers):
+            raise ValueError(f"Invalid worker bounds: min {min_workers}, max {max_workers}")
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.jobs_per_worker = max(1, jobs_per_worker)
+        self.max_queue_age_ms = max_queue_age_ms
+        self.scale_down_delay = scale_down_delay
+        self.below_since = None
+
+    def target(self, current, waiting, running, oldest_age_ms):
+        """
+        Number of workers the load asks for, within the bounds
+        """
+        wanted = math.ceil((waiting + running) / self.jobs_per_worker)
+        if self.max_queue_age_ms and oldest_age_ms is not None and oldest_age_ms > self.max_queue_age_ms:
+            wanted = max(wanted, current + 1)
+        return min(self.max_workers, max(self.min_workers, wanted))
+
+    def decide(self, current, waiting, running, oldest_age_ms, now=None):
+        """
+        Number of workers to run after this sample
+        """
+        now = time.monotonic() if now is None else now
+        target = self.target(current, waiting, running, oldest_age_ms)
+        if target >= current:
+            self.below_since = None
+            return target
+        if self.below_since is None:
+            self.below_since = now
+        if now - self.below_since < self.scale_down_delay:
+            return current
+        # Restart the delay so the next worker is stopped one delay later at the earliest
+        self.below_since = now
+        return current - 1
+
+
+class _Child:
+    """
+    One worker slot: its process and its restart state
+    """
+
+    def __init__(self, slot):
+        self.slot = slot
+        self.process = None
+        self.started_at = None
+        self.failures = 0
+        self.restart_at = None
+        self.stopping = False
+
+
+class Supervisor:
+    """
+    Runs worker.py processes and keeps their number between min and max
+    according to the queue's depth and the age of its oldest job.
+
+    Workers are stopped with SIGTERM, so they go through their own
+    `handle_shutdown` and finish their in-flight jobs before exiting. A worker
+    that exits without being asked to is restarted with exponential backoff.
+    """
+
+    def __init__(self, redis_url, queue_key, autoscaler, worker_args=(), lanes=None, cpu_sets=None,
+                 metrics_port=0, scale_interval=DEFAULT_SCALE_INTERVAL, shards=1, cluster=False):
+        """
+        Args:
+            redis_url: Redis connection URL
+            queue_key: Queue key prefix
+            autoscaler: Autoscaler deciding the number of workers
+            worker_args: Extra command line arguments for every worker
+            lanes: List of (lane, weight) tuples whose wait lists are sampled
+            cpu_sets: Optional list of CPU sets workers are pinned to, by slot
+            metrics_port: First metrics port; worker slot N serves on metrics_port + N (0 disables)
+            scale_interval: Seconds between two queue samples
+            shards: Number of shards the queue is split into; all of them are sampled
+            cluster: Whether redis_url points at a Redis Cluster
+        """
+        if cluster:
+            clients = [redis.RedisCluster.from_url(split_urls(redis_url)[0])]
+        else:
+            clients = [redis.from_url(url) for url in split_urls(redis_url)]
+        self.shards = build_shards(clients, queue_key, shards, cluster)
+        self.cluster = cluster
+        self.redis_url = redis_url
+        self.keys = QueueKeys(queue_key)
+        self.autoscaler = autoscaler
+        self.worker_args = list(worker_args)
+        self.lanes = lanes or parse_lanes("")
+        self.cpu_sets = cpu_sets or []
+        self.metrics_port = metrics_port
+        self.scale_interval = scale_interval
+        # slot -> _Child, for running workers and crashed ones waiting for their restart
+        self.children = {}
+        self.shutdown_requested = threading.Event()
+
+    def worker_command(self, slot):
+        lanes = ",".join(f"{lane}:{weight:g}" for lane, weight in self.lanes)
+        cmd = [sys.executable, WORKER_SCRIPT, "--redis", self.redis_url, "--queue", self.keys.queue_key,
+               "--lanes", lanes, "--shards", str(len(self.shards))]
+        if self.cluster:
+            cmd.append("--redis-cluster")
+        if self.metrics_port:
+            cmd += ["--metrics-port", str(self.metrics_port + slot)]
+        return cmd + self.worker_args
+
+    def spawn(self, child):
+        """
+        Start the worker process of a slot and pin it to the slot's CPU set
+        """
+        child.process = subprocess.Popen(self.worker_command(child.slot))
+        child.started_at = time.monotonic()
+        child.restart_at = None
+        if self.cpu_sets:
+            cpus = self.cpu_sets[child.slot % len(self.cpu_sets)]
+            try:
+                os.sched_setaffinity(child.process.pid, cpus)
+            except (AttributeError, OSError) as e:
+                logger.warning(f"Cannot pin worker {child.slot} to CPUs {sorted(cpus)}: {str(e)}")
+        logger.info(f"Started worker {child.slot} (pid {child.process.pid})")
+
+    def stop(self, child):
+        """
+        Ask a worker to finish its in-flight jobs and exit
+        """
+        child.stopping = True
+        if child.process and child.process.poll() is None:
+            logger.info(f"Stopping worker {child.slot} (pid {child.process.pid})")
+            child.process.send_signal(signal.SIGTERM)
+
+    def active(self):
+        """
+        Slots that count towards the number of workers: running or waiting to be restarted
+        """
+        return [child for child in self.children.values() if not child.stopping]
+
+    def sample_queue(self):
+        """
+        Sample the queue's load, summed over its shards
+
+        Returns:
+            Tuple of (waiting jobs, running jobs, age in ms of the oldest waiting job or None)
+        """
+        waiting = 0
+        running = 0
+        oldest = None
+        for shard in self.shards:
+            pipe = shard.redis.pipeline(transaction=False)
+            for lane, _ in self.lanes:
+                lane_key = shard.keys.lane(lane)
+                pipe.llen(lane_key)
+                # Producers push on the left and workers claim from the right, so the tail is the oldest job
+                pipe.lindex(lane_key, -1)
+            pipe.hlen(shard.keys.processing)
+            replies = pipe.execute()
+
+            running += replies[-1]
+            for depth, tail in zip(replies[0:-1:2], replies[1:-1:2]):
+                waiting += depth
+                if not tail:
+                    continue
+                try:
+                    timestamp = json.loads(tail).get("timestamp")
+                except (ValueError, AttributeError):
+                    continue
+                if isinstance(timestamp, (int, float)):
+                    oldest = timestamp if oldest is None else min(oldest, timestamp)
+        oldest_age_ms = max(0, int(time.time() * 1000 - oldest)) if oldest is not None else None
+        return waiting, running, oldest_age_ms
+
+    def scale(self):
+        """
+        Sample the queue and start or stop workers to match the autoscaler's decision
+        """
+        try:
+            waiting, running, oldest_age_ms = self.sample_queue()
+        except redis.RedisError as e:
+            logger.error(f"Cannot sample queue {self.keys.queue_key}: {str(e)}")
+            return
+
+        active = self.active()
+        wanted = self.autoscaler.decide(len(active), waiting, running, oldest_age_ms)
+        if wanted == len(active):
+            return
+        logger.info(f"Scaling from {len(active)} to {wanted} workers "
+                    f"(waiting {waiting}, running {running}, oldest {oldest_age_ms} ms)")
+        if wanted > len(active):
+            for _ in range(wanted - len(active)):
+                slot = next(slot for slot in range(len(self.children) + 1) if slot not in self.children)
+                child = self.children[slot] = _Child(slot)
+                self.spawn(child)
+        else:
+            # Stop the most recently started workers first
+            newest = sorted(active, key=lambda child: child.started_at or 0, reverse=True)
+            for child in newest[:len(active) - wanted]:
+                self.stop(child)
+
+    def check_children(self):
+        """
+        Reap exited workers and restart crashed ones once their backoff has passed
+        """
+        now = time.monotonic()
+        for slot, child in list(self.children.items()):
+            if child.process is not None and child.process.poll() is None:
+                continue
+
+            if child.process is not None:
+                code = child.process.returncode
+                child.process = None
+                if child.stopping or self.shutdown_requested.is_set():
+                    logger.info(f"Worker {slot} exited with code {code}")
+                    del self.children[slot]
+                    continue
+                if now - child.started_at >= STABLE_SECONDS:
+                    child.failures = 0
+                delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_BASE * 2 ** child.failures)
+                child.failures += 1
+                child.restart_at = now + delay
+                logger.warning(f"Worker {slot} exited unexpectedly with code {code}, restarting in {delay:g}s")
+
+            if child.stopping:
+                del self.children[slot]
+            elif child.restart_at is not None and now >= child.restart_at:
+                self.spawn(child)
+
+    def handle_shutdown(self, signum, frame):
+        """
+        Handle shutdown signals: stop every worker gracefully and exit once they are gone
+        """
+        logger.info(f"Received shutdown signal {signum}, stopping {len(self.children)} workers")
+        self.shutdown_requested.set()
+
+    def start(self):
+        """
+        Run the supervisor until a shutdown signal is received and all workers have exited
+        """
+        signal.signal(signal.SIGINT, self.handle_shutdown)
+        signal.signal(signal.SIGTERM, self.handle_shutdown)
+
+        logger.info(f"Supervising {self.autoscaler.min_workers}-{self.autoscaler.max_workers} workers "
+                    f"on queue {self.keys.queue_key}")
+        next_scale = 0
+        while not self.shutdown_requested.is_set():
+            self.check_children()
+            if time.monotonic() >= next_scale:
+                self.scale()
+                next_scale = time.monotonic() + self.scale_interval
+            self.shutdown_requested.wait(TICK_SECONDS)
+
+        for child in list(self.children.values()):
+            self.stop(child)
+        for child in list(self.children.values()):
+            if child.process is not None:
+                child.process.wait()
+        self.check_children()
+        logger.info("Supervisor stopped")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Asset Pipeline Worker supervisor. Arguments it does not know are passed on to every worker.'
+    )
+    parser.add_argument('--redis',
+                        default=f"redis://{os.environ.get('REDIS_HOST', 'localhost')}:{os.environ.get('REDIS_PORT', '6379')}",
+                        help='Redis connection URL, or a comma-separated list of nodes the queue shards are spread over')
+    parser.add_argument('--queue', default=os.environ.get('JOB_QUEUE_NAME', 'local-job-queue'),
+                        help='Redis queue key prefix')
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('QUEUE_SHARDS', '1')),
+                        help='Number of shards the queue is split into, passed on to the workers and sampled for scaling')
+    parser.add_argument('--redis-cluster', action='store_true',
+                        default=os.environ.get('REDIS_CLUSTER', '').lower() in ('1', 'true', 'yes'),
+                        help='Treat --redis as a Redis Cluster node, passed on to the workers')
+    parser.add_argument('--lanes', default=os.environ.get('WORKER_LANES', ''),
+                        help='Priority lanes of the queue with weights, passed on to the workers and sampled for scaling')
+    parser.add_argument('--min-workers', type=int, default=int(os.environ.get('MIN_WORKERS', '1')),
+                        help='Worker processes kept running even when the queue is empty')
+    parser.add_argument('--max-workers', type=int, default=int(os.environ.get('MAX_WORKERS', os.cpu_count() or 1)),
+                        help='Upper bound of worker processes')
+    parser.add_argument('--jobs-per-worker', type=int,
+                        default=int(os.environ.get('JOBS_PER_WORKER', DEFAULT_JOBS_PER_WORKER)),
+                        help='Waiting plus running jobs one worker process is expected to handle')
+    parser.add_argument('--max-queue-age-ms', type=int,
+                        default=int(os.environ.get('MAX_QUEUE_AGE_MS', DEFAULT_MAX_QUEUE_AGE_MS)),
+                        help='Age in ms of the oldest waiting job above which one more worker is started (0 disables)')
+    parser.add_argument('--scale-interval', type=float,
+                        default=float(os.environ.get('SCALE_INTERVAL', DEFAULT_SCALE_INTERVAL)),
+                        help='Seconds between two queue samples')
+    parser.add_argument('--scale-down-delay', type=float,
+                        default=float(os.environ.get('SCALE_DOWN_DELAY', DEFAULT_SCALE_DOWN_DELAY)),
+                        help='Seconds of lower demand before a worker is stopped')
+    parser.add_argument('--cpu-sets', default=os.environ.get('WORKER_CPU_SETS'),
+                        help='CPU sets workers are pinned to by slot, e.g. "0-3;4-7", or "auto" (Linux only)')
+    parser.add_argument('--metrics-port', type=int, default=int(os.environ.get('METRICS_PORT', '0')),
+                        help='First metrics port; worker slot N serves /metrics on this port + N (0 disables)')
+
+    args, worker_args = parser.parse_known_args()
+
+    try:
+        lanes = parse_lanes(args.lanes)
+        autoscaler = Autoscaler(args.min_workers, args.max_workers, jobs_per_worker=args.jobs_per_worker,
+                                max_queue_age_ms=args.max_queue_age_ms, scale_down_delay=args.scale_down_delay)
+        supervisor = Supervisor(
+            args.redis,
+            args.queue,
+            autoscaler,
+            worker_args=worker_args,
+            lanes=lanes,
+            cpu_sets=parse_cpu_sets(args.cpu_sets, args.max_workers),
+            metrics_port=args.metrics_port,
+            scale_interval=args.scale_interval,
+            shards=args.shards,
+            cluster=args.redis_cluster,
+        )
+        supervisor.start()
+    except Exception as e:
+        logger.critical(f"Supervisor failed to start: {str(e)}")
+        sys.exit(1)
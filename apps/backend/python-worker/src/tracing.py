@@ -0,0 +1,196 @@
+import contextlib
+import contextvars
+import cProfile
+import hashlib
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Number of functions listed in the profile summary attached to a job result
+PROFILE_TOP_FUNCTIONS = 40
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# cProfile can only be active once per process (and on Python 3.12+ it sees every
+# thread), so at most one job is profiled at a time
+_profile_lock = threading.Lock()
+
+
+def trace_id_for(job_id):
+    """
+    128-bit trace id derived from a job id, so every span of a job shares it
+    """
+    return hashlib.md5(str(job_id).encode()).hexdigest()
+
+
+class Span:
+    """
+    One timed operation. Spans of a job share its trace id; the parent is the
+    span that was active in the same thread or task, unless given explicitly.
+    """
+
+    def __init__(self, name, job_id=None, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent if parent is not None else _current_span.get()
+        self.job_id = job_id if job_id is not None else (self.parent.job_id if self.parent else None)
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self.discarded = False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def discard(self):
+        """
+        Do not export this span, e.g. a claim that returned no job
+        """
+        self.discarded = True
+
+    def to_dict(self):
+        attributes = dict(self.attributes)
+        if self.job_id is not None:
+            attributes["jobId"] = self.job_id
+        return {
+            "traceId": trace_id_for(self.job_id) if self.job_id is not None else None,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": attributes,
+        }
+
+
+class Tracer:
+    """
+    Records spans as JSON lines, one object per finished span with
+    OTLP-style field names (traceId, spanId, parentSpanId, start/end in ns).
+
+    Without a path the tracer is disabled and `span()` costs one check.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.file = None
+        self.lock = threading.Lock()
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.file = open(path, "a", buffering=1)
+            logger.info(f"Writing trace spans to {path}")
+
+    @property
+    def enabled(self):
+        return self.file is not None
+
+    def current(self):
+        """
+        Span active in the calling thread or task, to pass as parent to spans on other threads
+        """
+        return _current_span.get()
+
+    @contextlib.contextmanager
+    def span(self, name, job_id=None, parent=None, **attributes):
+        """
+        Time the `with` block as a span; yields the Span (or None when disabled)
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        span = Span(name, job_id=job_id, parent=parent, attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            if not span.discarded:
+                self.export(span)
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self.lock:
+            try:
+                self.file.write(line + "\n")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Failed to write trace span: {str(e)}")
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+class JobProfiler:
+    """
+    cProfile capture of the in-process work done while one job runs.
+
+    Script subprocesses are not covered; warm executors and the worker's own
+    code are. Only one job is profiled at a time.
+    """
+
+    def __init__(self, job_id, output_dir=None):
+        self.job_id = job_id
+        self.output_dir = output_dir
+        self.profiler = None
+
+    def start(self):
+        """
+        Start profiling; returns False when another job is already being profiled
+        """
+        if not _profile_lock.acquire(blocking=False):
+            logger.warning(f"[{self.job_id}] Profiler busy with another job, not profiling")
+            return False
+        try:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        except ValueError as e:
+            logger.warning(f"[{self.job_id}] Cannot start profiler: {str(e)}")
+            self.profiler = None
+            _profile_lock.release()
+            return False
+        return True
+
+    def stop(self):
+        """
+        Stop profiling and return the result fields: a text summary of the top
+        functions by cumulative time and the path of the full pstats dump
+        """
+        if self.profiler is None:
+            return {}
+        self.profiler.disable()
+        _profile_lock.release()
+
+        summary = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=summary)
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        fields = {"profile": summary.getvalue()}
+
+        if self.output_dir:
+            try:
+                os.makedirs(self.output_dir, exist_ok=True)
+                path = os.path.join(self.output_dir, f"{self.job_id}-{uuid.uuid4().hex[:8]}.prof")
+                stats.dump_stats(path)
+                fields["profileFile"] = path
+            except OSError as e:
+                logger.warning(f"[{self.job_id}] Cannot write profile dump: {str(e)}")
+        self.profiler = None
+        return fields
@@ -0,0 +1,147 @@
+import asyncio
+import math
+import os
+import subprocess
+import sys
+import time
+import types
+
+from serializers import FAST_JSON
+
+# Default number of recent samples kept per job type in `{queue}:usage:{type}`
+DEFAULT_USAGE_WINDOW = 50
+
+# Samples a job type needs before its measured memory replaces the static default
+MIN_USAGE_SAMPLES = 5
+
+# Percentile of the recent peak RSS samples taken as a job type's memory need
+MEMORY_PERCENTILE = 0.9
+
+# Whether children can be reaped with their resource usage (not on Windows)
+USAGE_SUPPORTED = hasattr(os, "wait4")
+
+# ru_maxrss is in KB on Linux and in bytes on macOS
+RSS_UNIT = 1024 * 1024 if sys.platform == "darwin" else 1024
+
+
+def usage_fields(rusage, wall_seconds):
+    """
+    Resource usage of a finished child, as attached to its step result: user
+    and system CPU seconds, peak RSS in MB, block reads and writes (512-byte
+    units) and wall-clock seconds
+    """
+    return {
+        "cpuUserS": round(rusage.ru_utime, 3),
+        "cpuSystemS": round(rusage.ru_stime, 3),
+        "maxRssMb": round(rusage.ru_maxrss / RSS_UNIT, 1),
+        "blockReads": rusage.ru_inblock,
+        "blockWrites": rusage.ru_oublock,
+        "wallS": round(wall_seconds, 3),
+    }
+
+
+def call_usage(before, after, wall_seconds):
+    """
+    Resource usage of one call in a long-lived process, such as a warm executor,
+    from `resource.getrusage` before and after it. CPU time and block I/O are the
+    call's own. The peak RSS is the process's peak so far: an upper bound of the
+    call's, comparable with the whole-process peak of a child. `maxRssDeltaMb`
+    is how much the call raised it.
+    """
+    usage = usage_fields(types.SimpleNamespace(
+        ru_utime=after.ru_utime - before.ru_utime,
+        ru_stime=after.ru_stime - before.ru_stime,
+        ru_maxrss=after.ru_maxrss,
+        ru_inblock=after.ru_inblock - before.ru_inblock,
+        ru_oublock=after.ru_oublock - before.ru_oublock,
+    ), wall_seconds)
+    usage["maxRssDeltaMb"] = round((after.ru_maxrss - before.ru_maxrss) / RSS_UNIT, 1)
+    return usage
+
+
+def wait_with_usage(process, started):
+    """
+    Wait for a `subprocess.Popen` child and read its resource usage with wait4.
+
+    Args:
+        process: The child process
+        started: `time.monotonic()` just before the child was started
+
+    Returns:
+        Tuple of (return code, usage fields, or None where wait4 is unavailable)
+    """
+    if not USAGE_SUPPORTED:
+        return process.wait(), None
+    try:
+        _pid, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # Already reaped elsewhere; its usage is gone
+        return process.wait(), None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage_fields(rusage, time.monotonic() - started)
+
+
+async def open_pipe_reader(pipe):
+    """
+    asyncio StreamReader over an output pipe of a `subprocess.Popen` child.
+
+    Children are spawned with Popen rather than `asyncio.create_subprocess_exec`
+    where usage is collected, since asyncio's child watcher reaps them with a
+    plain waitpid and their usage would be lost.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    return reader
+
+
+async def spawn_async(cmd):
+    """
+    Start a child whose usage `wait_with_usage` can collect, with its stdout and stderr as StreamReaders
+
+    Returns:
+        Tuple of (process, stdout reader, stderr reader)
+    """
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+    return process, await open_pipe_reader(process.stdout), await open_pipe_reader(process.stderr)
+
+
+def queue_usage_sample(pipe, keys, job_type, usage, window=DEFAULT_USAGE_WINDOW):
+    """
+    Add a run's usage to the rolling samples of its job type, keeping the last `window`
+    """
+    usage_key = keys.usage(job_type)
+    pipe.lpush(usage_key, FAST_JSON.dumps(usage))
+    pipe.ltrim(usage_key, 0, window - 1)
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a non-empty list
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def usage_estimates(samples_by_type):
+    """
+    Measured needs of the job types with enough samples: their memory need is
+    the MEMORY_PERCENTILE of the recent peak RSS, rounded up to whole MB.
+
+    Args:
+        samples_by_type: Job type -> raw samples read from `{queue}:usage:{type}`
+
+    Returns:
+        Job type -> needs overriding the type's defaults (see `resources.job_needs`)
+    """
+    estimates = {}
+    for job_type, samples in samples_by_type.items():
+        peaks = []
+        for raw in samples:
+            try:
+                peaks.append(float(FAST_JSON.loads(raw)["maxRssMb"]))
+            except (ValueError, KeyError, TypeError):
+                continue
+        if len(peaks) >= MIN_USAGE_SAMPLES:
+            estimates[job_type] = {"memoryMb": math.ceil(percentile(peaks, MEMORY_PERCENTILE))}
+    return estimates
@@ -1,230 +1,286 @@
+import functools
+import selectors
 import subprocess
-import sys
 import os
 import logging
 import time
 import json
-import uuid
 import signal
+import threading
 import redis
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from batching import BATCH_POLL_INTERVAL, batch_key
+from checkpoint import resumable_steps
+from lanes import LANE_BLOCK_TIMEOUT
+from log_capture import LineSplitter, LogCapture
+from pipeline import PipelineInterrupted, build_pipeline_steps, run_pipeline
+from progress import ProgressPublisher
+from scripts import SCRIPT_JOBS, build_script_command
+from serializers import negotiate
+from shards import split_urls
+from usage import queue_usage_sample, wait_with_usage
+from worker_core import (GENERIC_JOB_STEPS, WorkerCore, batch_results, generic_output, line_progress,
+                         pipeline_output, pipeline_result, script_error, script_line, script_output, script_result)
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-class Worker:
-    def __init__(self, redis_url="redis://localhost:6379", queue_key="jobs"):
+class Worker(WorkerCore):
+    """
+    Worker running each job on a slot thread, with blocking Redis calls.
+
+    Job handling, claims and the Redis transitions are shared with
+    `AsyncWorker` through `WorkerCore`; this class adds the I/O.
+    """
+
+    publisher_class = ProgressPublisher
+    
+    def __init__(self, *args, **kwargs):
         """
-        Initialize worker with Redis connection
-        
-        Args:
-            redis_url: Redis connection URL
-            queue_key: Base key for job queue in Redis
+        Initialize worker with Redis connection (arguments as for `WorkerCore`)
         """
-        self.worker_id = str(uuid.uuid4())[:8]
-        self.queue_key = queue_key
-        self.redis_url = redis_url
-        self.shutdown_requested = False
+        super().__init__(*args, **kwargs)
         
-        # Connect to Redis
-        try:
-            self.redis = redis.from_url(redis_url)
-            logger.info(f"Worker {self.worker_id} connected to Redis at {redis_url}")
-        except Exception as e:
-            logger.error(f"Failed to connect to Redis: {str(e)}")
-            raise
-
-    def execute_script(self, job_id, script_type, params):
+        # Job slots: a semaphore bounds in-flight jobs, active_jobs maps job id -> slot name
+        self.slots = threading.BoundedSemaphore(self.concurrency)
+        self.active_jobs_lock = threading.Lock()
+        self.prefetch_lock = threading.Lock()
+        
+        if self.cluster:
+            # Scripts run inside pipelines there, which need them loaded on every primary
+            self.shards[0].scripts.load()
+    
+    def connect(self, redis_url, cluster):
+        """
+        One pool per node is shared by all slots; the claim loop holds a single
+        blocking connection and each running slot borrows one on demand. A
+        cluster client keeps a pool for every node it discovers.
+        """
+        if cluster:
+            return [redis.RedisCluster.from_url(split_urls(redis_url)[0], max_connections=self.concurrency + 2)]
+        return [redis.from_url(url, max_connections=self.concurrency + 2) for url in split_urls(redis_url)]
+    
+    def execute_script(self, job_id, script_type, params, on_progress=None):
         """
         Execute one of the asset pipeline scripts based on the job type.
         
+        The script function runs on a warm executor when the pool is enabled and
+        one is idle; otherwise the script is started as a subprocess.
+        
         Args:
             job_id: The ID of the job
             script_type: Type of script to execute (export, import, decimate, tag)
             params: Parameters to pass to the script
+            on_progress: Optional callback(percentage or None, line) receiving the
+                script's progress instead of the job's progress key
         
         Returns:
             Dictionary with execution results
         """
-        # Get the base directory for the asset pipeline scripts
-        base_dir = os.environ.get("ASSET_PIPELINE_PATH", "../../asset-pipeline")
-        script_dir = os.path.join(base_dir, "src/automation")
-        
-        # Map job types to scripts
-        script_map = {
-            "asset-export": "export.py",
-            "asset-import": "import.py",
-            "asset-decimate": "decimate.py",
-            "asset-tag": "tag.py"
-        }
-        
-        if script_type not in script_map:
-            raise ValueError(f"Unknown script type: {script_type}")
-        
-        script_path = os.path.join(script_dir, script_map[script_type])
-        
-        # Convert params dictionary to command line arguments
-        cmd = [sys.executable, script_path]
-        
-        # Handle different parameter formats for each script type
-        if script_type == "asset-export":
-            cmd.extend([params.get("input"), params.get("output")])
-            if "format" in params:
-                cmd.extend(["--format", params.get("format")])
-            if "quality" in params:
-                cmd.extend(["--quality", str(params.get("quality"))])
-                
-        elif script_type == "asset-import":
-            cmd.extend([params.get("source"), params.get("destination")])
-            if "scale" in params:
-                cmd.extend(["--scale", str(params.get("scale"))])
-            if params.get("fix_orientation"):
-                cmd.append("--fix-orientation")
-                
-        elif script_type == "asset-decimate":
-            cmd.extend([params.get("input"), params.get("output")])
-            if "reduction" in params:
-                cmd.extend(["--reduction", str(params.get("reduction"))])
-            if params.get("preserve_uvs"):
-                cmd.append("--preserve-uvs")
-                
-        elif script_type == "asset-tag":
-            cmd.append(params.get("target"))
-            if "tags" in params and params["tags"]:
-                cmd.extend(["--tags"] + params["tags"])
-            if "category" in params:
-                cmd.extend(["--category", params.get("category")])
-            if params.get("replace"):
-                cmd.append("--replace")
+        cmd = build_script_command(script_type, params)
+        # Only the last lines stay in memory; the full log is spilled to a gzip file
+        capture = LogCapture(job_id, script_type, log_dir=self.log_dir, max_lines=self.log_tail_lines)
         
-        logger.info(f"[{job_id}] Executing command: {' '.join(cmd)}")
+        def handle_line(line, is_stderr=False):
+            parsed = script_line(capture, line, is_stderr)
+            if parsed is None:
+                return
         
+            # Stream the line as progress; the publisher coalesces the writes
+            percentage, stripped_line = parsed
+            if on_progress:
+                on_progress(percentage, stripped_line)
+                return
+            self.update_progress(job_id, line_progress(percentage, stripped_line))
+        
+        with self.tracer.span("execute_script", job_id=job_id, scriptType=script_type):
+            return self.run_script(job_id, script_type, params, cmd, capture, handle_line, on_progress)
+    
+    def run_script(self, job_id, script_type, params, cmd, capture, handle_line, on_progress):
+        """
+        Serve a script step from the step cache, a warm executor or a subprocess
+        """
+        if self.step_cache:
+            with self.tracer.span("step_cache.lookup"):
+                cached = self.step_cache.lookup(script_type, params)
+            if cached:
+                message = self.cache_hit(job_id, script_type, cached)
+                if on_progress:
+                    on_progress(100, message)
+                else:
+                    self.update_progress(job_id, {"log": message})
+                return cached
+        
+        usage = {}
         try:
-            # Execute the script and capture output
+            ran = None
+            if self.executor_pool and self.executor_pool.supports(script_type):
+                logger.info(f"[{job_id}] Running {script_type} on a warm executor")
+                with self.tracer.span("script.executor") as span:
+                    ran = self.executor_pool.run(script_type, params, handle_line)
+                    if span and ran is None:
+                        span.discard()
+        
+            if ran is None:
+                ran = self.run_subprocess(job_id, cmd, handle_line)
+            return_code, usage = ran
+            self.record_usage(script_type, usage)
+        
+            if return_code != 0:
+                raise Exception(f"Script execution failed with return code {return_code}")
+        
+            capture.close()
+            result = script_result(capture, return_code, usage)
+            if self.step_cache:
+                self.step_cache.store(script_type, params, result)
+            return result
+        
+        except Exception as e:
+            logger.exception(f"[{job_id}] Error executing script {script_type}")
+            capture.close()
+            return script_error(capture, str(e), usage)
+    
+    def run_subprocess(self, job_id, cmd, handle_line):
+        """
+        Run a script in a fresh interpreter, passing each output line to handle_line.
+        
+        stdout and stderr are read as they are written, so a script that fills
+        one pipe while we wait on the other cannot deadlock. The process is
+        reaped with wait4 to read its CPU time, peak RSS and block I/O.
+        
+        Returns:
+            Tuple of (process return code, usage fields or None, see `usage.usage_fields`)
+        """
+        logger.info(f"[{job_id}] Executing command: {' '.join(cmd)}")
+        
+        # Execute the script and capture output
+        started = time.monotonic()
+        with self.tracer.span("script.spawn"):
             process = subprocess.Popen(
                 cmd, 
                 stdout=subprocess.PIPE, 
                 stderr=subprocess.PIPE,
-                text=True
+                bufsize=0
             )
-            
-            # Process output in real-time and update progress
-            stdout_lines = []
-            for line in process.stdout:
-                stripped_line = line.strip()
-                stdout_lines.append(stripped_line)
-                logger.info(f"[{job_id}] {stripped_line}")
-                
-                # Try to extract progress percentage from the output
-                if "Progress:" in line and "%" in line:
-                    try:
-                        progress_text = line.split("Progress:")[1].strip()
-                        percentage = int(float(progress_text.split("%")[0].strip()))
-                        self.update_progress(job_id, {"percentage": percentage, "log": stripped_line})
-                    except Exception:
-                        pass
-            
-            # Wait for process to complete and get return code
-            return_code = process.wait()
-            
-            # Process any remaining stderr output
-            stderr_output = process.stderr.read()
-            if stderr_output:
-                for line in stderr_output.splitlines():
-                    stdout_lines.append(f"ERROR: {line.strip()}")
-                    logger.error(f"[{job_id}] {line.strip()}")
-            
-            if return_code != 0:
-                raise Exception(f"Script execution failed with return code {return_code}")
-                
-            return {
-                "success": True,
-                "output": stdout_lines,
-                "return_code": return_code
-            }
-            
-        except Exception as e:
-            logger.exception(f"[{job_id}] Error executing script {script_type}")
-            return {
-                "success": False,
-                "error": str(e),
-                "output": stdout_lines if 'stdout_lines' in locals() else []
-            }
-
+        
+        with self.tracer.span("script.run", pid=process.pid):
+            self.read_output(process, handle_line)
+        
+        # Wait for process to complete and get return code
+        with self.tracer.span("script.wait"):
+            return wait_with_usage(process, started)
+    
+    def read_output(self, process, handle_line):
+        """
+        Read a process's stdout and stderr until both are closed
+        """
+        if os.name == "nt":
+            # Pipes cannot be selected on Windows; drain stderr on a helper thread instead
+            stderr_reader = threading.Thread(target=self.read_stream, args=(process.stderr, handle_line, True),
+                                             daemon=True)
+            stderr_reader.start()
+            self.read_stream(process.stdout, handle_line, False)
+            stderr_reader.join()
+        else:
+            splitters = {False: LineSplitter(), True: LineSplitter()}
+            with selectors.DefaultSelector() as selector:
+                selector.register(process.stdout, selectors.EVENT_READ, False)
+                selector.register(process.stderr, selectors.EVENT_READ, True)
+                while selector.get_map():
+                    for key, _ in selector.select():
+                        is_stderr = key.data
+                        chunk = os.read(key.fd, 65536)
+                        if chunk:
+                            lines = splitters[is_stderr].feed(chunk)
+                        else:
+                            selector.unregister(key.fileobj)
+                            lines = splitters[is_stderr].close()
+                        for line in lines:
+                            handle_line(line, is_stderr=is_stderr)
+    
+    @staticmethod
+    def read_stream(stream, handle_line, is_stderr):
+        """
+        Read a pipe until EOF, passing each line to handle_line
+        """
+        splitter = LineSplitter()
+        for chunk in iter(lambda: stream.read(65536), b""):
+            for line in splitter.feed(chunk):
+                handle_line(line, is_stderr=is_stderr)
+        for line in splitter.close():
+            handle_line(line, is_stderr=is_stderr)
+    
     def execute_pipeline(self, job_id, params):
         """
-        Execute a full asset pipeline by running the scripts in sequence
+        Execute an asset pipeline as a graph of steps.
+        
+        Steps whose dependencies have completed run concurrently (up to
+        `maxParallelSteps` from the params, or the worker's pipeline parallelism),
+        and the job's progress is the steps' progress weighted by their cost.
         """
         logger.info(f"[{job_id}] Starting asset pipeline execution")
         results = {}
         
         try:
-            # Step 1: Import
-            logger.info(f"[{job_id}] Step 1/4: Importing asset")
-            self.update_progress(job_id, {"percentage": 5, "log": "Step 1/4: Importing asset..."})
-            
-            import_params = params.get("import", {})
-            import_result = self.execute_script(job_id, "asset-import", import_params)
-            if not import_result.get("success", False):
-                raise Exception(f"Import step failed: {import_result.get('error', 'Unknown error')}")
-                
-            results["import"] = import_result
-            self.update_progress(job_id, {"percentage": 25, "log": "Import step completed"})
-                
-            # Step 2: Tag
-            logger.info(f"[{job_id}] Step 2/4: Tagging asset")
-            self.update_progress(job_id, {"percentage": 30, "log": "Step 2/4: Tagging asset..."})
-            
-            tag_params = params.get("tag", {})
-            tag_result = self.execute_script(job_id, "asset-tag", tag_params)
-            if not tag_result.get("success", False):
-                raise Exception(f"Tag step failed: {tag_result.get('error', 'Unknown error')}")
-                
-            results["tag"] = tag_result
-            self.update_progress(job_id, {"percentage": 50, "log": "Tag step completed"})
-            
-            # Step 3: Decimate
-            logger.info(f"[{job_id}] Step 3/4: Decimating model")
-            self.update_progress(job_id, {"percentage": 55, "log": "Step 3/4: Decimating model..."})
-            
-            decimate_params = params.get("decimate", {})
-            decimate_result = self.execute_script(job_id, "asset-decimate", decimate_params)
-            if not decimate_result.get("success", False):
-                raise Exception(f"Decimate step failed: {decimate_result.get('error', 'Unknown error')}")
-                
-            results["decimate"] = decimate_result
-            self.update_progress(job_id, {"percentage": 75, "log": "Decimate step completed"})
-            
-            # Step 4: Export
-            logger.info(f"[{job_id}] Step 4/4: Exporting final asset")
-            self.update_progress(job_id, {"percentage": 80, "log": "Step 4/4: Exporting final asset..."})
-            
-            export_params = params.get("export", {})
-            export_result = self.execute_script(job_id, "asset-export", export_params)
-            if not export_result.get("success", False):
-                raise Exception(f"Export step failed: {export_result.get('error', 'Unknown error')}")
-                
-            results["export"] = export_result
-            self.update_progress(job_id, {"percentage": 95, "log": "Export step completed"})
-            
+            steps = build_pipeline_steps(params)
+            max_parallel = int(params.get("maxParallelSteps", self.pipeline_parallelism))
+        
+            completed = self.load_checkpoint(job_id, steps)
+            if completed:
+                self.update_progress(job_id, self.resumed_steps(job_id, steps, completed))
+        
+            job_span = self.tracer.current()
+        
+            def run_step(step, pipeline_run):
+                with self.tracer.span("pipeline.step", job_id=job_id, parent=job_span,
+                                      stepId=step["id"], stepType=step["type"]):
+                    return run_traced_step(step, pipeline_run)
+        
+            def run_traced_step(step, pipeline_run):
+                step_id = step["id"]
+                logger.info(f"[{job_id}] Starting step {step_id} ({step['type']})")
+                self.update_progress(job_id, {
+                    "percentage": pipeline_run.step_progress(step_id, None),
+                    "log": f"Starting step {step_id}..."
+                })
+        
+                def on_progress(percentage, line):
+                    self.update_progress(job_id, {
+                        "percentage": pipeline_run.step_progress(step_id, percentage),
+                        "log": f"[{step_id}] {line}"
+                    })
+        
+                with self.metrics.step_duration.time(step["type"]):
+                    step_result = self.execute_script(job_id, step["type"], step["params"], on_progress=on_progress)
+                if step_result.get("success", False):
+                    self.update_progress(job_id, {
+                        "percentage": pipeline_run.step_progress(step_id, 100),
+                        "log": f"Step {step_id} completed"
+                    })
+                    self.save_checkpoint(job_id, step, step_result)
+                return step_result
+        
+            # On shutdown no new steps start; the job is requeued and resumes from its checkpoint
+            results, error = run_pipeline(steps, run_step, max_parallel, completed=completed,
+                                          should_stop=lambda: self.shutdown_requested)
+            if error:
+                raise Exception(error)
+            self.clear_checkpoint(job_id)
+        
             # Complete pipeline
             logger.info(f"[{job_id}] Pipeline execution completed successfully")
             self.update_progress(job_id, {"percentage": 100, "log": "Pipeline execution completed"})
-            
-            return {
-                "success": True,
-                "message": "Asset pipeline executed successfully",
-                "steps": results
-            }
-            
+        
+            return pipeline_result(results)
+        
+        except PipelineInterrupted:
+            raise
+        
         except Exception as e:
             logger.exception(f"[{job_id}] Pipeline execution failed")
-            return {
-                "success": False,
-                "error": str(e),
-                "steps": results
-            }
-
+            return pipeline_result(results, str(e))
+    
     def process_job(self, job_data):
         """
         Process a job from the queue with locking.
@@ -232,9 +288,24 @@ class Worker:
         job_id = job_data.get("id")
         name = job_data.get("name")
         data = job_data.get("data", {})
-        lock_key = f"{self.queue_key}:{job_id}:lock"
+        slot_name = threading.current_thread().name
         
-        logger.info(f"Processing job {job_id} ({name}) with exclusive lock")
+        if not self.join_flights([job_data]):
+            # Attached to an identical job that is already running
+            return True
+        
+        if not self.lock_job(job_id, slot_name):
+            logger.warning(f"Job {job_id} is locked by another worker, handed it back to its lane")
+            self.flights.pop(job_id, None)
+            return False
+        
+        logger.info(f"Processing job {job_id} ({name}) with exclusive lock on {slot_name}")
+        self.record_queue_wait(job_data)
+        
+        with self.active_jobs_lock:
+            self.active_jobs[job_id] = slot_name
+            self.progress_publishers[job_id] = self.progress_publisher(job_data)
+        self.start_profiler(job_id, data)
         
         try:
             # Log start
@@ -242,220 +313,709 @@ class Worker:
                 job_id,
                 {"percentage": 0, "log": f"Starting job {name} processing from Python worker"},
             )
-            
+        
             # Check if this is a pipeline job
             if name == "asset-pipeline":
                 script_params = data.get("scriptParams", {})
-                
+        
                 if script_params.get("pipeline"):
                     self.update_progress(job_id, {"percentage": 2, "log": "Starting asset pipeline job..."})
-                    
+        
                     result = self.execute_pipeline(job_id, script_params)
-                    
+        
                     if not result.get("success", False):
                         raise Exception(f"Pipeline execution failed: {result.get('error', 'Unknown error')}")
-                    
-                    output_result = {
-                        "message": "Asset pipeline completed successfully",
-                        "pipelineOutput": result,
-                        "processedBy": "python-worker"
-                    }
-                    
-                    self.complete_job(job_id, output_result)
+        
+                    self.complete_job(job_id, pipeline_output(result))
                     return True
-            
+        
             # Proceed with other job types as before
             # Determine if this is a script execution job
-            script_jobs = ["asset-export", "asset-import", "asset-decimate", "asset-tag"]
-            
-            if name in script_jobs:
+            if name in SCRIPT_JOBS:
                 # This is a script job - extract parameters and execute script
                 script_params = data.get("scriptParams", {})
-                
+        
                 # Execute the script
                 self.update_progress(job_id, {"percentage": 10, "log": f"Executing {name} script..."})
-                
+        
                 result = self.execute_script(job_id, name, script_params)
-                
+        
                 if not result.get("success", False):
                     raise Exception(f"Script execution failed: {result.get('error', 'Unknown error')}")
-                    
-                # Update progress based on script output
-                for i, line in enumerate(result.get("output", [])):
-                    progress = min(10 + int(80 * (i+1) / max(len(result.get("output", [])), 1)), 90)
-                    self.update_progress(job_id, {"percentage": progress, "log": line})
-                    
+        
                 # Complete the job with the script's output
-                output_result = {
-                    "message": f"Script {name} completed successfully",
-                    "scriptOutput": result.get("output", []),
-                    "scriptType": name,
-                    "processedBy": "python-worker"
-                }
-                
                 self.update_progress(job_id, {"percentage": 100, "log": "Script execution completed"})
-                self.complete_job(job_id, output_result)
-                
+                self.complete_job(job_id, script_output(name, result))
+        
             else:
                 # Process generic job as before
                 # Simulate work with progress updates
-                for i in range(1, 6):
-                    progress = i * 20
+                for i in range(1, GENERIC_JOB_STEPS + 1):
+                    progress = i * 100 // GENERIC_JOB_STEPS
                     time.sleep(1.0)  # Reduced for faster testing
-
+        
                     log_message = f"Processing step {i}..."
                     logger.info(f"[{job_id}] {log_message}")
-
+        
                     self.update_progress(
                         job_id, {"percentage": progress, "log": log_message}
                     )
-
+        
                 # Complete the job
-                result = {
-                    "message": f"Job {job_id} completed successfully by Python worker",
-                    "processedData": data,
-                    "processorInfo": {
-                        "worker": "python",
-                        "id": self.worker_id,
-                        "timestamp": datetime.utcnow().isoformat(),
-                    },
-                }
-
-                self.complete_job(job_id, result)
-                
+                self.complete_job(job_id, generic_output(job_id, data, self.worker_id))
+        
             return True
-
+        
+        except PipelineInterrupted as e:
+            self.requeue_job(job_id, sorted(e.results))
+            return False
+        
         except Exception as e:
             logger.exception(f"Error processing job {job_id}")
             self.fail_job(job_id, str(e))
             return False
         finally:
             # Always release the lock when done
-            self.redis.delete(lock_key)
+            self.flights.pop(job_id, None)
+            with self.active_jobs_lock:
+                self.active_jobs.pop(job_id, None)
+                publisher = self.progress_publishers.pop(job_id, None)
+            if publisher:
+                publisher.flush()
+            self.discard_profiler(job_id)
+            self.unlock_job(job_id)
             logger.info(f"Released lock for job {job_id}")
-
+    
+    def lock_job(self, job_id, slot_name, pipe=None):
+        """
+        Take the exclusive lock of a claimed job, which expires with its lease.
+        If another worker holds it, the claim is handed back to the job's lane
+        without counting a retry (see `lua_scripts.LOCK_JOB`). With a pipeline
+        the call is only queued on it.
+        
+        Returns:
+            Whether the lock was taken; otherwise another worker is running the job
+        """
+        call = functools.partial(self.shard_for(job_id).scripts.lock_job,
+                                 **self.lock_call(job_id, f"{self.worker_id}:{slot_name}"))
+        if pipe is not None:
+            return call(client=pipe)
+        with self.redis_op("lock", job_id):
+            return call() == 1
+    
+    def unlock_job(self, job_id):
+        """
+        Release the lock of a job this worker ran
+        """
+        shard = self.shard_for(job_id)
+        with self.redis_op("unlock", job_id):
+            shard.redis.delete(shard.keys.job(job_id, "lock"))
+    
+    def execute_batch(self, script_type, jobs, warm_executor):
+        """
+        Execute a script for every job of a batch as one task on the warm
+        executor reserved for it (see `WorkerCore.batch_executor`).
+        
+        Returns:
+            Result of each job, in the shape returned by execute_script
+        """
+        params_list = [job.get("data", {}).get("scriptParams", {}) for job in jobs]
+        captures = [LogCapture(job.get("id"), script_type, log_dir=self.log_dir, max_lines=self.log_tail_lines)
+                    for job in jobs]
+        
+        def handle_line(index, line, is_stderr=False):
+            script_line(captures[index], line, is_stderr)
+        
+        logger.info(f"Running a batch of {len(jobs)} {script_type} job(s) on a warm executor")
+        with self.tracer.span("script.executor_batch", scriptType=script_type, jobs=len(jobs)):
+            return_codes, usages = self.executor_pool.run_batch(warm_executor, script_type, params_list, handle_line)
+        self.record_usage(script_type, *usages)
+        
+        return batch_results(captures, return_codes, usages)
+    
+    def process_batch(self, jobs, warm_executor):
+        """
+        Process compatible jobs as one batch.
+        
+        The script runs for all of them in one task on `warm_executor`, and locking,
+        queue-wait records, completion and unlocking each take one pipelined
+        round trip for the whole batch. Every job still gets its own result
+        or error; intermediate progress is not published.
+        """
+        name = jobs[0].get("name")
+        shard = self.shard_for(jobs[0].get("id"))
+        slot_name = threading.current_thread().name
+        jobs = self.join_flights(jobs)
+        if not jobs:
+            return True
+        
+        pipe = shard.redis.pipeline(transaction=False)
+        for job in jobs:
+            self.lock_job(job.get("id"), slot_name, pipe)
+        with self.redis_op("lock"):
+            jobs = self.locked_jobs(jobs, pipe.execute())
+        if not jobs:
+            return False
+        job_ids = [job.get("id") for job in jobs]
+        
+        logger.info(f"Processing batch of {len(jobs)} {name} job(s) {job_ids} with exclusive locks on {slot_name}")
+        pipe = shard.redis.pipeline(transaction=False)
+        for job in jobs:
+            self.record_queue_wait(job, pipe)
+        with self.active_jobs_lock:
+            for job_id in job_ids:
+                self.active_jobs[job_id] = slot_name
+        
+        try:
+            with self.redis_op("queue_wait"):
+                pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to record queue wait for batch {job_ids}: {str(e)}")
+        
+        try:
+            results = self.execute_batch(name, jobs, warm_executor)
+        
+            # Complete and fail every job of the batch in one round trip
+            pipe = shard.redis.pipeline(transaction=False)
+            for job, result in zip(jobs, results):
+                job_id = job.get("id")
+                if result.get("success", False):
+                    serializer = negotiate(job, self.serializer)
+                    self.queue_final_progress(pipe, job_id, serializer)
+                    output_result = script_output(name, result, batch_size=len(jobs))
+                    shard.scripts.complete_job(client=pipe, **self.complete_job_call(job_id, output_result, serializer))
+                else:
+                    shard.scripts.fail_job(
+                        client=pipe,
+                        **self.fail_job_call(job_id, f"Script execution failed: {result.get('error', 'Unknown error')}")
+                    )
+                self.metrics.job_finished(job_id, completed=result.get("success", False))
+            with self.redis_op("complete"):
+                pipe.execute()
+        
+            completed = sum(1 for result in results if result.get("success", False))
+            logger.info(f"Batch of {len(jobs)} {name} job(s) finished: {completed} completed, "
+                        f"{len(jobs) - completed} failed")
+            return True
+        
+        except Exception as e:
+            logger.exception(f"Error processing batch {job_ids}")
+            for job_id in job_ids:
+                self.fail_job(job_id, str(e))
+            return False
+        finally:
+            with self.active_jobs_lock:
+                for job_id in job_ids:
+                    self.active_jobs.pop(job_id, None)
+                    self.flights.pop(job_id, None)
+            with self.redis_op("unlock"):
+                shard.redis.delete(*[shard.keys.job(job_id, "lock") for job_id in job_ids])
+            logger.info(f"Released locks for batch {job_ids}")
+    
     def get_next_job(self):
         """
-        Get the next job from the Redis queue
+        Claim the next job from the Redis queue.
+        
+        Jobs prefetched by an earlier claim are served first. Otherwise a single
+        Lua call moves up to `prefetch` payloads straight into the processing
+        hash, trying the lanes in the order the scheduler picks; extra jobs are
+        kept in a local buffer. When every lane is empty we block with BLMOVE
+        on a hand-off list owned by this worker and move the payload into the
+        processing hash from there, so a claimed job is always recorded in
+        Redis and the caller never needs to sleep between polls. With several
+        lanes or shards the block only watches the first lane of one shard and
+        returns after a short timeout, so the others are polled again soon.
         """
-        # Get a job from pending queue
-        raw_data = self.redis.brpoplpush(
-            f"bull:{self.queue_key}:wait",
-            f"bull:{self.queue_key}:processing",
-            timeout=1
-        )
+        job = self.take_prefetched()
+        if job:
+            return job
+        
+        # Cleared before the claim so a job finishing after it wakes up the wait below
+        self.resources.released.clear()
+        claimed, lanes, shard = self.claim(self.prefetch)
         
-        if not raw_data:
+        if self.all_deferred(claimed):
+            # Jobs are waiting but none fits the free capacity: wait for a running job to release its tokens
+            self.resources.released.wait(LANE_BLOCK_TIMEOUT)
             return None
         
-        # Parse the job data
-        try:
-            return json.loads(raw_data)
-        except json.JSONDecodeError:
-            logger.error(f"Failed to parse job data: {raw_data}")
-            # Return the job to the pending queue
-            self.redis.rpush(f"{self.queue_key}:pending", raw_data)
-            # Remove from processing queue
-            self.redis.lrem(f"{self.queue_key}:processing", 1, raw_data)
+        if not claimed:
+            lanes, shard, lane_key, claiming_key, timeout = self.block_target()
+            with self.redis_op("block") as span:
+                moved = shard.redis.blmove(lane_key, claiming_key, timeout, src="RIGHT", dest="LEFT")
+                # Idle blocks would flood the trace
+                if span and not moved:
+                    span.discard()
+            if not moved:
+                return None
+            with self.redis_op("claim"):
+                claimed = shard.scripts.claim_jobs(**self.handoff_call(shard, lanes, lane_key, claiming_key))
+            if claimed and claimed[0] == b"deferred":
+                # The job does not fit the free capacity: put it back at the head of its
+                # lane and give running jobs a moment to release their tokens
+                with self.redis_op("defer"):
+                    shard.redis.lmove(claiming_key, lane_key, "RIGHT", "RIGHT")
+                self.resources.released.wait(timeout)
+                return None
+        
+        jobs = self.accept_claimed(claimed, lanes, shard)
+        if not jobs:
             return None
+        
+        self.keep_prefetched(jobs[1:])
+        return jobs[0]
+    
+    def claim(self, count):
+        """
+        Move up to `count` jobs into the processing hash of one shard without
+        blocking, trying the shards in the order the shard scheduler picks and
+        each shard's lanes in the order the lane scheduler picks
+        
+        Returns:
+            Tuple of (raw claim reply, lanes tried, shard the reply came from)
+        """
+        lanes = self.lanes.order()
+        deferred = None
+        for shard in self.shard_scheduler.order():
+            with self.redis_op("claim") as span:
+                claimed = shard.scripts.claim_jobs(**self.claim_call(shard, lanes, count))
+                # Empty polls would flood the trace
+                if span and not claimed:
+                    span.discard()
+            if any(status != b"deferred" for status in claimed[::3]):
+                return claimed, lanes, shard
+            # Only jobs that do not fit: another shard may have some that do
+            if claimed and deferred is None:
+                deferred = (claimed, lanes, shard)
+        return deferred or ([], lanes, self.shards[0])
+    
+    def collect_batch(self, job_data):
+        """
+        Gather up to `max_batch` jobs that can run in one batch with `job_data`.
+        
+        Compatible jobs are taken from the prefetch buffer first. While the batch
+        is short, more jobs are claimed until the batch window closes; claimed
+        jobs that do not fit stay prefetched, and claiming stops once the buffer
+        holds a batch worth of them. Every job keeps its capacity tokens until
+        the batch finishes, so a batch only grows as far as the free capacity
+        allows.
+        
+        Returns:
+            List of jobs starting with `job_data`
+        """
+        key = batch_key(job_data)
+        if self.max_batch <= 1 or key is None:
+            return [job_data]
+        
+        batch = [job_data]
+        deadline = time.monotonic() + self.batch_window
+        while (remaining := self.fill_batch(batch, key, deadline)) is not None:
+            try:
+                claimed, lanes, shard = self.claim(self.max_batch - len(batch))
+                jobs = self.accept_claimed(claimed, lanes, shard)
+            except Exception as e:
+                logger.error(f"Failed to claim more jobs for a batch: {str(e)}")
+                break
+            if jobs:
+                self.keep_prefetched(jobs)
+            else:
+                time.sleep(min(remaining, BATCH_POLL_INTERVAL))
+        return batch
+    
+    def release_prefetched(self):
+        """
+        Give prefetched jobs that were never started back to the queue
+        """
+        for shard, shard_job_ids in self.drain_prefetched().items():
+            try:
+                # Released last-first so the next job in line is popped first again
+                released = shard.scripts.release_jobs(**self.release_call(shard, shard_job_ids[::-1]))
+                logger.info(f"Returned {released} prefetched job(s) to {shard.keys.wait}")
+            except Exception as e:
+                logger.error(f"Failed to return prefetched jobs {shard_job_ids}: {str(e)}")
+    
+    def record_queue_wait(self, job_data, pipe=None):
+        """
+        Record how long a job waited in its lane: a `claimed` event in the job's
+        event stream and the lane's counters in `{queue}:lane-stats`. With a
+        pipeline the writes are only queued on it.
+        """
+        job_id = job_data.get("id")
+        lane, wait_ms = job_data.get("lane", self.lanes.names[0]), None
+        try:
+            queued = pipe is not None
+            pipe = pipe if queued else self.shard_for(job_id).redis.pipeline(transaction=False)
+            lane, wait_ms = self.queue_wait_writes(pipe, job_data)
+            if not queued:
+                with self.redis_op("queue_wait", job_id):
+                    pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to record queue wait for job {job_id}: {str(e)}")
+        
+        self.job_started(job_data, lane, wait_ms)
     
     def update_progress(self, job_id, progress_data):
         """
-        Update job progress in Redis
+        Update job progress in Redis.
+        
+        While the job is running the update goes through its coalescing
+        publisher; otherwise it is written directly.
         """
+        publisher = self.progress_publishers.get(job_id)
+        if publisher:
+            publisher.publish(progress_data)
+            return
+        
         try:
-            progress_key = f"{self.queue_key}:{job_id}:progress"
-            self.redis.set(progress_key, json.dumps(progress_data))
+            shard = self.shard_for(job_id)
+            progress_key = shard.keys.job(job_id, "progress")
+            shard.redis.set(progress_key, self.serializer.dumps(progress_data),
+                            ex=self.result_store.progress_ttl or None)
             logger.debug(f"Updated progress for job {job_id}: {progress_data}")
         except Exception as e:
             logger.error(f"Failed to update progress for job {job_id}: {str(e)}")
     
+    def flush_progress(self, job_id):
+        """
+        Write any coalesced progress for a job that is still pending
+        """
+        publisher = self.progress_publishers.get(job_id)
+        if publisher:
+            publisher.flush()
+    
+    def flush_progress_loop(self, stop_event):
+        """
+        Periodically write progress that has been held back by coalescing, so a
+        job that goes quiet after an update still shows its latest state
+        """
+        while not stop_event.wait(self.progress_interval):
+            with self.active_jobs_lock:
+                publishers = list(self.progress_publishers.values())
+            for publisher in publishers:
+                if publisher.is_due():
+                    publisher.flush()
+    
+    def heartbeat(self):
+        """
+        Extend the leases and lock keys of the jobs this worker holds, active
+        and prefetched, and record the worker itself as alive on every shard
+        """
+        lost = []
+        capacity = json.dumps(self.resources.snapshot())
+        for shard, shard_job_ids in self.held_jobs().items():
+            with self.redis_op("heartbeat"):
+                lost += shard.scripts.extend_leases(**self.extend_call(shard, shard_job_ids))
+                pipe = shard.redis.pipeline(transaction=False)
+                self.queue_registration(pipe, shard, capacity)
+                pipe.execute()
+        if lost:
+            self.forget_lost(lost)
+    
+    def reap_expired(self):
+        """
+        Requeue jobs whose lease expired, failing those out of retries, on every shard
+        """
+        for shard in self.shards:
+            with self.redis_op("reap"):
+                requeued, failed, recovered = shard.scripts.reap_expired(**self.reap_call(shard))
+            self.log_reaped(shard, requeued, failed, recovered)
+    
+    def sample_queue_depths(self):
+        """
+        Sample the length of every lane's wait list and of the processing hash
+        into the metrics, summed over the shards, and into each shard's load
+        """
+        depths = {}
+        for shard in self.shards:
+            pipe = shard.redis.pipeline(transaction=False)
+            self.queue_depth_reads(pipe, shard)
+            with self.redis_op("sample"):
+                depths[shard] = pipe.execute()
+        self.record_depths(depths)
+    
+    def record_usage(self, script_type, *usages):
+        """
+        Add the resource usage of script runs to the rolling samples of their type
+        """
+        usages = [usage for usage in usages if self.observe_usage(script_type, usage)]
+        if not usages:
+            return
+        shard = self.shards[0]
+        try:
+            pipe = shard.redis.pipeline(transaction=False)
+            for usage in usages:
+                queue_usage_sample(pipe, shard.keys, script_type, usage, self.usage_window)
+            with self.redis_op("usage"):
+                pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to record resource usage of {script_type}: {str(e)}")
+    
+    def refresh_usage_estimates(self):
+        """
+        Replace the static memory needs of script job types with the peaks
+        measured by their recent runs (see `usage.usage_estimates`), so claims
+        that would overrun the worker's memory budget are refused
+        """
+        if not self.usage_window:
+            return
+        pipe = self.shards[0].redis.pipeline(transaction=False)
+        self.queue_usage_reads(pipe)
+        with self.redis_op("usage"):
+            self.record_usage_estimates(pipe.execute())
+    
+    def heartbeat_loop(self, stop_event):
+        """
+        Heartbeat and reap a few times per lease, so a lease never lapses while
+        its worker is alive and a dead worker's jobs are back in the queue
+        within about one lease duration
+        """
+        while not stop_event.wait(self.lease_ttl / 3):
+            try:
+                self.heartbeat()
+                self.reap_expired()
+                self.sample_queue_depths()
+                self.refresh_usage_estimates()
+            except Exception as e:
+                logger.error(f"Lease heartbeat failed: {str(e)}")
+    
     def complete_job(self, job_id, result_data):
         """
         Mark a job as completed
         """
+        shard = self.shard_for(job_id)
+        self.flush_progress(job_id)
+        self.metrics.job_finished(job_id, completed=True)
+        serializer = self.finished_serializer(job_id)
+        result_data = self.profiled_result(job_id, result_data)
         try:
-            # Get the job data from processing list
-            job_key = f"{self.queue_key}:{job_id}"
-            self.redis.set(f"{job_key}:result", json.dumps(result_data))
-            self.redis.set(f"{job_key}:status", "completed")
-            
-            # Move job from processing to completed queue
-            job_data = None
-            for item in self.redis.lrange(f"{self.queue_key}:processing", 0, -1):
-                try:
-                    job = json.loads(item)
-                    if job.get("id") == job_id:
-                        job_data = item
-                        break
-                except:
-                    pass
-            
-            if job_data:
-                self.redis.lrem(f"{self.queue_key}:processing", 1, job_data)
-                self.redis.lpush(f"{self.queue_key}:completed", job_data)
-            
+            # Store the result and move the job out of the processing hash in one round trip
+            with self.redis_op("complete", job_id):
+                shard.scripts.complete_job(**self.complete_job_call(job_id, result_data, serializer))
+        
             logger.info(f"Job {job_id} completed successfully")
-            
+        
         except Exception as e:
             logger.error(f"Failed to mark job {job_id} as completed: {str(e)}")
     
+    def complete_job_call(self, job_id, result_data, serializer):
+        """
+        Keys and arguments of the complete script storing a job's encoded result
+        """
+        stored, encoding = self.result_store.encode(self.shard_for(job_id).keys.queue_key, job_id,
+                                                    serializer.dumps(result_data), serializer.content_type)
+        return self.complete_call(job_id, stored, encoding, serializer)
+    
     def fail_job(self, job_id, error_message):
         """
         Mark a job as failed
         """
+        shard = self.shard_for(job_id)
+        self.flush_progress(job_id)
+        self.metrics.job_finished(job_id, completed=False)
         try:
-            # Set job status and error
-            job_key = f"{self.queue_key}:{job_id}"
-            self.redis.set(f"{job_key}:status", "failed")
-            self.redis.set(f"{job_key}:error", error_message)
-            
-            # Move job from processing to failed queue
-            job_data = None
-            for item in self.redis.lrange(f"{self.queue_key}:processing", 0, -1):
-                try:
-                    job = json.loads(item)
-                    if job.get("id") == job_id:
-                        job_data = item
-                        break
-                except:
-                    pass
-            
-            if job_data:
-                self.redis.lrem(f"{self.queue_key}:processing", 1, job_data)
-                self.redis.lpush(f"{self.queue_key}:failed", job_data)
-            
+            # Record the error and move the job out of the processing hash in one round trip
+            with self.redis_op("fail", job_id):
+                shard.scripts.fail_job(**self.fail_job_call(job_id, error_message))
+        
             logger.error(f"Job {job_id} failed: {error_message}")
-            
+        
         except Exception as e:
             logger.error(f"Failed to mark job {job_id} as failed: {str(e)}")
     
+    def join_flights(self, jobs):
+        """
+        Register jobs under their idempotency keys (see `single_flight.idempotency_key`).
+        
+        A job whose key already has a job running is attached to that job
+        instead of running: it leaves its slot at once and gets the running
+        job's result or error when that job finishes.
+        
+        Returns:
+            The jobs that still have to run
+        """
+        keyed = self.flight_keys(jobs)
+        if not keyed:
+            return jobs
+        shard = self.shard_for(jobs[0].get("id"))
+        pipe = shard.redis.pipeline(transaction=False)
+        for job, key in keyed:
+            shard.scripts.join_flight(client=pipe, **self.join_flight_call(shard, job, key))
+        try:
+            with self.redis_op("join_flight"):
+                leaders = pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to register idempotency keys, running the jobs on their own: {str(e)}")
+            return jobs
+        return self.settle_flights(jobs, keyed, leaders, shard)
+    
+    def requeue_job(self, job_id, done_steps):
+        """
+        Put a pipeline job interrupted by shutdown back in its lane. Its
+        checkpoint is kept, so the next worker resumes after `done_steps`.
+        """
+        shard = self.shard_for(job_id)
+        self.flush_progress(job_id)
+        self.metrics.job_requeued(job_id)
+        try:
+            pipe = shard.redis.pipeline(transaction=False)
+            shard.scripts.release_jobs(client=pipe, **self.release_call(shard, [job_id]))
+            self.queue_requeued_event(pipe, job_id, done_steps)
+            with self.redis_op("requeue", job_id):
+                pipe.execute()
+        
+            logger.info(f"Job {job_id} requeued after steps {done_steps}")
+        
+        except Exception as e:
+            logger.error(f"Failed to requeue job {job_id}: {str(e)}")
+    
+    def load_checkpoint(self, job_id, steps):
+        """
+        Results of the steps of a pipeline job that a previous attempt
+        completed and that can be skipped (see `checkpoint.resumable_steps`)
+        """
+        shard = self.shard_for(job_id)
+        try:
+            with self.redis_op("checkpoint", job_id):
+                entries = shard.redis.hgetall(shard.keys.job(job_id, "checkpoint"))
+        except Exception as e:
+            logger.error(f"Failed to load checkpoint of job {job_id}, running all steps: {str(e)}")
+            return {}
+        return resumable_steps(job_id, steps, entries)
+    
+    def save_checkpoint(self, job_id, step, result):
+        """
+        Record a completed pipeline step in the job's checkpoint hash
+        """
+        try:
+            pipe = self.shard_for(job_id).redis.pipeline(transaction=False)
+            self.queue_checkpoint(pipe, job_id, step, result)
+            with self.redis_op("checkpoint", job_id):
+                pipe.execute()
+        except Exception as e:
+            # Only costs rerunning the step if the job is retried
+            logger.error(f"Failed to checkpoint step {step['id']} of job {job_id}: {str(e)}")
+    
+    def clear_checkpoint(self, job_id):
+        """
+        Drop the checkpoint of a pipeline that ran to completion
+        """
+        shard = self.shard_for(job_id)
+        try:
+            with self.redis_op("checkpoint", job_id):
+                shard.redis.delete(shard.keys.job(job_id, "checkpoint"))
+        except Exception as e:
+            logger.error(f"Failed to clear checkpoint of job {job_id}: {str(e)}")
+    
+    def run_slot(self, job_data):
+        """
+        Run a claimed job on a slot thread and free the slot afterwards
+        """
+        try:
+            with self.tracer.span("process_job", job_id=job_data.get("id"), jobName=job_data.get("name"),
+                                  lane=job_data.get("lane")):
+                self.process_job(job_data)
+        except Exception:
+            logger.exception(f"Unhandled error in job slot for job {job_data.get('id')}")
+        finally:
+            self.free_jobs([job_data])
+            self.slots.release()
+    
+    def run_batch_slot(self, jobs, warm_executor):
+        """
+        Run a batch of claimed jobs on a slot thread and free the slot and the
+        executor reserved for the batch afterwards
+        """
+        try:
+            with self.tracer.span("process_batch", job_id=jobs[0].get("id"), jobName=jobs[0].get("name"),
+                                  jobs=len(jobs)):
+                self.process_batch(jobs, warm_executor)
+        except Exception:
+            logger.exception(f"Unhandled error in job slot for batch {[job.get('id') for job in jobs]}")
+        finally:
+            # Only still reserved when the batch ended before its task was sent
+            self.executor_pool.release(warm_executor)
+            self.free_jobs(jobs)
+            self.slots.release()
+    
     def poll_queue(self):
         """
-        Continuously poll the Redis queue for new jobs
+        Continuously poll the Redis queue for new jobs.
+        
+        A job is only claimed once a slot is free, so at most `concurrency` jobs
+        are taken off the queue at any time. On shutdown no new jobs are claimed
+        and the loop waits for in-flight slots to drain.
         """
-        logger.info(f"Worker {self.worker_id} started polling queue {self.queue_key}")
+        logger.info(f"Worker {self.worker_id} started polling queue {self.queue_key} with {self.concurrency} slot(s)")
+        
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f"slot-{self.worker_id}")
+        
+        stop_flusher = threading.Event()
+        flusher = threading.Thread(target=self.flush_progress_loop, args=(stop_flusher,),
+                                   name=f"progress-{self.worker_id}", daemon=True)
+        flusher.start()
+        
+        self.heartbeat()
+        heartbeat = threading.Thread(target=self.heartbeat_loop, args=(stop_flusher,),
+                                     name=f"heartbeat-{self.worker_id}", daemon=True)
+        heartbeat.start()
+        
+        try:
+            while not self.shutdown_requested:
+                # Wait for a free slot, waking up regularly to notice shutdown
+                if not self.slots.acquire(timeout=1):
+                    continue
         
-        while not self.shutdown_requested:
+                try:
+                    # Get next job
+                    with self.tracer.span("get_next_job") as span:
+                        job_data = self.get_next_job()
+                        if span:
+                            if job_data:
+                                span.job_id = job_data.get("id")
+                            else:
+                                span.discard()
+        
+                    # A batch is only collected once a warm executor is reserved for it
+                    warm_executor = self.batch_executor(job_data) if job_data else None
+                    batch = self.collect_batch(job_data) if warm_executor else [job_data]
+                    if len(batch) > 1:
+                        executor.submit(self.run_batch_slot, batch, warm_executor)
+                    elif job_data:
+                        if warm_executor:
+                            self.executor_pool.release(warm_executor)
+                        # Hand the job to a slot; the slot releases itself when done
+                        executor.submit(self.run_slot, job_data)
+                    else:
+                        # No jobs in queue; the claim already blocked, so poll again right away
+                        self.slots.release()
+        
+                except KeyboardInterrupt:
+                    self.slots.release()
+                    logger.info("Shutdown requested via keyboard interrupt")
+                    self.shutdown_requested = True
+        
+                except Exception as e:
+                    self.slots.release()
+                    logger.exception(f"Error during queue polling: {str(e)}")
+                    # Sleep before retrying to avoid hammering Redis on errors
+                    time.sleep(5)
+        finally:
+            self.release_prefetched()
+            with self.active_jobs_lock:
+                in_flight = len(self.active_jobs)
+            logger.info(f"Worker {self.worker_id} draining {in_flight} in-flight job(s)")
+            executor.shutdown(wait=True)
+            stop_flusher.set()
+            self.tracer.close()
             try:
-                # Get next job
-                job_data = self.get_next_job()
-                
-                if job_data:
-                    # Process the job
-                    self.process_job(job_data)
-                else:
-                    # No jobs in queue, sleep before next poll
-                    time.sleep(1)
-            
-            except KeyboardInterrupt:
-                logger.info("Shutdown requested via keyboard interrupt")
-                self.shutdown_requested = True
-            
+                for shard in self.shards:
+                    shard.redis.zrem(shard.keys.workers, self.worker_id)
+                    shard.redis.hdel(shard.keys.capacity, self.worker_id)
+                    shard.redis.hdel(shard.keys.claiming_lanes, self.worker_id)
             except Exception as e:
-                logger.exception(f"Error during queue polling: {str(e)}")
-                # Sleep before retrying to avoid hammering Redis on errors
-                time.sleep(5)
+                logger.error(f"Failed to deregister worker {self.worker_id}: {str(e)}")
+            if self.executor_pool:
+                self.executor_pool.close()
         
         logger.info(f"Worker {self.worker_id} stopped polling")
     
@@ -463,7 +1023,9 @@ class Worker:
         """
         Handle shutdown signals gracefully
         """
-        logger.info(f"Received shutdown signal {signum}, stopping worker...")
+        with self.active_jobs_lock:
+            in_flight = list(self.active_jobs)
+        logger.info(f"Received shutdown signal {signum}, stopping worker after in-flight jobs finish: {in_flight}")
         self.shutdown_requested = True
     
     def start(self):
@@ -477,25 +1039,8 @@ class Worker:
         logger.info(f"Starting worker {self.worker_id}")
         self.poll_queue()
 
-
 # Script entrypoint
 if __name__ == "__main__":
-    import argparse
-    
-    # Parse command line arguments
-    parser = argparse.ArgumentParser(description='Asset Pipeline Worker')
-    parser.add_argument('--redis', 
-                        default=f"redis://{os.environ.get('REDIS_HOST', 'localhost')}:{os.environ.get('REDIS_PORT', '6379')}", 
-                        help='Redis connection URL')
-    parser.add_argument('--queue', default=os.environ.get('JOB_QUEUE_NAME', 'local-job-queue'),
-                        help='Redis queue key prefix')
-    
-    args = parser.parse_args()
-    
-    # Create and start worker
-    try:
-        worker = Worker(redis_url=args.redis, queue_key=args.queue)
-        worker.start()
-    except Exception as e:
-        logger.critical(f"Worker failed to start: {str(e)}")
-        sys.exit(1)
\ No newline at end of file
+    from cli import main
+    
+    main()
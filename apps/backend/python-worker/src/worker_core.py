@@ -0,0 +1,802 @@
+import abc
+import collections
+import contextlib
+import logging
+import time
+import uuid
+from datetime import datetime
+
+from batching import DEFAULT_BATCH_WINDOW_MS, batch_key, take_compatible
+from checkpoint import checkpoint_entry
+from lanes import DEFAULT_STARVATION_MS, LANE_BLOCK_TIMEOUT, LaneScheduler, lane_stat_fields, parse_lanes, queue_wait_ms
+from log_capture import DEFAULT_LOG_DIR, DEFAULT_LOG_TAIL_LINES
+from lua_scripts import DEFAULT_LEASE_TTL, DEFAULT_MAX_RETRIES, REAP_BATCH_SIZE, decode_claimed
+from metrics import WorkerMetrics
+from pipeline import DEFAULT_PIPELINE_PARALLELISM
+from progress import DEFAULT_EVENT_STREAM_MAXLEN, DEFAULT_PROGRESS_INTERVAL
+from resources import ResourcePool, available_cpus
+from result_store import ResultStore
+from scripts import SCRIPT_JOBS, parse_progress
+from serializers import FAST_JSON, negotiate
+from shards import ROUND_ROBIN, ShardScheduler, build_shards
+from single_flight import idempotency_key
+from tracing import JobProfiler, Tracer
+from usage import DEFAULT_USAGE_WINDOW, usage_estimates
+
+logger = logging.getLogger(__name__)
+
+# Jobs run at the same time by one worker of either engine unless --concurrency says otherwise
+DEFAULT_CONCURRENCY = 1
+
+# Simulated progress steps of a generic job, one second each
+GENERIC_JOB_STEPS = 5
+
+
+def script_result(capture, return_code, usage=None):
+    """
+    Result of a script run that exited with 0
+    """
+    return {"success": True, **capture.result_fields(), "return_code": return_code,
+            **({"usage": usage} if usage else {})}
+
+
+def script_error(capture, error, usage=None):
+    """
+    Result of a script run that failed with `error`
+    """
+    return {"success": False, "error": error, **capture.result_fields(), **({"usage": usage} if usage else {})}
+
+
+def batch_results(captures, return_codes, usages):
+    """
+    Close the log captures of a batch and build each job's result from its
+    return code: 0, another code, None when the executor died before the
+    script ran, or the exception raised while starting it
+    """
+    results = []
+    for capture, return_code, usage in zip(captures, return_codes, usages):
+        capture.close()
+        if return_code == 0:
+            results.append(script_result(capture, return_code, usage))
+            continue
+        if return_code is None:
+            error = "Executor process died before the script ran"
+        elif isinstance(return_code, Exception):
+            error = str(return_code)
+        else:
+            error = f"Script execution failed with return code {return_code}"
+        results.append(script_error(capture, error))
+    return results
+
+
+def script_line(capture, line, is_stderr):
+    """
+    Record a script output line in its log capture and log it
+
+    Returns:
+        Tuple of (percentage or None, stripped line) for a stdout line, None for stderr
+    """
+    stripped_line = line.strip()
+    capture.add(stripped_line, is_stderr)
+    if is_stderr:
+        logger.error(f"[{capture.job_id}] {stripped_line}")
+        return None
+    logger.info(f"[{capture.job_id}] {stripped_line}")
+    return parse_progress(line), stripped_line
+
+
+def line_progress(percentage, line):
+    """
+    Progress update streaming a script line; lines without a percentage keep the last one
+    """
+    progress_data = {"log": line}
+    if percentage is not None:
+        progress_data["percentage"] = percentage
+    return progress_data
+
+
+def pipeline_result(results, error=None):
+    """
+    Result of a pipeline run from its step results, failed when `error` is given
+    """
+    if error is not None:
+        return {"success": False, "error": error, "steps": results}
+    return {"success": True, "message": "Asset pipeline executed successfully", "steps": results}
+
+
+def pipeline_output(result):
+    """
+    Stored result of a pipeline job that ran all its steps
+    """
+    return {
+        "message": "Asset pipeline completed successfully",
+        "pipelineOutput": result,
+        "processedBy": "python-worker"
+    }
+
+
+def script_output(name, result, batch_size=None):
+    """
+    Stored result of a script job, `batch_size` when it ran as part of a batch
+    """
+    output_result = {
+        "message": f"Script {name} completed successfully",
+        "scriptOutput": result.get("output", []),
+        "scriptType": name,
+        "usage": result.get("usage"),
+    }
+    if batch_size is not None:
+        output_result["batchSize"] = batch_size
+    output_result["processedBy"] = "python-worker"
+    return output_result
+
+
+def generic_output(job_id, data, worker_id):
+    """
+    Stored result of a generic job
+    """
+    return {
+        "message": f"Job {job_id} completed successfully by Python worker",
+        "processedData": data,
+        "processorInfo": {
+            "worker": "python",
+            "id": worker_id,
+            "timestamp": datetime.utcnow().isoformat(),
+        },
+    }
+
+
+class WorkerCore(abc.ABC):
+    """
+    Engine-independent part of `Worker` and `AsyncWorker`.
+
+    Holds the worker's options and state, decodes claims, builds the keys and
+    arguments of the Lua transitions and the results jobs store, and keeps the
+    prefetch buffer, flights and checkpoints consistent. The engines add the
+    I/O: their Redis clients (`connect`), job slots, script runs and round trips.
+    """
+
+    # Publisher class coalescing a running job's progress writes
+    publisher_class = None
+
+    def __init__(self, redis_url="redis://localhost:6379", queue_key="jobs", concurrency=DEFAULT_CONCURRENCY,
+                 progress_interval=DEFAULT_PROGRESS_INTERVAL,
+                 event_stream_maxlen=DEFAULT_EVENT_STREAM_MAXLEN, executor_pool=None,
+                 pipeline_parallelism=DEFAULT_PIPELINE_PARALLELISM, step_cache=None, prefetch=1,
+                 lease_ttl=DEFAULT_LEASE_TTL, max_retries=DEFAULT_MAX_RETRIES, lanes=None,
+                 lane_policy="weighted", starvation_ms=DEFAULT_STARVATION_MS, log_dir=DEFAULT_LOG_DIR,
+                 log_tail_lines=DEFAULT_LOG_TAIL_LINES, tracer=None, resources=None,
+                 serializer=None, result_store=None, max_batch=1, batch_window_ms=DEFAULT_BATCH_WINDOW_MS,
+                 dedupe_ttl=0, shards=1, cluster=False, shard_policy=ROUND_ROBIN, usage_window=DEFAULT_USAGE_WINDOW):
+        """
+        Initialize worker with Redis connection
+
+        Args:
+            redis_url: Redis connection URL
+            queue_key: Base key for job queue in Redis
+            concurrency: Maximum number of jobs processed at the same time
+            progress_interval: Minimum seconds between two progress writes for a job
+            event_stream_maxlen: Approximate number of events kept in each job's event stream
+            executor_pool: Optional WarmExecutorPool used to run script jobs in-process
+            pipeline_parallelism: Maximum number of steps of one pipeline job running at once
+            step_cache: Optional StepCache used to skip steps already run with the same input
+            prefetch: Maximum number of jobs claimed per round trip when the queue is deep
+            lease_ttl: Seconds a claimed job stays leased without a heartbeat before it is requeued
+            max_retries: Number of times a job whose lease expired is requeued before it is failed
+            lanes: List of (lane, weight) tuples to consume, see parse_lanes (default: the queue's own wait list)
+            lane_policy: `weighted` or `strict` ordering of the lanes
+            starvation_ms: Age of a lane's oldest job after which it is served first (0 disables)
+            log_dir: Directory full script logs are spilled to once they outgrow the in-memory tail
+            log_tail_lines: Number of most recent script output lines kept in memory and in results
+            tracer: Optional Tracer recording spans of claims, jobs, steps, scripts and Redis writes
+            resources: Optional ResourcePool of capacity tokens; jobs are only claimed when their needs fit
+            serializer: Serializer of progress and results for jobs without a `contentType` (fastest JSON by default)
+            result_store: Optional ResultStore compressing or offloading large results and setting key TTLs
+            max_batch: Maximum number of compatible small jobs run as one batch on a warm executor
+                (1 disables batching, as does running without executor_pool)
+            batch_window_ms: Milliseconds a batch waits for more compatible jobs to be claimed
+            dedupe_ttl: Seconds an idempotency key stays registered to the job running under it
+                (0 disables deduplication)
+            shards: Number of shards the queue is split into, see shard_queue_key
+            cluster: Whether redis_url points at a Redis Cluster; otherwise it may list
+                several comma-separated nodes the shards are spread over
+            shard_policy: `round-robin` or `least-loaded` choice of the shard claimed from first
+            usage_window: Recent script runs per job type whose resource usage is kept in Redis
+                and turned into memory estimates (0 disables them)
+        """
+        self.worker_id = str(uuid.uuid4())[:8]
+        self.queue_key = queue_key
+        self.redis_url = redis_url
+        self.concurrency = max(1, int(concurrency))
+        self.shutdown_requested = False
+
+        # Running job id -> slot (or job name) running it. Engines running jobs on
+        # several threads replace these no-op guards with locks.
+        self.active_jobs = {}
+        self.active_jobs_lock = contextlib.nullcontext()
+
+        # Per-job progress publishers coalesce progress writes while a job runs
+        self.progress_interval = progress_interval
+        self.event_stream_maxlen = event_stream_maxlen
+        self.executor_pool = executor_pool
+        self.pipeline_parallelism = pipeline_parallelism
+        self.step_cache = step_cache
+        self.log_dir = log_dir
+        self.log_tail_lines = log_tail_lines
+
+        # Jobs claimed ahead of a free slot; returned to the queue on shutdown
+        self.prefetch = max(1, int(prefetch))
+        self.prefetched = collections.deque()
+        self.prefetch_lock = contextlib.nullcontext()
+
+        # Compatible small jobs claimed close together run as one batch
+        self.max_batch = max(1, int(max_batch)) if executor_pool else 1
+        if int(max_batch) > 1 and not executor_pool:
+            logger.warning("Micro-batching needs warm executors; running jobs one by one")
+        self.batch_window = batch_window_ms / 1000
+
+        # Identical jobs share one execution: job id -> flight key of the jobs leading one
+        self.dedupe_ttl_ms = int(dedupe_ttl * 1000)
+        self.flights = {}
+        self.progress_publishers = {}
+        self.serializer = serializer or FAST_JSON
+        self.result_store = result_store or ResultStore()
+
+        # Claimed jobs are leased; a heartbeat extends the leases of active and
+        # prefetched jobs and reaps the ones other workers stopped extending
+        self.lease_ttl = lease_ttl
+        self.lease_ttl_ms = int(lease_ttl * 1000)
+        self.max_retries = max_retries
+
+        # Priority lanes: separate wait lists of the same queue, tried in the order the scheduler picks
+        self.lanes = LaneScheduler(lanes or parse_lanes(None), policy=lane_policy, starvation_ms=starvation_ms)
+
+        # Capacity tokens (CPU slots, memory, accelerators) held by claimed jobs until they finish
+        self.resources = resources or ResourcePool(cpu=max(available_cpus(), self.concurrency))
+        # Script runs feed rolling usage samples, from which job types' memory needs are estimated
+        self.usage_window = max(0, int(usage_window))
+
+        # Recorded always, exposed over HTTP when a metrics server is started
+        self.metrics = WorkerMetrics(self.concurrency, active_jobs=lambda: len(self.active_jobs))
+        self.tracer = tracer or Tracer()
+        # Profilers of running jobs submitted with `data.profile`
+        self.profilers = {}
+
+        try:
+            self.cluster = cluster
+            clients = self.connect(redis_url, cluster)
+            self.shards = build_shards(clients, queue_key, shards, cluster)
+            logger.info(f"{type(self).__name__} {self.worker_id} connected to Redis at {redis_url} "
+                        f"({len(self.shards)} shard(s) on {len(clients)} client(s))")
+        except Exception as e:
+            logger.error(f"Failed to connect to Redis: {str(e)}")
+            raise
+
+        # Claims try the shards in the scheduler's order; claimed job id -> shard it came from
+        self.shard_scheduler = ShardScheduler(self.shards, policy=shard_policy)
+        self.job_shards = {}
+
+    @abc.abstractmethod
+    def connect(self, redis_url, cluster):
+        """
+        Redis clients of the nodes the shards are spread over, one for a cluster
+        """
+
+    @contextlib.contextmanager
+    def redis_op(self, operation, job_id=None):
+        """
+        Time a Redis round trip in the latency histogram and as a trace span
+        """
+        with self.tracer.span(f"redis.{operation}", job_id=job_id) as span, \
+                self.metrics.redis_latency.time(operation):
+            yield span
+
+    def shard_for(self, job_id):
+        """
+        Shard a claimed job lives on
+        """
+        return self.job_shards.get(job_id, self.shards[0])
+
+    def progress_publisher(self, job_data):
+        """
+        Coalescing publisher of a job's progress while it runs
+        """
+        shard = self.shard_for(job_data.get("id"))
+        return self.publisher_class(
+            shard.redis, shard.keys, job_data.get("id"), interval=self.progress_interval,
+            stream_maxlen=self.event_stream_maxlen, instrument=self.redis_op,
+            serializer=negotiate(job_data, self.serializer), ttl=self.result_store.progress_ttl
+        )
+
+    def claim_call(self, shard, lanes, count):
+        """
+        Keys and arguments of CLAIM_JOBS taking up to `count` jobs from a shard's lanes
+        """
+        lane_keys = [shard.keys.lane(lane) for lane in lanes]
+        return dict(
+            keys=[shard.keys.processing, shard.keys.pending, shard.keys.leases, shard.keys.job_lanes] + lane_keys,
+            args=[count, self.lease_ttl_ms, self.lanes.starvation_ms, self.resources.claim_argument(lanes)] + lane_keys,
+        )
+
+    def block_target(self):
+        """
+        Where a blocking claim waits: the first lane of the first shard in
+        line, this worker's hand-off list there and the block timeout
+
+        Returns:
+            Tuple of (lanes, shard, lane key, hand-off list key, timeout in seconds)
+        """
+        lanes = [self.lanes.block_lane()]
+        shard = self.shard_scheduler.order()[0]
+        timeout = 1 if len(self.lanes.names) == 1 and len(self.shards) == 1 else LANE_BLOCK_TIMEOUT
+        return lanes, shard, shard.keys.lane(lanes[0]), shard.keys.claiming(self.worker_id), timeout
+
+    def handoff_call(self, shard, lanes, lane_key, claiming_key):
+        """
+        Keys and arguments of CLAIM_JOBS moving the payload a blocking claim
+        put on this worker's hand-off list into the processing hash
+        """
+        return dict(
+            keys=[shard.keys.processing, shard.keys.pending, shard.keys.leases, shard.keys.job_lanes, claiming_key],
+            args=[1, self.lease_ttl_ms, 0, self.resources.claim_argument(lanes), lane_key],
+        )
+
+    @staticmethod
+    def all_deferred(claimed):
+        """
+        Whether a claim found waiting jobs but none that fits the free capacity
+        """
+        return bool(claimed) and all(status == b"deferred" for status in claimed[::3])
+
+    def accept_claimed(self, claimed, lanes, shard):
+        """
+        Decode the jobs of a claim reply, remember their shard, take their capacity tokens and count them
+        """
+        jobs, invalid = decode_claimed(claimed, lanes)
+        for raw_data in invalid:
+            logger.error(f"Failed to parse job data, moved to {shard.keys.pending}: {raw_data}")
+        for job in jobs:
+            job["shard"] = shard.index
+            self.job_shards[job.get("id")] = shard
+            self.resources.acquire(job.get("id"), self.resources.needs(job, job["lane"]))
+            self.metrics.job_claimed(job.get("name"), job["lane"])
+        self.shard_scheduler.claimed(shard, len(jobs))
+        return jobs
+
+    def take_prefetched(self):
+        """
+        Next job claimed ahead of a free slot, or None
+        """
+        with self.prefetch_lock:
+            if self.prefetched:
+                return self.prefetched.popleft()
+        return None
+
+    def keep_prefetched(self, jobs):
+        """
+        Buffer claimed jobs until a slot is free
+        """
+        with self.prefetch_lock:
+            self.prefetched.extend(jobs)
+
+    def batch_executor(self, job_data):
+        """
+        Warm executor reserved for a batch led by `job_data`, or None when the
+        job runs on its own: batching is off, the job cannot be batched or no
+        executor is idle. Without an idle executor no batch is collected, so
+        compatible jobs run as single jobs on their own slots instead of one
+        after another on this one.
+        """
+        if self.max_batch <= 1 or batch_key(job_data) is None:
+            return None
+        if not self.executor_pool or not self.executor_pool.supports(job_data.get("name")):
+            return None
+        return self.executor_pool.reserve()
+
+    def fill_batch(self, batch, key, deadline):
+        """
+        Move prefetched jobs compatible with a batch into it
+
+        Returns:
+            Seconds the batch may still wait for more claims, or None once it
+            is full, its window closed or the buffer already holds a batch worth
+        """
+        with self.prefetch_lock:
+            batch += take_compatible(self.prefetched, key, self.max_batch - len(batch))
+            buffered = len(self.prefetched)
+        remaining = deadline - time.monotonic()
+        if len(batch) >= self.max_batch or remaining <= 0 or buffered >= self.max_batch or self.shutdown_requested:
+            return None
+        return remaining
+
+    def drain_prefetched(self):
+        """
+        Empty the prefetch buffer and free the capacity of its jobs
+
+        Returns:
+            Shard -> ids of its prefetched jobs, in claim order
+        """
+        with self.prefetch_lock:
+            job_ids = [job.get("id") for job in self.prefetched]
+            self.prefetched.clear()
+        by_shard = collections.defaultdict(list)
+        for job_id in job_ids:
+            self.resources.release(job_id)
+            by_shard[self.job_shards.pop(job_id, self.shards[0])].append(job_id)
+        return by_shard
+
+    def free_jobs(self, jobs):
+        """
+        Give back the capacity tokens of jobs that finished and forget their shard
+        """
+        for job in jobs:
+            self.resources.release(job.get("id"))
+            self.job_shards.pop(job.get("id"), None)
+
+    @staticmethod
+    def release_call(shard, job_ids):
+        """
+        Keys and arguments of RELEASE_JOBS putting claimed jobs back at the head of their lanes
+        """
+        return dict(keys=[shard.keys.processing, shard.keys.wait, shard.keys.leases, shard.keys.job_lanes],
+                    args=list(job_ids))
+
+    def lock_call(self, job_id, owner):
+        """
+        Keys and arguments of LOCK_JOB taking a claimed job's lock for `owner`
+        """
+        shard = self.shard_for(job_id)
+        return dict(
+            keys=[shard.keys.job(job_id, "lock"), shard.keys.processing, shard.keys.wait, shard.keys.leases,
+                  shard.keys.job_lanes],
+            args=[job_id, owner, self.lease_ttl_ms],
+        )
+
+    def held_jobs(self):
+        """
+        Ids of the jobs this worker holds, running and prefetched, by shard
+        """
+        with self.active_jobs_lock:
+            job_ids = list(self.active_jobs)
+        with self.prefetch_lock:
+            job_ids += [job.get("id") for job in self.prefetched]
+        by_shard = {shard: [] for shard in self.shards}
+        for job_id in job_ids:
+            by_shard[self.shard_for(job_id)].append(job_id)
+        return by_shard
+
+    def extend_call(self, shard, job_ids):
+        """
+        Keys and arguments of EXTEND_LEASES for the jobs this worker holds on a shard
+        """
+        return dict(
+            keys=[shard.keys.leases, shard.keys.workers] + [shard.keys.job(job_id, "lock") for job_id in job_ids],
+            args=[self.lease_ttl_ms, self.worker_id] + job_ids,
+        )
+
+    def queue_registration(self, pipe, shard, capacity):
+        """
+        Queue this worker's advertised capacity on a pipeline, and the lane the
+        reaper returns its hand-off list to should it die
+        """
+        pipe.hset(shard.keys.capacity, self.worker_id, capacity)
+        pipe.hset(shard.keys.claiming_lanes, self.worker_id, shard.keys.lane(self.lanes.block_lane()))
+
+    def forget_lost(self, lost):
+        """
+        Handle jobs whose lease expired before the heartbeat could extend it.
+        Prefetched ones were reaped back into the queue and are dropped; running
+        ones are only reported.
+        """
+        lost = {job_id.decode() for job_id in lost}
+        with self.prefetch_lock:
+            # Prefetched jobs that were reaped are already back in the queue; leave them to whoever claims them
+            kept = [job for job in self.prefetched if str(job.get("id")) not in lost]
+            for job in self.prefetched:
+                if str(job.get("id")) in lost:
+                    self.resources.release(job.get("id"))
+                    self.job_shards.pop(job.get("id"), None)
+            dropped = len(self.prefetched) - len(kept)
+            self.prefetched = collections.deque(kept)
+        if dropped:
+            logger.warning(f"Dropped {dropped} prefetched job(s) whose lease expired")
+        with self.active_jobs_lock:
+            running = [job_id for job_id in self.active_jobs if str(job_id) in lost]
+        for job_id in running:
+            logger.warning(f"Lease of job {job_id} expired before it could be extended; it may run twice")
+
+    def reap_call(self, shard):
+        """
+        Keys and arguments of REAP_EXPIRED for a shard
+        """
+        return dict(
+            keys=[
+                shard.keys.leases,
+                shard.keys.processing,
+                shard.keys.wait,
+                shard.keys.failed,
+                shard.keys.retries,
+                shard.keys.workers,
+                shard.keys.job_lanes,
+                shard.keys.capacity,
+                shard.keys.claiming_lanes,
+            ],
+            args=[shard.keys.queue_key, self.max_retries, REAP_BATCH_SIZE, self.event_stream_maxlen,
+                  shard.keys.events_channel, *self.result_store.ttl_args()],
+        )
+
+    @staticmethod
+    def log_reaped(shard, requeued, failed, recovered):
+        """
+        Report what a REAP_EXPIRED run on a shard did
+        """
+        if requeued or failed or recovered:
+            logger.warning(f"Reaped expired leases on {shard.keys.queue_key}: {requeued} job(s) requeued, "
+                           f"{failed} failed, {recovered} recovered from dead workers' hand-off lists")
+
+    def queue_depth_reads(self, pipe, shard):
+        """
+        Queue reads of a shard's lane and processing depths on a pipeline
+        """
+        for lane in self.lanes.names:
+            pipe.llen(shard.keys.lane(lane))
+        pipe.hlen(shard.keys.processing)
+
+    def record_depths(self, depths_by_shard):
+        """
+        Store each shard's load and the depths summed over the shards in the metrics
+
+        Args:
+            depths_by_shard: Shard -> replies of its `queue_depth_reads`
+        """
+        totals = collections.Counter()
+        for shard, depths in depths_by_shard.items():
+            shard.waiting = sum(depths[:-1])
+            shard.processing = depths[-1]
+            totals.update(dict(zip(self.lanes.names + ["processing"], depths)))
+        for name in self.lanes.names + ["processing"]:
+            self.metrics.queue_depth.set(totals[name], name)
+
+    def observe_usage(self, script_type, usage):
+        """
+        Record the CPU time of a script run in the metrics
+
+        Returns:
+            Whether its usage should also be added to the rolling samples of its type
+        """
+        if not usage:
+            return False
+        self.metrics.script_cpu.observe(usage["cpuUserS"] + usage["cpuSystemS"], script_type)
+        return bool(self.usage_window)
+
+    def queue_usage_reads(self, pipe):
+        """
+        Queue reads of the usage samples of every script job type on a pipeline
+        """
+        for script_type in SCRIPT_JOBS:
+            pipe.lrange(self.shards[0].keys.usage(script_type), 0, -1)
+
+    def record_usage_estimates(self, samples):
+        """
+        Replace the static memory needs of script job types with the peaks of
+        their recent runs (see `usage.usage_estimates`)
+
+        Args:
+            samples: Replies of `queue_usage_reads`
+        """
+        self.resources.estimates = usage_estimates(dict(zip(SCRIPT_JOBS, samples)))
+        for job_type, needs in self.resources.estimates.items():
+            self.metrics.memory_estimate.set(needs["memoryMb"], job_type)
+
+    def queue_wait_writes(self, pipe, job_data):
+        """
+        Queue a job's `claimed` event and its lane's wait counters on a pipeline
+
+        Returns:
+            Tuple of (lane, milliseconds the job waited or None)
+        """
+        job_id = job_data.get("id")
+        shard = self.shard_for(job_id)
+        lane = job_data.get("lane", self.lanes.names[0])
+        wait_ms = queue_wait_ms(job_data)
+        pipe.xadd(shard.keys.job(job_id, "events"),
+                  {"type": "claimed", "lane": lane, "queueWaitMs": "" if wait_ms is None else wait_ms},
+                  maxlen=self.event_stream_maxlen, approximate=True)
+        if wait_ms is not None:
+            for field, amount in lane_stat_fields(lane, wait_ms).items():
+                pipe.hincrby(shard.keys.lane_stats, field, amount)
+        return lane, wait_ms
+
+    def job_started(self, job_data, lane, wait_ms):
+        """
+        Log and count a job that starts after waiting `wait_ms` in its lane
+        """
+        logger.info(f"Job {job_data.get('id')} waited {wait_ms if wait_ms is not None else '?'} ms in lane {lane}")
+        self.metrics.job_started(job_data.get("id"), job_data.get("name"), lane, wait_ms)
+
+    def complete_call(self, job_id, stored, encoding, serializer):
+        """
+        Keys and arguments of COMPLETE_JOB storing a job's encoded result
+        """
+        shard = self.shard_for(job_id)
+        call = dict(
+            keys=[
+                shard.keys.processing,
+                shard.keys.completed,
+                shard.keys.job(job_id, "result"),
+                shard.keys.job(job_id, "status"),
+                shard.keys.job(job_id, "events"),
+                shard.keys.leases,
+                shard.keys.retries,
+                shard.keys.job_lanes,
+                shard.keys.job(job_id, "progress"),
+            ],
+            args=[job_id, stored, self.event_stream_maxlen, shard.keys.events_channel,
+                  serializer.content_type, encoding, *self.result_store.ttl_args()],
+        )
+        return self.flight_call(job_id, call)
+
+    def fail_job_call(self, job_id, error_message):
+        """
+        Keys and arguments of the fail script recording a job's error
+        """
+        shard = self.shard_for(job_id)
+        call = dict(
+            keys=[
+                shard.keys.processing,
+                shard.keys.failed,
+                shard.keys.job(job_id, "status"),
+                shard.keys.job(job_id, "error"),
+                shard.keys.job(job_id, "events"),
+                shard.keys.leases,
+                shard.keys.retries,
+                shard.keys.job_lanes,
+                shard.keys.job(job_id, "progress"),
+            ],
+            args=[job_id, error_message, self.event_stream_maxlen, shard.keys.events_channel,
+                  *self.result_store.ttl_args()],
+        )
+        return self.flight_call(job_id, call)
+
+    def queue_final_progress(self, pipe, job_id, serializer):
+        """
+        Queue the final progress of a batch job that completed on a pipeline
+        """
+        pipe.set(self.shard_for(job_id).keys.job(job_id, "progress"),
+                 serializer.dumps({"percentage": 100, "log": "Script execution completed"}),
+                 ex=self.result_store.progress_ttl or None)
+
+    def flight_call(self, job_id, call):
+        """
+        Add the flight keys to a complete or fail script call when the job
+        leads a flight, so the jobs attached to it get the same outcome
+        """
+        flight_key = self.flights.get(job_id)
+        if flight_key:
+            call["keys"] += [flight_key, f"{flight_key}:followers"]
+            call["args"].append(self.shard_for(job_id).keys.queue_key)
+        return call
+
+    def flight_keys(self, jobs):
+        """
+        Jobs that carry an idempotency key (see `single_flight.idempotency_key`),
+        as (job, key) pairs; empty when deduplication is off
+        """
+        if not self.dedupe_ttl_ms:
+            return []
+        return [(job, key) for job, key in ((job, idempotency_key(job)) for job in jobs) if key]
+
+    def join_flight_call(self, shard, job, key):
+        """
+        Keys and arguments of JOIN_FLIGHT registering a job under its idempotency key
+        """
+        flight_key = shard.keys.flight(key)
+        return dict(
+            keys=[flight_key, f"{flight_key}:followers", shard.keys.leases, shard.keys.job(job.get("id"), "events")],
+            args=[job.get("id"), self.dedupe_ttl_ms, self.event_stream_maxlen],
+        )
+
+    def settle_flights(self, jobs, keyed, leaders, shard):
+        """
+        Record the flights the jobs lead and drop the ones attached to an
+        identical job already running
+
+        Returns:
+            The jobs that still have to run
+        """
+        attached = set()
+        for (job, key), leader in zip(keyed, leaders):
+            job_id = job.get("id")
+            leader = leader.decode()
+            if leader == str(job_id):
+                self.flights[job_id] = shard.keys.flight(key)
+            else:
+                logger.info(f"Job {job_id} attached to identical job {leader} (key {key})")
+                self.metrics.jobs_deduplicated.inc(job.get("name"))
+                attached.add(job_id)
+        return [job for job in jobs if job.get("id") not in attached]
+
+    def locked_jobs(self, jobs, locked):
+        """
+        Jobs of a batch whose lock was taken; the others were handed back to their lane
+        """
+        for job, ok in zip(jobs, locked):
+            if not ok:
+                logger.warning(f"Job {job.get('id')} is locked by another worker, handed it back to its lane")
+                self.flights.pop(job.get("id"), None)
+        return [job for job, ok in zip(jobs, locked) if ok]
+
+    def queue_requeued_event(self, pipe, job_id, done_steps):
+        """
+        Queue the `requeued` event of a job interrupted by shutdown on a pipeline
+        """
+        pipe.xadd(self.shard_for(job_id).keys.job(job_id, "events"),
+                  {"type": "requeued", "completedSteps": ",".join(done_steps)},
+                  maxlen=self.event_stream_maxlen, approximate=True)
+
+    def queue_checkpoint(self, pipe, job_id, step, result):
+        """
+        Queue the checkpoint entry of a completed pipeline step on a pipeline
+        """
+        checkpoint_key = self.shard_for(job_id).keys.job(job_id, "checkpoint")
+        pipe.hset(checkpoint_key, step["id"], checkpoint_entry(step, result))
+        if self.result_store.result_ttl:
+            pipe.expire(checkpoint_key, self.result_store.result_ttl)
+
+    def resumed_steps(self, job_id, steps, completed):
+        """
+        Log and count the pipeline steps a job skips because its checkpoint has them
+
+        Returns:
+            Progress update announcing the resume
+        """
+        logger.info(f"[{job_id}] Resuming pipeline, skipping checkpointed steps: {sorted(completed)}")
+        for step_id in completed:
+            self.metrics.steps_resumed.inc(steps[step_id]["type"])
+        return {"log": f"Resuming pipeline after steps: {', '.join(sorted(completed))}"}
+
+    def cache_hit(self, job_id, script_type, cached):
+        """
+        Log a step served from the step cache
+
+        Returns:
+            The progress line announcing it
+        """
+        message = f"{script_type} result served from step cache ({cached['cacheKey'][:12]})"
+        logger.info(f"[{job_id}] {message}")
+        return message
+
+    def start_profiler(self, job_id, data):
+        """
+        Start profiling a job submitted with `data.profile`
+        """
+        if data.get("profile"):
+            profiler = JobProfiler(job_id, output_dir=self.log_dir)
+            if profiler.start():
+                self.profilers[job_id] = profiler
+
+    def discard_profiler(self, job_id):
+        """
+        Stop the profiler of a job that did not complete, keeping its dump for the post-mortem
+        """
+        profiler = self.profilers.pop(job_id, None)
+        if profiler:
+            profile_file = profiler.stop().get("profileFile")
+            if profile_file:
+                logger.info(f"Profile of job {job_id} written to {profile_file}")
+
+    def profiled_result(self, job_id, result_data):
+        """
+        Add the profile of a completed job to its result
+        """
+        profiler = self.profilers.pop(job_id, None)
+        if profiler:
+            return {**result_data, **profiler.stop()}
+        return result_data
+
+    def finished_serializer(self, job_id):
+        """
+        Serializer a finishing job's result is stored with: the one negotiated for its progress
+        """
+        publisher = self.progress_publishers.get(job_id)
+        return publisher.serializer if publisher else self.serializer
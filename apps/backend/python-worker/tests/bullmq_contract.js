@@ -0,0 +1,94 @@
+// Node side of the BullMQ contract test (test_bullmq_contract.py). Uses the
+// bullmq installed for backend-service, so the Python worker is checked against
+// the exact version the backend produces with.
+//
+// node bullmq_contract.js <redis url> <queue> version|produce|consume <seconds>|inspect <ids JSON>
+const fs = require('fs');
+const path = require('path');
+
+const bullmqMain = require.resolve('bullmq', { paths: [path.resolve(__dirname, '../../backend-service')] });
+const bullmqDir = bullmqMain.slice(0, bullmqMain.lastIndexOf(path.join('node_modules', 'bullmq')) + 'node_modules/bullmq'.length);
+const { FlowProducer, Job, Queue, Worker } = require(bullmqMain);
+
+const [redisUrl, queueName, command, arg] = process.argv.slice(2);
+const url = new URL(redisUrl);
+const connection = { host: url.hostname, port: Number(url.port || 6379), maxRetriesPerRequest: null };
+
+async function produce() {
+  const queue = new Queue(queueName, { connection });
+  await queue.obliterate({ force: true });
+  const ids = { plain: [], prioritized: [], delayed: [], failing: [], child: [] };
+  for (let n = 0; n < 6; n++) {
+    ids.plain.push((await queue.add('generic', { n })).id);
+  }
+  ids.prioritized.push((await queue.add('generic', { n: 'prioritized' }, { priority: 3 })).id);
+  ids.delayed.push((await queue.add('generic', { n: 'delayed' }, { delay: 500 })).id);
+  // asset-tag fails in Python without a pipeline checkout, and in Node by design
+  ids.failing.push((await queue.add('asset-tag', { scriptParams: { target: 'missing', tags: ['x'] } },
+    { attempts: 2, backoff: { type: 'fixed', delay: 100 } })).id);
+  const flows = new FlowProducer({ connection });
+  const flow = await flows.add({
+    name: 'generic', queueName, data: { n: 'parent' },
+    children: [{ name: 'generic', queueName, data: { n: 'child' } }],
+  });
+  ids.child.push(flow.children[0].job.id);
+  ids.plain.push(flow.job.id);
+  await flows.close();
+  await queue.close();
+  return ids;
+}
+
+async function consume(seconds) {
+  const worker = new Worker(queueName, async (job) => {
+    if (job.name === 'asset-tag') {
+      throw new Error('asset-tag is only run by Python workers');
+    }
+    await new Promise((resolve) => setTimeout(resolve, 200));
+    return { processorInfo: { worker: 'node' }, processedData: job.data };
+  }, { connection, concurrency: 2, name: 'node-contract' });
+  await new Promise((resolve) => setTimeout(resolve, seconds * 1000));
+  await worker.close();
+  return {};
+}
+
+async function inspect(ids) {
+  const queue = new Queue(queueName, { connection });
+  const jobs = {};
+  for (const id of ids) {
+    const job = await Job.fromId(queue, id);
+    jobs[id] = job && {
+      state: await job.getState(),
+      returnvalue: job.returnvalue,
+      failedReason: job.failedReason,
+      attemptsMade: job.attemptsMade,
+      processedBy: job.processedBy,
+      progress: job.progress,
+    };
+  }
+  const counts = await queue.getJobCounts('wait', 'active', 'delayed', 'prioritized', 'completed', 'failed');
+  await queue.close();
+  return { jobs, counts };
+}
+
+async function main() {
+  switch (command) {
+    case 'version':
+      return { version: JSON.parse(fs.readFileSync(path.join(bullmqDir, 'package.json'))).version };
+    case 'produce':
+      return produce();
+    case 'consume':
+      return consume(Number(arg));
+    case 'inspect':
+      return inspect(JSON.parse(arg));
+    default:
+      throw new Error(`Unknown command ${command}`);
+  }
+}
+
+main().then((result) => {
+  process.stdout.write(JSON.stringify(result));
+  process.exit(0);
+}).catch((err) => {
+  console.error(err);
+  process.exit(1);
+});
@@ -0,0 +1,260 @@
+import asyncio
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+# The worker modules import each other by name from src/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+# Stand-ins for the asset pipeline scripts: each records its call, prints its
+# progress and copies or tags its input, as a function warm executors import and
+# as a command line. A tag target ending in `bad` fails, one starting with
+# `slow` takes a second and one starting with `noisy` floods stderr first.
+FAKE_SCRIPTS = {
+    "tag.py": """
+def tag_assets(target_path, tags, category="general", replace=False):
+    record("tag " + target_path)
+    print("Progress: 50%")
+    if target_path.startswith("slow"):
+        time.sleep(1)
+    if target_path.startswith("noisy"):
+        for line in range(5000):
+            print(f"warning {line}: " + "x" * 100, file=sys.stderr)
+    if target_path.endswith("bad"):
+        print("cannot tag " + target_path, file=sys.stderr)
+        return False
+    print("tagged " + target_path)
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if tag_assets(sys.argv[1], sys.argv[3:]) else 1)
+""",
+    "export.py": """
+def export_asset(input_file, output_file, format="fbx", quality=75):
+    record("export " + input_file)
+    if os.path.exists(os.path.join(HERE, "fail-export")):
+        print("export broke", file=sys.stderr)
+        return False
+    shutil.copy(input_file, output_file)
+    print("Progress: 100%")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if export_asset(sys.argv[1], sys.argv[2]) else 1)
+""",
+    "import.py": """
+def import_asset(source_file, destination, scale=1.0, fix_orientation=False):
+    record("import " + source_file)
+    os.makedirs(destination, exist_ok=True)
+    imported = os.path.join(destination, os.path.basename(source_file))
+    shutil.copy(source_file, imported)
+    open(imported + ".meta", "w").close()
+    print("Progress: 100%")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if import_asset(sys.argv[1], sys.argv[2]) else 1)
+""",
+    "decimate.py": """
+def decimate_model(input_file, output_file, target_reduction=50, preserve_uvs=True):
+    record("decimate " + input_file)
+    time.sleep(float(os.environ.get("FAKE_DECIMATE_SECONDS", "0")))
+    shutil.copy(input_file, output_file)
+    print("Progress: 100%")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if decimate_model(sys.argv[1], sys.argv[2]) else 1)
+""",
+}
+
+FAKE_SCRIPT_HEADER = """import os, shutil, sys, time
+HERE = os.path.dirname(os.path.abspath(__file__))
+def record(call):
+    with open(os.path.join(HERE, "calls"), "a") as calls:
+        calls.write(call + "\\n")
+"""
+
+
+class FakePipeline:
+    """
+    Directory of fake asset pipeline scripts and the calls they received
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.script_dir = os.path.join(root, "src", "automation")
+        os.makedirs(self.script_dir)
+        for name, body in FAKE_SCRIPTS.items():
+            with open(os.path.join(self.script_dir, name), "w") as script:
+                script.write(FAKE_SCRIPT_HEADER + body)
+
+    def calls(self):
+        """
+        Calls received so far, e.g. `tag t1`, in the order they were made
+        """
+        path = os.path.join(self.script_dir, "calls")
+        if not os.path.exists(path):
+            return []
+        with open(path) as calls:
+            return calls.read().splitlines()
+
+    def fail_export(self, failing=True):
+        path = os.path.join(self.script_dir, "fail-export")
+        if failing:
+            open(path, "w").close()
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def pipeline_job(self, job_id):
+        """
+        A `pipeline: true` job importing, tagging, decimating and exporting a mesh under the pipeline root
+        """
+        mesh = os.path.join(self.root, "mesh.obj")
+        with open(mesh, "w") as source:
+            source.write("mesh")
+        imported = os.path.join(self.root, "imported", "mesh.obj")
+        decimated = os.path.join(self.root, "decimated.obj")
+        params = {
+            "pipeline": True,
+            "import": {"source": mesh, "destination": os.path.dirname(imported)},
+            "tag": {"target": imported, "tags": ["x"]},
+            "decimate": {"input": imported, "output": decimated},
+            "export": {"input": decimated, "output": os.path.join(self.root, "mesh.glb")},
+        }
+        return {"id": job_id, "name": "asset-pipeline", "data": {"scriptParams": params}}
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    monkeypatch.setenv("ASSET_PIPELINE_PATH", str(tmp_path / "asset-pipeline"))
+    return FakePipeline(str(tmp_path / "asset-pipeline"))
+
+
+@pytest.fixture
+def warm_pool(pipeline):
+    """
+    Started pool of one warm executor running the fake pipeline scripts
+    """
+    from executor_pool import WarmExecutorPool
+
+    pool = WarmExecutorPool(1, script_dir=pipeline.script_dir)
+    pool.start()
+    yield pool
+    pool.close()
+
+
+class Engine:
+    """
+    Runs workers of one engine against fake Redis servers.
+
+    Coroutines of the asyncio engine run on one event loop kept for the whole
+    test, so `engine.run(worker.method(...))` reads the same for both engines.
+    """
+
+    def __init__(self, name):
+        import fakeredis
+
+        self.name = name
+        self.servers = {}
+        self.loop = asyncio.new_event_loop() if name == "asyncio" else None
+        self.fakeredis = fakeredis
+        self.redis = self.client("redis://localhost:6379")
+
+    def server(self, url):
+        return self.servers.setdefault(url, self.fakeredis.FakeServer())
+
+    def client(self, url):
+        """
+        Synchronous client of the fake server behind `url`, for setting up and checking keys
+        """
+        return self.fakeredis.FakeRedis(server=self.server(url))
+
+    def worker(self, worker_class=None, **options):
+        options.setdefault("redis_url", "redis://localhost:6379")
+        options.setdefault("queue_key", "q")
+        if self.name == "asyncio":
+            import fakeredis.aioredis
+
+            from async_worker import AsyncWorker
+
+            with mock.patch("redis.asyncio.from_url",
+                            side_effect=lambda url, **kwargs: fakeredis.aioredis.FakeRedis(server=self.server(url))):
+                return (worker_class or AsyncWorker)(**options)
+        from worker import Worker
+
+        with mock.patch("redis.from_url", side_effect=lambda url, **kwargs: self.client(url)):
+            return (worker_class or Worker)(**options)
+
+    def run(self, value):
+        """
+        Result of a worker method call, awaited on the test's loop for the asyncio engine
+        """
+        if inspect.isawaitable(value):
+            return self.loop.run_until_complete(value)
+        return value
+
+    def poll(self, worker, until, timeout=15):
+        """
+        Run a worker's poll loop until `until()` is true or `timeout` seconds
+        passed, then shut it down and wait for its jobs to drain
+
+        Returns:
+            Whether `until()` became true
+        """
+        deadline = time.monotonic() + timeout
+        if self.name == "asyncio":
+            async def poll():
+                task = asyncio.create_task(worker.poll_queue())
+                while not until() and time.monotonic() < deadline:
+                    await asyncio.sleep(0.05)
+                worker.shutdown_requested = True
+                await task
+
+            self.run(poll())
+        else:
+            thread = threading.Thread(target=worker.poll_queue)
+            thread.start()
+            while not until() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            worker.shutdown_requested = True
+            thread.join()
+        return until()
+
+    def close(self):
+        if self.loop:
+            self.loop.close()
+
+
+@pytest.fixture(params=["threads", "asyncio"])
+def engine(request):
+    # fakeredis runs the Lua transitions with lupa
+    pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    engine = Engine(request.param)
+    yield engine
+    engine.close()
+
+
+def push(client, wait_key, *jobs):
+    """
+    Add job payloads to a wait list the way producers do, oldest first
+    """
+    for job in jobs:
+        client.lpush(wait_key, json.dumps({"timestamp": int(time.time() * 1000), **job}))
+
+
+def tag_job(job_id, target=None, **data):
+    return {"id": job_id, "name": "asset-tag",
+            "data": {"scriptParams": {"target": target or job_id, "tags": ["x"]}, **data}}
+
+
+def status(client, keys, job_id):
+    value = client.get(keys.job(job_id, "status"))
+    return value.decode() if value is not None else None
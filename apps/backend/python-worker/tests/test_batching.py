@@ -0,0 +1,96 @@
+import collections
+
+from batching import batch_key, take_compatible
+from conftest import push, status, tag_job
+from resources import ResourcePool
+from result_store import read_result
+
+
+def test_jobs_share_a_batch_key_by_category():
+    plain = tag_job("a")
+    same = tag_job("b", category="general")
+    other = {**tag_job("c"), "data": {"scriptParams": {"target": "c", "tags": ["x"], "category": "props"}}}
+
+    assert batch_key(plain) == batch_key({**same, "data": {"scriptParams": {"target": "b", "category": "general"}}})
+    assert batch_key(plain) != batch_key(other)
+    assert batch_key({"name": "asset-export", "data": {}}) is None
+    assert batch_key({**plain, "data": {**plain["data"], "profile": True}}) is None
+
+
+def test_take_compatible_keeps_the_order_of_the_others():
+    jobs = collections.deque([tag_job("a"), {"id": "e", "name": "asset-export"}, tag_job("b"), tag_job("c")])
+
+    taken = take_compatible(jobs, batch_key(tag_job("x")), 2)
+
+    assert [job["id"] for job in taken] == ["a", "b"]
+    assert [job["id"] for job in jobs] == ["e", "c"]
+
+
+def test_reserved_executor_returns_to_the_pool_once(warm_pool):
+    executor = warm_pool.reserve()
+    assert warm_pool.reserve() is None
+
+    warm_pool.release(executor)
+    assert warm_pool.idle.qsize() == 1
+
+    executor = warm_pool.reserve()
+    return_codes, _ = warm_pool.run_batch(executor, "asset-tag", [{"target": "a", "tags": ["x"]}], lambda *line: None)
+    # The task gave it back already
+    warm_pool.release(executor)
+    assert return_codes == [0]
+    assert warm_pool.idle.qsize() == 1
+
+
+def batch_worker(engine, warm_pool):
+    return engine.worker(executor_pool=warm_pool, max_batch=4, batch_window_ms=200, concurrency=2,
+                         resources=ResourcePool(cpu=4))
+
+
+def finished(engine, keys, job_ids):
+    return lambda: all(status(engine.redis, keys, job_id) in ("completed", "failed") for job_id in job_ids)
+
+
+def test_compatible_jobs_run_as_one_batch_with_their_own_outcomes(engine, pipeline, warm_pool):
+    worker = batch_worker(engine, warm_pool)
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("t0"), tag_job("t1"), tag_job("t2", "t2-bad"), tag_job("t3"))
+    done = finished(engine, keys, ["t0", "t1", "t2", "t3"])
+    # The worker closes the pool on shutdown, so look for the executor while it still runs
+    returned = []
+
+    def executor_returned():
+        if done() and warm_pool.idle.qsize() == 1:
+            returned.append(True)
+        return bool(returned)
+
+    assert engine.poll(worker, executor_returned)
+
+    assert sorted(pipeline.calls()) == ["tag t0", "tag t1", "tag t2-bad", "tag t3"]
+    for job_id in ("t0", "t1", "t3"):
+        result = read_result(engine.redis, keys, job_id)
+        assert result["batchSize"] == 4
+        assert result["scriptOutput"][-1] == f"tagged {job_id}"
+    assert status(engine.redis, keys, "t2") == "failed"
+    assert b"return code 1" in engine.redis.get(keys.job("t2", "error"))
+    assert engine.redis.hlen(keys.processing) == 0
+    # Every job's tokens are given back once the batch finished
+    assert not worker.resources.held
+    assert worker.resources.free() == worker.resources.capacity
+
+
+def test_jobs_run_alone_while_no_executor_is_idle(engine, pipeline, warm_pool):
+    busy = warm_pool.reserve()
+    worker = batch_worker(engine, warm_pool)
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("t0"), tag_job("t1"), tag_job("t2"))
+
+    try:
+        assert engine.poll(worker, finished(engine, keys, ["t0", "t1", "t2"]))
+    finally:
+        warm_pool.release(busy)
+
+    for job_id in ("t0", "t1", "t2"):
+        assert status(engine.redis, keys, job_id) == "completed"
+        assert "batchSize" not in read_result(engine.redis, keys, job_id)
+    assert sorted(pipeline.calls()) == ["tag t0", "tag t1", "tag t2"]
+    assert not worker.resources.held
@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+import pytest
+
+import bullmq_worker
+
+# BullMQ release the BULL_* scripts were checked against; bump it after re-running this test on a new one
+BULLMQ_VERSION = "5.58."
+
+CONTRACT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bullmq_contract.js")
+REDIS_URL = os.environ.get("REDIS_URL")
+
+
+def node(*args, timeout=60):
+    """
+    Run a command of bullmq_contract.js and return its JSON output
+    """
+    completed = subprocess.run(["node", CONTRACT_SCRIPT, REDIS_URL, *args], capture_output=True, text=True,
+                               timeout=timeout)
+    assert completed.returncode == 0, completed.stderr
+    return json.loads(completed.stdout)
+
+
+@pytest.fixture
+def bullmq_version():
+    if not REDIS_URL:
+        pytest.skip("REDIS_URL is not set")
+    if not shutil.which("node"):
+        pytest.skip("node is not installed")
+    probe = subprocess.run(["node", CONTRACT_SCRIPT, REDIS_URL, "-", "version"], capture_output=True, text=True)
+    if probe.returncode != 0:
+        pytest.skip("bullmq is not installed for backend-service (npm install)")
+    return json.loads(probe.stdout)["version"]
+
+
+def test_node_and_python_workers_share_a_queue(bullmq_version, tmp_path, monkeypatch):
+    assert bullmq_version.startswith(BULLMQ_VERSION), (
+        f"bullmq {bullmq_version} is installed but the BullMQ transitions were checked against {BULLMQ_VERSION}x"
+    )
+    # No pipeline checkout: asset-tag jobs fail, which exercises attempts and backoff
+    monkeypatch.setenv("ASSET_PIPELINE_PATH", str(tmp_path))
+    queue = f"contract-{uuid.uuid4().hex[:8]}"
+    ids = node(queue, "produce")
+
+    worker = bullmq_worker.BullMQWorker(redis_url=REDIS_URL, queue_key=queue, concurrency=4, lease_ttl=5)
+    thread = threading.Thread(target=worker.poll_queue)
+    thread.start()
+    try:
+        # Let the Python worker claim first, then run a Node worker next to it
+        time.sleep(1)
+        node(queue, "consume", "8")
+        all_ids = [job_id for group in ids.values() for job_id in group]
+        deadline = time.time() + 30
+        while True:
+            report = node(queue, "inspect", json.dumps(all_ids))
+            if all(job["state"] in ("completed", "failed") for job in report["jobs"].values()) or time.time() > deadline:
+                break
+            time.sleep(1)
+    finally:
+        worker.shutdown_requested = True
+        thread.join()
+
+    jobs = report["jobs"]
+    for job_id in ids["plain"] + ids["prioritized"] + ids["delayed"] + ids["child"]:
+        assert jobs[job_id]["state"] == "completed", jobs[job_id]
+        assert jobs[job_id]["returnvalue"]["processorInfo"]["worker"] in ("python", "node")
+    python_jobs = [job for job in jobs.values() if (job["processedBy"] or "").startswith("python-worker-")]
+    assert python_jobs, "the Python worker claimed no job"
+    assert all(job["progress"]["percentage"] == 100 for job in python_jobs if job["state"] == "completed")
+
+    # Children of a flow are left to Node workers, whose moveToFinished moves the parent on
+    assert jobs[ids["child"][0]]["processedBy"] == "node-contract"
+
+    failing = jobs[ids["failing"][0]]
+    assert failing["state"] == "failed"
+    assert failing["attemptsMade"] == 2
+
+    counts = report["counts"]
+    assert counts["wait"] == counts["active"] == counts["delayed"] == counts["prioritized"] == 0
@@ -0,0 +1,158 @@
+import json
+import time
+
+import pytest
+
+from bullmq_worker import AsyncBullMQWorker, BullMQWorker, retry_delay
+from conftest import tag_job
+from keys import BullKeys
+
+KEYS = BullKeys("assets")
+
+
+def add(client, data, opts=None, delay=0, priority=0):
+    """
+    Add a job the way BullMQ's `Queue.add` does
+    """
+    job_id = str(client.incr(KEYS.prefix + "id"))
+    now = int(time.time() * 1000)
+    client.hset(KEYS.job(job_id), mapping={"name": "asset-tag", "data": json.dumps(data),
+                                           "opts": json.dumps(opts or {}), "timestamp": now,
+                                           "delay": delay, "priority": priority})
+    if delay:
+        client.zadd(KEYS.delayed, {job_id: (now + delay) * 0x1000})
+        client.zadd(KEYS.marker, {"1": now + delay})
+    elif priority:
+        client.zadd(KEYS.prioritized, {job_id: priority * 0x100000000 + client.incr(KEYS.pc)})
+        client.zadd(KEYS.marker, {"0": 0})
+    else:
+        client.lpush(KEYS.wait, job_id)
+        client.zadd(KEYS.marker, {"0": 0})
+    client.xadd(KEYS.events, {"event": "waiting", "jobId": job_id})
+    return job_id
+
+
+def tag(target):
+    return tag_job(target)["data"]
+
+
+def bull_worker(engine, **options):
+    worker_class = AsyncBullMQWorker if engine.name == "asyncio" else BullMQWorker
+    return engine.worker(worker_class, queue_key="assets", **options)
+
+
+def job_hash(client, job_id):
+    return {field.decode(): value.decode() for field, value in client.hgetall(KEYS.job(job_id)).items()}
+
+
+def events(client):
+    return [(fields[b"event"].decode(), fields.get(b"jobId", b"").decode()) for _, fields in client.xrange(KEYS.events)]
+
+
+def test_retry_delay_follows_backoff_options():
+    assert retry_delay({}, 1) == -1
+    assert retry_delay({"attempts": 3}, 1) == 0
+    assert retry_delay({"attempts": 3, "backoff": 500}, 1) == 500
+    assert retry_delay({"attempts": 3, "backoff": {"type": "fixed", "delay": 100}}, 2) == 100
+    assert retry_delay({"attempts": 4, "backoff": {"type": "exponential", "delay": 100}}, 3) == 400
+    assert retry_delay({"attempts": 3, "backoff": {"type": "exponential", "delay": 100}}, 3) == -1
+
+
+def test_options_without_a_place_in_the_bullmq_layout_are_refused(engine):
+    with pytest.raises(ValueError, match="prefetch"):
+        bull_worker(engine, prefetch=2)
+
+
+def test_jobs_move_through_bullmq_states(engine, pipeline):
+    client = engine.redis
+    done = add(client, tag("keep"))
+    removed = add(client, tag("removed"), {"removeOnComplete": True})
+    prioritized = add(client, tag("prioritized"), priority=5)
+    delayed = add(client, tag("delayed"), delay=500)
+    worker = bull_worker(engine, concurrency=2)
+
+    assert engine.poll(worker, lambda: client.zcard(KEYS.completed) == 3)
+
+    assert sorted(member.decode() for member in client.zrange(KEYS.completed, 0, -1)) == sorted(
+        [done, prioritized, delayed])
+    finished = job_hash(client, done)
+    assert finished["atm"] == "1"
+    assert finished["pb"] == worker.worker_name
+    assert json.loads(finished["returnvalue"])["scriptOutput"][-1] == "tagged keep"
+    assert json.loads(finished["progress"])["percentage"] == 100
+    assert b"Progress: 50%" in client.lrange(KEYS.logs(done), 0, -1)
+    assert not client.exists(KEYS.job(removed))
+    assert int(job_hash(client, delayed)["processedOn"]) >= int(job_hash(client, delayed)["timestamp"]) + 500
+    assert client.llen(KEYS.wait) == client.llen(KEYS.active) == 0
+    assert client.keys(KEYS.prefix + "*:lock") == []
+    assert ("completed", done) in events(client)
+
+
+def test_failed_jobs_are_retried_with_backoff_until_attempts_run_out(engine, pipeline):
+    client = engine.redis
+    retried = add(client, tag("bad"), {"attempts": 3, "backoff": {"type": "exponential", "delay": 100}})
+    once = add(client, tag("also-bad"))
+    worker = bull_worker(engine)
+
+    assert engine.poll(worker, lambda: client.zcard(KEYS.failed) == 2)
+
+    assert pipeline.calls().count("tag bad") == 3
+    assert job_hash(client, retried)["atm"] == "3"
+    assert "return code 1" in job_hash(client, retried)["failedReason"]
+    assert job_hash(client, once)["atm"] == "1"
+    assert [event for event, job_id in events(client) if job_id == retried].count("delayed") == 2
+    assert ("retries-exhausted", retried) in events(client)
+
+
+def test_unreadable_job_data_fails_the_job(engine, pipeline):
+    client = engine.redis
+    job_id = add(client, {})
+    client.hset(KEYS.job(job_id), "data", "{nope")
+    worker = bull_worker(engine)
+
+    assert engine.poll(worker, lambda: client.zcard(KEYS.failed) == 1)
+
+    assert job_hash(client, job_id)["failedReason"].startswith("Invalid job data")
+
+
+def test_stalled_jobs_of_dead_workers_are_recovered(engine, pipeline):
+    client = engine.redis
+    stalled = add(client, tag("stalled"))
+    # Active without a lock, as if the Node worker running it died
+    client.lrem(KEYS.wait, 1, stalled)
+    client.lpush(KEYS.active, stalled)
+    client.sadd(KEYS.stalled, stalled)
+    worker = bull_worker(engine, lease_ttl=0.5)
+
+    assert engine.poll(worker, lambda: client.zcard(KEYS.completed) == 1)
+
+    assert job_hash(client, stalled)["stc"] == "1"
+    assert ("stalled", stalled) in events(client)
+
+
+def test_rate_limited_queues_and_flow_children_are_left_to_node_workers(engine, pipeline):
+    client = engine.redis
+    child = add(client, tag("child"))
+    client.hset(KEYS.job(child), "parentKey", "bull:flows:p1")
+    after = add(client, tag("after"))
+    worker = bull_worker(engine)
+
+    client.hset(KEYS.meta, "max", 10)
+    assert engine.run(worker.get_next_job()) is None
+    assert "rate limited" in worker.refused
+
+    client.hdel(KEYS.meta, "max")
+    client.set(KEYS.limiter, 3, px=5000)
+    assert engine.run(worker.get_next_job()) is None
+    assert "rate limited" in worker.refused
+
+    client.delete(KEYS.limiter)
+    assert engine.run(worker.get_next_job()) is None
+    assert worker.refused.startswith(f"Not claiming from the queue, job is the child of a flow (job {child})")
+    assert client.lrange(KEYS.wait, 0, -1) == [after.encode(), child.encode()]
+    assert client.llen(KEYS.active) == 0
+
+    # Once a Node worker took the child, claims resume
+    client.lrem(KEYS.wait, 1, child)
+    assert engine.run(worker.get_next_job())["id"] == after
+    assert worker.refused is None
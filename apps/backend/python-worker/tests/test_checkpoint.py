@@ -0,0 +1,101 @@
+import json
+import os
+import threading
+
+from conftest import push, status
+from progress import read_job_events
+from result_store import read_result
+
+
+def run_job(engine, worker, job):
+    push(engine.redis, worker.shards[0].keys.wait, job)
+    claimed = engine.run(worker.get_next_job())
+    try:
+        return engine.run(worker.process_job(claimed))
+    finally:
+        worker.free_jobs([claimed])
+
+
+def checkpointed(engine, keys, job_id):
+    return sorted(field.decode() for field in engine.redis.hkeys(keys.job(job_id, "checkpoint")))
+
+
+def test_retried_pipeline_resumes_after_its_checkpointed_steps(engine, pipeline):
+    worker = engine.worker()
+    keys = worker.shards[0].keys
+    job = pipeline.pipeline_job("p1")
+    pipeline.fail_export()
+
+    assert not run_job(engine, worker, job)
+    assert checkpointed(engine, keys, "p1") == ["decimate", "import", "tag"]
+
+    pipeline.fail_export(False)
+    assert run_job(engine, worker, job)
+
+    assert [call.split()[0] for call in pipeline.calls()][-2:] == ["export", "export"]
+    assert len(pipeline.calls()) == 5
+    assert status(engine.redis, keys, "p1") == "completed"
+    steps = read_result(engine.redis, keys, "p1")["pipelineOutput"]["steps"]
+    assert {step_id: step.get("fromCheckpoint", False) for step_id, step in steps.items()} == {
+        "import": True, "tag": True, "decimate": True, "export": False}
+    # A pipeline that ran to completion leaves no checkpoint behind
+    assert checkpointed(engine, keys, "p1") == []
+
+
+def test_steps_whose_artifacts_are_gone_run_again_with_their_dependents(engine, pipeline):
+    worker = engine.worker()
+    job = pipeline.pipeline_job("p1")
+    pipeline.fail_export()
+    run_job(engine, worker, job)
+    before = len(pipeline.calls())
+
+    os.remove(os.path.join(pipeline.root, "decimated.obj"))
+    pipeline.fail_export(False)
+    assert run_job(engine, worker, job)
+
+    assert [call.split()[0] for call in pipeline.calls()[before:]] == ["decimate", "export"]
+
+
+def test_edited_steps_run_again(engine, pipeline):
+    worker = engine.worker()
+    job = pipeline.pipeline_job("p1")
+    pipeline.fail_export()
+    run_job(engine, worker, job)
+    before = len(pipeline.calls())
+
+    job["data"]["scriptParams"]["tag"]["tags"] = ["y"]
+    pipeline.fail_export(False)
+    assert run_job(engine, worker, job)
+
+    assert sorted(call.split()[0] for call in pipeline.calls()[before:]) == ["export", "tag"]
+
+
+def test_shutdown_requeues_the_pipeline_with_its_checkpoint(engine, pipeline, monkeypatch):
+    monkeypatch.setenv("FAKE_DECIMATE_SECONDS", "1")
+    worker = engine.worker()
+    keys = worker.shards[0].keys
+    job = pipeline.pipeline_job("p1")
+
+    stop = threading.Timer(0.3, lambda: setattr(worker, "shutdown_requested", True))
+    stop.start()
+    run_job(engine, worker, job)
+    stop.join()
+
+    # Running steps finish, but the export never starts
+    assert "export" not in [call.split()[0] for call in pipeline.calls()]
+    assert checkpointed(engine, keys, "p1") == ["decimate", "import", "tag"]
+    assert [json.loads(raw)["id"] for raw in engine.redis.lrange(keys.wait, 0, -1)] == ["p1"]
+    assert engine.redis.hlen(keys.processing) == 0
+    assert engine.redis.zcard(keys.leases) == 0
+    assert status(engine.redis, keys, "p1") not in ("completed", "failed")
+    last_event = read_job_events(engine.redis, keys, "p1")[-1][1]
+    assert last_event["type"] == "requeued"
+    assert sorted(last_event["completedSteps"].split(",")) == ["decimate", "import", "tag"]
+
+    monkeypatch.setenv("FAKE_DECIMATE_SECONDS", "0")
+    resumed = engine.worker()
+    engine.redis.delete(keys.wait)
+    assert run_job(engine, resumed, job)
+    # Only the export runs on the resumed attempt
+    assert [call.split()[0] for call in pipeline.calls()][-1] == "export"
+    assert len(pipeline.calls()) == 4
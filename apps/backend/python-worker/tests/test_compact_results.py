@@ -0,0 +1,94 @@
+import json
+import os
+import time
+
+import pytest
+
+from compact_results import MIN_ORPHAN_AGE, ResultCompactor
+from keys import QueueKeys
+from result_store import REFERENCE_PREFIX, ZLIB, ResultStore, decode_stored
+
+LARGE = json.dumps({"success": True, "scriptOutput": ["line"] * 200}).encode()
+SMALL = b'{"success": true}'
+
+
+@pytest.fixture
+def client():
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeRedis()
+
+
+def age(path):
+    old = time.time() - MIN_ORPHAN_AGE - 60
+    os.utime(path, (old, old))
+
+
+def test_large_plain_results_are_compressed_keeping_their_ttl(client):
+    keys = QueueKeys("q")
+    client.set(keys.job("big", "result"), LARGE, ex=500)
+    client.set(keys.job("small", "result"), SMALL)
+    store = ResultStore(compress_threshold=1024, codec=ZLIB, result_ttl=0, status_ttl=0, progress_ttl=0)
+
+    stats = ResultCompactor(client, "q", store, batch_size=1).run()
+
+    assert stats["results"] == 2
+    assert stats["compressed"] == 1
+    assert stats["bytesBefore"] == len(LARGE) > stats["bytesAfter"]
+    assert decode_stored(client.get(keys.job("big", "result"))) == LARGE
+    assert 0 < client.ttl(keys.job("big", "result")) <= 500
+    assert client.get(keys.job("small", "result")) == SMALL
+
+    # Compressed results are left alone on the next run
+    stats = ResultCompactor(client, "q", store).run()
+    assert (stats["results"], stats["compressed"]) == (1, 0)
+
+
+def test_dry_run_changes_nothing(client, tmp_path):
+    keys = QueueKeys("q")
+    client.set(keys.job("big", "result"), LARGE)
+    store = ResultStore(codec=ZLIB, artifact_dir=str(tmp_path), offload_threshold=1024)
+
+    stats = ResultCompactor(client, "q", store, dry_run=True).run()
+
+    assert stats["offloaded"] == 1
+    assert stats["expiring"] == 1
+    assert client.get(keys.job("big", "result")) == LARGE
+    assert client.ttl(keys.job("big", "result")) == -1
+    assert not (tmp_path / "q").exists()
+
+
+def test_only_keys_of_finished_jobs_get_a_ttl(client):
+    keys = QueueKeys("q")
+    client.set(keys.job("done", "status"), "completed")
+    client.set(keys.job("done", "progress"), "{}")
+    client.set(keys.job("running", "status"), "processing")
+    client.set(keys.job("running", "progress"), "{}")
+    store = ResultStore(result_ttl=600, status_ttl=1200, progress_ttl=300)
+
+    ResultCompactor(client, "q", store).run()
+
+    assert 600 < client.ttl(keys.job("done", "status")) <= 1200
+    assert 0 < client.ttl(keys.job("done", "progress")) <= 300
+    assert client.ttl(keys.job("running", "status")) == -1
+    assert client.ttl(keys.job("running", "progress")) == -1
+
+
+def test_orphaned_artifacts_are_pruned(client, tmp_path):
+    keys = QueueKeys("q")
+    store = ResultStore(codec=ZLIB, artifact_dir=str(tmp_path), offload_threshold=1024, result_ttl=0,
+                        status_ttl=0, progress_ttl=0)
+    for job_id in ("kept", "expired", "recent"):
+        stored, _ = store.encode("q", job_id, LARGE, "application/json")
+        client.set(keys.job(job_id, "result"), stored)
+    client.delete(keys.job("expired", "result"), keys.job("recent", "result"))
+    interrupted = tmp_path / "q" / ".kept.tmp"
+    interrupted.write_bytes(b"partial")
+    for name in ("kept.result.zlib", "expired.result.zlib", ".kept.tmp"):
+        age(tmp_path / "q" / name)
+
+    stats = ResultCompactor(client, "q", store).run()
+
+    assert stats["orphanedArtifacts"] == 2
+    assert sorted(os.listdir(tmp_path / "q")) == ["kept.result.zlib", "recent.result.zlib"]
+    assert client.get(keys.job("kept", "result")).startswith(REFERENCE_PREFIX)
+    assert decode_stored(client.get(keys.job("kept", "result"))) == LARGE
@@ -0,0 +1,52 @@
+import pytest
+
+from executor_pool import UsageError, _call, build_call_args
+
+
+class FakeConn:
+    """
+    Executor end of the pipe, keeping what the executor sends
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def send(self, message):
+        self.messages.append(message)
+
+
+def test_call_args_carry_the_cli_defaults():
+    assert build_call_args("asset-tag", {"target": "a", "tags": ["x"]}) == {
+        "target_path": "a", "tags": ["x"], "category": "general", "replace": False,
+    }
+    assert build_call_args("asset-export", {"input": "a", "output": "b", "quality": "90"})["quality"] == 90
+
+
+@pytest.mark.parametrize("script_type, params, missing", [
+    ("asset-export", {"output": "b"}, "input"),
+    ("asset-import", {"source": "a", "destination": ""}, "destination"),
+    ("asset-decimate", {"output": "b"}, "input"),
+    ("asset-tag", {"target": "a", "tags": []}, "--tags/-t"),
+])
+def test_missing_required_params_are_a_usage_error(script_type, params, missing):
+    with pytest.raises(UsageError, match=f"required: {missing}"):
+        build_call_args(script_type, params)
+
+
+def test_usage_error_exits_with_2_like_argparse():
+    conn = FakeConn()
+    called = []
+
+    return_code = _call(conn, lambda **kwargs: called.append(kwargs), "asset-tag", {"tags": ["x"]})
+
+    assert return_code == 2
+    assert not called
+    assert conn.messages == [("stderr", "error: the following arguments are required: target")]
+
+
+def test_call_reports_the_function_outcome():
+    conn = FakeConn()
+
+    assert _call(conn, lambda **kwargs: print("tagged") or True, "asset-tag", {"target": "a", "tags": ["x"]}) == 0
+    assert _call(conn, lambda **kwargs: False, "asset-tag", {"target": "a", "tags": ["x"]}) == 1
+    assert conn.messages == [("stdout", "tagged")]
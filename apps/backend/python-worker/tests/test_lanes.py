@@ -0,0 +1,106 @@
+import collections
+import json
+import random
+import time
+
+import pytest
+
+from conftest import push
+from lanes import parse_lanes
+from resources import ResourcePool
+
+
+def test_parse_lanes():
+    assert parse_lanes("interactive:5,default:3,bulk") == [("interactive", 5.0), ("default", 3.0), ("bulk", 1.0)]
+    assert parse_lanes("") == [("default", 1.0)]
+    with pytest.raises(ValueError):
+        parse_lanes("bulk:0")
+    with pytest.raises(ValueError):
+        parse_lanes("bulk,bulk")
+
+
+def lane_worker(engine, policy="weighted", **options):
+    return engine.worker(lanes=parse_lanes("interactive:5,default:3,bulk:1"), lane_policy=policy,
+                         resources=ResourcePool(cpu=4), **options)
+
+
+def fill_lanes(engine, keys, count):
+    for lane in ("interactive", "default", "bulk"):
+        push(engine.redis, keys.lane(lane), *[{"id": f"{lane}{i}", "name": "generic", "data": {}}
+                                              for i in range(count)])
+
+
+def claim_lanes(engine, worker, count):
+    lanes = []
+    for _ in range(count):
+        job = engine.run(worker.get_next_job())
+        # Nothing runs the jobs, so give their tokens straight back
+        worker.free_jobs([job])
+        lanes.append(job["lane"])
+    return lanes
+
+
+def test_default_lane_is_the_original_wait_list(engine):
+    keys = engine.worker().shards[0].keys
+    assert keys.lane("default") == keys.wait == "bull:q:wait"
+    assert keys.lane("bulk") == "bull:q:bulk:wait"
+
+
+def test_strict_policy_drains_lanes_in_order(engine):
+    worker = lane_worker(engine, "strict")
+    keys = worker.shards[0].keys
+    fill_lanes(engine, keys, 2)
+
+    assert claim_lanes(engine, worker, 6) == ["interactive"] * 2 + ["default"] * 2 + ["bulk"] * 2
+
+
+def test_weighted_policy_shares_claims_by_weight(engine, monkeypatch):
+    monkeypatch.setattr(random, "random", random.Random(7).random)
+    worker = lane_worker(engine)
+    keys = worker.shards[0].keys
+    fill_lanes(engine, keys, 200)
+
+    shares = collections.Counter(claim_lanes(engine, worker, 180))
+
+    assert shares["interactive"] > shares["default"] > shares["bulk"] > 0
+
+
+def test_starving_lane_is_served_first(engine):
+    worker = lane_worker(engine, "strict", starvation_ms=1000)
+    keys = worker.shards[0].keys
+    fill_lanes(engine, keys, 1)
+    engine.redis.rpush(keys.lane("bulk"), json.dumps({"id": "old", "name": "generic", "data": {},
+                                                      "timestamp": int(time.time() * 1000) - 60000}))
+
+    job = engine.run(worker.get_next_job())
+
+    assert (job["id"], job["lane"]) == ("old", "bulk")
+
+
+def test_released_prefetched_jobs_return_to_their_lane(engine):
+    worker = lane_worker(engine, "strict", prefetch=3)
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.lane("interactive"), *[{"id": f"i{i}", "name": "generic", "data": {}} for i in range(3)])
+
+    engine.run(worker.get_next_job())
+    assert len(worker.prefetched) == 2
+    engine.run(worker.release_prefetched())
+
+    assert [json.loads(raw)["id"] for raw in engine.redis.lrange(keys.lane("interactive"), 0, -1)] == ["i2", "i1"]
+    assert engine.redis.llen(keys.wait) == 0
+    assert engine.redis.hkeys(keys.processing) == [b"i0"]
+
+
+def test_dead_worker_hand_off_list_returns_to_its_block_lane(engine):
+    gpu = engine.worker(lanes=parse_lanes("gpu:3,default:1"), resources=ResourcePool(cpu=1, accelerators=1))
+    reaper = engine.worker()
+    keys = reaper.shards[0].keys
+    engine.run(gpu.heartbeat())
+    engine.redis.lpush(keys.claiming(gpu.worker_id), json.dumps({"id": "g1", "name": "generic"}))
+    engine.redis.zadd(keys.workers, {gpu.worker_id: 0})
+
+    engine.run(reaper.reap_expired())
+
+    assert [json.loads(raw)["id"] for raw in engine.redis.lrange(keys.lane("gpu"), 0, -1)] == ["g1"]
+    assert engine.redis.llen(keys.wait) == 0
+    assert engine.redis.hget(keys.claiming_lanes, gpu.worker_id) is None
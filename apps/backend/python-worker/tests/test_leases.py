@@ -0,0 +1,104 @@
+import json
+import time
+
+from conftest import push, status, tag_job
+from resources import ResourcePool
+
+
+def lease_of(client, keys, job_id):
+    return client.zscore(keys.leases, job_id)
+
+
+def test_heartbeat_extends_leases_of_held_jobs(engine, pipeline):
+    worker = engine.worker(lease_ttl=5)
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("t1"))
+    job = engine.run(worker.get_next_job())
+    worker.active_jobs[job["id"]] = "slot-0"
+    claimed_until = lease_of(engine.redis, keys, "t1")
+
+    time.sleep(0.05)
+    engine.run(worker.heartbeat())
+
+    assert lease_of(engine.redis, keys, "t1") > claimed_until
+    assert engine.redis.zscore(keys.workers, worker.worker_id) is not None
+
+
+def test_expired_leases_are_requeued_then_failed(engine, pipeline):
+    worker = engine.worker(lease_ttl=0.2, max_retries=1)
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("t1"))
+
+    job = engine.run(worker.get_next_job())
+    assert job["id"] == "t1"
+    engine.run(worker.reap_expired())
+    assert engine.redis.zcard(keys.leases) == 1
+    # Its slot died without finishing it
+    worker.free_jobs([job])
+
+    time.sleep(0.3)
+    engine.run(worker.reap_expired())
+    assert engine.redis.zcard(keys.leases) == 0
+    assert engine.redis.hlen(keys.processing) == 0
+    assert [json.loads(raw)["id"] for raw in engine.redis.lrange(keys.wait, 0, -1)] == ["t1"]
+    assert engine.redis.hget(keys.retries, "t1") == b"1"
+
+    # The retry runs out the next time the lease expires
+    assert engine.run(worker.get_next_job())["id"] == "t1"
+    time.sleep(0.3)
+    engine.run(worker.reap_expired())
+    assert engine.redis.llen(keys.wait) == 0
+    assert status(engine.redis, keys, "t1") == "failed"
+    assert engine.redis.get(keys.job("t1", "error")) is not None
+    assert engine.redis.hget(keys.retries, "t1") is None
+
+
+def test_heartbeat_drops_prefetched_jobs_whose_lease_was_reaped(engine, pipeline):
+    worker = engine.worker(lease_ttl=0.2, prefetch=2, resources=ResourcePool(cpu=2))
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("t1"), tag_job("t2"))
+    engine.run(worker.get_next_job())
+    assert len(worker.prefetched) == 1
+
+    time.sleep(0.3)
+    engine.run(worker.reap_expired())
+    engine.run(worker.heartbeat())
+
+    assert not worker.prefetched
+    assert engine.redis.llen(keys.wait) == 2
+
+
+def test_dead_worker_hand_off_list_is_returned_to_the_queue(engine, pipeline):
+    worker = engine.worker()
+    keys = worker.shards[0].keys
+    engine.redis.lpush(keys.claiming("dead"), json.dumps(tag_job("z")))
+    engine.redis.zadd(keys.workers, {"dead": 0})
+
+    engine.run(worker.reap_expired())
+
+    assert [json.loads(raw)["id"] for raw in engine.redis.lrange(keys.wait, 0, -1)] == ["z"]
+    assert engine.redis.zscore(keys.workers, "dead") is None
+    assert engine.redis.llen(keys.claiming("dead")) == 0
+
+
+def test_contended_lock_hands_the_claim_back(engine, pipeline):
+    worker = engine.worker(lease_ttl=3)
+    keys = worker.shards[0].keys
+    engine.redis.set(keys.job("t1", "lock"), "other", px=500)
+    push(engine.redis, keys.wait, tag_job("t1"))
+
+    job = engine.run(worker.get_next_job())
+    assert not engine.run(worker.process_job(job))
+    worker.free_jobs([job])
+
+    # The job goes back to its lane untouched rather than sitting leased until the reaper finds it
+    assert engine.redis.hlen(keys.processing) == 0
+    assert engine.redis.zcard(keys.leases) == 0
+    assert engine.redis.hlen(keys.job_lanes) == 0
+    assert engine.redis.hget(keys.retries, "t1") is None
+    assert [json.loads(raw)["id"] for raw in engine.redis.lrange(keys.wait, 0, -1)] == ["t1"]
+    assert worker.resources.free() == worker.resources.capacity
+
+    time.sleep(0.6)
+    assert engine.run(worker.process_job(engine.run(worker.get_next_job())))
+    assert status(engine.redis, keys, "t1") == "completed"
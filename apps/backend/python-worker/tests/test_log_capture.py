@@ -0,0 +1,71 @@
+import gzip
+import os
+
+from conftest import push, status, tag_job
+from log_capture import MAX_LINE_BYTES, LineSplitter, LogCapture
+from result_store import read_result
+
+
+def test_only_the_tail_is_kept_in_memory(tmp_path):
+    capture = LogCapture("j", "asset-tag", log_dir=str(tmp_path), max_lines=3)
+    for line in range(10):
+        capture.add(f"line {line}", is_stderr=line == 9)
+    capture.close()
+
+    fields = capture.result_fields()
+    assert fields["output"] == ["line 7", "line 8", "ERROR: line 9"]
+    assert fields["outputTruncated"] == 7
+
+
+def test_full_log_is_spilled_to_gzip_once_the_tail_overflows(tmp_path):
+    capture = LogCapture("j", "asset-tag", log_dir=str(tmp_path), max_lines=3)
+    for line in range(3):
+        capture.add(f"line {line}")
+    assert capture.result_fields().keys() == {"output"}
+
+    for line in range(3, 10):
+        capture.add(f"line {line}")
+    capture.close()
+
+    log_file = capture.result_fields()["logFile"]
+    assert os.path.dirname(log_file) == str(tmp_path)
+    with gzip.open(log_file, "rt") as f:
+        assert f.read().splitlines() == [f"line {line}" for line in range(10)]
+
+
+def test_unwritable_log_dir_keeps_the_tail(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    capture = LogCapture("j", "asset-tag", log_dir=str(blocker / "logs"), max_lines=2)
+    for line in range(5):
+        capture.add(f"line {line}")
+    capture.close()
+
+    assert capture.result_fields() == {"output": ["line 3", "line 4"], "outputTruncated": 3}
+
+
+def test_long_output_without_newlines_is_split():
+    splitter = LineSplitter()
+
+    lines = splitter.feed(b"a\nb" + b"x" * MAX_LINE_BYTES)
+
+    assert lines[0] == "a\n"
+    assert len(lines[1]) == MAX_LINE_BYTES
+    assert splitter.close() == ["x"]
+
+
+def test_stderr_heavy_script_does_not_block(engine, pipeline, tmp_path):
+    # Far more stderr than a pipe buffer holds, written before anything on stdout
+    log_dir = tmp_path / "logs"
+    worker = engine.worker(log_dir=str(log_dir), log_tail_lines=20)
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("t1", "noisy-t1"))
+
+    assert engine.poll(worker, lambda: status(engine.redis, keys, "t1") == "completed")
+
+    output = read_result(engine.redis, keys, "t1")["scriptOutput"]
+    assert len(output) == 20
+    assert output[-1] == "tagged noisy-t1"
+    [log_file] = os.listdir(log_dir)
+    with gzip.open(log_dir / log_file, "rt") as f:
+        assert sum(1 for line in f if line.startswith("ERROR: warning ")) == 5000
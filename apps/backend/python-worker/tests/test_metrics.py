@@ -0,0 +1,66 @@
+import pytest
+
+from conftest import push, tag_job
+from metrics import Counter, Gauge, Histogram, WorkerMetrics, _Metric
+from resources import ResourcePool
+
+
+def test_metric_types_must_render_their_samples():
+    with pytest.raises(TypeError):
+        _Metric("worker_things", "Things")
+
+
+def test_counters_and_gauges_render_in_the_text_format():
+    counter = Counter("worker_jobs_total", "Jobs", ("job_type",))
+    counter.inc('asset-"tag"')
+    counter.inc("asset-export", amount=2)
+    gauge = Gauge("worker_slots", "Slots", callback=lambda: 3)
+
+    assert counter.render() == [
+        "# HELP worker_jobs_total Jobs",
+        "# TYPE worker_jobs_total counter",
+        'worker_jobs_total{job_type="asset-\\"tag\\""} 1',
+        'worker_jobs_total{job_type="asset-export"} 2',
+    ]
+    assert gauge.render()[-1] == "worker_slots 3"
+
+
+def test_histogram_buckets_are_cumulative_and_inclusive():
+    histogram = Histogram("worker_wait_seconds", "Wait", ("lane",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 7):
+        histogram.observe(value, "default")
+
+    assert histogram.render()[2:] == [
+        'worker_wait_seconds_bucket{lane="default",le="0.1"} 2',
+        'worker_wait_seconds_bucket{lane="default",le="1"} 3',
+        'worker_wait_seconds_bucket{lane="default",le="+Inf"} 4',
+        'worker_wait_seconds_sum{lane="default"} 7.65',
+        'worker_wait_seconds_count{lane="default"} 4',
+    ]
+
+
+def test_job_durations_are_counted_by_outcome():
+    metrics = WorkerMetrics(concurrency=2)
+    metrics.job_started("a", "asset-tag", "default", 1500)
+    metrics.job_finished("a", completed=False)
+    # Finishing twice, or a job that never started, counts nothing
+    metrics.job_finished("a", completed=True)
+
+    rendered = metrics.render()
+    assert 'worker_jobs_failed_total{job_type="asset-tag"} 1' in rendered
+    assert "worker_jobs_completed_total{" not in rendered
+    assert 'worker_job_queue_wait_seconds_count{lane="default"} 1' in rendered
+    assert "worker_concurrency 2" in rendered
+
+
+def test_jobs_are_counted_when_claimed_not_when_started(engine):
+    worker = engine.worker(prefetch=3, resources=ResourcePool(cpu=4))
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("t1"), tag_job("t2"), tag_job("t3"))
+
+    job = engine.run(worker.get_next_job())
+
+    assert job["id"] == "t1"
+    assert worker.metrics.jobs_claimed.values == {("asset-tag", "default"): 3}
+    assert not worker.metrics.running
+    worker.free_jobs([job, *worker.prefetched])
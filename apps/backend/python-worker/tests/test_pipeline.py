@@ -0,0 +1,95 @@
+import os
+import threading
+
+import pytest
+
+from conftest import push, status
+from pipeline import PipelineError, build_pipeline_steps, run_pipeline
+from progress import read_job_events
+from result_store import read_result
+
+
+def test_default_pipeline_tags_alongside_decimation():
+    steps = build_pipeline_steps({"pipeline": True, "tag": {"target": "a"}})
+
+    assert list(steps) == ["import", "tag", "decimate", "export"]
+    assert steps["tag"]["params"] == {"target": "a"}
+    assert steps["decimate"]["dependsOn"] == ["import"]
+    assert steps["export"]["dependsOn"] == ["tag", "decimate"]
+
+
+@pytest.mark.parametrize("definition, message", [
+    ([{"id": "a", "type": "import", "dependsOn": ["b"]}, {"id": "b", "type": "export", "dependsOn": ["a"]}], "cycle"),
+    ([{"id": "a", "type": "import", "dependsOn": ["missing"]}], "unknown step"),
+    ([{"id": "a", "type": "render"}], "Unknown pipeline step type"),
+    ([{"id": "a", "type": "tag"}, {"id": "a", "type": "tag"}], "Duplicate"),
+    ([], "non-empty list"),
+])
+def test_invalid_pipelines_are_rejected(definition, message):
+    with pytest.raises(PipelineError, match=message):
+        build_pipeline_steps({"pipeline": definition})
+
+
+def test_independent_steps_run_at_the_same_time():
+    steps = build_pipeline_steps({"pipeline": True})
+    both_running = threading.Barrier(2, timeout=5)
+    started = []
+
+    def run_step(step, pipeline_run):
+        started.append(step["id"])
+        if step["id"] in ("tag", "decimate"):
+            both_running.wait()
+        return {"success": True}
+
+    results, error = run_pipeline(steps, run_step)
+
+    assert error is None
+    assert set(results) == set(steps)
+    assert started[0] == "import" and started[-1] == "export"
+
+
+def test_failed_step_stops_its_dependents():
+    steps = build_pipeline_steps({"pipeline": True})
+    started = []
+
+    def run_step(step, pipeline_run):
+        started.append(step["id"])
+        return {"success": step["id"] != "decimate", "error": "out of memory"}
+
+    results, error = run_pipeline(steps, run_step, max_parallel=1)
+
+    assert error == "Step decimate failed: out of memory"
+    assert "export" not in started
+
+
+def test_pipeline_job_runs_every_step(engine, pipeline):
+    worker = engine.worker()
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, pipeline.pipeline_job("p1"))
+
+    assert engine.run(worker.process_job(engine.run(worker.get_next_job())))
+
+    calls = [call.split()[0] for call in pipeline.calls()]
+    assert calls[0] == "import" and calls[-1] == "export"
+    assert sorted(calls[1:3]) == ["decimate", "tag"]
+    assert os.path.exists(os.path.join(pipeline.root, "mesh.glb"))
+    assert status(engine.redis, keys, "p1") == "completed"
+    steps = read_result(engine.redis, keys, "p1")["pipelineOutput"]["steps"]
+    assert set(steps) == {"import", "tag", "decimate", "export"}
+    percentages = [int(fields["percentage"]) for _, fields in read_job_events(engine.redis, keys, "p1")
+                   if fields["type"] == "progress"]
+    assert percentages == sorted(percentages)
+    assert percentages[-1] == 100
+
+
+def test_failed_step_fails_the_pipeline_job(engine, pipeline):
+    pipeline.fail_export()
+    worker = engine.worker()
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, pipeline.pipeline_job("p1"))
+
+    assert not engine.run(worker.process_job(engine.run(worker.get_next_job())))
+
+    assert status(engine.redis, keys, "p1") == "failed"
+    assert b"Step export failed" in engine.redis.get(keys.job("p1", "error"))
+    assert not os.path.exists(os.path.join(pipeline.root, "mesh.glb"))
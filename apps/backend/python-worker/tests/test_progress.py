@@ -0,0 +1,135 @@
+import asyncio
+import contextlib
+import json
+
+import pytest
+
+from keys import QueueKeys
+from progress import AsyncProgressPublisher, ProgressPublisher, read_job_events
+
+
+fakeredis = pytest.importorskip("fakeredis")
+AsyncClient = fakeredis.aioredis.FakeRedis
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def client(server):
+    return fakeredis.FakeRedis(server=server)
+
+
+def publisher(client, writes, **options):
+    """
+    Publisher for job `j` that appends to `writes` on every round trip
+    """
+    def instrument(operation, job_id=None):
+        writes.append(operation)
+        return contextlib.nullcontext()
+
+    publisher_class = AsyncProgressPublisher if isinstance(client, AsyncClient) else ProgressPublisher
+    return publisher_class(client, QueueKeys("q"), "j", instrument=instrument, **options)
+
+
+def snapshot(client):
+    return json.loads(client.get(QueueKeys("q").job("j", "progress")))
+
+
+def logs(client):
+    return [fields[b"log"].decode() for _id, fields in client.xrange(QueueKeys("q").job("j", "events"))
+            if fields[b"type"] == b"log"]
+
+
+def test_updates_within_the_interval_are_coalesced(client):
+    writes = []
+    progress = publisher(client, writes, interval=60)
+
+    progress.publish({"percentage": 10, "log": "started"})
+    progress.publish({"percentage": 20, "log": "halfway"})
+    progress.publish({"log": "still going"})
+
+    assert writes == ["progress"]
+    assert snapshot(client)["percentage"] == 10
+    assert progress.is_due() is False
+
+
+def test_final_update_is_written_at_once_with_the_buffered_logs(client):
+    writes = []
+    progress = publisher(client, writes, interval=60)
+
+    progress.publish({"percentage": 10, "log": "started"})
+    progress.publish({"percentage": 50, "log": "halfway"})
+    progress.publish({"log": "almost"})
+    progress.publish({"percentage": 100, "log": "done"})
+
+    # The three lines after the first write go out together in one pipelined round trip
+    assert writes == ["progress", "progress"]
+    assert snapshot(client) == {"percentage": 100, "log": "done"}
+    assert logs(client) == ["started", "halfway", "almost", "done"]
+
+
+def test_flush_writes_whatever_is_pending(client):
+    writes = []
+    progress = publisher(client, writes, interval=60)
+    progress.publish({"percentage": 10})
+    progress.publish({"percentage": 30, "log": "late"})
+
+    progress.flush()
+    progress.flush()
+
+    assert writes == ["progress", "progress"]
+    assert snapshot(client)["percentage"] == 30
+
+
+def test_async_publisher_coalesces_the_same_way(server, client):
+    writes = []
+
+    async def run():
+        progress = publisher(AsyncClient(server=server), writes, interval=60)
+        await progress.publish({"percentage": 10, "log": "started"})
+        await progress.publish({"percentage": 50, "log": "halfway"})
+        await progress.publish({"percentage": 100, "log": "done"})
+
+    asyncio.run(run())
+
+    assert writes == ["progress", "progress"]
+    assert logs(client) == ["started", "halfway", "done"]
+
+
+def test_event_stream_is_capped(client):
+    progress = publisher(client, [], interval=0, stream_maxlen=10)
+
+    for line in range(300):
+        progress.publish({"log": f"line {line}"})
+
+    # Trimming is approximate: Redis only drops whole stream nodes (100 entries by default)
+    assert client.xlen(QueueKeys("q").job("j", "events")) <= 10 + 100
+    assert logs(client)[-1] == "line 299"
+
+
+def test_snapshot_and_stream_expire_after_the_last_write(client):
+    keys = QueueKeys("q")
+    progress = publisher(client, [], interval=0, ttl=30)
+
+    progress.publish({"percentage": 40, "log": "working"})
+
+    assert 0 < client.ttl(keys.job("j", "progress")) <= 30
+    assert 0 < client.ttl(keys.job("j", "events")) <= 30
+
+
+def test_events_are_read_after_the_last_seen_id(client):
+    progress = publisher(client, [], interval=0)
+    progress.publish({"percentage": 10, "log": "started"})
+
+    events = read_job_events(client, QueueKeys("q"), "j")
+    assert [fields for _id, fields in events] == [
+        {"type": "log", "percentage": "10", "log": "started"},
+        {"type": "progress", "percentage": "10"},
+    ]
+
+    progress.publish({"percentage": 100})
+    newer = read_job_events(client, QueueKeys("q"), "j", last_id=events[-1][0])
+    assert [fields for _id, fields in newer] == [{"type": "progress", "percentage": "100"}]
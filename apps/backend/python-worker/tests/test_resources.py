@@ -0,0 +1,66 @@
+import json
+
+from conftest import push, tag_job
+from lanes import parse_lanes
+from resources import ResourcePool, job_needs
+
+
+def test_declared_needs_override_lane_and_job_type_defaults():
+    job = {"name": "asset-tag", "data": {"resources": {"memoryMb": 64, "disk": 5}}}
+
+    assert job_needs(job) == {"cpu": 1, "memoryMb": 64, "accelerator": 0}
+    assert job_needs({"name": "asset-tag"}, lane="gpu")["accelerator"] == 1
+    assert job_needs({"name": "asset-tag"}, estimates={"asset-tag": {"memoryMb": 300}})["memoryMb"] == 300
+
+
+def test_oversized_needs_are_capped_except_accelerators():
+    pool = ResourcePool(cpu=2, memory_mb=1024)
+
+    assert pool.fits({"cpu": 8, "memoryMb": 4096})
+    assert not pool.fits({"cpu": 1, "accelerator": 1})
+    pool.acquire("a", {"cpu": 8})
+    assert pool.free()["cpu"] == 0
+    assert not pool.fits({"cpu": 1})
+    pool.release("a")
+    assert pool.released.is_set()
+    assert pool.free() == pool.capacity
+
+
+def test_jobs_that_do_not_fit_stay_queued_until_tokens_are_released(engine):
+    pool = ResourcePool(cpu=2, memory_mb=4096)
+    worker = engine.worker(concurrency=2, resources=pool)
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, {"id": "d1", "name": "asset-decimate", "data": {}},
+         {"id": "d2", "name": "asset-decimate", "data": {}})
+
+    first = engine.run(worker.get_next_job())
+    assert first["id"] == "d1"
+    assert pool.free()["cpu"] == 0
+
+    assert engine.run(worker.get_next_job()) is None
+    assert [json.loads(raw)["id"] for raw in engine.redis.lrange(keys.wait, 0, -1)] == ["d2"]
+    assert engine.redis.hkeys(keys.processing) == [b"d1"]
+
+    worker.free_jobs([first])
+    assert engine.run(worker.get_next_job())["id"] == "d2"
+
+
+def test_accelerator_lane_is_skipped_without_accelerators(engine, pipeline):
+    pool = ResourcePool(cpu=2)
+    worker = engine.worker(concurrency=2, resources=pool, lanes=parse_lanes("gpu,default"), lane_policy="strict")
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.lane("gpu"), tag_job("g1"))
+    push(engine.redis, keys.wait, *[tag_job(f"t{i}") for i in range(4)])
+
+    advertised = {}
+
+    def finished():
+        advertised.update(json.loads(engine.redis.hget(keys.capacity, worker.worker_id) or "{}"))
+        return engine.redis.llen(keys.completed) == 4
+
+    assert engine.poll(worker, finished)
+    assert [json.loads(raw)["id"] for raw in engine.redis.lrange(keys.lane("gpu"), 0, -1)] == ["g1"]
+    assert not pool.held
+    assert advertised["capacity"] == {"cpu": 2, "accelerator": 0}
+    # A worker that stopped no longer advertises its capacity
+    assert engine.redis.hget(keys.capacity, worker.worker_id) is None
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from conftest import push, tag_job
+from result_store import IDENTITY, REFERENCE, ZLIB, ZSTD, ResultStore, decode_stored, is_compressed, read_result
+from serializers import JSON_CONTENT_TYPE
+
+RESULT = json.dumps({"success": True, "scriptOutput": ["line"] * 200}).encode()
+
+
+@pytest.mark.parametrize("codec", [ZLIB, ZSTD])
+def test_results_over_the_threshold_are_compressed(codec):
+    if codec == ZSTD:
+        pytest.importorskip("zstandard")
+    store = ResultStore(compress_threshold=len(RESULT), codec=codec)
+
+    stored, encoding = store.encode("q", "j1", RESULT, JSON_CONTENT_TYPE)
+
+    assert encoding == codec
+    assert len(stored) < len(RESULT)
+    assert decode_stored(stored) == RESULT
+
+
+def test_small_results_are_stored_as_they_are():
+    store = ResultStore(compress_threshold=len(RESULT) + 1)
+
+    assert store.encode("q", "j1", RESULT, JSON_CONTENT_TYPE) == (RESULT, IDENTITY)
+    assert decode_stored(RESULT) == RESULT
+    assert decode_stored(None) is None
+
+
+def test_large_results_are_offloaded_behind_a_reference(tmp_path):
+    store = ResultStore(codec=ZLIB, artifact_dir=str(tmp_path), offload_threshold=len(RESULT))
+
+    stored, encoding = store.encode("q", "j1", RESULT, JSON_CONTENT_TYPE)
+
+    assert encoding == REFERENCE
+    reference = json.loads(stored)
+    assert reference["resultRef"] == str(tmp_path / "q" / "j1.result.zlib")
+    assert reference["size"] == len(RESULT)
+    assert decode_stored(stored) == RESULT
+
+
+def test_results_stay_in_redis_when_the_artifact_dir_is_unwritable(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    store = ResultStore(codec=ZLIB, artifact_dir=str(blocker), offload_threshold=1)
+
+    stored, encoding = store.encode("q", "j1", RESULT, JSON_CONTENT_TYPE)
+
+    assert encoding == ZLIB
+    assert decode_stored(stored) == RESULT
+
+
+def test_compression_is_told_apart_from_json_and_msgpack():
+    msgpack = pytest.importorskip("msgpack")
+
+    assert not is_compressed(RESULT)
+    assert not is_compressed(b"[1, 2]")
+    assert not is_compressed(msgpack.packb({"success": True, "scriptOutput": []}))
+    assert is_compressed(ResultStore(codec=ZLIB).encode("q", "j", RESULT * 400, JSON_CONTENT_TYPE)[0])
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        ResultStore(codec="brotli")
+
+
+def test_finished_job_keys_expire_after_the_store_ttls(engine, pipeline):
+    store = ResultStore(result_ttl=600, status_ttl=1200, progress_ttl=300)
+    assert store.ttl_args() == [600, 1200, 300]
+    worker = engine.worker(result_store=store)
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("t1"))
+
+    assert engine.poll(worker, lambda: read_result(engine.redis, keys, "t1") is not None)
+
+    assert 0 < engine.redis.ttl(keys.job("t1", "result")) <= 600
+    assert 600 < engine.redis.ttl(keys.job("t1", "status")) <= 1200
+    assert 0 < engine.redis.ttl(keys.job("t1", "events")) <= 300
@@ -0,0 +1,87 @@
+import importlib.util
+import sys
+
+import pytest
+
+import serializers
+from conftest import push, status, tag_job
+from result_store import read_result
+from serializers import FAST_JSON, JSON, get_serializer, negotiate
+
+VALUE = {"success": True, "scriptOutput": ["tagged a"], "usage": {"wallS": 0.25}, "return_code": 0}
+
+
+def load_without(*missing):
+    """
+    Fresh copy of the serializers module as if `missing` libraries were not installed
+    """
+    blocked = {name: None for name in missing}
+    spec = importlib.util.spec_from_file_location("serializers_without", serializers.__file__)
+    module = importlib.util.module_from_spec(spec)
+    saved = {name: sys.modules.get(name) for name in blocked}
+    sys.modules.update(blocked)
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        for name, previous in saved.items():
+            if previous is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = previous
+    return module
+
+
+@pytest.mark.parametrize("name", sorted(serializers.SERIALIZERS))
+def test_every_serializer_round_trips_a_result(name):
+    serializer = get_serializer(name)
+
+    assert serializer.loads(serializer.dumps(VALUE)) == VALUE
+
+
+def test_unknown_serializer_is_rejected():
+    with pytest.raises(ValueError, match="not available"):
+        get_serializer("cbor")
+
+
+def test_content_type_picks_the_serializer():
+    pytest.importorskip("msgpack")
+
+    assert negotiate({"id": "a"}) is FAST_JSON
+    assert negotiate({"id": "a"}, default=JSON) is JSON
+    assert negotiate({"contentType": "application/json; charset=utf-8"}) is FAST_JSON
+    assert negotiate({"contentType": "application/vnd.msgpack"}).name == "msgpack"
+    assert negotiate({"contentType": "MSGPACK"}).name == "msgpack"
+    assert negotiate({"contentType": "application/cbor"}) is FAST_JSON
+
+
+def test_missing_libraries_fall_back_to_json():
+    module = load_without("orjson", "msgpack")
+
+    assert module.FAST_JSON is module.JSON
+    assert sorted(module.SERIALIZERS) == ["json"]
+    assert module.negotiate({"contentType": "application/x-msgpack"}) is module.JSON
+    with pytest.raises(ValueError):
+        module.get_serializer("orjson")
+
+
+@pytest.mark.parametrize("content_type, serializer_name", [
+    (None, "json"),
+    ("application/json", "json"),
+    ("application/x-msgpack", "msgpack"),
+    ("application/cbor", "json"),
+])
+def test_jobs_get_results_in_their_content_type(engine, pipeline, content_type, serializer_name):
+    serializer = serializers.SERIALIZERS.get(serializer_name)
+    if serializer is None:
+        pytest.skip(f"{serializer_name} is not installed")
+    job = tag_job("t1")
+    if content_type:
+        job["contentType"] = content_type
+    worker = engine.worker()
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, job)
+
+    assert engine.poll(worker, lambda: status(engine.redis, keys, "t1") == "completed")
+
+    assert read_result(engine.redis, keys, "t1", serializer)["scriptOutput"][-1] == "tagged t1"
+    assert serializer.loads(engine.redis.get(keys.job("t1", "progress")))["percentage"] == 100
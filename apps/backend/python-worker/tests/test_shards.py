@@ -0,0 +1,85 @@
+from unittest import mock
+
+import pytest
+
+from conftest import tag_job
+from keys import QueueKeys
+from producer import QueueProducer
+from resources import ResourcePool
+from shards import LEAST_LOADED, ShardScheduler, build_shards, shard_index, shard_queue_key
+
+NODES = "redis://a:6379,redis://b:6379"
+
+
+def test_shard_keys_share_one_hash_tag():
+    assert shard_queue_key("q", 0, 1) == "q"
+    assert shard_queue_key("q", 0, 1, cluster=True) == "{q:0}"
+    keys = QueueKeys(shard_queue_key("q", 2, 3))
+    assert keys.wait == "bull:{q:2}:wait"
+    assert keys.lane("bulk") == "bull:{q:2}:bulk:wait"
+    assert keys.processing == "{q:2}:processing"
+    assert keys.job("j1", "status") == "{q:2}:j1:status"
+
+
+def test_jobs_spread_over_shards_by_id():
+    indexes = [shard_index(f"job-{i}", 4) for i in range(200)]
+
+    assert indexes == [shard_index(f"job-{i}", 4) for i in range(200)]
+    assert set(indexes) == {0, 1, 2, 3}
+    assert shard_index("anything", 1) == 0
+
+
+def test_shards_are_spread_over_clients_round_robin():
+    clients = [mock.Mock(), mock.Mock()]
+
+    shards = build_shards(clients, "q", 3)
+
+    assert [(shard.index, shard.redis, shard.keys.queue_key) for shard in shards] == [
+        (0, clients[0], "{q:0}"), (1, clients[1], "{q:1}"), (2, clients[0], "{q:2}")]
+
+
+def test_round_robin_rotates_the_first_shard():
+    scheduler = ShardScheduler(build_shards([mock.Mock()], "q", 3))
+
+    assert [[shard.index for shard in scheduler.order()] for _ in range(3)] == [[0, 1, 2], [1, 2, 0], [2, 0, 1]]
+
+
+def test_least_loaded_prefers_shards_with_waiting_jobs_and_few_in_flight():
+    shards = build_shards([mock.Mock()], "q", 3)
+    scheduler = ShardScheduler(shards, LEAST_LOADED)
+    shards[0].waiting, shards[0].processing = 5, 4
+    shards[1].waiting, shards[1].processing = 0, 0
+    shards[2].waiting, shards[2].processing = 2, 1
+
+    assert [shard.index for shard in scheduler.order()] == [2, 0, 1]
+    # Claiming every waiting job of a shard sends the next claim elsewhere
+    scheduler.claimed(shards[2], 2)
+    assert [shard.index for shard in scheduler.order()] == [0, 1, 2]
+
+
+def test_unknown_shard_policy_is_rejected():
+    with pytest.raises(ValueError):
+        ShardScheduler([], "random")
+
+
+def test_worker_drains_every_shard_the_producer_fills(engine, pipeline):
+    with mock.patch("redis.from_url", side_effect=lambda url, **kwargs: engine.client(url)):
+        producer = QueueProducer(NODES, "q", shards=3)
+    worker = engine.worker(redis_url=NODES, shards=3, concurrency=4, prefetch=2, resources=ResourcePool(cpu=4))
+    job_ids = [producer.add("asset-tag", tag_job(f"a{i}")["data"]) for i in range(6)]
+    job_ids += producer.add_many([("asset-tag", tag_job(f"t{i}")["data"], f"t{i}") for i in range(6)])
+
+    assert engine.poll(worker, lambda: all(producer.status(job_id) == "completed" for job_id in job_ids))
+
+    for job_id in job_ids:
+        shard = producer.shard_for(job_id)
+        # Each job's keys live on the node holding its shard, under the shard's hash tag
+        node = engine.client(NODES.split(",")[shard.index % 2])
+        assert node.get(f"{{q:{shard.index}}}:{job_id}:status") == b"completed"
+    for url in NODES.split(","):
+        node = engine.client(url)
+        for index in range(3):
+            keys = QueueKeys(shard_queue_key("q", index, 3))
+            assert node.llen(keys.wait) == 0
+            assert node.hlen(keys.processing) == 0
+            assert node.zcard(keys.leases) == 0
@@ -0,0 +1,94 @@
+import json
+import time
+
+from conftest import push, status, tag_job
+from progress import read_job_events
+from resources import ResourcePool
+from result_store import read_result
+from single_flight import idempotency_key
+
+
+def test_identical_script_jobs_share_a_key():
+    first = {"id": "a", "name": "asset-tag", "data": {"scriptParams": {"target": "m", "tags": ["x"]}}}
+    second = {"id": "b", "name": "asset-tag", "data": {"scriptParams": {"tags": ["x"], "target": "m", "category": None}}}
+    other = {"id": "c", "name": "asset-tag", "data": {"scriptParams": {"target": "n", "tags": ["x"]}}}
+
+    assert idempotency_key(first) == idempotency_key(second) != idempotency_key(other)
+    assert idempotency_key({"name": "generic", "data": {}}) is None
+    assert idempotency_key({"name": "generic", "data": {"idempotencyKey": "k1"}}) == "k1"
+    assert idempotency_key({"name": "asset-tag", "data": {"scriptParams": {}, "profile": True}}) is None
+
+
+def dedupe_worker(engine, **options):
+    return engine.worker(dedupe_ttl=30, concurrency=3, resources=ResourcePool(cpu=3), **options)
+
+
+def finished(engine, keys, *job_ids):
+    return lambda: all(status(engine.redis, keys, job_id) in ("completed", "failed") for job_id in job_ids)
+
+
+def attached_to(engine, keys, job_id):
+    return [fields["leader"] for _, fields in read_job_events(engine.redis, keys, job_id)
+            if fields["type"] == "attached"]
+
+
+def test_identical_jobs_run_once_and_share_the_result(engine, pipeline):
+    worker = dedupe_worker(engine)
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("j1", "slow1"), tag_job("j2", "slow1"), tag_job("j3", "slow2"))
+
+    assert engine.poll(worker, finished(engine, keys, "j1", "j2", "j3"))
+
+    assert sorted(pipeline.calls()) == ["tag slow1", "tag slow2"]
+    assert [status(engine.redis, keys, job_id) for job_id in ("j1", "j2", "j3")] == ["completed"] * 3
+    assert attached_to(engine, keys, "j2") == ["j1"]
+    assert read_result(engine.redis, keys, "j2")["scriptOutput"] == read_result(engine.redis, keys, "j1")["scriptOutput"]
+    assert sorted(json.loads(raw)["id"] for raw in engine.redis.lrange(keys.completed, 0, -1)) == ["j1", "j2", "j3"]
+    assert engine.redis.hlen(keys.processing) == 0
+    assert engine.redis.zcard(keys.leases) == 0
+    assert engine.redis.keys(f"{keys.queue_key}:flight:*") == []
+
+
+def test_attached_jobs_get_the_leaders_error(engine, pipeline):
+    worker = dedupe_worker(engine)
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("j1", "slow-bad"), tag_job("j2", "slow-bad"))
+
+    assert engine.poll(worker, finished(engine, keys, "j1", "j2"))
+
+    assert pipeline.calls() == ["tag slow-bad"]
+    assert [status(engine.redis, keys, job_id) for job_id in ("j1", "j2")] == ["failed"] * 2
+    assert engine.redis.get(keys.job("j2", "error")) == engine.redis.get(keys.job("j1", "error"))
+    assert engine.redis.hlen(keys.processing) == 0
+
+
+def test_jobs_run_on_their_own_without_dedupe(engine, pipeline):
+    worker = engine.worker(concurrency=2, resources=ResourcePool(cpu=2))
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("j1", "m"), tag_job("j2", "m"))
+
+    assert engine.poll(worker, finished(engine, keys, "j1", "j2"))
+
+    assert pipeline.calls() == ["tag m", "tag m"]
+
+
+def test_jobs_attached_to_a_leader_that_never_finishes_are_handed_out_again(engine, pipeline):
+    worker = dedupe_worker(engine, lease_ttl=5)
+    keys = worker.shards[0].keys
+    job = tag_job("j1", "m")
+    engine.redis.set(keys.flight(idempotency_key(job)), "ghost", px=300)
+    push(engine.redis, keys.wait, job)
+
+    claimed = engine.run(worker.get_next_job())
+    assert engine.run(worker.process_job(claimed))
+    worker.free_jobs([claimed])
+    assert attached_to(engine, keys, "j1") == ["ghost"]
+    assert pipeline.calls() == []
+
+    time.sleep(0.4)
+    engine.run(worker.reap_expired())
+    assert [json.loads(raw)["id"] for raw in engine.redis.lrange(keys.wait, 0, -1)] == ["j1"]
+
+    assert engine.run(worker.process_job(engine.run(worker.get_next_job())))
+    assert pipeline.calls() == ["tag m"]
+    assert status(engine.redis, keys, "j1") == "completed"
@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from keys import QueueKeys
+from step_cache import StepCache
+
+
+@pytest.fixture
+def step(pipeline, tmp_path):
+    """
+    An export step whose artifact exists, and the cache it was stored in
+    """
+    source = tmp_path / "model.obj"
+    source.write_text("v 0 0 0\n")
+    output = tmp_path / "first" / "model.fbx"
+    output.parent.mkdir()
+    output.write_text("fbx of model")
+    params = {"input": str(source), "output": str(output), "format": "fbx", "quality": 75}
+    result = {"success": True, "scriptOutput": [f"Exported {source} to {output}"], "return_code": 0,
+              "logFile": str(tmp_path / "run.log.gz"), "usage": {"cpuUserS": 1.0}}
+
+    cache = StepCache(tmp_path / "cache")
+    cache.store("asset-export", params, result)
+    return cache, params
+
+
+def test_identical_step_is_served_with_its_paths_rewritten(step, tmp_path):
+    cache, params = step
+    output = tmp_path / "second" / "model.fbx"
+
+    cached = cache.lookup("asset-export", {**params, "output": str(output)})
+
+    assert cached["cached"] is True
+    assert cached["scriptOutput"] == [f"Exported {params['input']} to {output}"]
+    # The spilled log and usage belong to the run that made the entry
+    assert "logFile" not in cached and "usage" not in cached
+    assert output.read_text() == "fbx of model"
+    assert cache.stats() == {"hits": 1, "misses": 0}
+
+
+def test_changed_params_miss(step):
+    cache, params = step
+
+    assert cache.lookup("asset-export", {**params, "quality": 90}) is None
+    assert cache.stats() == {"hits": 0, "misses": 1}
+
+
+def test_changed_input_misses(step):
+    cache, params = step
+    with open(params["input"], "a") as f:
+        f.write("v 1 1 1\n")
+
+    assert cache.lookup("asset-export", params) is None
+
+
+def test_changed_script_misses(step, pipeline):
+    cache, params = step
+    with open(os.path.join(pipeline.script_dir, "export.py"), "a") as f:
+        f.write("# new version\n")
+
+    assert cache.lookup("asset-export", params) is None
+
+
+def test_hits_are_counted_in_redis(pipeline, tmp_path):
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis()
+    keys = QueueKeys("q")
+    source = tmp_path / "model.obj"
+    source.write_text("v 0 0 0\n")
+    params = {"input": str(source), "output": str(tmp_path / "model.fbx")}
+    (tmp_path / "model.fbx").write_text("fbx")
+    cache = StepCache(tmp_path / "cache", client=client, keys=keys)
+
+    cache.store("asset-export", params, {"success": True})
+    cache.lookup("asset-export", params)
+
+    assert client.hgetall(keys.cache_stats) == {b"hits": b"1"}
+    assert client.ttl(keys.cache_entry(cache.cache_key("asset-export", params))) > 0
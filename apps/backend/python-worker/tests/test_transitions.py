@@ -0,0 +1,84 @@
+import json
+
+from conftest import push, status, tag_job
+from result_store import read_result
+
+
+def test_claim_moves_the_payload_into_the_processing_hash(engine, pipeline):
+    worker = engine.worker()
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("t1"))
+
+    job = engine.run(worker.get_next_job())
+
+    assert job["id"] == "t1"
+    assert engine.redis.llen(keys.wait) == 0
+    assert json.loads(engine.redis.hget(keys.processing, "t1"))["id"] == "t1"
+    assert engine.redis.zscore(keys.leases, "t1") is not None
+    assert engine.redis.hget(keys.job_lanes, "t1") == keys.wait.encode()
+
+
+def test_completion_is_one_transition_by_id(engine, pipeline):
+    worker = engine.worker(concurrency=2)
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("t1"), tag_job("t2"))
+    first = engine.run(worker.get_next_job())
+    second = engine.run(worker.get_next_job())
+
+    # Finishing the job claimed last leaves the other one in place
+    assert engine.run(worker.process_job(second))
+
+    assert status(engine.redis, keys, "t2") == "completed"
+    assert engine.redis.hkeys(keys.processing) == [b"t1"]
+    assert engine.redis.zrange(keys.leases, 0, -1) == [b"t1"]
+    assert engine.redis.hkeys(keys.job_lanes) == [b"t1"]
+    assert [json.loads(raw)["id"] for raw in engine.redis.lrange(keys.completed, 0, -1)] == ["t2"]
+    result = read_result(engine.redis, keys, "t2")
+    assert result["scriptType"] == "asset-tag"
+    assert result["scriptOutput"][-1] == "tagged t2"
+    events = [fields[b"type"] for _, fields in engine.redis.xrange(keys.job("t2", "events"))]
+    assert events[0] == b"claimed" and events[-1] == b"completed"
+
+    assert engine.run(worker.process_job(first))
+    assert engine.redis.hlen(keys.processing) == 0
+    assert engine.redis.zcard(keys.leases) == 0
+
+
+def test_failure_records_the_error(engine, pipeline):
+    worker = engine.worker()
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("t1", target="bad"))
+
+    assert not engine.run(worker.process_job(engine.run(worker.get_next_job())))
+
+    assert status(engine.redis, keys, "t1") == "failed"
+    assert b"return code 1" in engine.redis.get(keys.job("t1", "error"))
+    assert engine.redis.hlen(keys.processing) == 0
+    assert engine.redis.zcard(keys.leases) == 0
+    assert [json.loads(raw)["id"] for raw in engine.redis.lrange(keys.failed, 0, -1)] == ["t1"]
+    assert engine.redis.get(keys.job("t1", "lock")) is None
+
+
+def test_finishing_a_job_no_longer_claimed_only_records_its_outcome(engine, pipeline):
+    worker = engine.worker()
+    keys = worker.shards[0].keys
+
+    engine.run(worker.complete_job("gone", {"message": "late"}))
+
+    assert status(engine.redis, keys, "gone") == "completed"
+    assert engine.redis.llen(keys.completed) == 0
+
+
+def test_unparsable_payloads_are_parked_on_the_pending_list(engine, pipeline):
+    worker = engine.worker()
+    keys = worker.shards[0].keys
+    engine.redis.lpush(keys.wait, "not json")
+    push(engine.redis, keys.wait, tag_job("t1"))
+
+    claimed = []
+    while job := engine.run(worker.get_next_job()):
+        claimed.append(job["id"])
+
+    assert claimed == ["t1"]
+    assert engine.redis.lrange(keys.pending, 0, -1) == [b"not json"]
+    assert engine.redis.hkeys(keys.processing) == [b"t1"]
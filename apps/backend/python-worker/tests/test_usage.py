@@ -0,0 +1,54 @@
+import json
+
+from conftest import push, status, tag_job
+from resources import ResourcePool
+from result_store import read_result
+from usage import MIN_USAGE_SAMPLES, usage_estimates
+
+
+def samples(*peaks):
+    return [json.dumps({"maxRssMb": peak}) for peak in peaks]
+
+
+def test_memory_is_estimated_from_the_90th_percentile_once_there_are_enough_samples():
+    peaks = [100 * i + 0.5 for i in range(1, 11)]
+
+    assert usage_estimates({"asset-tag": samples(*peaks[:MIN_USAGE_SAMPLES - 1])}) == {}
+    assert usage_estimates({"asset-tag": samples(*peaks)}) == {"asset-tag": {"memoryMb": 901}}
+    # Unreadable samples do not count towards the minimum
+    assert usage_estimates({"asset-tag": samples(*peaks[:MIN_USAGE_SAMPLES - 1]) + ["{}", "nope"]}) == {}
+
+
+def test_claims_are_refused_once_measured_memory_exceeds_what_is_free(engine):
+    pool = ResourcePool(cpu=2, memory_mb=1024)
+    worker = engine.worker(concurrency=2, resources=pool)
+    keys = worker.shards[0].keys
+    engine.redis.lpush(keys.usage("asset-tag"), *samples(*[700] * MIN_USAGE_SAMPLES))
+    engine.run(worker.refresh_usage_estimates())
+    assert pool.estimates == {"asset-tag": {"memoryMb": 700}}
+    push(engine.redis, keys.wait, tag_job("t1"), tag_job("t2"))
+
+    first = engine.run(worker.get_next_job())
+    assert first["id"] == "t1"
+    assert pool.free()["memoryMb"] == 324
+
+    # The default of 128 MB would fit; the measured 700 MB does not
+    assert engine.run(worker.get_next_job()) is None
+    assert [json.loads(raw)["id"] for raw in engine.redis.lrange(keys.wait, 0, -1)] == ["t2"]
+
+    worker.free_jobs([first])
+    assert engine.run(worker.get_next_job())["id"] == "t2"
+
+
+def test_warm_executor_runs_record_their_usage(engine, pipeline, warm_pool):
+    worker = engine.worker(executor_pool=warm_pool)
+    keys = worker.shards[0].keys
+    push(engine.redis, keys.wait, tag_job("t1"))
+
+    assert engine.poll(worker, lambda: status(engine.redis, keys, "t1") == "completed")
+
+    usage = read_result(engine.redis, keys, "t1")["usage"]
+    assert usage["maxRssMb"] > 0
+    assert usage["maxRssDeltaMb"] >= 0
+    assert usage["wallS"] >= 0
+    assert [json.loads(raw) for raw in engine.redis.lrange(keys.usage("asset-tag"), 0, -1)] == [usage]